@@ -0,0 +1,28 @@
+"""
+Admin Auth Module for SwissAxa Portal
+Restricts operator-only routes to the accounts listed in ADMIN_EMAILS
+"""
+import functools
+
+from flask import abort, current_app
+from flask_login import current_user, login_required
+
+
+def is_admin(user):
+    """True if the user is logged in with an address from ADMIN_EMAILS"""
+    if not getattr(user, 'is_authenticated', False):
+        return False
+    admins = current_app.config.get('ADMIN_EMAILS') or ()
+    return (user.email or '').lower() in admins
+
+
+def admin_required(view):
+    """Like login_required, but answers 403 to users who are not admins"""
+
+    @functools.wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if not is_admin(current_user):
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
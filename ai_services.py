@@ -4,18 +4,39 @@ Handles all AI-powered features using OpenAI API
 """
 import os
 import json
+import time
 from typing import Dict, List, Optional
-from openai import OpenAI
 from datetime import datetime
+from metrics import AI_REQUESTS, AI_REQUEST_DURATION, AI_TOKENS
 
 # Initialize OpenAI client
 openai_client = None
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
 if OPENAI_API_KEY:
+    # The openai package is slow to import, so only load it when it will be used
+    from openai import OpenAI
     openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
 
+def _chat_completion(feature: str, **kwargs):
+    """Call the chat completions API, recording latency, tokens and errors per feature"""
+    started = time.perf_counter()
+    try:
+        response = openai_client.chat.completions.create(**kwargs)
+    except Exception:
+        AI_REQUESTS.labels(feature, 'error').inc()
+        raise
+    finally:
+        AI_REQUEST_DURATION.labels(feature).observe(time.perf_counter() - started)
+    AI_REQUESTS.labels(feature, 'ok').inc()
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        AI_TOKENS.labels(feature, 'prompt').inc(usage.prompt_tokens or 0)
+        AI_TOKENS.labels(feature, 'completion').inc(usage.completion_tokens or 0)
+    return response
+
+
 class AIService:
     """Main AI service class for handling all AI operations"""
     
@@ -50,7 +71,7 @@ class AIService:
             Format as JSON with 'similar_products' (array) and 'recommendations' (array).
             """
             
-            response = openai_client.chat.completions.create(
+            response = _chat_completion('compare_policies',
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "You are an insurance comparison expert. Provide detailed, accurate comparisons."},
@@ -139,7 +160,7 @@ class AIService:
             Return only the classification word.
             """
             
-            response = openai_client.chat.completions.create(
+            response = _chat_completion('tag_document',
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "You are a document classification expert. Classify documents accurately."},
@@ -246,7 +267,7 @@ class AIService:
             # Use gpt-4o-mini for text-only, gpt-4o for vision
             model = "gpt-4o-mini" if not image_files else "gpt-4o"
             
-            response = openai_client.chat.completions.create(
+            response = _chat_completion('analyze_claim',
                 model=model,
                 messages=messages,
                 temperature=0.5,
@@ -304,7 +325,7 @@ class AIService:
             Return as JSON array with: name, type, reason, estimated_premium
             """
             
-            response = openai_client.chat.completions.create(
+            response = _chat_completion('recommend_policies',
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "You are an insurance advisor. Provide personalized recommendations."},
@@ -345,7 +366,7 @@ class AIService:
             Return as JSON array of suggested times in format: ["YYYY-MM-DD HH:MM", ...]
             """
             
-            response = openai_client.chat.completions.create(
+            response = _chat_completion('suggest_appointments',
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "You are a scheduling assistant. Suggest optimal appointment times."},
@@ -384,7 +405,7 @@ class AIService:
             Return JSON with: is_anomaly (boolean), reason (string), risk_level (low/medium/high)
             """
             
-            response = openai_client.chat.completions.create(
+            response = _chat_completion('transaction_anomaly',
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "You are a fraud detection expert. Identify suspicious transaction patterns."},
@@ -431,7 +452,7 @@ class AIService:
             Return JSON with: is_valid (boolean), inconsistencies (array of strings), requires_reauth (boolean)
             """
             
-            response = openai_client.chat.completions.create(
+            response = _chat_completion('validate_user_data',
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "You are a data validation expert. Check for inconsistencies."},
@@ -480,7 +501,7 @@ class AIService:
             
             messages.append({"role": "user", "content": message})
             
-            response = openai_client.chat.completions.create(
+            response = _chat_completion('chat',
                 model="gpt-4o-mini",
                 messages=messages,
                 temperature=0.7,
@@ -1,26 +1,36 @@
 """
 Analytics Module for SwissAxa Portal
 Tracks user activity, AI usage, and provides insights
+
+The portal does not import this module at startup. The analytics views call
+init_analytics() on first use, which defines the models once per process and
+creates their tables once per app.
 """
 from datetime import datetime, timedelta
 from sqlalchemy import func
-from flask_sqlalchemy import SQLAlchemy
+from flask import current_app, has_app_context
 import json
+import threading
 
 # db will be set by init_analytics
 db = None
+_init_lock = threading.Lock()
 
 def init_analytics(app_db):
-    """Initialize analytics with database instance"""
+    """Initialize analytics with database instance; later calls only create missing tables"""
     global db, AnalyticsEvent, AIUsageLog
-    db = app_db
-    AnalyticsEvent, AIUsageLog = _create_models(app_db)
-    # Create tables
-    try:
-        with app_db.app.app_context():
-            app_db.create_all()
-    except:
-        pass
+    with _init_lock:
+        if db is None:
+            AnalyticsEvent, AIUsageLog = _create_models(app_db)
+            db = app_db
+        # Create tables
+        if has_app_context() and not current_app.extensions.get('analytics'):
+            try:
+                app_db.create_all()
+                current_app.extensions['analytics'] = True
+            except Exception:
+                pass
+    return AnalyticsEvent, AIUsageLog
 
 class AnalyticsEvent:
     """Analytics Event Model - will be bound to db in init"""
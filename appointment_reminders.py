@@ -0,0 +1,223 @@
+"""
+Appointment Reminders Module for SwissAxa Portal
+Reminds customers of upcoming appointments by notification and email
+
+APPOINTMENT_REMINDER_OFFSETS lists how long before an appointment to remind
+(default 24 hours and 1 hour, in minutes). A scan looks at each offset's
+window of appointment times with a range query over the
+(status, date_time) index, a batch at a time, instead of keeping a timer
+per appointment. The windows do not overlap: an appointment less than an
+hour away is only due for the 1 hour reminder, so a scheduler that was down
+for a while does not send both. Appointments booked after a reminder time
+(a booking for later today gets no 24 hour reminder) are skipped.
+
+Every reminder, sent or skipped, is recorded in AppointmentReminder, unique per
+appointment and offset. The record, the notification and the queued email
+are committed together, and the record is inserted first, so a scheduler
+that loses the insert to another instance sends nothing. Any number of
+schedulers can run, and a restarted one carries on where the records say.
+
+Each web process scans every APPOINTMENT_REMINDER_POLL_SECONDS from a
+background thread, started with its first request; or run
+
+    flask appointment-reminders
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import exists, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+_INSERT_IGNORE_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def reminder_windows(offsets, now):
+    """
+    (offset, earliest, latest) appointment times due for each offset's reminder
+
+    An appointment is due for the smallest offset it is within, so windows
+    run from the next smaller offset up to the offset itself.
+    """
+    windows = []
+    lower = now
+    for offset in sorted(set(offsets)):
+        upper = now + timedelta(minutes=offset)
+        windows.append((offset, lower, upper))
+        lower = upper
+    return windows
+
+
+def _due_batch(offset, earliest, latest, after, limit):
+    """Appointments in (earliest, latest] without this reminder, after the keyset cursor"""
+    from models import db, Agent, Appointment, AppointmentReminder, User
+    query = (
+        select(Appointment.id, Appointment.user_id, Appointment.date_time, Appointment.created_at,
+               User.email, User.language, Agent.name.label('agent_name'))
+        .join(User, User.id == Appointment.user_id)
+        .outerjoin(Agent, Agent.id == Appointment.agent_id)
+        .where(
+            Appointment.status == 'scheduled',
+            Appointment.date_time > earliest,
+            Appointment.date_time <= latest,
+            ~exists().where(AppointmentReminder.appointment_id == Appointment.id,
+                            AppointmentReminder.offset_minutes == offset),
+        )
+        .order_by(Appointment.date_time, Appointment.id)
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(tuple_(Appointment.date_time, Appointment.id) > after)
+    return db.session.execute(query).all()
+
+
+def _booked_too_late(appointment, offset):
+    """Booked after its reminder time, e.g. for later today with the 24 hour reminder"""
+    return (appointment.created_at is not None
+            and appointment.created_at > appointment.date_time - timedelta(minutes=offset))
+
+
+def _claim(appointments, offset, now):
+    """Record the reminders; returns the ids this scheduler recorded first"""
+    from models import db, AppointmentReminder
+    insert = _INSERT_IGNORE_DIALECTS.get(db.engine.dialect.name)
+    # Skipped reminders are recorded too (sent_at NULL), so later scans pass over them
+    rows = [{'appointment_id': appointment.id, 'offset_minutes': offset,
+             'sent_at': None if _booked_too_late(appointment, offset) else now}
+            for appointment in appointments]
+    if insert is not None:
+        stmt = insert(AppointmentReminder).on_conflict_do_nothing(
+            index_elements=['appointment_id', 'offset_minutes']
+        ).returning(AppointmentReminder.appointment_id)
+        return set(db.session.scalars(stmt, rows).all())
+    claimed = set()
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.add(AppointmentReminder(**row))
+            claimed.add(row['appointment_id'])
+        except IntegrityError:
+            pass  # Another scheduler sent it
+    return claimed
+
+
+def _send_reminder(appointment):
+    from email_outbox import enqueue_email
+    from email_templates import render_email
+    from notifications import add_notification
+    appointment_date = appointment.date_time.strftime('%Y-%m-%d %H:%M')
+    agent_text = f" with {appointment.agent_name}" if appointment.agent_name else ""
+    add_notification(
+        user_id=appointment.user_id,
+        title="Appointment Reminder",
+        message=f"Your appointment{agent_text} is on {appointment_date}",
+        notification_type='info',
+        action_url='/services/scheduling',
+        commit=False
+    )
+    email = render_email('appointment_reminder', appointment.language, appointment_date=appointment_date,
+                         agent_name=appointment.agent_name)
+    enqueue_email(appointment.email, email.subject, email.text, email.html, commit=False)
+
+
+def send_due_reminders(now=None, offsets=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Send every reminder that is due
+
+    Returns:
+        dict: reminders sent per offset in minutes
+    """
+    from models import db
+    now = now or datetime.utcnow()
+    offsets = offsets or current_app.config['APPOINTMENT_REMINDER_OFFSETS']
+    sent = {}
+    for offset, earliest, latest in reminder_windows(offsets, now):
+        sent[offset] = 0
+        after = None
+        while True:
+            batch = _due_batch(offset, earliest, latest, after, batch_size)
+            if not batch:
+                break
+            claimed = _claim(batch, offset, now)
+            for appointment in batch:
+                if appointment.id in claimed and not _booked_too_late(appointment, offset):
+                    _send_reminder(appointment)
+                    sent[offset] += 1
+            db.session.commit()
+            if len(batch) < batch_size:
+                break
+            after = (batch[-1].date_time, batch[-1].id)
+    return sent
+
+
+class ReminderScheduler:
+    """Thread that sends due reminders every poll_interval seconds"""
+
+    def __init__(self, app, enabled=True, poll_interval=60.0):
+        self.app = app
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            # Started in each worker of a pre-forking server, not in the parent
+            if not self.enabled or (self._pid == os.getpid() and self._thread is not None):
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='appointment-reminders', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        from models import db
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    send_due_reminders()
+                except Exception:
+                    logger.exception('Sending appointment reminders failed')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            self._stopping.wait(self.poll_interval)
+
+
+def init_appointment_reminders(app):
+    """Initialize the reminder scheduler and CLI command with Flask app"""
+    app.config.setdefault('APPOINTMENT_REMINDER_OFFSETS', [24 * 60, 60])
+    app.config.setdefault('APPOINTMENT_REMINDER_SCHEDULER', True)
+    app.config.setdefault('APPOINTMENT_REMINDER_POLL_SECONDS', 60.0)
+
+    scheduler = ReminderScheduler(app, enabled=app.config['APPOINTMENT_REMINDER_SCHEDULER'],
+                                  poll_interval=app.config['APPOINTMENT_REMINDER_POLL_SECONDS'])
+    app.extensions['appointment_reminders'] = scheduler
+    app.before_request(scheduler.start)
+
+    @app.cli.command('appointment-reminders')
+    @click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+                  help='Appointments read per query.')
+    def appointment_reminders_command(batch_size):
+        """Send the appointment reminders that are due."""
+        sent = send_due_reminders(batch_size=batch_size)
+        click.echo('Sent ' + ', '.join(f'{count} reminders {offset} minutes ahead'
+                                       for offset, count in sent.items()) + '.')
+
+    return scheduler
@@ -0,0 +1,263 @@
+"""
+Availability Module for SwissAxa Portal
+Free appointment slots per agent and conflict-free booking
+
+Appointments last APPOINTMENT_DURATION_MINUTES and start on a grid from the
+beginning of the agent's working hours (AgentWorkingHours rows, or
+AGENT_DEFAULT_WORKING_HOURS for agents without any). An AgentSchedule holds
+an agent's working hours and the start times of their booked appointments
+as a sorted list; since all appointments have the same length, a bisect
+finds any overlap, and the next free slots are found without a query.
+
+Schedules are cached per process for AVAILABILITY_CACHE_SECONDS and cover
+APPOINTMENT_BOOKING_DAYS ahead. The cache only serves suggestions: booking
+locks the agent row and checks for overlapping appointments in the same
+transaction as the insert, so two customers can never get the same slot,
+whatever the cache of their process says.
+
+Service desk appointments are not limited to one at a time, but follow
+SERVICE_DESK_HOURS and the same slot grid.
+
+Appointment times are compared with datetime.utcnow(), like the reminder
+windows in appointment_reminders.py.
+"""
+import threading
+import time
+from bisect import bisect_right, insort
+from datetime import datetime, time as clock_time, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import select, update
+
+
+class SlotUnavailable(Exception):
+    """Raised when a requested appointment time cannot be booked"""
+
+    def __init__(self, message, suggestions=()):
+        super().__init__(message)
+        self.suggestions = list(suggestions)
+
+
+def _parse_hours(hours):
+    """{weekday: [(start, end), ...]} from (weekday, 'HH:MM', 'HH:MM') tuples"""
+    windows = {}
+    for weekday, start, end in hours:
+        if isinstance(start, str):
+            start, end = clock_time.fromisoformat(start), clock_time.fromisoformat(end)
+        windows.setdefault(weekday, []).append((start, end))
+    for day in windows.values():
+        day.sort()
+    return windows
+
+
+class AgentSchedule:
+    """Working hours and booked appointment starts of one agent"""
+
+    def __init__(self, hours, booked, duration, exclusive=True):
+        self.windows = _parse_hours(hours)
+        self.booked = sorted(booked)
+        self.duration = duration
+        self.exclusive = exclusive  # False for the service desk, which takes parallel appointments
+        self.loaded_at = time.monotonic()
+
+    def is_working_slot(self, start):
+        """Whether an appointment may start here: inside working hours and on the slot grid"""
+        for window_start, window_end in self.windows.get(start.weekday(), ()):
+            opens = datetime.combine(start.date(), window_start)
+            if opens <= start and start + self.duration <= datetime.combine(start.date(), window_end):
+                return (start - opens) % self.duration == timedelta(0)
+        return False
+
+    def is_free(self, start):
+        """No booked appointment overlaps one starting here"""
+        if not self.exclusive:
+            return True
+        # The first booking starting after start - duration is the only one that can overlap
+        i = bisect_right(self.booked, start - self.duration)
+        return i == len(self.booked) or self.booked[i] >= start + self.duration
+
+    def add(self, start):
+        insort(self.booked, start)
+
+    def free_slots(self, after, limit, until):
+        """The first `limit` free slot starts later than `after` and before `until`"""
+        slots = []
+        day = after.date()
+        while len(slots) < limit and datetime.combine(day, clock_time()) < until:
+            for window_start, window_end in self.windows.get(day.weekday(), ()):
+                slot = datetime.combine(day, window_start)
+                closes = datetime.combine(day, window_end)
+                while slot + self.duration <= closes and len(slots) < limit:
+                    if slot > after and slot < until and self.is_free(slot):
+                        slots.append(slot)
+                    slot += self.duration
+            day += timedelta(days=1)
+        return slots
+
+
+def _duration():
+    return timedelta(minutes=current_app.config['APPOINTMENT_DURATION_MINUTES'])
+
+
+def _horizon(now):
+    return now + timedelta(days=current_app.config['APPOINTMENT_BOOKING_DAYS'])
+
+
+def _agent_hours(agent_id):
+    from models import db, AgentWorkingHours
+    rows = db.session.execute(
+        select(AgentWorkingHours.weekday, AgentWorkingHours.start_time, AgentWorkingHours.end_time)
+        .where(AgentWorkingHours.agent_id == agent_id)
+    ).all()
+    return [tuple(row) for row in rows] or current_app.config['AGENT_DEFAULT_WORKING_HOURS']
+
+
+def _booked_starts(agent_id, start, end):
+    from models import db, Appointment
+    return db.session.scalars(
+        select(Appointment.date_time)
+        .where(Appointment.agent_id == agent_id, Appointment.status == 'scheduled',
+               Appointment.date_time > start - _duration(), Appointment.date_time < end)
+    ).all()
+
+
+def load_schedule(agent_id, now=None):
+    """Build an agent's schedule from the database; agent_id None is the service desk"""
+    now = now or datetime.utcnow()
+    if agent_id is None:
+        return AgentSchedule(current_app.config['SERVICE_DESK_HOURS'], [], _duration(), exclusive=False)
+    return AgentSchedule(_agent_hours(agent_id), _booked_starts(agent_id, now, _horizon(now)), _duration())
+
+
+class AvailabilityIndex:
+    """Agent schedules cached per process for max_age seconds"""
+
+    def __init__(self, max_age=30):
+        self.max_age = max_age
+        self._schedules = {}
+        self._lock = threading.Lock()
+
+    def get(self, agent_id):
+        with self._lock:
+            schedule = self._schedules.get(agent_id)
+        if schedule is None or time.monotonic() - schedule.loaded_at > self.max_age:
+            schedule = load_schedule(agent_id)
+            with self._lock:
+                self._schedules[agent_id] = schedule
+        return schedule
+
+    def booked(self, agent_id, start):
+        """Record a booking made by this process"""
+        with self._lock:
+            schedule = self._schedules.get(agent_id)
+            if schedule is not None:
+                schedule.add(start)
+
+    def invalidate(self, agent_id=None):
+        with self._lock:
+            if agent_id is None:
+                self._schedules.clear()
+            else:
+                self._schedules.pop(agent_id, None)
+
+
+def get_availability_index():
+    return current_app.extensions['availability']
+
+
+def suggest_slots(agent_id=None, after=None, limit=5):
+    """The next free appointment starts with an agent (or the service desk)"""
+    after = after or datetime.utcnow()
+    schedule = get_availability_index().get(agent_id)
+    return schedule.free_slots(after, limit, _horizon(datetime.utcnow()))
+
+
+def book_appointment(user_id, agent_id, appointment_type, date_time, purpose, commit=True):
+    """
+    Book an appointment if the agent is free
+
+    The agent row is locked by an UPDATE before the overlap check, so
+    bookings for one agent run one after the other. Call this without
+    earlier reads in the transaction, so SQLite's snapshot starts at the lock.
+
+    Raises:
+        SlotUnavailable: Outside working hours, in the past, or taken;
+            carries the next free slots as suggestions
+    """
+    from models import db, Agent, Appointment
+    now = datetime.utcnow()
+    duration = _duration()
+    if agent_id is not None:
+        locked = db.session.execute(
+            update(Agent).where(Agent.id == agent_id).values(id=Agent.id),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        if not locked:
+            db.session.rollback()
+            raise SlotUnavailable('Unknown agent.')
+        hours = AgentSchedule(_agent_hours(agent_id), [], duration)
+    else:
+        hours = AgentSchedule(current_app.config['SERVICE_DESK_HOURS'], [], duration, exclusive=False)
+    if date_time <= now or date_time > _horizon(now) or not hours.is_working_slot(date_time):
+        db.session.rollback()
+        who = 'The agent' if agent_id is not None else 'The service desk'
+        raise SlotUnavailable(f'{who} does not take appointments at this time.',
+                              suggest_slots(agent_id, after=max(date_time, now)))
+    if agent_id is not None:
+        taken = db.session.scalar(
+            select(Appointment.id)
+            .where(Appointment.agent_id == agent_id, Appointment.status == 'scheduled',
+                   Appointment.date_time > date_time - duration, Appointment.date_time < date_time + duration)
+            .limit(1)
+        )
+        if taken is not None:
+            db.session.rollback()
+            # This process's schedule missed the booking; reload it for the suggestions
+            get_availability_index().invalidate(agent_id)
+            raise SlotUnavailable('This time is already booked.', suggest_slots(agent_id, after=date_time))
+    appointment = Appointment(user_id=user_id, agent_id=agent_id, appointment_type=appointment_type,
+                              date_time=date_time, purpose=purpose)
+    db.session.add(appointment)
+    if commit:
+        db.session.commit()
+        if agent_id is not None:
+            get_availability_index().booked(agent_id, date_time)
+    return appointment
+
+
+def init_availability(app):
+    """Initialize the availability cache and the agent-hours CLI command with Flask app"""
+    app.config.setdefault('APPOINTMENT_DURATION_MINUTES', 30)
+    app.config.setdefault('APPOINTMENT_BOOKING_DAYS', 60)
+    app.config.setdefault('AVAILABILITY_CACHE_SECONDS', 30)
+    app.config.setdefault('AGENT_DEFAULT_WORKING_HOURS', [(weekday, '09:00', '17:00') for weekday in range(5)])
+    app.config.setdefault('SERVICE_DESK_HOURS', [(weekday, '08:00', '18:00') for weekday in range(5)])
+    app.config.setdefault('APPOINTMENT_AI_SUGGESTIONS', False)
+
+    index = AvailabilityIndex(max_age=app.config['AVAILABILITY_CACHE_SECONDS'])
+    app.extensions['availability'] = index
+
+    @app.cli.command('agent-hours')
+    @click.argument('agent_id', type=int)
+    @click.argument('hours', nargs=-1)
+    def agent_hours_command(agent_id, hours):
+        """Set an agent's working hours, e.g. 0-4 09:00-12:00 0-4 13:00-17:00 (0 = Monday)."""
+        from models import db, AgentWorkingHours
+        if len(hours) % 2:
+            raise click.UsageError('Give hours as pairs of weekdays and times.')
+        rows = []
+        for days, times in zip(hours[::2], hours[1::2]):
+            first, _, last = days.partition('-')
+            start, _, end = times.partition('-')
+            for weekday in range(int(first), int(last or first) + 1):
+                rows.append(AgentWorkingHours(agent_id=agent_id, weekday=weekday,
+                                              start_time=clock_time.fromisoformat(start),
+                                              end_time=clock_time.fromisoformat(end)))
+        db.session.query(AgentWorkingHours).filter_by(agent_id=agent_id).delete()
+        db.session.add_all(rows)
+        db.session.commit()
+        index.invalidate(agent_id)
+        click.echo(f'Agent {agent_id} works {len(rows)} periods a week.')
+
+    return index
@@ -0,0 +1,4 @@
+"""
+Benchmark harness for SwissAxa Portal
+Load tests for the portal's hot routes; run them with run_benchmarks.py
+"""
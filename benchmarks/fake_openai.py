@@ -0,0 +1,84 @@
+"""
+Minimal OpenAI-compatible server, so benchmarks measure the portal and not the API
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Valid JSON, so endpoints that parse structured answers take their normal path
+DEFAULT_CONTENT = json.dumps({
+    'damage_type': 'water_damage',
+    'severity': 'medium',
+    'estimated_cost': 1500,
+    'suggested_description': 'Water damage in the kitchen',
+    'recommendations': ['Document the damage', 'Stop the water supply'],
+})
+
+
+class FakeOpenAIServer:
+    """Answers /v1/chat/completions with a fixed message after an optional delay"""
+
+    def __init__(self, latency=0.0, content=DEFAULT_CONTENT):
+        self.latency = latency
+        self.content = content
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self._server.server_address[1]}/v1'
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _completion(self, request):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'gpt-4o-mini'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 50, 'completion_tokens': 50, 'total_tokens': 100},
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send(200, server._completion(request))
+                else:
+                    self._send(404, {'error': {'message': f'Unknown path {self.path}'}})
+
+        return Handler
@@ -0,0 +1,365 @@
+"""
+Benchmark Harness Module for SwissAxa Portal
+Drives the hot routes over HTTP at a fixed concurrency and summarizes the results
+
+The app is served in-process by a threaded WSGI server, so the harness can
+count the SQL statements each request runs. Every worker is a separate
+logged-in user with its own keep-alive connection. Each route is run
+separately: the workers start together, each sends its share of the
+requests, and throughput is measured over the whole phase.
+"""
+import http.client
+import json
+import math
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+QUERY_COUNT_HEADER = 'X-Benchmark-Queries'
+PASSWORD = 'password123'  # Shared by the users init_sample_data --bulk creates
+
+# Slack on query counts: any real N+1 adds far more than this
+QUERY_SLACK = 0.5
+
+
+class Route:
+    """One benchmarked request; path, form, files and json may be callables of the worker"""
+
+    def __init__(self, name, method, path, form=None, files=None, json=None, expect=(200,), fresh_session=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.form = form
+        self.files = files
+        self.json = json
+        self.expect = expect
+        self.fresh_session = fresh_session  # Measure with a new, logged-out client
+
+    def build(self, worker):
+        def value(item):
+            return item(worker) if callable(item) else item
+
+        headers = {}
+        body = None
+        if self.files is not None:
+            body, content_type = encode_multipart(value(self.form) or {}, value(self.files))
+            headers['Content-Type'] = content_type
+        elif self.form is not None:
+            body = urlencode(value(self.form)).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif self.json is not None:
+            body = json.dumps(value(self.json)).encode()
+            headers['Content-Type'] = 'application/json'
+        return self.method, value(self.path), body, headers
+
+
+JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00' + b'\x00' * 4096
+PDF = b'%PDF-1.4\n' + b'0' * 8192
+
+ROUTES = [
+    Route('login', 'POST', '/login', form=lambda w: {'email': w.email, 'password': PASSWORD},
+          expect=(302,), fresh_session=True),
+    Route('dashboard', 'GET', '/dashboard'),
+    Route('policies', 'GET', '/policies'),
+    Route('documents', 'GET', '/documents'),
+    Route('upload_document', 'POST', '/documents/upload', form={'document_type': 'policy'},
+          files={'file': ('benchmark.pdf', PDF)}, expect=(302,)),
+    Route('file_claim', 'POST', '/services/claims/file',
+          form={'description': 'Benchmark claim', 'damage_type': 'water_damage'},
+          files={'media': ('photo.jpg', JPEG)}, expect=(302,)),
+    Route('chat', 'POST', '/api/chat', json={'message': 'What does my home insurance cover?'}),
+    Route('mobile_claims', 'GET', '/api/mobile/claims'),
+    Route('mobile_claim_detail', 'GET', lambda w: f'/api/mobile/claims/{w.claim_id}'),
+    Route('mobile_policies', 'GET', '/api/mobile/policies'),
+    Route('mobile_documents', 'GET', '/api/mobile/documents'),
+    Route('mobile_notifications', 'GET', '/api/mobile/notifications'),
+    Route('mobile_dashboard_stats', 'GET', '/api/mobile/dashboard/stats'),
+    Route('mobile_chat', 'POST', '/api/mobile/chat', json={'message': 'How do I file a claim?'}),
+]
+
+
+def encode_multipart(fields, files):
+    """Encode form fields and {name: (filename, bytes)} as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """HTTP client with one keep-alive connection and a cookie jar"""
+
+    def __init__(self, host, port, timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cookies = {}
+        self._conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._conn.request(method, path, body=body, headers=headers)
+                response = self._conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server may close an idle keep-alive connection; retry once on a new one
+                self.close()
+                if attempt:
+                    raise
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            name, _, value = cookie.split(';', 1)[0].partition('=')
+            self.cookies[name.strip()] = value
+        if response.getheader('Connection', '').lower() == 'close':
+            self.close()
+        return response.status, response.headers, data
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class Worker:
+    """A benchmark user: credentials, ids used in paths, and a logged-in client"""
+
+    def __init__(self, email, claim_id, client):
+        self.email = email
+        self.claim_id = claim_id
+        self.client = client
+
+    def login(self):
+        status, _, _ = self.client.request('POST', '/login', urlencode({'email': self.email, 'password': PASSWORD}).encode(),
+                                           {'Content-Type': 'application/x-www-form-urlencoded'})
+        if status != 302:
+            raise RuntimeError(f'Login failed for {self.email} (HTTP {status})')
+
+
+class _KeepAliveHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class BenchmarkServer:
+    """Serves the app on a local port from a background thread, counting queries per request"""
+
+    def __init__(self, app):
+        self.app = app
+        self._server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_KeepAliveHandler)
+        self._server.daemon_threads = True
+        self.host, self.port = '127.0.0.1', self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._uninstall = None
+
+    def start(self):
+        self._uninstall = install_query_counter(self.app)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._uninstall:
+            self._uninstall()
+
+    def client(self):
+        return Client(self.host, self.port)
+
+
+def install_query_counter(app):
+    """
+    Report the number of SQL statements each request ran in a response header
+
+    Uses signals and engine events rather than app hooks, so it can be added
+    to an app that is already serving. Returns a function that removes it.
+    """
+    from flask import g, has_app_context, request_finished
+    from sqlalchemy import event
+    from models import db
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if has_app_context():
+            g._benchmark_queries = g.get('_benchmark_queries', 0) + 1
+
+    def finished(sender, response, **extra):
+        response.headers[QUERY_COUNT_HEADER] = str(g.get('_benchmark_queries', 0))
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count)
+    request_finished.connect(finished, app)
+
+    def uninstall():
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', count)
+        request_finished.disconnect(finished, app)
+    return uninstall
+
+
+def prepare_workers(server, count):
+    """Log in one worker per bulk user, taking users with at least one claim"""
+    from sqlalchemy import func, select
+    from models import db, User, Claim
+
+    with server.app.app_context():
+        rows = db.session.execute(
+            select(User.email, func.min(Claim.id))
+            .join(Claim, Claim.user_id == User.id)
+            .where(User.email.like('%@bulk.example.com'))
+            .group_by(User.id)
+            .order_by(User.id)
+            .limit(count)
+        ).all()
+    if len(rows) < count:
+        raise RuntimeError(f'Need {count} bulk users with claims, found {len(rows)}; '
+                           f'generate more with init_sample_data.py --bulk')
+    workers = [Worker(email, claim_id, server.client()) for email, claim_id in rows]
+    for worker in workers:
+        worker.login()
+    return workers
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def run_route(server, route, workers, requests, warmup=0):
+    """
+    Send requests of one route from all workers at once
+
+    Each worker sends requests // len(workers) measured requests, after
+    warmup unmeasured ones.
+    """
+    per_worker = max(1, requests // len(workers))
+    latencies, queries, errors = [], [], []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(workers) + 1)
+
+    def send(worker):
+        client = server.client() if route.fresh_session else worker.client
+        method, path, body, headers = route.build(worker)
+        start = time.perf_counter()
+        try:
+            status, response_headers, _ = client.request(method, path, body, headers)
+        except (http.client.HTTPException, OSError) as e:
+            return time.perf_counter() - start, None, repr(e)
+        finally:
+            if route.fresh_session:
+                client.close()
+        elapsed = time.perf_counter() - start
+        error = None if status in route.expect else f'HTTP {status}'
+        count = response_headers.get(QUERY_COUNT_HEADER)
+        return elapsed, int(count) if count is not None else None, error
+
+    def run(worker):
+        for _ in range(warmup):
+            send(worker)
+        barrier.wait()
+        results = [send(worker) for _ in range(per_worker)]
+        with lock:
+            for elapsed, count, error in results:
+                latencies.append(elapsed)
+                if count is not None:
+                    queries.append(count)
+                if error:
+                    errors.append(error)
+
+    threads = [threading.Thread(target=run, args=(worker,), daemon=True) for worker in workers]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return summarize(latencies, queries, errors, wall)
+
+
+def summarize(latencies, queries, errors, wall):
+    """Per-route summary; latencies in milliseconds"""
+    ordered = sorted(latencies)
+    result = {
+        'requests': len(ordered),
+        'errors': len(errors),
+        'throughput_rps': round(len(ordered) / wall, 2) if wall else 0.0,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+        'p50_ms': round(percentile(ordered, 50) * 1000, 2),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 2),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+    if errors:
+        result['error_samples'] = sorted(set(errors))[:5]
+    return result
+
+
+def run_benchmarks(server, routes, concurrency, requests, warmup=0, progress=print):
+    """Run each route in turn and return {route name: summary}"""
+    workers = prepare_workers(server, concurrency)
+    results = {}
+    try:
+        for route in routes:
+            results[route.name] = summary = run_route(server, route, workers, requests, warmup)
+            progress(format_summary(route.name, summary))
+    finally:
+        for worker in workers:
+            worker.client.close()
+    return results
+
+
+def format_summary(name, summary):
+    queries = summary['queries_per_request']
+    return (f'{name:<24} {summary["throughput_rps"]:>9.1f} req/s  p50 {summary["p50_ms"]:>8.1f}ms  '
+            f'p95 {summary["p95_ms"]:>8.1f}ms  p99 {summary["p99_ms"]:>8.1f}ms  '
+            f'queries {"-" if queries is None else queries:>6}  errors {summary["errors"]}')
+
+
+def compare(baseline, current, tolerance=0.2):
+    """
+    List regressions of current against baseline route summaries
+
+    Latency (p50, p95) may grow and throughput may drop by the tolerance
+    fraction before a route is flagged. Queries per request are averaged
+    over the run and barely vary, so they may only grow by QUERY_SLACK (a
+    cache miss or two), far less than any N+1. Routes missing from the
+    baseline are skipped.
+    """
+    regressions = []
+    for name, now in current.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if now['errors'] > before.get('errors', 0):
+            regressions.append(f'{name}: errors {before.get("errors", 0)} -> {now["errors"]}')
+        for key in ('p50_ms', 'p95_ms'):
+            if before[key] and now[key] > before[key] * (1 + tolerance):
+                regressions.append(f'{name}: {key} {before[key]} -> {now[key]}')
+        if before['throughput_rps'] and now['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f'{name}: throughput_rps {before["throughput_rps"]} -> {now["throughput_rps"]}')
+        if (before.get('queries_per_request') is not None and now.get('queries_per_request') is not None
+                and now['queries_per_request'] > before['queries_per_request'] + QUERY_SLACK):
+            regressions.append(f'{name}: queries_per_request {before["queries_per_request"]} '
+                               f'-> {now["queries_per_request"]}')
+    return regressions
@@ -0,0 +1,147 @@
+"""
+Startup Benchmark Module for SwissAxa Portal
+Cold-start time and per-worker memory of the portal
+
+Every run starts a fresh interpreter that imports the app and builds it,
+the way a worker process boots. It reports how long that took, the peak RSS
+and which heavy optional modules got loaded. The worker measurement builds
+the app once, then forks workers like a pre-forking server does. Each worker
+serves one request and reports its private (unshared) memory, which is what
+every additional worker really costs.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --workers 4 --output benchmarks/startup.json
+
+Private memory is read from /proc and is only reported on Linux.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Optional subsystems that should only load when first used
+HEAVY_MODULES = ('openai', 'ai_services', 'flask_mail', 'flask_babel', 'analytics')
+
+_BOOT = '''
+import json, os, resource, sys, time
+started = time.perf_counter()
+import app as portal
+imported = time.perf_counter()
+application = portal.create_app() if hasattr(portal, 'create_app') else portal.app
+ready = time.perf_counter()
+'''
+
+COLD_START = _BOOT + '''
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_ms': (ready - imported) * 1000,
+    'total_ms': (ready - started) * 1000,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+    'loaded': sorted(set(sys.argv[1:]) & set(sys.modules)),
+}))
+'''
+
+WORKERS = _BOOT + '''
+from benchmarks.startup import private_memory_kb
+results = []
+for _ in range(int(sys.argv[1])):
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        application.test_client().get('/login')
+        with os.fdopen(write, 'w') as f:
+            json.dump({'private_kb': private_memory_kb()}, f)
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        results.append(json.load(f))
+    os.waitpid(pid, 0)
+print(json.dumps({'parent_private_kb': private_memory_kb(), 'workers': results}))
+'''
+
+
+def private_memory_kb():
+    """Private (unshared) memory of this process in KiB, or None where /proc is missing"""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if line.count(':') == 1)
+    except OSError:
+        return None
+    return sum(int(fields[key].split()[0]) for key in ('Private_Clean', 'Private_Dirty') if key in fields)
+
+
+def _run(code, args, workdir):
+    env = dict(os.environ,
+               APP_CONFIG='production',
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+               PYTHONPATH=ROOT)
+    # Run from an empty directory so upload folders created at boot land there
+    result = subprocess.run([sys.executable, '-c', code, *map(str, args)], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_cold_start(runs=5, workdir=None):
+    """Boot the app in fresh interpreters; returns medians plus the modules loaded"""
+    workdir = workdir or tempfile.mkdtemp(prefix='swissaxa-startup-')
+    # The first run also fills the bytecode cache, so it is not timed
+    _run(COLD_START, HEAVY_MODULES, workdir)
+    samples = [_run(COLD_START, HEAVY_MODULES, workdir) for _ in range(runs)]
+    summary = {key: round(statistics.median(sample[key] for sample in samples), 1)
+               for key in ('import_ms', 'create_ms', 'total_ms', 'max_rss_kb', 'modules')}
+    summary['loaded'] = samples[-1]['loaded']
+    return summary
+
+
+def measure_workers(workers=3, workdir=None):
+    """Fork workers from a booted app; returns private memory of the parent and each worker"""
+    if not hasattr(os, 'fork'):
+        return None
+    workdir = workdir or tempfile.mkdtemp(prefix='swissaxa-startup-')
+    result = _run(WORKERS, [workers], workdir)
+    private = [worker['private_kb'] for worker in result['workers'] if worker['private_kb'] is not None]
+    return {
+        'parent_private_kb': result['parent_private_kb'],
+        'worker_private_kb': round(statistics.median(private)) if private else None,
+        'workers': len(result['workers']),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure portal cold start and per-worker memory')
+    parser.add_argument('--runs', type=int, default=5, help='Timed cold starts (median is reported)')
+    parser.add_argument('--workers', type=int, default=3, help='Workers forked for the memory measurement')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='swissaxa-startup-')
+    try:
+        report = {'cold_start': measure_cold_start(args.runs, workdir),
+                  'workers': measure_workers(args.workers, workdir)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    cold = report['cold_start']
+    print(f"Cold start: {cold['total_ms']:.0f} ms (import {cold['import_ms']:.0f} ms, "
+          f"create {cold['create_ms']:.0f} ms), peak RSS {cold['max_rss_kb'] / 1024:.1f} MiB, "
+          f"{cold['modules']:.0f} modules")
+    print(f"Optional modules loaded at boot: {', '.join(cold['loaded']) or 'none'}")
+    workers = report['workers']
+    if workers and workers['worker_private_kb'] is not None:
+        print(f"Private memory per worker after one request: {workers['worker_private_kb'] / 1024:.1f} MiB "
+              f"(parent {workers['parent_private_kb'] / 1024:.1f} MiB)")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
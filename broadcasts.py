@@ -0,0 +1,259 @@
+"""
+Broadcasts Module for SwissAxa Portal
+Notifies every holder of a policy type at once, e.g. when its terms change
+
+A campaign is created through POST /admin/broadcasts and processed by
+`flask broadcasts-run` (from cron, or by hand), never inside a web request.
+Holders are selected with one query over the (policy_type, status, user_id)
+index and paged by user id. Each batch is one transaction: a multi-row insert
+of notifications, one counter statement, and the campaign's cursor and
+progress. A crash loses at most the batch in flight, and the next run
+continues after the last committed user. The cursor only moves if it still
+has the value the batch started from, so two runners never notify a user
+twice.
+
+With send_email the holders' emails are then queued in the email outbox in
+chunks with their own cursor. Each chunk is queued in the transaction that
+moves the cursor, so every holder is queued exactly once.
+"""
+from datetime import datetime
+
+import click
+from flask import current_app
+from sqlalchemy import exists, select, update
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_EMAIL_BATCH_SIZE = 500
+ACTIVE_STATUSES = ('pending', 'notifying', 'emailing')
+
+
+def _holder_filter(campaign):
+    from models import SwissAxaPolicy
+    conditions = [SwissAxaPolicy.policy_type == campaign.policy_type]
+    if campaign.policy_status is not None:
+        conditions.append(SwissAxaPolicy.status == campaign.policy_status)
+    return conditions
+
+
+def count_targets(campaign):
+    """Number of users holding a policy the campaign addresses"""
+    from models import db, SwissAxaPolicy
+    holders = select(SwissAxaPolicy.user_id).where(*_holder_filter(campaign)).distinct().subquery()
+    return db.session.scalar(select(db.func.count()).select_from(holders))
+
+
+def create_campaign(title, message, policy_type, policy_status='active', notification_type='info',
+                    action_url=None, send_email=False, created_by=None):
+    """Record a campaign to be sent by the next broadcasts-run"""
+    from models import db, BroadcastCampaign
+    campaign = BroadcastCampaign(
+        title=title,
+        message=message,
+        policy_type=policy_type,
+        policy_status=policy_status,
+        notification_type=notification_type,
+        action_url=action_url,
+        send_email=send_email,
+        created_by=created_by
+    )
+    campaign.targeted = count_targets(campaign)
+    db.session.add(campaign)
+    db.session.commit()
+    return campaign
+
+
+def _next_holders(campaign, after_user_id, limit):
+    """The next user ids after after_user_id, read from the policy index"""
+    from models import db, SwissAxaPolicy
+    return db.session.scalars(
+        select(SwissAxaPolicy.user_id)
+        .where(*_holder_filter(campaign), SwissAxaPolicy.user_id > after_user_id)
+        .distinct()
+        .order_by(SwissAxaPolicy.user_id)
+        .limit(limit)
+    ).all()
+
+
+def _next_recipients(campaign, after_user_id, limit):
+    """The next (user id, email) pairs of holders after after_user_id"""
+    from models import db, User, SwissAxaPolicy
+    return db.session.execute(
+        select(User.id, User.email)
+        .where(User.id > after_user_id,
+               exists().where(SwissAxaPolicy.user_id == User.id, *_holder_filter(campaign)))
+        .order_by(User.id)
+        .limit(limit)
+    ).all()
+
+
+def _advance(campaign_id, start, status, cursor, **changes):
+    """
+    Move the campaign on, in the batch's transaction, if it is still at start (status, cursor)
+
+    Returns False if another runner moved it or it was cancelled; the caller then rolls back.
+    """
+    from models import db, BroadcastCampaign
+    values = {'status': status, 'cursor': cursor}
+    for column, delta in changes.items():
+        values[column] = getattr(BroadcastCampaign, column) + delta
+    if status == 'completed':
+        values['finished_at'] = datetime.utcnow()
+    result = db.session.execute(
+        update(BroadcastCampaign)
+        .where(BroadcastCampaign.id == campaign_id,
+               BroadcastCampaign.status == start[0],
+               BroadcastCampaign.cursor == start[1])
+        .values(**values),
+        execution_options={'synchronize_session': False}
+    )
+    return result.rowcount == 1
+
+
+def _notify_batch(campaign, start, batch_size):
+    from notifications import add_notifications
+    user_ids = _next_holders(campaign, campaign.cursor, batch_size)
+    if not user_ids:
+        # The next phase starts from the first user again
+        return _advance(campaign.id, start, 'emailing' if campaign.send_email else 'completed', 0)
+    added = add_notifications(user_ids, campaign.title, campaign.message,
+                              notification_type=campaign.notification_type, action_url=campaign.action_url)
+    return _advance(campaign.id, start, 'notifying', user_ids[-1], notified=added)
+
+
+def _email_batch(campaign, start, batch_size):
+    from email_outbox import enqueue_email
+    recipients = _next_recipients(campaign, campaign.cursor, batch_size)
+    if not recipients:
+        return _advance(campaign.id, start, 'completed', 0)
+    for _, email in recipients:
+        enqueue_email(email, campaign.title, campaign.message, commit=False)
+    return _advance(campaign.id, start, 'emailing', recipients[-1][0], emailed=len(recipients))
+
+
+def run_campaign(campaign_id, batch_size=DEFAULT_BATCH_SIZE, email_batch_size=DEFAULT_EMAIL_BATCH_SIZE,
+                 max_batches=None):
+    """
+    Send a campaign, or continue it where the last run stopped
+
+    Returns:
+        dict: batches run, status reached, complete (False if max_batches stopped the run)
+    """
+    from models import db, BroadcastCampaign
+    batches = 0
+    while True:
+        db.session.expire_all()
+        campaign = db.session.get(BroadcastCampaign, campaign_id)
+        if campaign is None or campaign.status not in ACTIVE_STATUSES:
+            break
+        if max_batches is not None and batches >= max_batches:
+            break
+        if campaign.started_at is None:
+            campaign.started_at = datetime.utcnow()
+            db.session.commit()
+        start = (campaign.status, campaign.cursor)
+        if campaign.status == 'emailing':
+            moved = _email_batch(campaign, start, email_batch_size)
+        else:
+            moved = _notify_batch(campaign, start, batch_size)
+        if moved:
+            db.session.commit()
+            batches += 1
+        else:
+            db.session.rollback()
+            current_app.logger.info(f'Broadcast {campaign_id} was advanced by another runner')
+
+    status = campaign.status if campaign is not None else None
+    return {'batches': batches, 'status': status, 'complete': status not in ACTIVE_STATUSES}
+
+
+def run_pending_campaigns(**options):
+    """Run every unfinished campaign, oldest first; returns {campaign id: result}"""
+    from models import db, BroadcastCampaign
+    campaign_ids = db.session.scalars(
+        select(BroadcastCampaign.id)
+        .where(BroadcastCampaign.status.in_(ACTIVE_STATUSES))
+        .order_by(BroadcastCampaign.id)
+    ).all()
+    return {campaign_id: run_campaign(campaign_id, **options) for campaign_id in campaign_ids}
+
+
+def cancel_campaign(campaign):
+    """Stop a campaign; users notified so far keep their notification"""
+    from models import db
+    if campaign.status in ACTIVE_STATUSES:
+        campaign.status = 'cancelled'
+        campaign.finished_at = datetime.utcnow()
+        db.session.commit()
+    return campaign
+
+
+def init_broadcasts(app):
+    """Register the broadcast admin routes and the broadcasts-run CLI command with Flask app"""
+    from flask import jsonify, request
+    from flask_login import current_user
+    from admin_auth import admin_required
+
+    @app.route('/admin/broadcasts', methods=['POST'])
+    @admin_required
+    def create_broadcast():
+        data = request.get_json(silent=True) or {}
+        missing = [field for field in ('title', 'message', 'policy_type') if not data.get(field)]
+        if missing:
+            return jsonify({'error': f"Missing: {', '.join(missing)}"}), 400
+        campaign = create_campaign(
+            title=data['title'],
+            message=data['message'],
+            policy_type=data['policy_type'],
+            policy_status=data.get('policy_status', 'active'),
+            notification_type=data.get('notification_type', 'info'),
+            action_url=data.get('action_url'),
+            send_email=bool(data.get('send_email')),
+            created_by=current_user.id
+        )
+        return jsonify(campaign.to_dict()), 201
+
+    @app.route('/admin/broadcasts')
+    @admin_required
+    def list_broadcasts():
+        from models import BroadcastCampaign
+        campaigns = BroadcastCampaign.query.order_by(BroadcastCampaign.id.desc()).limit(50).all()
+        return jsonify([campaign.to_dict() for campaign in campaigns])
+
+    @app.route('/admin/broadcasts/<int:campaign_id>')
+    @admin_required
+    def broadcast_progress(campaign_id):
+        from models import db, BroadcastCampaign
+        return jsonify(db.get_or_404(BroadcastCampaign, campaign_id).to_dict())
+
+    @app.route('/admin/broadcasts/<int:campaign_id>/cancel', methods=['POST'])
+    @admin_required
+    def cancel_broadcast(campaign_id):
+        from models import db, BroadcastCampaign
+        return jsonify(cancel_campaign(db.get_or_404(BroadcastCampaign, campaign_id)).to_dict())
+
+    @app.cli.command('broadcasts-run')
+    @click.option('--campaign', 'campaign_id', type=int, default=None,
+                  help='Only this campaign (default: every unfinished one).')
+    @click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+                  help='Users notified per transaction.')
+    @click.option('--email-batch-size', default=DEFAULT_EMAIL_BATCH_SIZE, show_default=True,
+                  help='Emails queued per transaction.')
+    @click.option('--max-batches', type=int, default=None,
+                  help='Stop each campaign after this many batches; the next run continues.')
+    def broadcasts_run_command(campaign_id, batch_size, email_batch_size, max_batches):
+        """Send pending broadcast campaigns."""
+        options = {'batch_size': batch_size, 'email_batch_size': email_batch_size, 'max_batches': max_batches}
+        if campaign_id is not None:
+            results = {campaign_id: run_campaign(campaign_id, **options)}
+        else:
+            results = run_pending_campaigns(**options)
+        from models import db, BroadcastCampaign
+        for run_id, result in results.items():
+            campaign = db.session.get(BroadcastCampaign, run_id)
+            if campaign is None:
+                click.echo(f'Campaign {run_id}: not found.')
+                continue
+            click.echo(f"Campaign {run_id}: {campaign.status}, notified {campaign.notified}/"
+                       f"{campaign.targeted}, emails queued {campaign.emailed} in {result['batches']} batches.")
+        if not results:
+            click.echo('No campaigns to run.')
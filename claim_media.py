@@ -0,0 +1,113 @@
+"""
+Claim Media Module for SwissAxa Portal
+Saves claim photos and videos in parallel, hashing and sniffing them on the way
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.utils import secure_filename
+from storage import unique_key
+from upload_validation import ValidatingReader, sniff_media_type
+
+DEFAULT_WORKERS = 4
+
+# Extension fallback for content the sniffer does not recognize
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def classify_media(header: bytes, filename: str):
+    """Sniff the media type, falling back to the extension for unknown content"""
+    sniffed = sniff_media_type(header)
+    if sniffed:
+        return sniffed
+    if filename.lower().endswith(VIDEO_EXTENSIONS):
+        return 'video', None
+    return 'photo', None
+
+
+def get_executor(max_workers=None):
+    """Return the process-wide worker pool used for media writes"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=max_workers or DEFAULT_WORKERS,
+                    thread_name_prefix='claim-media'
+                )
+    return _executor
+
+
+def pending_writes():
+    """Media writes queued behind the busy workers"""
+    executor = _executor
+    return executor._work_queue.qsize() if executor is not None else 0
+
+
+def _save_one(file, storage, prefix, checks):
+    """Stream one upload into storage while validating, hashing and sniffing it"""
+    filename = secure_filename(file.filename)
+    key = unique_key(prefix, filename)
+    reader = ValidatingReader(file.stream, checks, filename=filename)
+    storage.put_stream(key, reader, content_type=file.mimetype)
+
+    media_type, mime_type = classify_media(reader.header, filename)
+    return {
+        'filename': filename,
+        'file_path': key,
+        'media_type': media_type,
+        'mime_type': mime_type,
+        'content_hash': reader.content_hash,
+        'file_size': reader.size
+    }
+
+
+def save_claim_media(files, storage, prefix='claims', max_workers=None, checks_factory=None):
+    """
+    Write uploaded claim media concurrently
+
+    Runs before the claim transaction is opened, so no database lock is held
+    while files are written. If any file fails or is rejected by a check, the
+    ones already written are removed again and the error is re-raised.
+
+    Args:
+        files: FileStorage objects from request.files.getlist('media')
+        storage: Storage backend receiving the files
+        prefix: Key prefix for the stored media
+        max_workers: Size of the shared worker pool on first use
+        checks_factory: Callable returning fresh upload checks for one file
+
+    Returns:
+        list: One dict per saved file, in upload order
+    """
+    files = [f for f in files if f and f.filename]
+    if not files:
+        return []
+
+    executor = get_executor(max_workers)
+    futures = [
+        executor.submit(_save_one, f, storage, prefix, checks_factory() if checks_factory else [])
+        for f in files
+    ]
+
+    saved, error = [], None
+    for future in futures:
+        try:
+            saved.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error:
+        discard_saved_media(storage, saved)
+        raise error
+    return saved
+
+
+def discard_saved_media(storage, saved):
+    """Remove files written by save_claim_media, e.g. after a failed commit"""
+    for item in saved:
+        try:
+            storage.delete(item['file_path'])
+        except Exception:
+            pass
@@ -0,0 +1,188 @@
+"""
+Configuration Module for SwissAxa Portal
+Settings per environment, with the database selected by DATABASE_URL
+
+Pick the environment with APP_CONFIG (development, testing, production).
+DATABASE_URL selects the primary database, for example
+postgresql://user:pass@db:5432/portal. DATABASE_REPLICA_URLS is an optional
+comma-separated list of read replicas, used by views marked @read_only.
+"""
+import os
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+def _env_list(name, lower=False):
+    values = [value.strip() for value in os.getenv(name, '').split(',') if value.strip()]
+    return [value.lower() for value in values] if lower else values
+
+
+def normalize_database_url(url):
+    """Accept the postgres:// scheme that some hosting providers still hand out"""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+class Config:
+    """Settings shared by all environments"""
+    SECRET_KEY = os.getenv('SECRET_KEY', 'swissaxa-secret-key-2024')
+    SQLALCHEMY_DATABASE_URI = normalize_database_url(os.getenv('DATABASE_URL', 'sqlite:///swissaxa_portal.db'))
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DATABASE_REPLICA_URLS = [normalize_database_url(url.strip())
+                             for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    # Connection pool for server databases (ignored for SQLite)
+    DATABASE_POOL_SIZE = _env_int('DATABASE_POOL_SIZE', 10)
+    DATABASE_MAX_OVERFLOW = _env_int('DATABASE_MAX_OVERFLOW', 20)
+    DATABASE_POOL_TIMEOUT = _env_int('DATABASE_POOL_TIMEOUT', 10)  # Seconds to wait for a free connection
+    DATABASE_POOL_RECYCLE = _env_int('DATABASE_POOL_RECYCLE', 1800)  # Below typical server/proxy idle timeouts
+    DATABASE_POOL_PRE_PING = _env_bool('DATABASE_POOL_PRE_PING', True)
+    # After a write, route this user's reads to the primary so they see their own changes
+    DATABASE_REPLICA_STICKY_SECONDS = _env_int('DATABASE_REPLICA_STICKY_SECONDS', 5)
+    # SQLite tuning; pragma defaults live in db_engine.py
+    SQLITE_PRAGMAS = {}
+    DB_SERIALIZE_WRITES = True  # One writer at a time, in arrival order
+    DB_WRITE_QUEUE_TIMEOUT = 10.0  # Seconds before a queued write gives up with 503
+
+    UPLOAD_FOLDER = 'uploads'
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    MEDIA_UPLOAD_WORKERS = 4  # Parallel writers for claim photos/videos
+    # Upload validation; type and size defaults live in upload_validation.py
+    UPLOAD_REJECT_UNKNOWN_TYPES = False
+    UPLOAD_SCANNER_ADDRESS = os.getenv('UPLOAD_SCANNER_ADDRESS')  # clamd, e.g. 'localhost:3310'
+    STORAGE_QUOTA_BYTES = _env_int('STORAGE_QUOTA_BYTES', 0) or None  # Per user; None = unlimited
+    STORAGE_GC_GRACE_SECONDS = 24 * 3600  # Unreferenced files younger than this are kept
+    # Flask-Login user cache: 'local' (per process), 'memcached' (shared) or 'none'
+    USER_CACHE_BACKEND = os.getenv('USER_CACHE_BACKEND', 'local')
+    USER_CACHE_ADDRESS = os.getenv('USER_CACHE_ADDRESS', 'localhost:11211')
+    USER_CACHE_TTL = _env_int('USER_CACHE_TTL', 30)  # Seconds
+    ID_BLOCK_SIZE = 1000  # Claim/policy numbers leased per database round trip
+    NOTIFICATION_RETENTION_DAYS = _env_int('NOTIFICATION_RETENTION_DAYS', 90)  # flask notifications-purge
+    # Email outbox (email_outbox.py): sender threads per web process; 0 = only `flask email-outbox-worker`
+    EMAIL_OUTBOX_WORKERS = _env_int('EMAIL_OUTBOX_WORKERS', 2)
+    EMAIL_MAX_ATTEMPTS = _env_int('EMAIL_MAX_ATTEMPTS', 6)  # Then the email is marked dead
+    EMAIL_RETRY_BASE_SECONDS = 30  # Doubles after every failed attempt
+    EMAIL_RETRY_MAX_SECONDS = 3600
+    # Pooled SMTP connections (smtp_pool.py); rate limits are messages per second per process
+    EMAIL_SMTP_MAX_MESSAGES = 100  # Then the connection is replaced
+    EMAIL_SMTP_IDLE_SECONDS = 30  # Unused connections older than this are closed, not reused
+    EMAIL_RATE_LIMIT_PER_SECOND = float(os.getenv('EMAIL_RATE_LIMIT_PER_SECOND', 0)) or None
+    EMAIL_RATE_LIMITS = {}  # Per SMTP host, e.g. {'email-smtp.eu-central-1.amazonaws.com': 14}
+    # Attachments (email_attachments.py): files beyond the cap are sent as expiring download links
+    EMAIL_ATTACHMENT_MAX_BYTES = _env_int('EMAIL_ATTACHMENT_MAX_BYTES', 10 * 1024 * 1024)  # Before base64
+    EMAIL_ATTACHMENT_LINKS = _env_bool('EMAIL_ATTACHMENT_LINKS', True)  # False = fail instead
+    EMAIL_ATTACHMENT_LINK_EXPIRES = 7 * 24 * 3600  # The most S3 presigned URLs allow
+    EMAIL_SPOOL_MEMORY_BYTES = 1024 * 1024  # Larger messages are spooled to a temporary file
+    # Claim update digests (email_digests.py): updates within the window go out as one email; 0 = one email each
+    EMAIL_DIGEST_WINDOW_SECONDS = _env_int('EMAIL_DIGEST_WINDOW_SECONDS', 300)
+    EMAIL_DIGEST_SCHEDULER = True  # Timer thread per web process; False = only `flask email-digests-flush`
+    EMAIL_DIGEST_POLL_SECONDS = 30.0
+    # Appointment reminders (appointment_reminders.py): minutes before the appointment
+    APPOINTMENT_REMINDER_OFFSETS = [int(m) for m in _env_list('APPOINTMENT_REMINDER_OFFSETS')] or [24 * 60, 60]
+    APPOINTMENT_REMINDER_SCHEDULER = True  # Thread per web process; False = only `flask appointment-reminders`
+    APPOINTMENT_REMINDER_POLL_SECONDS = 60.0
+    # Appointment slots (availability.py); hours are (weekday, start, end) with 0 = Monday
+    APPOINTMENT_DURATION_MINUTES = 30
+    APPOINTMENT_BOOKING_DAYS = 60  # How far ahead customers can book
+    AVAILABILITY_CACHE_SECONDS = 30  # Per-process schedules; booking always checks the database
+    AGENT_DEFAULT_WORKING_HOURS = [(weekday, '09:00', '17:00') for weekday in range(5)]  # `flask agent-hours`
+    SERVICE_DESK_HOURS = [(weekday, '08:00', '18:00') for weekday in range(5)]
+    APPOINTMENT_AI_SUGGESTIONS = _env_bool('APPOINTMENT_AI_SUGGESTIONS', False)  # Let the LLM rank free slots
+    # Email templates (email_templates.py); unset = check the files for changes only in debug mode
+    EMAIL_TEMPLATE_AUTO_RELOAD = None
+    PORTAL_URL = os.getenv('PORTAL_URL', 'http://localhost:5000')  # For links in emails
+    # Server-Sent Events push (notification_stream.py): 'local' (one process) or 'database' (polls, any process)
+    NOTIFICATION_STREAM_BROKER = os.getenv('NOTIFICATION_STREAM_BROKER', 'local')
+    NOTIFICATION_STREAM_POLL_SECONDS = 1.0
+    NOTIFICATION_STREAM_KEEPALIVE_SECONDS = 15  # Below typical proxy idle timeouts
+    NOTIFICATION_STREAM_MAX_SECONDS = _env_int('NOTIFICATION_STREAM_MAX_SECONDS', 300)  # Then the client reconnects
+    # Per-request query stats (query_stats.py): Server-Timing header and slow-request log
+    QUERY_STATS_ENABLED = _env_bool('QUERY_STATS_ENABLED', True)
+    SERVER_TIMING_HEADER = _env_bool('SERVER_TIMING_HEADER', True)
+    SLOW_REQUEST_MS = _env_int('SLOW_REQUEST_MS', 500)
+    SLOW_REQUEST_QUERIES = _env_int('SLOW_REQUEST_QUERIES', 50)  # Log chatty requests even when fast
+    SLOW_REQUEST_TOP_STATEMENTS = 5
+    # /metrics in the Prometheus text format, scraped with 'Authorization: Bearer <METRICS_TOKEN>'.
+    # Without a token it is only served in debug and testing, as it shows per-endpoint traffic,
+    # queue depths and pool internals
+    METRICS_ENABLED = _env_bool('METRICS_ENABLED', True)
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    # Sampling profiler (profiling.py); off unless PROFILING_ENABLED is set
+    PROFILING_ENABLED = _env_bool('PROFILING_ENABLED', False)
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.0))  # Fraction of all requests
+    PROFILE_ENDPOINTS = _env_list('PROFILE_ENDPOINTS')  # e.g. 'file_claim,policy_management'
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')  # Sent as X-Profile-Request to profile one request
+    PROFILE_INTERVAL = 0.005  # Seconds between stack samples
+    PROFILE_MIN_DURATION_MS = _env_int('PROFILE_MIN_DURATION_MS', 0)  # Discard faster requests
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    PROFILE_MAX_FILES = 500
+    # Accounts allowed on /admin/profiles and other operator routes
+    ADMIN_EMAILS = _env_list('ADMIN_EMAILS', lower=True)
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    EMAIL_OUTBOX_WORKERS = 0  # Tests send queued email themselves
+    EMAIL_DIGEST_WINDOW_SECONDS = 0  # Claim emails are queued at once unless a test sets a window
+    EMAIL_DIGEST_SCHEDULER = False
+    APPOINTMENT_REMINDER_SCHEDULER = False
+    SQLALCHEMY_DATABASE_URI = normalize_database_url(os.getenv('DATABASE_URL', 'sqlite:///:memory:'))
+
+
+class ProductionConfig(Config):
+    SQLITE_PRAGMAS = {'busy_timeout': 10000}
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def get_config(name=None):
+    """Return the config class for name, or for APP_CONFIG (default development)"""
+    return CONFIGS[name or os.getenv('APP_CONFIG', 'development')]
+
+
+def pool_options(config):
+    """QueuePool settings for a server database"""
+    return {
+        'pool_size': config['DATABASE_POOL_SIZE'],
+        'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+        'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+        'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+        'pool_pre_ping': config['DATABASE_POOL_PRE_PING'],
+    }
+
+
+def init_database_config(app):
+    """
+    Derive the engine settings Flask-SQLAlchemy reads from the DATABASE_* keys
+
+    Must run before the SQLAlchemy extension is initialized. Replicas become
+    binds named replica_0, replica_1, ...; no models are mapped to them, so
+    create_all never touches them.
+    """
+    config = app.config
+    url = config['SQLALCHEMY_DATABASE_URI']
+    if not url.startswith('sqlite'):
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(pool_options(config),
+                                                   **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    for index, replica_url in enumerate(config.get('DATABASE_REPLICA_URLS') or []):
+        options = {} if replica_url.startswith('sqlite') else pool_options(config)
+        binds[f'replica_{index}'] = dict(options, url=replica_url)
+    config['SQLALCHEMY_BINDS'] = binds
@@ -0,0 +1,265 @@
+"""
+Database Engine Module for SwissAxa Portal
+SQLite connection pragmas, a single-writer queue and read-replica routing
+
+SQLite allows one writer at a time. With the default rollback journal,
+readers also block the writer, and lock contention surfaces as "database is
+locked" once the busy timeout runs out. This module switches every connection
+to WAL, so readers and the writer no longer block each other. Inside the
+process, sessions that are about to write queue for a single write slot in
+arrival order. They do not all poll the SQLite lock. Waiting is bounded: a
+request that cannot get the slot in time fails with 503 instead of hanging.
+
+When read replicas are configured, views decorated with @read_only query a
+replica. Flushes and DML statements always go to the primary. So do reads
+by a user who wrote within the last few seconds, so they see their own changes.
+"""
+import contextvars
+import functools
+import random
+import threading
+import time
+from collections import deque
+
+from flask import current_app, has_app_context, has_request_context, jsonify, request, session as http_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',          # Durable at checkpoints; safe with WAL
+    'busy_timeout': 5000,             # ms to wait for locks held by other processes
+    'cache_size': -64000,             # Negative = KiB, so 64 MB of page cache
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+class WriteQueueTimeout(Exception):
+    """Raised when a session waited too long for the write slot"""
+
+
+class WriteSerializer:
+    """
+    FIFO lock handing the write slot to waiting threads in arrival order
+
+    Reentrant per thread, so several sessions used by one thread (nested app
+    contexts) never wait for each other.
+    """
+
+    def __init__(self, timeout=10.0):
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._owner = None
+        self._depth = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        me = threading.get_ident()
+        with self._condition:
+            if self._owner == me:
+                self._depth += 1
+                return
+            ticket = object()
+            self._queue.append(ticket)
+            deadline = time.monotonic() + timeout
+            try:
+                while self._owner is not None or self._queue[0] is not ticket:
+                    self.waits += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise WriteQueueTimeout(f'No database write slot after {timeout:g}s')
+                    self._condition.wait(remaining)
+            except BaseException:
+                self._queue.remove(ticket)
+                self._condition.notify_all()
+                raise
+            self._queue.popleft()
+            self._owner = me
+            self._depth = 1
+
+    def release(self):
+        with self._condition:
+            if self._owner != threading.get_ident():
+                raise RuntimeError('Write slot released by a thread that does not hold it')
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._condition.notify_all()
+
+    @property
+    def queue_length(self):
+        return len(self._queue)
+
+
+class RoutingSession(Session):
+    """Session that reads from a replica while a @read_only view runs"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or not _use_replica.get():
+            return engine
+        if self._flushing or isinstance(clause, UpdateBase) or self.info.get('db_wrote') \
+                or self.info.get('db_primary'):
+            return engine
+        engines = self._db.engines
+        if engine is not engines.get(None):
+            return engine
+        replicas = [e for key, e in sorted(engines.items(), key=lambda item: str(item[0]))
+                    if key and key.startswith('replica_')]
+        if not replicas:
+            return engine
+        # Stay on one replica per session so a request sees a consistent snapshot
+        index = self.info.setdefault('replica_index', random.randrange(len(replicas)))
+        return replicas[index % len(replicas)]
+
+
+def read_only(view):
+    """Route the view's queries to a read replica when one is configured"""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if http_session.get('db_primary_until', 0) > time.time():
+            return view(*args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+def _app_extension(name):
+    return current_app.extensions.get(name) if has_app_context() else None
+
+
+def _listen_once(target, identifier, fn):
+    # The session is shared by every app create_app() builds; listen only once
+    if not event.contains(target, identifier, fn):
+        event.listen(target, identifier, fn)
+
+
+def _mark_flush_wrote(sess, flush_context):
+    sess.info['db_wrote'] = True
+
+
+def _mark_dml_wrote(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['db_wrote'] = True
+
+
+def _stick_to_primary(sess):
+    sticky_seconds = _app_extension('replica_sticky_seconds')
+    if sess.info.pop('db_wrote', False) and sticky_seconds is not None:
+        # Rest of this request, then this user's next requests for a while
+        sess.info['db_primary'] = True
+        if has_request_context():
+            http_session['db_primary_until'] = time.time() + sticky_seconds
+
+
+def _forget_write(sess):
+    sess.info.pop('db_wrote', None)
+
+
+def install_replica_stickiness(session):
+    """
+    Remember in the user's session that they just wrote, so their next reads use the primary
+
+    Only acts in apps with replicas, i.e. with app.extensions['replica_sticky_seconds'] set.
+    """
+    _listen_once(session, 'after_flush', _mark_flush_wrote)
+    _listen_once(session, 'do_orm_execute', _mark_dml_wrote)
+    _listen_once(session, 'after_commit', _stick_to_primary)
+    _listen_once(session, 'after_rollback', _forget_write)
+
+
+def _apply_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+    return on_connect
+
+
+def _acquire_write_slot(sess):
+    serializer = _app_extension('write_serializer')
+    if serializer is not None and not sess.info.get('write_slot'):
+        serializer.acquire()
+        sess.info['write_slot'] = serializer
+
+
+def _before_flush(sess, flush_context, instances):
+    _acquire_write_slot(sess)
+
+
+def _before_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _acquire_write_slot(orm_execute_state.session)
+
+
+def _release_write_slot(sess, transaction):
+    if transaction.parent is None:
+        serializer = sess.info.pop('write_slot', None)
+        if serializer is not None:
+            serializer.release()
+
+
+def install_write_serializer(session):
+    """
+    Take the write slot before a session's first write; give it back when its transaction ends
+
+    Uses the serializer of the current app, app.extensions['write_serializer'].
+    """
+    _listen_once(session, 'before_flush', _before_flush)
+    _listen_once(session, 'do_orm_execute', _before_dml)
+    _listen_once(session, 'after_transaction_end', _release_write_slot)
+
+
+def init_db_engine(app, db):
+    """
+    Configure the engines of the Flask-SQLAlchemy instance for concurrent use
+
+    The instance should be created with session_options={'class_': RoutingSession}
+    for replica routing to take effect.
+    """
+    pragmas = dict(DEFAULT_SQLITE_PRAGMAS, **app.config.get('SQLITE_PRAGMAS', {}))
+    with app.app_context():
+        engines = dict(db.engines)
+    for engine in engines.values():
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', _apply_pragmas(pragmas))
+
+    app.extensions['replica_sticky_seconds'] = None
+    if any(key and key.startswith('replica_') for key in engines):
+        app.extensions['replica_sticky_seconds'] = app.config.get('DATABASE_REPLICA_STICKY_SECONDS', 5)
+        install_replica_stickiness(db.session)
+
+    serializer = None
+    primary = engines.get(None)
+    if primary is not None and primary.dialect.name == 'sqlite' and app.config.get('DB_SERIALIZE_WRITES', True):
+        serializer = WriteSerializer(timeout=app.config.get('DB_WRITE_QUEUE_TIMEOUT', 10.0))
+        install_write_serializer(db.session)
+
+        @app.errorhandler(WriteQueueTimeout)
+        def write_queue_timeout(error):
+            db.session.rollback()
+            if request.path.startswith('/api/'):
+                response = jsonify({'error': 'The service is busy, please try again'})
+            else:
+                response = app.response_class('The service is busy, please try again', mimetype='text/plain')
+            response.status_code = 503
+            response.headers['Retry-After'] = '1'
+            return response
+
+    app.extensions['write_serializer'] = serializer
+    return serializer
@@ -0,0 +1,171 @@
+"""
+Email Attachments Module for SwissAxa Portal
+Streams email attachments from storage, or links to them when too large
+
+Attachments are storage keys (older rows hold upload paths, which
+storage_key() converts). An email with attachments is written to a spooled
+temporary file one chunk at a time, base64 encoding each chunk as it is read
+from storage, and the file is streamed to the mail server. A worker holds at
+most EMAIL_SPOOL_MEMORY_BYTES of a message in memory, however large the
+policy PDFs it carries; larger messages spill to disk.
+
+EMAIL_ATTACHMENT_MAX_BYTES caps the attached bytes per email. With
+EMAIL_ATTACHMENT_LINKS on, the files that do not fit are sent as presigned
+download links valid for EMAIL_ATTACHMENT_LINK_EXPIRES seconds; otherwise
+the email fails with AttachmentTooLarge and is not retried.
+"""
+import base64
+import mimetypes
+import os
+import uuid
+from collections import namedtuple
+from email.message import EmailMessage
+from email.policy import SMTP
+from email.utils import formatdate
+from html import escape
+
+from flask import current_app
+
+from storage import ObjectNotFound, get_storage, storage_key
+
+# 57 input bytes encode to one 76 character base64 line
+BASE64_LINE_BYTES = 57
+READ_SIZE = BASE64_LINE_BYTES * 1024
+
+Attachment = namedtuple('Attachment', ['key', 'filename', 'size'])
+AttachmentLink = namedtuple('AttachmentLink', ['filename', 'size', 'url'])
+
+
+class AttachmentTooLarge(Exception):
+    """Raised when attachments exceed EMAIL_ATTACHMENT_MAX_BYTES and cannot be linked"""
+
+    # Sending again cannot succeed; the outbox marks the email dead at once
+    permanent = True
+
+
+def resolve_attachments(references):
+    """Look up the size of each attachment; missing files are skipped"""
+    storage = get_storage()
+    attachments = []
+    for reference in references:
+        key = storage_key(reference)
+        try:
+            attachments.append(Attachment(key, os.path.basename(key), storage.size(key)))
+        except ObjectNotFound:
+            current_app.logger.warning(f'Email attachment {reference} not found, skipped')
+    return attachments
+
+
+def plan_attachments(attachments, max_bytes, allow_links=True):
+    """
+    Split attachments into those sent in the email and those sent as links
+
+    The smallest files are attached first, so as many as possible fit.
+
+    Returns:
+        tuple: (attached, linked), each in the original order
+    """
+    fitting = set()
+    total = 0
+    for index, attachment in sorted(enumerate(attachments), key=lambda item: item[1].size):
+        if max_bytes is not None and total + attachment.size > max_bytes:
+            break
+        fitting.add(index)
+        total += attachment.size
+    attached = [a for i, a in enumerate(attachments) if i in fitting]
+    linked = [a for i, a in enumerate(attachments) if i not in fitting]
+    if linked and not allow_links:
+        raise AttachmentTooLarge(f'{len(linked)} attachment(s) exceed the {max_bytes} byte limit')
+    return attached, linked
+
+
+def presign_links(attachments, expires_in):
+    """Expiring download URLs for attachments; raises AttachmentTooLarge if storage cannot sign"""
+    storage = get_storage()
+    portal_url = current_app.config.get('PORTAL_URL', 'http://localhost:5000').rstrip('/')
+    links = []
+    for attachment in attachments:
+        url = storage.presign(attachment.key, expires_in=expires_in, filename=attachment.filename)
+        if not url:
+            raise AttachmentTooLarge(f'{attachment.filename} is too large to attach and storage cannot link it')
+        # The local backend signs URLs served by the portal itself
+        links.append(AttachmentLink(attachment.filename, attachment.size,
+                                    portal_url + url if url.startswith('/') else url))
+    return links
+
+
+def _format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+def add_links(body, html_body, links):
+    """Append download links to the text and HTML bodies"""
+    lines = [f'{link.filename} ({_format_size(link.size)}): {link.url}' for link in links]
+    body = (body or '').rstrip('\n') + '\n\n' + '\n'.join(lines) + '\n'
+    if html_body:
+        items = ''.join(f'<li><a href="{escape(link.url)}">{escape(link.filename)}</a> '
+                        f'({_format_size(link.size)})</li>' for link in links)
+        block = f'<ul>{items}</ul>'
+        end = html_body.lower().rfind('</body>')
+        html_body = html_body[:end] + block + html_body[end:] if end != -1 else html_body + block
+    return body, html_body
+
+
+def _header_bytes(headers):
+    message = EmailMessage(policy=SMTP)
+    for name, value in headers:
+        if value:
+            message[name] = value
+    return b''.join(SMTP.fold_binary(name, value) for name, value in message.items())
+
+
+def _body_part(body, html_body):
+    part = EmailMessage(policy=SMTP)
+    part.set_content(body or '', cte='quoted-printable')
+    if html_body:
+        part.add_alternative(html_body, subtype='html', cte='quoted-printable')
+    del part['MIME-Version']
+    return part.as_bytes()
+
+
+def _write_base64(out, chunks):
+    """Base64 encode a stream of chunks into 76 character lines"""
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        if len(pending) >= READ_SIZE:
+            # Encode whole lines only, so line breaks fall where they would for the whole file
+            whole = len(pending) - len(pending) % BASE64_LINE_BYTES
+            out.write(base64.encodebytes(pending[:whole]).replace(b'\n', b'\r\n'))
+            pending = pending[whole:]
+    if pending:
+        out.write(base64.encodebytes(pending).replace(b'\n', b'\r\n'))
+
+
+def write_message(out, sender, recipients, subject, body, html_body, attachments, message_id=None, date=None):
+    """Write a multipart/mixed email with streamed attachments to a binary file"""
+    storage = get_storage()
+    boundary = f'=_swissaxa_{uuid.uuid4().hex}'
+    out.write(_header_bytes([
+        ('From', sender),
+        ('To', ', '.join(recipients)),
+        ('Subject', subject),
+        ('Date', formatdate(date, localtime=True)),
+        ('Message-ID', message_id),
+        ('MIME-Version', '1.0'),
+    ]))
+    out.write(f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n'.encode('ascii'))
+    out.write(f'--{boundary}\r\n'.encode('ascii') + _body_part(body, html_body))
+    for attachment in attachments:
+        content_type = mimetypes.guess_type(attachment.filename)[0] or 'application/octet-stream'
+        part = EmailMessage(policy=SMTP)
+        part['Content-Type'] = content_type
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=attachment.filename)
+        out.write(f'\r\n--{boundary}\r\n'.encode('ascii') + part.as_bytes())
+        _write_base64(out, storage.get_stream(attachment.key, chunk_size=READ_SIZE))
+    out.write(f'\r\n--{boundary}--\r\n'.encode('ascii'))
@@ -0,0 +1,307 @@
+"""
+Email Digests Module for SwissAxa Portal
+Coalesces bursts of claim updates into one summary email per recipient
+
+A claim often moves through several statuses within minutes. Instead of one
+email per change, add_claim_update() records the change and opens a digest
+for the recipient, due EMAIL_DIGEST_WINDOW_SECONDS after its first update.
+Updates arriving before then join the same digest; when it is due, one
+email lists them all (a single update is sent as a normal claim update).
+The window is not extended by later updates, so a busy claim still gets its
+email on time.
+
+Pending digests live in the database, indexed by due time, so any number of
+them survive restarts and any process can send them. Each process runs a
+DigestScheduler thread, started with its first request, that keeps the digests due within the next poll
+interval in a min-heap and sleeps until the earliest one, so digests go out
+when due without scanning the table. Sending claims the digest with a
+compare-and-set delete, so a digest is sent by one process only. Without
+the thread, run
+
+    flask email-digests-flush
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 100
+REFILL_LIMIT = 10000  # Timers loaded into one process's heap per poll
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _open_digest(recipient, language, due_at):
+    """Create the recipient's digest unless one is already waiting"""
+    from models import db, EmailDigest
+    upsert = _UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if upsert is not None:
+        stmt = upsert(EmailDigest).values(recipient=recipient, language=language, due_at=due_at,
+                                          created_at=datetime.utcnow())
+        # Keep the due time of the waiting digest; the latest language wins
+        db.session.execute(stmt.on_conflict_do_update(index_elements=[EmailDigest.recipient],
+                                                      set_={'language': stmt.excluded.language}))
+        return
+    digest = db.session.scalar(select(EmailDigest).where(EmailDigest.recipient == recipient))
+    if digest is None:
+        db.session.add(EmailDigest(recipient=recipient, language=language, due_at=due_at))
+    else:
+        digest.language = language
+
+
+def add_claim_update(recipient, claim_number, status, language=None, commit=True):
+    """
+    Record a claim status change for the recipient's next digest
+
+    With commit=False the update is part of the caller's transaction.
+
+    Returns:
+        datetime: When a digest opened now would be due
+    """
+    from models import db, EmailDigestEvent
+    due_at = datetime.utcnow() + timedelta(seconds=current_app.config['EMAIL_DIGEST_WINDOW_SECONDS'])
+    db.session.add(EmailDigestEvent(recipient=recipient, claim_number=claim_number, status=status))
+    _open_digest(recipient, language, due_at)
+    if commit:
+        db.session.commit()
+        scheduler = current_app.extensions.get('email_digests')
+        if scheduler is not None:
+            scheduler.schedule(recipient, due_at)
+    return due_at
+
+
+def _group_by_claim(events):
+    claims = {}
+    for event in events:
+        claim = claims.setdefault(event.claim_number, {'claim_number': event.claim_number, 'statuses': []})
+        if not claim['statuses'] or claim['statuses'][-1] != event.status:
+            claim['statuses'].append(event.status)
+    return list(claims.values())
+
+
+def render_digest(events, language=None):
+    """The email for a recipient's collected updates, oldest first"""
+    from email_templates import render_email
+    if len(events) == 1:
+        return render_email('claim_update', language, claim_number=events[0].claim_number,
+                            status=events[0].status)
+    return render_email('claim_digest', language, claims=_group_by_claim(events))
+
+
+def flush_digest(recipient, now=None):
+    """
+    Send the recipient's digest if it is due
+
+    Returns:
+        bool: True if this call queued the email
+    """
+    from models import db, EmailDigest, EmailDigestEvent
+    from email_outbox import enqueue_email
+    now = now or datetime.utcnow()
+    digest = db.session.execute(
+        select(EmailDigest.id, EmailDigest.language)
+        .where(EmailDigest.recipient == recipient, EmailDigest.due_at <= now)
+    ).first()
+    if digest is None:
+        db.session.rollback()
+        return False
+    # Only one process gets a row count of 1
+    claimed = db.session.execute(
+        delete(EmailDigest).where(EmailDigest.id == digest.id, EmailDigest.due_at <= now),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return False
+    events = db.session.scalars(
+        select(EmailDigestEvent).where(EmailDigestEvent.recipient == recipient).order_by(EmailDigestEvent.id)
+    ).all()
+    if not events:
+        # Already sent by the digest before this one, which was flushed while they were added
+        db.session.commit()
+        return False
+    db.session.execute(
+        delete(EmailDigestEvent)
+        .where(EmailDigestEvent.recipient == recipient, EmailDigestEvent.id <= events[-1].id),
+        execution_options={'synchronize_session': False}
+    )
+    email = render_digest(events, digest.language)
+    # Queued in the same transaction: the updates are sent exactly when they are deleted
+    enqueue_email(recipient, email.subject, email.text, email.html, commit=False)
+    db.session.commit()
+    return True
+
+
+def due_digests(until, limit=REFILL_LIMIT):
+    """(due_at, recipient) of digests due by the given time, earliest first"""
+    from models import db, EmailDigest
+    return db.session.execute(
+        select(EmailDigest.due_at, EmailDigest.recipient)
+        .where(EmailDigest.due_at <= until)
+        .order_by(EmailDigest.due_at)
+        .limit(limit)
+    ).all()
+
+
+def flush_due_digests(now=None, batch_size=FLUSH_BATCH_SIZE):
+    """Send every digest that is due; returns how many were sent"""
+    now = now or datetime.utcnow()
+    sent = 0
+    while True:
+        batch = due_digests(now, limit=batch_size)
+        for _, recipient in batch:
+            sent += flush_digest(recipient, now)
+        if len(batch) < batch_size:
+            return sent
+
+
+def pending_digests():
+    from models import db, EmailDigest
+    return db.session.scalar(select(db.func.count()).select_from(EmailDigest))
+
+
+class DigestTimers:
+    """
+    Min-heap of digest due times, one live timer per recipient
+
+    Rescheduling a recipient leaves its old entry in the heap; pop_due()
+    skips entries that no longer match, so each operation is O(log n).
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+
+    def push(self, due_at, recipient):
+        """Add a timer; an earlier timer for the recipient is kept"""
+        current = self._due.get(recipient)
+        if current is not None and current <= due_at:
+            return False
+        self._due[recipient] = due_at
+        heapq.heappush(self._heap, (due_at, recipient))
+        return True
+
+    def next_due(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """Remove and return the recipients whose timers are due"""
+        due = []
+        while self.next_due() is not None and self._heap[0][0] <= now:
+            _, recipient = heapq.heappop(self._heap)
+            del self._due[recipient]
+            due.append(recipient)
+        return due
+
+    def __len__(self):
+        return len(self._due)
+
+
+class DigestScheduler:
+    """
+    Thread that sends digests when they are due
+
+    Started with the first request in a process. Every poll_interval
+    it loads the digests due before the next poll, whichever process opened
+    them, so the heap holds only the near future.
+    """
+
+    def __init__(self, app, enabled=True, poll_interval=30.0):
+        self.app = app
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        self.timers = DigestTimers()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if not self.enabled or (self._pid == os.getpid() and self._thread is not None):
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='email-digests', daemon=True)
+            self._thread.start()
+
+    def schedule(self, recipient, due_at):
+        if not self.enabled:
+            return
+        with self._lock:
+            earliest = self.timers.next_due()
+            added = self.timers.push(due_at, recipient)
+        if added and (earliest is None or due_at < earliest):
+            self._wakeup.set()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _refill(self):
+        horizon = datetime.utcnow() + timedelta(seconds=self.poll_interval)
+        for due_at, recipient in due_digests(horizon):
+            with self._lock:
+                self.timers.push(due_at, recipient)
+
+    def _run(self):
+        from models import db
+        next_refill = 0
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    if time.monotonic() >= next_refill:
+                        self._refill()
+                        next_refill = time.monotonic() + self.poll_interval
+                    now = datetime.utcnow()
+                    with self._lock:
+                        due = self.timers.pop_due(now)
+                    for recipient in due:
+                        flush_digest(recipient, now)
+                except Exception:
+                    logger.exception('Sending email digests failed')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            with self._lock:
+                earliest = self.timers.next_due()
+            wait = max(0.0, next_refill - time.monotonic())
+            if earliest is not None:
+                wait = min(wait, max(0.0, (earliest - datetime.utcnow()).total_seconds()))
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+
+def init_email_digests(app):
+    """Initialize the digest scheduler and CLI command with Flask app"""
+    app.config.setdefault('EMAIL_DIGEST_WINDOW_SECONDS', 300)
+    app.config.setdefault('EMAIL_DIGEST_SCHEDULER', True)
+    app.config.setdefault('EMAIL_DIGEST_POLL_SECONDS', 30.0)
+
+    scheduler = DigestScheduler(app, enabled=app.config['EMAIL_DIGEST_SCHEDULER'],
+                                poll_interval=app.config['EMAIL_DIGEST_POLL_SECONDS'])
+    app.extensions['email_digests'] = scheduler
+    app.before_request(scheduler.start)
+
+    @app.cli.command('email-digests-flush')
+    def email_digests_flush_command():
+        """Queue every claim update digest that is due."""
+        sent = flush_due_digests()
+        click.echo(f'Queued {sent} digests; {pending_digests()} waiting.')
+
+    return scheduler
@@ -0,0 +1,274 @@
+"""
+Email Outbox Module for SwissAxa Portal
+Persistent queue for outgoing email, sent by background workers
+
+enqueue_email() only inserts a row, so requests never wait for the mail
+server. Workers claim due rows, send them, and record the result. A failed
+send is retried after an exponential backoff (EMAIL_RETRY_BASE_SECONDS,
+doubling up to EMAIL_RETRY_MAX_SECONDS). After EMAIL_MAX_ATTEMPTS the message
+is marked 'dead' and kept for inspection; `flask email-outbox-requeue` sends
+dead messages again.
+
+Workers run as threads in each web process (EMAIL_OUTBOX_WORKERS, started
+with the first request) or in a separate process:
+
+    flask email-outbox-worker
+
+A worker claims a row by moving it to 'sending' with a lease. If the worker
+dies mid-send, the row is retried once the lease expires, so a message can
+be sent twice but is never lost.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import and_, func, or_, select, update
+
+from metrics import EMAIL_QUEUE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+CLAIM_BATCH_SIZE = 10
+
+
+def enqueue_email(to, subject, body, html_body=None, attachments=None, commit=True):
+    """
+    Queue an email; it is sent by the outbox workers
+
+    With commit=False the email is part of the caller's transaction and is
+    only sent if that commits.
+    """
+    from models import db, EmailOutbox
+    message = EmailOutbox(
+        recipients=json.dumps([to] if isinstance(to, str) else list(to)),
+        subject=subject,
+        body=body,
+        html_body=html_body,
+        attachments=json.dumps(attachments) if attachments else None
+    )
+    db.session.add(message)
+    if commit:
+        db.session.commit()
+        worker = current_app.extensions.get('email_outbox')
+        if worker is not None:
+            worker.wake()
+    return message
+
+
+def retry_delay(attempts, base, maximum):
+    """Seconds to wait after the given number of failed attempts, with jitter"""
+    delay = min(base * 2 ** (attempts - 1), maximum)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _claimable(now):
+    from models import EmailOutbox
+    return or_(
+        and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+        # A worker that died while sending
+        and_(EmailOutbox.status == 'sending', EmailOutbox.locked_until < now),
+    )
+
+
+def claim_messages(limit=CLAIM_BATCH_SIZE):
+    """Move up to limit due messages to 'sending' for this worker and commit; returns them"""
+    from models import db, EmailOutbox
+    now = datetime.utcnow()
+    lease = timedelta(seconds=current_app.config['EMAIL_SEND_LEASE_SECONDS'])
+    candidates = db.session.scalars(
+        select(EmailOutbox.id)
+        .where(_claimable(now))
+        .order_by(EmailOutbox.next_attempt_at)
+        .limit(limit)
+    ).all()
+    claimed = []
+    for message_id in candidates:
+        # Only succeeds if no other worker claimed it since the select
+        result = db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id == message_id, _claimable(now))
+            .values(status='sending', locked_until=now + lease, attempts=EmailOutbox.attempts + 1),
+            execution_options={'synchronize_session': False}
+        )
+        if result.rowcount:
+            claimed.append(message_id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return db.session.scalars(select(EmailOutbox).where(EmailOutbox.id.in_(claimed))).all()
+
+
+def send_message(message):
+    """Send one claimed message and record the outcome; returns True if it was sent"""
+    from models import db
+    from email_service import deliver_email
+    config = current_app.config
+    try:
+        deliver_email(json.loads(message.recipients), message.subject, message.body,
+                      html_body=message.html_body,
+                      attachments=json.loads(message.attachments) if message.attachments else None)
+    except Exception as e:
+        message.last_error = f'{type(e).__name__}: {e}'[:1000]
+        message.locked_until = None
+        # Errors marked permanent (e.g. email_attachments.AttachmentTooLarge) fail the same way every time
+        if message.attempts >= config['EMAIL_MAX_ATTEMPTS'] or getattr(e, 'permanent', False):
+            message.status = 'dead'
+            current_app.logger.error(f'Email {message.id} failed {message.attempts} times, giving up: {e}')
+        else:
+            message.status = 'pending'
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=retry_delay(
+                message.attempts, config['EMAIL_RETRY_BASE_SECONDS'], config['EMAIL_RETRY_MAX_SECONDS']))
+        db.session.commit()
+        return False
+
+    message.status = 'sent'
+    message.sent_at = datetime.utcnow()
+    message.locked_until = None
+    message.last_error = None
+    db.session.commit()
+    EMAIL_QUEUE_LATENCY.observe((message.sent_at - message.created_at).total_seconds())
+    return True
+
+
+def process_outbox(limit=CLAIM_BATCH_SIZE):
+    """Claim and send one batch of due messages; returns how many were claimed"""
+    messages = claim_messages(limit)
+    for message in messages:
+        send_message(message)
+    return len(messages)
+
+
+def outbox_depth():
+    """Messages waiting to be sent, including ones waiting for a retry"""
+    from models import db, EmailOutbox
+    return db.session.scalar(
+        select(func.count()).select_from(EmailOutbox).where(EmailOutbox.status.in_(('pending', 'sending')))
+    )
+
+
+def dead_count():
+    from models import db, EmailOutbox
+    return db.session.scalar(select(func.count()).select_from(EmailOutbox).where(EmailOutbox.status == 'dead'))
+
+
+def requeue_dead(message_ids=None):
+    """Give dead messages a fresh set of attempts; returns how many"""
+    from models import db, EmailOutbox
+    stmt = update(EmailOutbox).where(EmailOutbox.status == 'dead')
+    if message_ids:
+        stmt = stmt.where(EmailOutbox.id.in_(message_ids))
+    result = db.session.execute(
+        stmt.values(status='pending', attempts=0, next_attempt_at=datetime.utcnow()),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+class OutboxWorker:
+    """
+    Sender threads for one app
+
+    Threads start with the first request (or wake()) in a process, so a
+    pre-forking server starts them in each worker, not in the parent, and
+    email queued by other processes or left over from a restart is sent
+    without waiting for a new one. They sleep until woken by a new email or
+    for at most poll_interval seconds.
+    """
+
+    def __init__(self, app, threads=2, poll_interval=5.0):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._threads = []
+        self._pid = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if not self.threads or (self._pid == os.getpid() and self._threads):
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = [threading.Thread(target=self._run, name=f'email-outbox-{i}', daemon=True)
+                             for i in range(self.threads)]
+            for thread in self._threads:
+                thread.start()
+
+    def wake(self):
+        self.start()
+        self._wakeup.set()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        pool = self.app.extensions.get('smtp_pool')
+        if pool is not None:
+            pool.close()
+
+    def _run(self):
+        from models import db
+        while not self._stopping.is_set():
+            claimed = 0
+            with self.app.app_context():
+                try:
+                    claimed = process_outbox()
+                except Exception:
+                    logger.exception('Email outbox batch failed')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            if not claimed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+
+def init_email_outbox(app):
+    """Initialize the outbox workers and CLI commands with Flask app"""
+    app.config.setdefault('EMAIL_OUTBOX_WORKERS', 2)
+    app.config.setdefault('EMAIL_OUTBOX_POLL_SECONDS', 5.0)
+    app.config.setdefault('EMAIL_MAX_ATTEMPTS', 6)
+    app.config.setdefault('EMAIL_RETRY_BASE_SECONDS', 30)
+    app.config.setdefault('EMAIL_RETRY_MAX_SECONDS', 3600)
+    app.config.setdefault('EMAIL_SEND_LEASE_SECONDS', 300)
+
+    # With EMAIL_OUTBOX_WORKERS = 0 only `flask email-outbox-worker` sends
+    worker = OutboxWorker(app, threads=app.config['EMAIL_OUTBOX_WORKERS'],
+                          poll_interval=app.config['EMAIL_OUTBOX_POLL_SECONDS'])
+    app.extensions['email_outbox'] = worker
+    app.before_request(worker.start)
+
+    @app.cli.command('email-outbox-worker')
+    @click.option('--once', is_flag=True, help='Send what is due now, then exit.')
+    def email_outbox_worker_command(once):
+        """Send queued email until stopped."""
+        from models import db
+        sent = 0
+        while True:
+            claimed = process_outbox()
+            sent += claimed
+            db.session.remove()
+            if not claimed:
+                if once:
+                    break
+                time.sleep(app.config['EMAIL_OUTBOX_POLL_SECONDS'])
+        click.echo(f'Processed {sent} emails; {outbox_depth()} waiting, {dead_count()} dead.')
+
+    @app.cli.command('email-outbox-requeue')
+    @click.argument('message_ids', nargs=-1, type=int)
+    def email_outbox_requeue_command(message_ids):
+        """Retry dead emails (all, or the given ids)."""
+        click.echo(f'Requeued {requeue_dead(message_ids)} emails.')
+
+    return worker
@@ -1,148 +1,169 @@
 """
 Email Service Module for SwissAxa Portal
 Handles email sending using Flask-Mail
+
+The send_*() helpers queue their email in the outbox (email_outbox.py) and
+return once it is stored; the outbox workers deliver it with deliver_email().
+send_email() still sends immediately, for callers that must know the result.
+Both send over the app's pooled SMTP connections (smtp_pool.py). The helpers
+render their text from the localized templates in email_templates.py.
+
+Not imported at startup: the first delivery in an app sets up Flask-Mail for it.
 """
 from flask import current_app
-from flask_mail import Mail, Message
+from sqlalchemy.exc import SQLAlchemyError
+from flask_mail import BadHeaderError, Mail, Message, sanitize_address, sanitize_addresses
+from email_attachments import add_links, plan_attachments, presign_links, resolve_attachments, write_message
+from email_digests import add_claim_update
+from email_outbox import enqueue_email
+from email_templates import render_email
+from metrics import EMAIL_SENT, EMAIL_SEND_DURATION
+from smtp_pool import create_smtp_pool
 import os
+import tempfile
+import threading
 
 mail = Mail()
+_pool_lock = threading.Lock()
 
 def init_email(app):
     """Initialize email service with Flask app"""
-    # Email configuration
-    app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
-    app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
-    app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'True').lower() == 'true'
-    app.config['MAIL_USE_SSL'] = os.getenv('MAIL_USE_SSL', 'False').lower() == 'true'
-    app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME', '')
-    app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD', '')
-    app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', 'noreply@swissaxa.de')
+    # Email configuration; settings passed to create_app() take precedence
+    app.config.setdefault('MAIL_SERVER', os.getenv('MAIL_SERVER', 'smtp.gmail.com'))
+    app.config.setdefault('MAIL_PORT', int(os.getenv('MAIL_PORT', 587)))
+    app.config.setdefault('MAIL_USE_TLS', os.getenv('MAIL_USE_TLS', 'True').lower() == 'true')
+    app.config.setdefault('MAIL_USE_SSL', os.getenv('MAIL_USE_SSL', 'False').lower() == 'true')
+    app.config.setdefault('MAIL_USERNAME', os.getenv('MAIL_USERNAME', ''))
+    app.config.setdefault('MAIL_PASSWORD', os.getenv('MAIL_PASSWORD', ''))
+    app.config.setdefault('MAIL_DEFAULT_SENDER', os.getenv('MAIL_DEFAULT_SENDER', 'noreply@swissaxa.de'))
+    
+    # SMTP connection reuse and sending rate; see smtp_pool.py
+    app.config.setdefault('EMAIL_SMTP_MAX_MESSAGES', 100)
+    app.config.setdefault('EMAIL_SMTP_IDLE_SECONDS', 30)
+    app.config.setdefault('EMAIL_RATE_LIMIT_PER_SECOND', None)
+    app.config.setdefault('EMAIL_RATE_LIMITS', {})
+    
+    # Attachments; see email_attachments.py
+    app.config.setdefault('EMAIL_ATTACHMENT_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('EMAIL_ATTACHMENT_LINKS', True)
+    app.config.setdefault('EMAIL_ATTACHMENT_LINK_EXPIRES', 7 * 24 * 3600)
+    app.config.setdefault('EMAIL_SPOOL_MEMORY_BYTES', 1024 * 1024)
     
     mail.init_app(app)
     return mail
 
-def send_email(to, subject, body, html_body=None, attachments=None):
+def get_smtp_pool(app=None):
+    """The app's pool of open SMTP connections, created with the first email"""
+    app = app or current_app._get_current_object()
+    with _pool_lock:
+        if 'mail' not in app.extensions:
+            init_email(app)
+        if 'smtp_pool' not in app.extensions:
+            app.extensions['smtp_pool'] = create_smtp_pool(app, mail)
+    return app.extensions['smtp_pool']
+
+def deliver_email(to, subject, body, html_body=None, attachments=None):
     """
-    Send an email
-    
+    Send an email now; raises if the mail server does not accept it
+
     Args:
         to: Recipient email address or list of addresses
         subject: Email subject
         body: Plain text body
         html_body: HTML body (optional)
-        attachments: List of attachment file paths (optional)
+        attachments: List of storage keys or upload paths (optional)
+    """
+    # The portal imports this module on the first email, not at startup
+    pool = get_smtp_pool()
+    config = current_app.config
+    attached = []
+    if attachments:
+        found = resolve_attachments(attachments)
+        attached, linked = plan_attachments(found, config['EMAIL_ATTACHMENT_MAX_BYTES'],
+                                            allow_links=config['EMAIL_ATTACHMENT_LINKS'])
+        if linked:
+            links = presign_links(linked, config['EMAIL_ATTACHMENT_LINK_EXPIRES'])
+            body, html_body = add_links(body, html_body, links)
+    
+    msg = Message(
+        subject=subject,
+        recipients=[to] if isinstance(to, str) else to,
+        body=body,
+        html=html_body
+    )
+    if attached:
+        if msg.has_bad_headers():
+            raise BadHeaderError
+        # Spooled to disk past EMAIL_SPOOL_MEMORY_BYTES; attachments are never held whole
+        with tempfile.SpooledTemporaryFile(max_size=config['EMAIL_SPOOL_MEMORY_BYTES']) as spool:
+            write_message(spool, sanitize_address(msg.sender), msg.recipients, subject, body, html_body,
+                          attached, message_id=msg.msgId)
+            _send(lambda: pool.send_stream(sanitize_address(msg.sender),
+                                           list(sanitize_addresses(msg.send_to)), spool))
+        return
+    _send(lambda: pool.send(msg))
+
+def _send(send):
+    try:
+        with EMAIL_SEND_DURATION.time():
+            send()
+    except Exception:
+        EMAIL_SENT.labels('error').inc()
+        raise
+    EMAIL_SENT.labels('ok').inc()
+
+def send_email(to, subject, body, html_body=None, attachments=None):
+    """
+    Send an email now, without the outbox
     
     Returns:
         bool: True if email sent successfully, False otherwise
     """
     try:
-        msg = Message(
-            subject=subject,
-            recipients=[to] if isinstance(to, str) else to,
-            body=body,
-            html=html_body
-        )
-        
-        # Add attachments if provided
-        if attachments:
-            for attachment_path in attachments:
-                if os.path.exists(attachment_path):
-                    with current_app.open_resource(attachment_path) as f:
-                        msg.attach(
-                            os.path.basename(attachment_path),
-                            'application/octet-stream',
-                            f.read()
-                        )
-        
-        mail.send(msg)
+        deliver_email(to, subject, body, html_body=html_body, attachments=attachments)
         return True
     except Exception as e:
         current_app.logger.error(f"Failed to send email: {e}")
         return False
 
-def send_claim_notification(user_email, claim_number, status):
-    """Send notification email for claim status updates"""
-    subject = f"Claim Update: {claim_number}"
-    body = f"""
-Dear Customer,
-
-Your claim {claim_number} status has been updated to: {status}
-
-You can view the details in your customer portal.
+def queue_email(to, subject, body, html_body=None, attachments=None):
+    """
+    Queue an email in the outbox
+    
+    Returns:
+        bool: True once the email is stored for sending, False if it could not be stored
+    """
+    from models import db
+    try:
+        enqueue_email(to, subject, body, html_body=html_body, attachments=attachments)
+        return True
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f"Failed to queue email: {e}")
+        return False
 
-Best regards,
-SwissAxa Customer Service
-"""
-    html_body = f"""
-    <html>
-    <body>
-        <h2>Claim Update</h2>
-        <p>Dear Customer,</p>
-        <p>Your claim <strong>{claim_number}</strong> status has been updated to: <strong>{status}</strong></p>
-        <p>You can view the details in your <a href="http://localhost:5000/services/claims">customer portal</a>.</p>
-        <p>Best regards,<br>SwissAxa Customer Service</p>
-    </body>
-    </html>
+def send_claim_notification(user_email, claim_number, status, language=None):
     """
-    return send_email(user_email, subject, body, html_body)
+    Send notification email for claim status updates
+    
+    Within EMAIL_DIGEST_WINDOW_SECONDS of the first update, further updates
+    are collected and sent together (email_digests.py).
+    """
+    if current_app.config.get('EMAIL_DIGEST_WINDOW_SECONDS'):
+        add_claim_update(user_email, claim_number, status, language=language)
+        return True
+    email = render_email('claim_update', language, claim_number=claim_number, status=status)
+    return queue_email(user_email, email.subject, email.text, email.html)
 
-def send_appointment_confirmation(user_email, appointment_date, agent_name=None):
+def send_appointment_confirmation(user_email, appointment_date, agent_name=None, language=None):
     """Send appointment confirmation email"""
-    agent_info = f" with {agent_name}" if agent_name else ""
-    subject = "Appointment Confirmation - SwissAxa"
-    body = f"""
-Dear Customer,
-
-Your appointment{agent_info} has been confirmed for:
-{appointment_date}
+    email = render_email('appointment_confirmation', language,
+                         appointment_date=appointment_date, agent_name=agent_name)
+    return queue_email(user_email, email.subject, email.text, email.html)
 
-We look forward to meeting with you.
-
-Best regards,
-SwissAxa Customer Service
-"""
-    html_body = f"""
-    <html>
-    <body>
-        <h2>Appointment Confirmation</h2>
-        <p>Dear Customer,</p>
-        <p>Your appointment{agent_info} has been confirmed for:</p>
-        <p><strong>{appointment_date}</strong></p>
-        <p>We look forward to meeting with you.</p>
-        <p>Best regards,<br>SwissAxa Customer Service</p>
-    </body>
-    </html>
-    """
-    return send_email(user_email, subject, body, html_body)
-
-def send_contact_email(recipient_email, sender_name, sender_email, subject, message):
+def send_contact_email(recipient_email, sender_name, sender_email, subject, message, language=None):
     """Send contact email from customer to service desk/agent"""
-    email_subject = f"Portal Contact: {subject}"
-    body = f"""
-Message from SwissAxa Customer Portal
-
-From: {sender_name} ({sender_email})
-Subject: {subject}
-
-Message:
-{message}
-
----
-This email was sent from the SwissAxa Customer Self-Service Portal.
-"""
-    html_body = f"""
-    <html>
-    <body>
-        <h2>Message from SwissAxa Customer Portal</h2>
-        <p><strong>From:</strong> {sender_name} ({sender_email})<br>
-        <strong>Subject:</strong> {subject}</p>
-        <hr>
-        <p>{message.replace(chr(10), '<br>')}</p>
-        <hr>
-        <p><small>This email was sent from the SwissAxa Customer Self-Service Portal.</small></p>
-    </body>
-    </html>
-    """
-    return send_email(recipient_email, email_subject, body, html_body)
+    email = render_email('contact_message', language, sender_name=sender_name,
+                         sender_email=sender_email, subject=subject, message=message)
+    return queue_email(recipient_email, email.subject, email.text, email.html)
 
@@ -0,0 +1,90 @@
+"""
+Email Templates Module for SwissAxa Portal
+Renders localized emails from Jinja templates compiled once per process
+
+Each email is one template per language in templates/email/<language>/,
+with three blocks: subject, text and html. render_email() renders all three
+from one compiled template and one context. Templates are compiled on first
+use and kept; with EMAIL_TEMPLATE_AUTO_RELOAD off (the default outside
+debug mode) Jinja does not even check the files again, so a bulk send only
+pays for rendering.
+
+A language without its own template falls back to the default language.
+Only the html block is autoescaped; templates mark it with
+{% autoescape true %}.
+"""
+import os
+import threading
+from collections import namedtuple
+
+from flask import current_app
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, TemplateNotFound
+
+from i18n_support import default_language
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')
+BLOCKS = ('subject', 'text', 'html')
+
+RenderedEmail = namedtuple('RenderedEmail', BLOCKS)
+
+_environments = {}
+_resolved = {}
+_lock = threading.Lock()
+
+
+def _environment(auto_reload):
+    environment = _environments.get(auto_reload)
+    if environment is None:
+        with _lock:
+            environment = _environments.setdefault(auto_reload, Environment(
+                loader=FileSystemLoader(TEMPLATE_DIR),
+                auto_reload=auto_reload,
+                cache_size=-1,  # Never evict; there are only a few email templates
+                undefined=StrictUndefined,
+                trim_blocks=True,
+                lstrip_blocks=True,
+            ))
+    return environment
+
+
+def get_email_template(name, language):
+    """The compiled template for an email in a language, or in the default language"""
+    auto_reload = current_app.config.get('EMAIL_TEMPLATE_AUTO_RELOAD')
+    if auto_reload is None:
+        auto_reload = current_app.debug
+    fallback = default_language()
+    key = (name, language, fallback, auto_reload)
+    template = _resolved.get(key)
+    if template is None or auto_reload:
+        environment = _environment(auto_reload)
+        try:
+            template = environment.get_template(f'{language}/{name}.jinja')
+        except TemplateNotFound:
+            template = environment.get_template(f'{fallback}/{name}.jinja')
+        _resolved[key] = template
+    return template
+
+
+def render_email(name, language=None, **context):
+    """
+    Render an email's subject, plain-text and HTML body in one pass
+
+    Returns:
+        RenderedEmail: subject, text, html
+    """
+    template = get_email_template(name, language or default_language())
+    context.setdefault('portal_url', current_app.config.get('PORTAL_URL', 'http://localhost:5000').rstrip('/'))
+    render_context = template.new_context(context)
+    parts = [''.join(template.blocks[block](render_context)).strip() for block in BLOCKS]
+    return RenderedEmail(*parts)
+
+
+def template_names():
+    """Every (language, email name) with a template"""
+    names = []
+    for language in sorted(os.listdir(TEMPLATE_DIR)):
+        directory = os.path.join(TEMPLATE_DIR, language)
+        if os.path.isdir(directory):
+            names.extend((language, filename[:-len('.jinja')])
+                         for filename in sorted(os.listdir(directory)) if filename.endswith('.jinja'))
+    return names
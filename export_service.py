@@ -0,0 +1,227 @@
+"""
+Export Service Module for SwissAxa Portal
+Streams a user's documents and claim media as a ZIP archive built on the fly
+"""
+import io
+import json
+import os
+import zipfile
+from datetime import datetime
+from storage import get_storage, storage_key, StorageError
+
+# Size of the reads from storage; also bounds how much archive data is buffered
+# between two yields, independent of the total archive size.
+CHUNK_SIZE = 64 * 1024
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, unseekable sink collecting zipfile output between yields.
+
+    Because it cannot seek, zipfile writes sizes and CRCs in data descriptors
+    after each entry instead of patching local headers, so nothing has to be
+    kept around once it has been handed to the client.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _zip_date_time(timestamp):
+    """ZIP timestamps cannot predate 1980"""
+    timestamp = timestamp or datetime.now()
+    if timestamp.year < 1980:
+        timestamp = datetime(1980, 1, 1)
+    return timestamp.timetuple()[:6]
+
+
+def _iter_file_entry(zf, sink, arcname, size, chunks, timestamp):
+    """Copy one stored object into the archive, yielding archive bytes per chunk"""
+    info = zipfile.ZipInfo(arcname, date_time=_zip_date_time(timestamp))
+    # Media and PDFs are already compressed, so store them as-is and keep the
+    # export I/O-bound. Declaring the size up front lets zipfile pick ZIP64
+    # for entries over 4 GB.
+    info.compress_type = zipfile.ZIP_STORED
+    info.file_size = size
+
+    with zf.open(info, 'w') as dest:
+        for chunk in chunks:
+            dest.write(chunk)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _unique_name(name, used):
+    """Avoid duplicate archive names when two uploads share a filename"""
+    candidate = name
+    counter = 1
+    while candidate in used:
+        base, ext = os.path.splitext(name)
+        candidate = f'{base}_{counter}{ext}'
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+def collect_export_entries(user_id):
+    """
+    List the files belonging to a user as lightweight dicts
+
+    Returns:
+        tuple: (documents, claims) where claims carry their media entries
+    """
+    from models import db, Document, Claim, ClaimMedia
+
+    used_names = set()
+    documents = []
+    for doc in db.session.query(
+        Document.id, Document.filename, Document.file_path,
+        Document.document_type, Document.uploaded_at
+    ).filter(Document.user_id == user_id).order_by(Document.id):
+        documents.append({
+            'id': doc.id,
+            'filename': doc.filename,
+            'document_type': doc.document_type,
+            'uploaded_at': doc.uploaded_at,
+            'file_path': doc.file_path,
+            'archive_path': _unique_name(f'documents/{doc.filename}', used_names)
+        })
+
+    claims = {}
+    for claim in db.session.query(
+        Claim.id, Claim.claim_number, Claim.status, Claim.damage_type,
+        Claim.description, Claim.submitted_at
+    ).filter(Claim.user_id == user_id).order_by(Claim.id):
+        claims[claim.id] = {
+            'id': claim.id,
+            'claim_number': claim.claim_number,
+            'status': claim.status,
+            'damage_type': claim.damage_type,
+            'description': claim.description,
+            'submitted_at': claim.submitted_at,
+            'media': []
+        }
+
+    for media in db.session.query(
+        ClaimMedia.id, ClaimMedia.claim_id, ClaimMedia.filename,
+        ClaimMedia.file_path, ClaimMedia.media_type, ClaimMedia.uploaded_at
+    ).join(Claim, Claim.id == ClaimMedia.claim_id).filter(
+        Claim.user_id == user_id
+    ).order_by(ClaimMedia.id):
+        claim = claims[media.claim_id]
+        folder = claim['claim_number'] or f'claim_{claim["id"]}'
+        claim['media'].append({
+            'id': media.id,
+            'filename': media.filename,
+            'media_type': media.media_type,
+            'uploaded_at': media.uploaded_at,
+            'file_path': media.file_path,
+            'archive_path': _unique_name(f'claims/{folder}/{media.filename}', used_names)
+        })
+
+    return documents, list(claims.values())
+
+
+def build_manifest(user_id, documents, claims):
+    """Build the JSON manifest describing claims, policies and exported files"""
+    from models import SwissAxaPolicy, ExternalPolicy
+
+    def _iso(value):
+        return value.isoformat() if value else None
+
+    def _file_entry(entry):
+        return {
+            'id': entry['id'],
+            'filename': entry['filename'],
+            'archive_path': None if entry.get('missing') else entry['archive_path'],
+            'uploaded_at': _iso(entry['uploaded_at']),
+            'missing': bool(entry.get('missing'))
+        }
+
+    policies = SwissAxaPolicy.query.filter_by(user_id=user_id).all()
+    external_policies = ExternalPolicy.query.filter_by(user_id=user_id).all()
+
+    return {
+        'user_id': user_id,
+        'generated_at': datetime.utcnow().isoformat(),
+        'documents': [
+            dict(_file_entry(d), document_type=d['document_type']) for d in documents
+        ],
+        'claims': [{
+            'claim_number': c['claim_number'],
+            'status': c['status'],
+            'damage_type': c['damage_type'],
+            'description': c['description'],
+            'submitted_at': _iso(c['submitted_at']),
+            'media': [dict(_file_entry(m), media_type=m['media_type']) for m in c['media']]
+        } for c in claims],
+        'policies': [{
+            'policy_number': p.policy_number,
+            'policy_type': p.policy_type,
+            'coverage_amount': p.coverage_amount,
+            'premium': p.premium,
+            'status': p.status,
+            'expiration_date': _iso(p.expiration_date)
+        } for p in policies],
+        'external_policies': [{
+            'insurance_company': p.insurance_company,
+            'policy_number': p.policy_number,
+            'policy_type': p.policy_type,
+            'expiration_date': _iso(p.expiration_date)
+        } for p in external_policies]
+    }
+
+
+def stream_user_export(user_id, include_manifest=False, chunk_size=CHUNK_SIZE):
+    """
+    Generate a ZIP archive of a user's uploads, one chunk at a time
+
+    The archive is written straight into the response: memory use is bounded
+    by chunk_size and the first bytes go out before any file has been read
+    completely, no matter how large the export is.
+
+    Args:
+        user_id: Owner of the documents and claims
+        include_manifest: Append manifest.json describing claims and policies
+        chunk_size: Bytes read from storage per step
+
+    Yields:
+        bytes: Consecutive pieces of the ZIP archive
+    """
+    documents, claims = collect_export_entries(user_id)
+    files = documents + [m for c in claims for m in c['media']]
+    storage = get_storage()
+
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, mode='w', allowZip64=True) as zf:
+        for entry in files:
+            key = storage_key(entry['file_path'])
+            try:
+                size = storage.size(key)
+                chunks = storage.get_stream(key, chunk_size=chunk_size)
+            except StorageError:
+                entry['missing'] = True
+                continue
+            for data in _iter_file_entry(zf, sink, entry['archive_path'], size, chunks,
+                                         entry['uploaded_at']):
+                if data:
+                    yield data
+
+        if include_manifest:
+            manifest = build_manifest(user_id, documents, claims)
+            zf.writestr('manifest.json', json.dumps(manifest, indent=2),
+                        compress_type=zipfile.ZIP_DEFLATED)
+    # Closing the archive writes the central directory
+    yield sink.drain()
@@ -1,12 +1,16 @@
 """
 Internationalization (i18n) Support for SwissAxa Portal
 Supports German and English languages
+
+Flask-Babel is imported on first use, not at startup. set_language() and
+get_babel() initialize it for the current app if that has not happened yet.
 """
-from flask import request, session
-from flask_babel import Babel, gettext as _, lazy_gettext as _l
+from flask import current_app, request, session
 import os
+import threading
 
-babel = Babel()
+babel = None
+_init_lock = threading.Lock()
 
 # Language mappings
 SUPPORTED_LANGUAGES = {
@@ -16,27 +20,57 @@ SUPPORTED_LANGUAGES = {
 
 def init_i18n(app):
     """Initialize i18n with Flask app"""
-    app.config['LANGUAGES'] = SUPPORTED_LANGUAGES
-    app.config['BABEL_DEFAULT_LOCALE'] = os.getenv('DEFAULT_LANGUAGE', 'en')
-    app.config['BABEL_DEFAULT_TIMEZONE'] = 'UTC'
-    
-    babel.init_app(app)
+    global babel
+    from flask_babel import Babel
+    with _init_lock:
+        if 'babel' in app.extensions:
+            return babel
+        app.config.setdefault('LANGUAGES', SUPPORTED_LANGUAGES)
+        app.config.setdefault('BABEL_DEFAULT_LOCALE', os.getenv('DEFAULT_LANGUAGE', 'en'))
+        app.config.setdefault('BABEL_DEFAULT_TIMEZONE', 'UTC')
+
+        if babel is None:
+            babel = Babel()
+        babel.init_app(app, locale_selector=get_locale)
     return babel
 
-@babel.localeselector
+def get_babel():
+    """Flask-Babel for the current app, initialized on first use"""
+    return init_i18n(current_app._get_current_object())
+
+def default_language():
+    """Language used when nothing better is known, e.g. for emails to staff"""
+    return current_app.config.get('BABEL_DEFAULT_LOCALE') or os.getenv('DEFAULT_LANGUAGE', 'en')
+
+def user_language(user):
+    """Language saved for a user, or the default language"""
+    language = getattr(user, 'language', None)
+    return language if language in SUPPORTED_LANGUAGES else default_language()
+
 def get_locale():
     """Determine the best matching language"""
     # Check session first
     if 'language' in session:
         return session.get('language')
     
+    # Then the language saved for the logged-in user
+    from flask_login import current_user
+    if current_user and current_user.is_authenticated and current_user.language in SUPPORTED_LANGUAGES:
+        return current_user.language
+    
     # Check request header
     return request.accept_languages.best_match(SUPPORTED_LANGUAGES.keys()) or 'en'
 
 def set_language(language_code):
-    """Set language for current session"""
+    """Set language for current session, and for the logged-in user's emails"""
+    get_babel()
     if language_code in SUPPORTED_LANGUAGES:
         session['language'] = language_code
+        from flask_login import current_user
+        if current_user and current_user.is_authenticated:
+            from models import db
+            current_user.language = language_code
+            db.session.commit()
         return True
     return False
 
@@ -1,13 +1,44 @@
 """
 Script to initialize sample data for SwissAxa Customer Portal
 Run this after setting up the database to create sample policies and data
+
+    python init_sample_data.py            # Demo user with a few policies
+    python init_sample_data.py --bulk --users 100000 --claims-per-user 2 --media-size 65536
+
+Bulk mode generates data at production volume, so performance changes can be
+measured locally. It uses a fixed seed (--seed): the same parameters always
+produce the same rows relative to --reference-date. Rows are written with
+batched executemany inserts, one transaction per --batch-size users, with
+primary keys assigned up front, so child rows never need a read-back.
+Dummy media and document files of --media-size bytes go through the
+configured storage backend.
 """
+import argparse
+import hashlib
+import io
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import func, select
 
-from app import app, db, User, Agent, SwissAxaPolicy, ExternalPolicy
-from datetime import datetime, timedelta
+from models import db, User, Agent, SwissAxaPolicy, ExternalPolicy, Claim, ClaimMedia, Document, Appointment
+from id_generator import format_claim_number, format_policy_number
 from werkzeug.security import generate_password_hash
 
-def init_sample_data():
+def _portal_app(app=None):
+    """The app to load data into: the given one, the current one, or a new one from APP_CONFIG"""
+    if app is not None:
+        return app
+    if has_app_context():
+        return current_app._get_current_object()
+    from app import create_app
+    return create_app()
+
+def init_sample_data(app=None):
+    app = _portal_app(app)
     with app.app_context():
         # Create sample user if doesn't exist
         user = User.query.filter_by(email='demo@example.com').first()
@@ -103,6 +134,271 @@ def init_sample_data():
         print("Email: demo@example.com")
         print("Password: demo123")
 
+FIRST_NAMES = ['Anna', 'Ben', 'Clara', 'David', 'Emma', 'Felix', 'Hanna', 'Jonas', 'Lea', 'Lukas',
+               'Marie', 'Max', 'Mia', 'Noah', 'Paul', 'Sophie', 'Tim', 'Laura', 'Leon', 'Julia']
+LAST_NAMES = ['Müller', 'Schmidt', 'Schneider', 'Fischer', 'Weber', 'Meyer', 'Wagner', 'Becker',
+              'Schulz', 'Hoffmann', 'Koch', 'Richter', 'Klein', 'Wolf', 'Neumann', 'Schwarz']
+CITIES = [('Köln', '50667', 50.94, 6.96), ('Berlin', '10115', 52.52, 13.40), ('München', '80331', 48.14, 11.58),
+          ('Hamburg', '20095', 53.55, 9.99), ('Frankfurt', '60311', 50.11, 8.68), ('Zürich', '8001', 47.37, 8.54)]
+STREETS = ['Hauptstraße', 'Bahnhofstraße', 'Gartenweg', 'Schulstraße', 'Lindenallee', 'Bergstraße']
+POLICY_TYPES = [
+    ('Comprehensive Auto Insurance', 20000, 80000, 600, 2000),
+    ('Home Insurance', 100000, 500000, 400, 1500),
+    ('Health Insurance', 50000, 200000, 2500, 6000),
+    ('Life Insurance', 100000, 1000000, 300, 3000),
+    ('Liability Insurance', 1000000, 5000000, 60, 200),
+]
+DAMAGE_TYPES = ['vehicle_collision', 'water_damage', 'fire_damage', 'theft', 'storm_damage', 'glass_breakage']
+DOCUMENT_TYPES = ['policy', 'invoice', 'medical_report', 'id_document', 'correspondence', 'general']
+EVENT_NAMES = [('page_view', 'dashboard'), ('page_view', 'policies'), ('page_view', 'documents'),
+               ('page_view', 'claims'), ('action', 'document_upload'), ('action', 'claim_filed'),
+               ('ai', 'chat_message'), ('auth', 'login')]
+USER_AGENTS = ['Mozilla/5.0 (Windows NT 10.0; Win64; x64)', 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0)',
+               'SwissAxaMobile/2.3 (Android 14)', 'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_0)']
+
+# Leading bytes that upload sniffing recognizes, so generated files look real
+FILE_HEADERS = {
+    'photo': b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00',
+    'video': b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom',
+    'document': b'%PDF-1.4\n',
+}
+
+# Parents before children
+INSERT_ORDER = ['user', 'swissaxa_policy', 'claim', 'claim_media', 'document', 'appointment', 'analytics_events']
+
+
+def _dummy_file(kind, size, rng):
+    """One payload per kind, reused for every generated file of that kind"""
+    header = FILE_HEADERS[kind]
+    data = header + rng.randbytes(max(size - len(header), 0))
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def generate_bulk_data(users=1000, policies_per_user=2, claims_per_user=1, media_per_claim=2,
+                       documents_per_user=2, appointments_per_user=1, events_per_user=10,
+                       media_size=16 * 1024, seed=42, batch_size=1000, reference_date=None,
+                       password='password123', progress=print, app=None):
+    """
+    Generate a large, reproducible data set
+
+    Bulk users log in as user<id>@bulk.example.com with the given password.
+    Generated rows are appended after any existing rows, so the function can
+    run repeatedly against the same database. Rows go to app's database, by
+    default the current app's.
+
+    Returns:
+        Counter: rows inserted per table, plus 'files' written to storage
+    """
+    rng = random.Random(seed)
+    today = reference_date or date.today()
+    now = datetime.combine(today, datetime.min.time()) + timedelta(hours=12)
+    app = _portal_app(app)
+
+    with app.app_context():
+        AnalyticsEvent = None
+        if events_per_user:
+            try:
+                from analytics import init_analytics
+                AnalyticsEvent, _ = init_analytics(db)
+            except ImportError:
+                pass
+        db.create_all()
+        engine = db.engine
+        tables = {model.__table__.name: model.__table__
+                  for model in (User, SwissAxaPolicy, Claim, ClaimMedia, Document, Appointment)}
+        if AnalyticsEvent is not None:
+            tables['analytics_events'] = AnalyticsEvent.__table__
+
+        storage = None
+        if media_size:
+            from storage import get_storage
+            storage = get_storage()
+            # Own generator, so the same seed gives the same rows whatever the file size
+            payload_rng = random.Random(seed)
+            payloads = {kind: _dummy_file(kind, media_size, payload_rng) for kind in FILE_HEADERS}
+
+        # Hashing is deliberately slow; one hash shared by all bulk users keeps it out of the run time
+        password_hash = generate_password_hash(password)
+
+        with engine.begin() as conn:
+            next_ids = {name: (conn.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+                        for name, table in tables.items()}
+            agent_count = max(1, users // 500)
+            first_agent = (conn.execute(select(func.max(Agent.id))).scalar() or 0) + 1
+            conn.execute(Agent.__table__.insert(), [
+                {'id': first_agent + i, 'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                 'email': f'agent{first_agent + i}@bulk.swissaxa.example', 'phone': f'+49 221 {100000 + i}'}
+                for i in range(agent_count)
+            ])
+        agent_ids = range(first_agent, first_agent + agent_count)
+
+        # One lease each for all claim and policy numbers
+        generator = app.extensions['id_generator']
+        policy_numbers = iter(generator.reserve(engine, 'policy', users * policies_per_user or 1))
+        claim_numbers = iter(generator.reserve(engine, 'claim', users * claims_per_user or 1))
+
+        def new_id(name):
+            value = next_ids[name]
+            next_ids[name] += 1
+            return value
+
+        counts = Counter()
+        started = time.perf_counter()
+        for chunk_start in range(0, users, batch_size):
+            rows = defaultdict(list)
+            files = []
+            for _ in range(min(batch_size, users - chunk_start)):
+                user_id = new_id('user')
+                city, postcode, lat, lon = rng.choice(CITIES)
+                address = f'{rng.choice(STREETS)} {rng.randint(1, 200)}, {postcode} {city}'
+                rows['user'].append({
+                    'id': user_id, 'email': f'user{user_id}@bulk.example.com', 'password_hash': password_hash,
+                    'first_name': rng.choice(FIRST_NAMES), 'last_name': rng.choice(LAST_NAMES),
+                    'phone': f'+49 {rng.randint(150, 179)} {rng.randint(1000000, 9999999)}',
+                    'address': address, 'correspondence_address': address,
+                    'bank_account': f'DE{rng.randint(10, 99)} {rng.randint(10**17, 10**18 - 1)}',
+                    'agent_id': rng.choice(agent_ids),
+                })
+
+                policy_ids = []
+                for _ in range(policies_per_user):
+                    policy_id = new_id('swissaxa_policy')
+                    policy_ids.append(policy_id)
+                    kind, cov_min, cov_max, prem_min, prem_max = rng.choice(POLICY_TYPES)
+                    expires = today + timedelta(days=rng.randint(-90, 730))
+                    rows['swissaxa_policy'].append({
+                        'id': policy_id, 'user_id': user_id, 'policy_type': kind,
+                        'policy_number': format_policy_number(next(policy_numbers), now),
+                        'coverage_amount': float(rng.randrange(cov_min, cov_max, 1000)),
+                        'premium': round(rng.uniform(prem_min, prem_max), 2),
+                        'expiration_date': expires, 'status': 'active' if expires >= today else 'expired',
+                        'created_at': now - timedelta(days=rng.randint(30, 1500)),
+                    })
+
+                for _ in range(claims_per_user):
+                    claim_id = new_id('claim')
+                    submitted = now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+                    rows['claim'].append({
+                        'id': claim_id, 'user_id': user_id,
+                        'policy_id': rng.choice(policy_ids) if policy_ids else None,
+                        'claim_number': format_claim_number(next(claim_numbers), submitted),
+                        'description': f'Generated claim {claim_id}',
+                        'damage_type': rng.choice(DAMAGE_TYPES),
+                        'latitude': lat + rng.uniform(-0.1, 0.1), 'longitude': lon + rng.uniform(-0.1, 0.1),
+                        'address': address,
+                        'status': rng.choice(['submitted', 'submitted', 'in_review', 'approved', 'rejected']),
+                        'submitted_at': submitted,
+                    })
+                    for n in range(media_per_claim):
+                        media_type = 'video' if rng.random() < 0.1 else 'photo'
+                        filename = f'{media_type}_{n + 1}.{"mp4" if media_type == "video" else "jpg"}'
+                        key = f'claims/bulk/{claim_id}_{filename}'
+                        row = {'id': new_id('claim_media'), 'claim_id': claim_id, 'filename': filename,
+                               'file_path': key, 'media_type': media_type, 'uploaded_at': submitted}
+                        if storage:
+                            data, digest = payloads[media_type]
+                            row.update(content_hash=digest, file_size=len(data))
+                            files.append((key, data))
+                        rows['claim_media'].append(row)
+
+                for n in range(documents_per_user):
+                    document_id = new_id('document')
+                    filename = f'document_{n + 1}.pdf'
+                    key = f'documents/bulk/{document_id}_{filename}'
+                    row = {'id': document_id, 'user_id': user_id, 'filename': filename, 'file_path': key,
+                           'document_type': rng.choice(DOCUMENT_TYPES),
+                           'uploaded_at': now - timedelta(days=rng.randint(0, 1000))}
+                    if storage:
+                        data, digest = payloads['document']
+                        row.update(content_hash=digest, file_size=len(data))
+                        files.append((key, data))
+                    rows['document'].append(row)
+
+                for _ in range(appointments_per_user):
+                    when = now + timedelta(days=rng.randint(-60, 60), hours=rng.randint(-3, 5))
+                    rows['appointment'].append({
+                        'id': new_id('appointment'), 'user_id': user_id, 'agent_id': rng.choice(agent_ids),
+                        'appointment_type': rng.choice(['service_desk', 'agent']), 'date_time': when,
+                        'purpose': 'Generated appointment',
+                        'status': 'scheduled' if when >= now else rng.choice(['completed', 'cancelled']),
+                        'created_at': when - timedelta(days=rng.randint(1, 30)),
+                    })
+
+                if 'analytics_events' in tables:
+                    for _ in range(events_per_user):
+                        event_type, event_name = rng.choice(EVENT_NAMES)
+                        rows['analytics_events'].append({
+                            'id': new_id('analytics_events'), 'user_id': user_id,
+                            'event_type': event_type, 'event_name': event_name,
+                            'timestamp': now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600)),
+                            'ip_address': f'10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}',
+                            'user_agent': rng.choice(USER_AGENTS),
+                        })
+
+            with engine.begin() as conn:
+                for name in INSERT_ORDER:
+                    if rows[name]:
+                        conn.execute(tables[name].insert(), rows[name])
+                        counts[name] += len(rows[name])
+            for key, data in files:
+                storage.put_stream(key, io.BytesIO(data))
+            counts['files'] += len(files)
+
+            elapsed = time.perf_counter() - started
+            total = sum(v for k, v in counts.items() if k != 'files')
+            progress(f'{chunk_start + len(rows["user"])}/{users} users, {total} rows, '
+                     f'{counts["files"]} files ({total / elapsed:,.0f} rows/s)')
+
+        # Usage counters in one set-based pass instead of per file
+        from storage_usage import recount_usage
+        recount_usage()
+        db.session.commit()
+    counts['agent'] = agent_count
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create demo data, or bulk data with --bulk')
+    parser.add_argument('--bulk', action='store_true', help='Generate a large data set instead of the demo user')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--policies-per-user', type=int, default=2)
+    parser.add_argument('--claims-per-user', type=int, default=1)
+    parser.add_argument('--media-per-claim', type=int, default=2)
+    parser.add_argument('--documents-per-user', type=int, default=2)
+    parser.add_argument('--appointments-per-user', type=int, default=1)
+    parser.add_argument('--events-per-user', type=int, default=10)
+    parser.add_argument('--media-size', type=int, default=16 * 1024,
+                        help='Bytes per generated media/document file; 0 writes no files')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=1000, help='Users per insert transaction')
+    parser.add_argument('--reference-date', type=date.fromisoformat, default=None,
+                        help='Date the generated data is relative to (YYYY-MM-DD, default today)')
+    args = parser.parse_args(argv)
+
+    if not args.bulk:
+        init_sample_data()
+        return
+
+    started = time.perf_counter()
+    counts = generate_bulk_data(
+        users=args.users,
+        policies_per_user=args.policies_per_user,
+        claims_per_user=args.claims_per_user,
+        media_per_claim=args.media_per_claim,
+        documents_per_user=args.documents_per_user,
+        appointments_per_user=args.appointments_per_user,
+        events_per_user=args.events_per_user,
+        media_size=args.media_size,
+        seed=args.seed,
+        batch_size=args.batch_size,
+        reference_date=args.reference_date,
+    )
+    print(f"\nBulk data generated in {time.perf_counter() - started:.1f}s:")
+    for name, count in sorted(counts.items()):
+        print(f"  {name}: {count}")
+    print("\nLogin: user<id>@bulk.example.com / password123")
+
+
 if __name__ == '__main__':
-    init_sample_data()
+    main()
 
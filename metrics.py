@@ -0,0 +1,426 @@
+"""
+Metrics Module for SwissAxa Portal
+Counters and histograms exposed on /metrics in the Prometheus text format
+
+Recording a value takes no lock: every thread adds to its own shard of a
+metric, and shards are only summed when /metrics is scraped. A thread
+registers its shard the first time it touches a metric. The shards of
+threads that have ended are folded into a retired total on the next scrape,
+so thread-per-request servers do not grow the shard lists without bound.
+
+Gauges for state that already lives elsewhere (pool usage, queue depths,
+cache stats) are read at scrape time from callbacks and cost nothing on the
+hot path.
+
+Each process keeps its own registry. With several worker processes, scrape
+each one or run a single process per container.
+"""
+import bisect
+import hmac
+import math
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; spans fast page renders up to slow AI and SMTP calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Sharded:
+    """Per-thread shards of a value, summed on read"""
+
+    def __init__(self, new_shard, merge):
+        self._new_shard = new_shard
+        self._merge = merge
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._live = []  # (thread, shard)
+        self._retired = new_shard()
+        self._prune_at = 64
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self._new_shard()
+            with self._lock:
+                self._live.append((threading.current_thread(), shard))
+                # Also retire here, in case /metrics is never scraped
+                if len(self._live) >= self._prune_at:
+                    self._retire_dead()
+                    self._prune_at = 2 * len(self._live) + 64
+            return shard
+
+    def _retire_dead(self):
+        live = []
+        for thread, shard in self._live:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._live = live
+
+    def shards(self):
+        with self._lock:
+            self._retire_dead()
+            return [self._retired] + [shard for _, shard in self._live]
+
+
+def _merge_lists(target, source):
+    for i, value in enumerate(source):
+        target[i] += value
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = _Sharded(lambda: [0.0], _merge_lists)
+
+    def inc(self, amount=1):
+        self._value.shard()[0] += amount
+
+    def get(self):
+        return sum(shard[0] for shard in self._value.shards())
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Per shard: one count per bucket (+Inf last), then sum, then count
+        self._value = _Sharded(lambda: [0.0] * (len(buckets) + 3), _merge_lists)
+
+    def observe(self, value):
+        shard = self._value.shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def get(self):
+        """Cumulative bucket counts, sum and count"""
+        totals = [0.0] * (len(self.buckets) + 3)
+        for shard in self._value.shards():
+            _merge_lists(totals, shard)
+        cumulative, running = [], 0
+        for count in totals[:-2]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-2], totals[-1]
+
+
+class _Timer:
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        """Child for one combination of label values; created once, then a dict lookup"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}, got {values}')
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._samples(values, child))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic total, e.g. requests or tokens"""
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def _samples(self, values, child):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}']
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, e.g. latencies in seconds"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _samples(self, values, child):
+        cumulative, total, count = child.get()
+        lines = []
+        for bound, running in zip(self.buckets + (math.inf,), cumulative):
+            labels = _format_labels(self.labelnames, values, [('le', _format_value(bound))])
+            lines.append(f'{self.name}_bucket{labels} {_format_value(running)}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {_format_value(count)}')
+        return lines
+
+
+class CallbackMetric:
+    """Gauge or counter read from a callback at scrape time; the callback yields (label values, value)"""
+
+    def __init__(self, name, documentation, labelnames=(), callback=None, type_name='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.type_name = type_name
+        self._callbacks = [callback] if callback else []
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for callback in self._callbacks:
+            try:
+                samples = list(callback())
+            except Exception:
+                continue  # A failing source must not break the scrape
+            for values, value in samples:
+                lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def exposition(self):
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests handled', ['endpoint', 'method', 'status']))
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time to handle an HTTP request', ['endpoint', 'method']))
+
+AI_REQUESTS = REGISTRY.register(Counter(
+    'ai_requests_total', 'OpenAI API calls by feature and outcome (ok, error)', ['feature', 'outcome']))
+AI_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'ai_request_duration_seconds', 'OpenAI API call latency', ['feature']))
+AI_TOKENS = REGISTRY.register(Counter(
+    'ai_tokens_total', 'OpenAI tokens used, by feature and kind (prompt, completion)', ['feature', 'kind']))
+
+EMAIL_SENT = REGISTRY.register(Counter(
+    'email_sent_total', 'Emails handed to the mail server, by outcome (ok, error)', ['outcome']))
+EMAIL_SEND_DURATION = REGISTRY.register(Histogram(
+    'email_send_duration_seconds', 'Time to hand one email to the mail server'))
+EMAIL_SMTP_CONNECTIONS = REGISTRY.register(Counter(
+    'email_smtp_connections_opened_total', 'SMTP connections opened; each carries many emails'))
+EMAIL_QUEUE_LATENCY = REGISTRY.register(Histogram(
+    'email_queue_latency_seconds', 'Time from queueing an email to sending it, retries included',
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 4 * 3600.0)))
+EMAIL_OUTBOX_DEAD = REGISTRY.register(CallbackMetric(
+    'email_outbox_dead', 'Emails that failed every attempt and wait for email-outbox-requeue'))
+
+DB_POOL_SIZE = REGISTRY.register(CallbackMetric(
+    'db_pool_size', 'Configured connection pool size', ['bind']))
+DB_POOL_CHECKED_OUT = REGISTRY.register(CallbackMetric(
+    'db_pool_checked_out', 'Connections currently in use', ['bind']))
+DB_POOL_OVERFLOW = REGISTRY.register(CallbackMetric(
+    'db_pool_overflow', 'Connections open beyond the pool size', ['bind']))
+
+QUEUE_DEPTH = REGISTRY.register(CallbackMetric(
+    'queue_depth', 'Work waiting in a background queue', ['queue']))
+DB_WRITE_QUEUE_TIMEOUTS = REGISTRY.register(CallbackMetric(
+    'db_write_queue_timeouts_total', 'Writes that gave up waiting for the write slot', type_name='counter'))
+USER_CACHE_REQUESTS = REGISTRY.register(CallbackMetric(
+    'user_cache_requests_total', 'User cache lookups by result (hit, miss)', ['result'], type_name='counter'))
+NOTIFICATION_STREAMS = REGISTRY.register(CallbackMetric(
+    'notification_streams_open', 'Server-Sent Events notification streams open in this process'))
+
+
+def register_queue(name, depth):
+    """Report a background queue's depth; depth() is called at scrape time"""
+    QUEUE_DEPTH.add_callback(lambda: [((name,), depth())])
+
+
+def _pool_samples(db, method):
+    for key, engine in db.engines.items():
+        pool_method = getattr(engine.pool, method, None)
+        if pool_method is not None:
+            yield (key or 'default',), pool_method()
+
+
+def _app_extension(name):
+    from flask import current_app, has_app_context
+    return current_app.extensions.get(name) if has_app_context() else None
+
+
+def _write_queue_depth():
+    serializer = _app_extension('write_serializer')
+    return serializer.queue_length if serializer is not None else 0
+
+
+def _write_queue_timeouts():
+    serializer = _app_extension('write_serializer')
+    return [((), serializer.timeouts)] if serializer is not None else []
+
+
+def _user_cache_samples():
+    cache = _app_extension('user_cache')
+    return [(('hit',), cache.hits), (('miss',), cache.misses)] if cache is not None else []
+
+
+def _email_outbox_depth():
+    from email_outbox import outbox_depth
+    return outbox_depth() if _app_extension('email_outbox') is not None else 0
+
+
+def _email_outbox_dead():
+    from email_outbox import dead_count
+    return [((), dead_count())] if _app_extension('email_outbox') is not None else []
+
+
+def _notification_stream_samples():
+    broker = _app_extension('notification_stream')
+    return [((), broker.hub.open_streams)] if broker is not None else []
+
+
+_sources_installed = False
+
+
+def _install_sources(db):
+    """Scrape-time sources; added once and read from the app serving /metrics"""
+    global _sources_installed
+    if _sources_installed:
+        return
+    _sources_installed = True
+    if db is not None:
+        DB_POOL_SIZE.add_callback(lambda: _pool_samples(db, 'size'))
+        DB_POOL_CHECKED_OUT.add_callback(lambda: _pool_samples(db, 'checkedout'))
+        # QueuePool counts overflow from -pool_size until the pool is full
+        DB_POOL_OVERFLOW.add_callback(lambda: [(labels, max(value, 0))
+                                               for labels, value in _pool_samples(db, 'overflow')])
+
+    register_queue('db_write', _write_queue_depth)
+    DB_WRITE_QUEUE_TIMEOUTS.add_callback(_write_queue_timeouts)
+
+    try:
+        from claim_media import pending_writes
+        register_queue('claim_media', pending_writes)
+    except ImportError:
+        pass
+
+    register_queue('email_outbox', _email_outbox_depth)
+    EMAIL_OUTBOX_DEAD.add_callback(_email_outbox_dead)
+
+    USER_CACHE_REQUESTS.add_callback(_user_cache_samples)
+    NOTIFICATION_STREAMS.add_callback(_notification_stream_samples)
+
+
+def init_metrics(app, db=None):
+    """Initialize metrics collection and the /metrics endpoint with Flask app"""
+    from flask import Response, abort, g, request
+
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_TOKEN', None)
+    if not app.config['METRICS_ENABLED']:
+        return None
+
+    @app.before_request
+    def start_request_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            # Endpoint names, not paths, keep the label set small
+            endpoint = request.endpoint or 'unmatched'
+            HTTP_REQUEST_DURATION.labels(endpoint, request.method).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+        return response
+
+    _install_sources(db)
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if token:
+            # Constant-time; bytes, since compare_digest refuses non-ASCII str
+            if not hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                       f'Bearer {token}'.encode()):
+                abort(401)
+        elif not (app.debug or app.testing):
+            # Traffic per endpoint, queue depths and pool internals stay private without a token
+            abort(403)
+        return Response(REGISTRY.exposition(), content_type=CONTENT_TYPE)
+
+    return REGISTRY
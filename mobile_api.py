@@ -4,18 +4,27 @@ Provides REST API for mobile app integration
 """
 from flask import Blueprint, jsonify, request
 from flask_login import login_required, current_user
-from app import db
+from sqlalchemy import func
+from models import db, Claim, ClaimMedia, SwissAxaPolicy, Document, Appointment
+from db_engine import read_only
 from datetime import datetime
 
 mobile_api = Blueprint('mobile_api', __name__, url_prefix='/api/mobile')
 
 @mobile_api.route('/claims', methods=['GET'])
 @login_required
+@read_only
 def get_claims():
     """Get user claims for mobile app"""
-    from app import Claim, ClaimMedia
-    
-    claims = Claim.query.filter_by(user_id=current_user.id).order_by(Claim.created_at.desc()).all()
+    claims = Claim.query.filter_by(user_id=current_user.id).order_by(Claim.submitted_at.desc()).all()
+    # One grouped count instead of loading each claim's media
+    media_counts = dict(
+        db.session.query(ClaimMedia.claim_id, func.count(ClaimMedia.id))
+        .join(Claim, Claim.id == ClaimMedia.claim_id)
+        .filter(Claim.user_id == current_user.id)
+        .group_by(ClaimMedia.claim_id)
+        .all()
+    )
     
     return jsonify([{
         'id': c.id,
@@ -24,16 +33,15 @@ def get_claims():
         'damage_type': c.damage_type,
         'description': c.description,
         'address': c.address,
-        'created_at': c.created_at.isoformat() if c.created_at else None,
-        'media_count': len(c.media) if hasattr(c, 'media') else 0
+        'created_at': c.submitted_at.isoformat() if c.submitted_at else None,
+        'media_count': media_counts.get(c.id, 0)
     } for c in claims])
 
 @mobile_api.route('/claims/<int:claim_id>', methods=['GET'])
 @login_required
+@read_only
 def get_claim_detail(claim_id):
     """Get detailed claim information"""
-    from app import Claim
-    
     claim = Claim.query.filter_by(id=claim_id, user_id=current_user.id).first()
     if not claim:
         return jsonify({'error': 'Claim not found'}), 404
@@ -47,7 +55,7 @@ def get_claim_detail(claim_id):
         'address': claim.address,
         'latitude': claim.latitude,
         'longitude': claim.longitude,
-        'created_at': claim.created_at.isoformat() if claim.created_at else None,
+        'created_at': claim.submitted_at.isoformat() if claim.submitted_at else None,
         'media': [{
             'id': m.id,
             'filename': m.filename,
@@ -57,32 +65,52 @@ def get_claim_detail(claim_id):
 
 @mobile_api.route('/notifications', methods=['GET'])
 @login_required
+@read_only
 def get_notifications():
-    """Get notifications for mobile app"""
+    """Get notifications for mobile app, newest first; ?before=<id> for the next page"""
     try:
-        from notifications import get_user_notifications
-        notifications = get_user_notifications(current_user.id)
-        return jsonify([n.to_dict() for n in notifications])
+        from notifications import get_user_notifications, page_params, unread_count
+        notifications = get_user_notifications(current_user.id, **page_params(request.args))
+        response = jsonify([n.to_dict() for n in notifications])
+        response.headers['X-Unread-Count'] = str(unread_count(current_user.id))
+        return response
     except ImportError:
         return jsonify([])
 
+@mobile_api.route('/notifications/stream', methods=['GET'])
+@login_required
+def notification_stream():
+    """Push new notifications to the mobile app as Server-Sent Events"""
+    from notification_stream import last_event_id, stream_response
+    return stream_response(current_user.id, last_event_id(request))
+
 @mobile_api.route('/notifications/<int:notification_id>/read', methods=['POST'])
 @login_required
 def mark_notification_read(notification_id):
     """Mark notification as read"""
     try:
         from notifications import mark_notification_read
-        mark_notification_read(current_user.id, notification_id)
+        if not mark_notification_read(current_user.id, notification_id):
+            return jsonify({'error': 'Notification not found'}), 404
         return jsonify({'success': True})
     except ImportError:
         return jsonify({'error': 'Notifications not available'}), 500
 
+@mobile_api.route('/notifications/read-all', methods=['POST'])
+@login_required
+def mark_all_notifications_read():
+    """Mark all notifications as read"""
+    try:
+        from notifications import mark_all_read
+        return jsonify({'success': True, 'marked': mark_all_read(current_user.id)})
+    except ImportError:
+        return jsonify({'error': 'Notifications not available'}), 500
+
 @mobile_api.route('/policies', methods=['GET'])
 @login_required
+@read_only
 def get_policies():
     """Get user policies for mobile app"""
-    from app import SwissAxaPolicy
-    
     policies = SwissAxaPolicy.query.filter_by(user_id=current_user.id).all()
     
     return jsonify([{
@@ -97,10 +125,9 @@ def get_policies():
 
 @mobile_api.route('/documents', methods=['GET'])
 @login_required
+@read_only
 def get_documents():
     """Get user documents for mobile app"""
-    from app import Document
-    
     documents = Document.query.filter_by(user_id=current_user.id).order_by(Document.uploaded_at.desc()).all()
     
     return jsonify([{
@@ -112,10 +139,9 @@ def get_documents():
 
 @mobile_api.route('/dashboard/stats', methods=['GET'])
 @login_required
+@read_only
 def get_dashboard_stats():
     """Get dashboard statistics for mobile app"""
-    from app import Claim, SwissAxaPolicy, Document, Appointment
-    
     stats = {
         'total_policies': SwissAxaPolicy.query.filter_by(user_id=current_user.id).count(),
         'active_claims': Claim.query.filter_by(user_id=current_user.id, status='submitted').count(),
@@ -0,0 +1,291 @@
+"""
+Models Module for SwissAxa Portal
+Database models and the shared Flask-SQLAlchemy instance
+
+The instance is not bound to an app here; create_app() in app.py calls
+db.init_app(). Modules that need the database import it from this module,
+so importing a model never builds the app.
+"""
+from datetime import datetime
+
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from db_engine import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(128))
+    first_name = db.Column(db.String(100))
+    last_name = db.Column(db.String(100))
+    phone = db.Column(db.String(20))
+    address = db.Column(db.String(255))
+    correspondence_address = db.Column(db.String(255))
+    bank_account = db.Column(db.String(50))
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'))
+    language = db.Column(db.String(5))  # Language for emails; see i18n_support.user_language()
+    
+    def set_password(self, password):
+        self.password_hash = generate_password_hash(password)
+    
+    def check_password(self, password):
+        return check_password_hash(self.password_hash, password)
+
+class Agent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    phone = db.Column(db.String(20))
+
+class AgentWorkingHours(db.Model):
+    """A period an agent takes appointments on one weekday (0 = Monday), see availability.py"""
+    __table_args__ = (db.Index('ix_agent_working_hours_agent_weekday', 'agent_id', 'weekday'),)
+    id = db.Column(db.Integer, primary_key=True)
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+
+class SwissAxaPolicy(db.Model):
+    __tablename__ = 'swissaxa_policy'
+    # Broadcasts page through the holders of a policy type by user id (broadcasts.py)
+    __table_args__ = (db.Index('ix_swissaxa_policy_type_status_user', 'policy_type', 'status', 'user_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    policy_number = db.Column(db.String(50), unique=True, nullable=False)
+    policy_type = db.Column(db.String(100))
+    coverage_amount = db.Column(db.Float)
+    premium = db.Column(db.Float)
+    expiration_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), default='active')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref='swissaxa_policies')
+
+class ExternalPolicy(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    insurance_company = db.Column(db.String(100), nullable=False)
+    policy_number = db.Column(db.String(50))
+    policy_type = db.Column(db.String(100))
+    expiration_date = db.Column(db.Date)
+    file_path = db.Column(db.String(255), index=True)
+    file_size = db.Column(db.Integer)
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref='external_policies')
+
+class Document(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(255), nullable=False, index=True)
+    document_type = db.Column(db.String(100))
+    content_hash = db.Column(db.String(64))  # SHA-256 of the stored file
+    file_size = db.Column(db.Integer)
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref='documents')
+
+class Claim(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    policy_id = db.Column(db.Integer, db.ForeignKey('swissaxa_policy.id'))
+    claim_number = db.Column(db.String(50), unique=True)
+    description = db.Column(db.Text)
+    damage_type = db.Column(db.String(100))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    address = db.Column(db.String(255))
+    status = db.Column(db.String(20), default='submitted')
+    submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref='claims')
+    policy = db.relationship('SwissAxaPolicy', backref='claims')
+
+class ClaimMedia(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    claim_id = db.Column(db.Integer, db.ForeignKey('claim.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(255), nullable=False, index=True)
+    media_type = db.Column(db.String(20))  # 'photo' or 'video'
+    content_hash = db.Column(db.String(64))  # SHA-256 of the stored file
+    file_size = db.Column(db.Integer)
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    claim = db.relationship('Claim', backref='media')
+
+class PolicyChangeRequest(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    policy_id = db.Column(db.Integer, db.ForeignKey('swissaxa_policy.id'))
+    request_type = db.Column(db.String(50))  # 'upgrade', 'change', 'cancel'
+    description = db.Column(db.Text)
+    status = db.Column(db.String(20), default='pending')
+    submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref='policy_change_requests')
+    policy = db.relationship('SwissAxaPolicy', backref='change_requests')
+
+class Appointment(db.Model):
+    # Reminders scan upcoming appointments by status and time (appointment_reminders.py);
+    # booking checks an agent's appointments around the requested time (availability.py)
+    __table_args__ = (db.Index('ix_appointment_status_date_time', 'status', 'date_time'),
+                      db.Index('ix_appointment_agent_date_time', 'agent_id', 'date_time'))
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'))
+    appointment_type = db.Column(db.String(50))  # 'service_desk' or 'agent'
+    date_time = db.Column(db.DateTime, nullable=False)
+    purpose = db.Column(db.Text)
+    status = db.Column(db.String(20), default='scheduled')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref='appointments')
+    agent = db.relationship('Agent', backref='appointments')
+
+class AppointmentReminder(db.Model):
+    """A reminder sent (or skipped) for an appointment; one per offset, see appointment_reminders.py"""
+    __table_args__ = (db.UniqueConstraint('appointment_id', 'offset_minutes',
+                                          name='uq_appointment_reminder_offset'),)
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
+    offset_minutes = db.Column(db.Integer, nullable=False)
+    sent_at = db.Column(db.DateTime)  # NULL when skipped: booked after the reminder was due
+
+class BankAccount(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    bank_name = db.Column(db.String(100), nullable=False)  # Sparkasse, N26, Deutsche Bank, etc.
+    account_number = db.Column(db.String(50))
+    is_connected = db.Column(db.Boolean, default=False)
+    
+    user = db.relationship('User', backref='bank_accounts')
+
+class StorageUsage(db.Model):
+    """Running totals of the files each user has stored"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    bytes_used = db.Column(db.BigInteger, nullable=False, default=0)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class IdSequence(db.Model):
+    """Next unleased value of each number sequence, see id_generator.py"""
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=1)
+
+class StorageScanCheckpoint(db.Model):
+    """Resume point of an incremental storage scan"""
+    name = db.Column(db.String(50), primary_key=True)
+    last_key = db.Column(db.String(1024))  # None = start a new pass
+    pass_started_at = db.Column(db.DateTime)
+    last_completed_at = db.Column(db.DateTime)
+    keys_scanned = db.Column(db.Integer, default=0)
+    orphans_deleted = db.Column(db.Integer, default=0)
+    bytes_reclaimed = db.Column(db.BigInteger, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Notification(db.Model):
+    """In-app notification, see notifications.py"""
+    __table_args__ = (db.Index('ix_notification_user_id_id', 'user_id', 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    message = db.Column(db.Text)
+    notification_type = db.Column(db.String(20), default='info')  # 'info', 'success', 'warning', 'error'
+    action_url = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    read_at = db.Column(db.DateTime)  # None = unread
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'message': self.message,
+            'type': self.notification_type,
+            'action_url': self.action_url,
+            'timestamp': self.created_at.isoformat() if self.created_at else None,
+            'read': self.read_at is not None
+        }
+
+class NotificationCounter(db.Model):
+    """Unread notifications per user, adjusted whenever one is added or read"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BroadcastCampaign(db.Model):
+    """Notification sent to every holder of a policy type, see broadcasts.py"""
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    notification_type = db.Column(db.String(20), default='info')
+    action_url = db.Column(db.String(255))
+    policy_type = db.Column(db.String(100), nullable=False)
+    policy_status = db.Column(db.String(20))  # None = any status
+    send_email = db.Column(db.Boolean, nullable=False, default=False)
+    # 'pending', 'notifying', 'emailing', 'completed' or 'cancelled'
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    cursor = db.Column(db.Integer, nullable=False, default=0)  # Last user id done in the current phase
+    targeted = db.Column(db.Integer, nullable=False, default=0)
+    notified = db.Column(db.Integer, nullable=False, default=0)
+    emailed = db.Column(db.Integer, nullable=False, default=0)  # Queued in the email outbox
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'policy_type': self.policy_type,
+            'policy_status': self.policy_status,
+            'send_email': self.send_email,
+            'status': self.status,
+            'targeted': self.targeted,
+            'notified': self.notified,
+            'emailed': self.emailed,
+            'progress': min(round(self.notified / self.targeted, 3), 1.0) if self.targeted else 1.0,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class EmailDigest(db.Model):
+    """Claim updates waiting to go to one recipient as a single email, see email_digests.py"""
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), unique=True, nullable=False)
+    language = db.Column(db.String(5))
+    due_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class EmailDigestEvent(db.Model):
+    """One claim update collected for an EmailDigest"""
+    __table_args__ = (db.Index('ix_email_digest_event_recipient_id', 'recipient', 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    claim_number = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class EmailOutbox(db.Model):
+    """Email waiting to be sent by the outbox workers, see email_outbox.py"""
+    __table_args__ = (db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    recipients = db.Column(db.Text, nullable=False)  # JSON list of addresses
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    html_body = db.Column(db.Text)
+    attachments = db.Column(db.Text)  # JSON list of storage keys (or older upload paths)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'sending', 'sent', 'dead'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)  # While 'sending'; after that another worker may retry
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
@@ -0,0 +1,336 @@
+"""
+Notification Stream Module for SwissAxa Portal
+Pushes new notifications to the browser and mobile app over Server-Sent Events
+
+Each open stream is a subscription in this process's NotificationHub. A
+notification is handed to the broker once the transaction that added it
+commits. The broker delivers it to the hub of every process holding a
+stream for that user.
+
+Brokers:
+    local     only this process (default; enough for a single worker)
+    database  every process polls the notification table for new rows, so
+              notifications added by other workers, cron jobs or the CLI are
+              delivered too. Polling only runs while this process has open
+              streams.
+
+Event ids are notification ids. A client that reconnects sends the last one
+in Last-Event-ID, and the stream first replays what it missed from the
+database, at most NOTIFICATION_STREAM_REPLAY_LIMIT at a time: a stream that
+replays that many ends right after them, so the client picks up the rest
+with its next Last-Event-ID. A stream ends after
+NOTIFICATION_STREAM_MAX_SECONDS, and also when its client reads too slowly
+and its queue fills up. The browser's
+EventSource then reconnects by itself.
+
+An open stream holds a worker thread but no database connection. Run the
+app with a threaded server or gevent workers when many clients connect.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from flask import Response, current_app, has_app_context
+from sqlalchemy import event, func, select
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 100
+POLL_BATCH_SIZE = 500
+
+
+def notification_event(notification):
+    """The event sent for a notification"""
+    return {'id': notification.id, 'user_id': notification.user_id, 'data': notification.to_dict()}
+
+
+def format_event(event_):
+    """Encode an event in the text/event-stream format"""
+    return f"id: {event_['id']}\nevent: notification\ndata: {json.dumps(event_['data'])}\n\n"
+
+
+class Subscription:
+    """One open stream; events wait in a bounded queue until the stream sends them"""
+
+    def __init__(self, user_id, max_queued=DEFAULT_QUEUE_SIZE):
+        self.user_id = user_id
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=max_queued)
+
+    def put(self, event_):
+        try:
+            self._queue.put_nowait(event_)
+        except queue.Full:
+            # The client reconnects and catches up from the database
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Next event, or None if none arrived within timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class NotificationHub:
+    """In-process pub/sub: delivers events to this process's open streams by user id"""
+
+    def __init__(self, max_queued=DEFAULT_QUEUE_SIZE):
+        self.max_queued = max_queued
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, self.max_queued)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id, event_):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event_)
+
+    @property
+    def open_streams(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class LocalBroker:
+    """Delivers notifications to streams in this process only"""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def subscribe(self, user_id):
+        return self.hub.subscribe(user_id)
+
+    def publish(self, user_id, event_):
+        self.hub.publish(user_id, event_)
+
+
+class DatabaseBroker:
+    """
+    Delivers notifications added by any process by polling the notification table
+
+    One thread per process reads rows above the last id it has seen, through
+    the primary key, every `interval` seconds. It starts with the first open
+    stream and stops when the last one closes.
+    """
+
+    def __init__(self, hub, app, interval=1.0):
+        self.hub = hub
+        self.app = app
+        self.interval = interval
+        self.polls = 0
+        self._last_id = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        with self._lock:
+            subscription = self.hub.subscribe(user_id)
+            # A thread started before a fork does not exist in the child
+            if self._thread is None or self._pid != os.getpid():
+                # Read the starting point now, before the caller replays, so no row falls in between
+                self._last_id = self._max_id()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='notification-poller', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def publish(self, user_id, event_):
+        pass  # The committed row is the message; the pollers pick it up
+
+    def _max_id(self):
+        from models import db, Notification
+        with self.app.app_context():
+            try:
+                return db.session.scalar(select(func.max(Notification.id))) or 0
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self.hub.open_streams:
+                    self._thread = None
+                    return
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Polling for new notifications failed')
+
+    def poll(self):
+        """Deliver rows added since the last poll; returns how many"""
+        from models import db, Notification
+        delivered = 0
+        with self.app.app_context():
+            try:
+                while True:
+                    rows = db.session.scalars(
+                        select(Notification)
+                        .where(Notification.id > self._last_id)
+                        .order_by(Notification.id)
+                        .limit(POLL_BATCH_SIZE)
+                    ).all()
+                    for notification in rows:
+                        self.hub.publish(notification.user_id, notification_event(notification))
+                    if rows:
+                        self._last_id = rows[-1].id
+                    delivered += len(rows)
+                    if len(rows) < POLL_BATCH_SIZE:
+                        break
+            finally:
+                db.session.remove()
+        self.polls += 1
+        return delivered
+
+
+def create_broker(app, hub):
+    """Build the broker selected by NOTIFICATION_STREAM_BROKER"""
+    broker = app.config.get('NOTIFICATION_STREAM_BROKER', 'local')
+    if broker == 'local':
+        return LocalBroker(hub)
+    if broker == 'database':
+        return DatabaseBroker(hub, app, interval=app.config.get('NOTIFICATION_STREAM_POLL_SECONDS', 1.0))
+    raise ValueError(f'Unknown notification stream broker: {broker}')
+
+
+def _current_broker():
+    return current_app.extensions.get('notification_stream') if has_app_context() else None
+
+
+def _collect_new(sess, flush_context):
+    # Serialize while the rows are loaded; after the commit they are expired
+    from models import Notification
+    events = [notification_event(obj) for obj in sess.new if isinstance(obj, Notification)]
+    if events:
+        sess.info.setdefault('notification_events', []).extend(events)
+
+
+def publish_after_commit(sess, notifications):
+    """Push notifications written without the ORM (bulk inserts) once sess commits"""
+    sess.info.setdefault('notification_events', []).extend(
+        notification_event(notification) for notification in notifications)
+
+
+def _publish_committed(sess):
+    events = sess.info.pop('notification_events', ())
+    broker = _current_broker()
+    if broker is not None:
+        for event_ in events:
+            broker.publish(event_['user_id'], event_)
+
+
+def _discard_rolled_back(sess):
+    sess.info.pop('notification_events', None)
+
+
+def stream_response(user_id, last_event_id=None):
+    """
+    The text/event-stream response for a user's notifications
+
+    Missed notifications (ids above last_event_id) are read here, before the
+    response starts, so the stream itself needs no database connection.
+    """
+    from models import db, Notification
+    config = current_app.config
+    broker = current_app.extensions['notification_stream']
+    subscription = broker.subscribe(user_id)
+    try:
+        if last_event_id is not None:
+            missed = db.session.scalars(
+                select(Notification)
+                .where(Notification.user_id == user_id, Notification.id > last_event_id)
+                .order_by(Notification.id)
+                .limit(config['NOTIFICATION_STREAM_REPLAY_LIMIT'])
+            ).all()
+            replay = [notification_event(notification) for notification in missed]
+            # Ids up to here are either replayed or were already seen
+            sent_up_to = max([last_event_id] + [event_['id'] for event_ in replay])
+            # More may be missed; the client reconnects from the last replayed id for the rest
+            truncated = len(missed) == config['NOTIFICATION_STREAM_REPLAY_LIMIT']
+        else:
+            replay = []
+            truncated = False
+            sent_up_to = db.session.scalar(
+                select(func.max(Notification.id)).where(Notification.user_id == user_id)
+            ) or 0
+    except Exception:
+        broker.hub.unsubscribe(subscription)
+        raise
+
+    keepalive = config['NOTIFICATION_STREAM_KEEPALIVE_SECONDS']
+    max_seconds = config['NOTIFICATION_STREAM_MAX_SECONDS']
+
+    def generate():
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield f"retry: {config['NOTIFICATION_STREAM_RETRY_MS']}\n\n"
+            for event_ in replay:
+                yield format_event(event_)
+            if truncated:
+                return
+            while not subscription.overflowed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                event_ = subscription.get(timeout=min(keepalive, remaining))
+                if event_ is None:
+                    yield ': keepalive\n\n'
+                elif event_['id'] > sent_up_to:
+                    yield format_event(event_)
+        finally:
+            broker.hub.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Keep nginx from buffering the stream
+    })
+
+
+def last_event_id(request):
+    """The Last-Event-ID header (or ?last_event_id= for clients that cannot set headers)"""
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def init_notification_stream(app, session):
+    """Initialize the notification hub and broker with Flask app"""
+    app.config.setdefault('NOTIFICATION_STREAM_BROKER', 'local')
+    app.config.setdefault('NOTIFICATION_STREAM_POLL_SECONDS', 1.0)
+    app.config.setdefault('NOTIFICATION_STREAM_KEEPALIVE_SECONDS', 15)
+    app.config.setdefault('NOTIFICATION_STREAM_MAX_SECONDS', 300)
+    app.config.setdefault('NOTIFICATION_STREAM_RETRY_MS', 3000)
+    app.config.setdefault('NOTIFICATION_STREAM_REPLAY_LIMIT', 100)
+
+    hub = NotificationHub(max_queued=app.config.get('NOTIFICATION_STREAM_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+    broker = create_broker(app, hub)
+    app.extensions['notification_stream'] = broker
+
+    # Shared by every app; each publishes to the current app's broker
+    for identifier, fn in (('after_flush', _collect_new),
+                           ('after_commit', _publish_committed),
+                           ('after_rollback', _discard_rolled_back)):
+        if not event.contains(session, identifier, fn):
+            event.listen(session, identifier, fn)
+    return broker
@@ -1,80 +1,243 @@
 """
 Notifications Module for SwissAxa Portal
-Handles web push notifications and in-app notifications
+Handles in-app notifications, stored in the database
+
+Notifications are rows in the notification table, so background jobs and
+other devices can reach a user and the session cookie stays small. Lists are
+read newest first through the (user_id, id) index and paged by id. Each
+user's unread count is kept in notification_counter and adjusted in the same
+transaction that adds or reads a notification, so the badge is a primary key
+lookup. Marking one notification read is a single UPDATE by primary key.
+
+Old notifications are deleted by purge_notifications() in small batches
+(flask notifications-purge), taking unread ones off the counters as it goes.
 """
-from flask import session
-from datetime import datetime
-import json
-
-class Notification:
-    """Notification model"""
-    def __init__(self, notification_id, title, message, notification_type='info', 
-                 action_url=None, timestamp=None, read=False):
-        self.id = notification_id
-        self.title = title
-        self.message = message
-        self.type = notification_type  # 'info', 'success', 'warning', 'error'
-        self.action_url = action_url
-        self.timestamp = timestamp or datetime.utcnow()
-        self.read = read
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'message': self.message,
-            'type': self.type,
-            'action_url': self.action_url,
-            'timestamp': self.timestamp.isoformat() if isinstance(self.timestamp, datetime) else str(self.timestamp),
-            'read': self.read
-        }
-
-def get_user_notifications(user_id):
-    """Get notifications for a user (stored in session for demo)"""
-    key = f'notifications_{user_id}'
-    notifications_data = session.get(key, [])
-    return [Notification(**n) if isinstance(n, dict) else n for n in notifications_data]
-
-def add_notification(user_id, title, message, notification_type='info', action_url=None):
-    """Add a notification for a user"""
-    key = f'notifications_{user_id}'
-    notifications = get_user_notifications(user_id)
-    
-    notification_id = len(notifications) + 1
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import bindparam, case, delete, insert, select, update
+from sqlalchemy.dialects import sqlite, postgresql
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+DEFAULT_PURGE_BATCH_SIZE = 1000
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _add_unread(user_id, delta):
+    """Adjust a user's unread counter inside the caller's transaction"""
+    from models import db, NotificationCounter
+    now = datetime.utcnow()
+    upsert = _UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if upsert is not None:
+        stmt = upsert(NotificationCounter).values(user_id=user_id, unread_count=max(delta, 0), updated_at=now)
+        stmt = stmt.on_conflict_do_update(index_elements=[NotificationCounter.user_id], set_={
+            'unread_count': case((NotificationCounter.unread_count + delta > 0,
+                                  NotificationCounter.unread_count + delta), else_=0),
+            'updated_at': stmt.excluded.updated_at,
+        })
+        db.session.execute(stmt)
+        return
+
+    result = db.session.execute(
+        update(NotificationCounter)
+        .where(NotificationCounter.user_id == user_id)
+        .values(unread_count=case((NotificationCounter.unread_count + delta > 0,
+                                   NotificationCounter.unread_count + delta), else_=0),
+                updated_at=now)
+    )
+    if result.rowcount == 0:
+        db.session.add(NotificationCounter(user_id=user_id, unread_count=max(delta, 0), updated_at=now))
+
+
+def _add_unread_many(user_ids, now):
+    """Add one unread notification to each user's counter, in one statement where possible"""
+    from models import db, NotificationCounter
+    upsert = _UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if upsert is None:
+        for user_id in user_ids:
+            _add_unread(user_id, 1)
+        return
+    stmt = upsert(NotificationCounter)
+    stmt = stmt.on_conflict_do_update(index_elements=[NotificationCounter.user_id], set_={
+        'unread_count': NotificationCounter.unread_count + 1,
+        'updated_at': stmt.excluded.updated_at,
+    })
+    db.session.execute(stmt, [{'user_id': user_id, 'unread_count': 1, 'updated_at': now}
+                              for user_id in user_ids])
+
+
+def get_user_notifications(user_id, limit=DEFAULT_PAGE_SIZE, before_id=None, unread_only=False):
+    """
+    Get a user's notifications, newest first
+
+    Args:
+        limit: Page size
+        before_id: Only notifications older than this id, for the next page
+        unread_only: Skip notifications that were read
+    """
+    from models import db, Notification
+    query = select(Notification).where(Notification.user_id == user_id)
+    if before_id is not None:
+        query = query.where(Notification.id < before_id)
+    if unread_only:
+        query = query.where(Notification.read_at.is_(None))
+    return db.session.scalars(query.order_by(Notification.id.desc()).limit(limit)).all()
+
+
+def page_params(args):
+    """get_user_notifications() arguments from ?limit=&before=&unread= query args"""
+    limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return {
+        'limit': min(max(limit, 1), MAX_PAGE_SIZE),
+        'before_id': args.get('before', type=int),
+        'unread_only': args.get('unread', '').lower() in ('1', 'true', 'yes'),
+    }
+
+
+def unread_count(user_id):
+    """Number of unread notifications of a user"""
+    from models import db, NotificationCounter
+    counter = db.session.get(NotificationCounter, user_id)
+    return counter.unread_count if counter else 0
+
+
+def add_notification(user_id, title, message, notification_type='info', action_url=None, commit=True):
+    """
+    Add a notification for a user
+
+    With commit=False the notification is part of the caller's transaction.
+    """
+    from models import db, Notification
     notification = Notification(
-        notification_id=notification_id,
+        user_id=user_id,
         title=title,
         message=message,
         notification_type=notification_type,
         action_url=action_url
     )
-    
-    notifications.insert(0, notification)  # Add to beginning
-    # Keep only last 50 notifications
-    notifications = notifications[:50]
-    
-    session[key] = [n.to_dict() for n in notifications]
+    db.session.add(notification)
+    _add_unread(user_id, 1)
+    if commit:
+        db.session.commit()
     return notification
 
+
+def add_notifications(user_ids, title, message, notification_type='info', action_url=None):
+    """
+    Add the same notification for many users, in the caller's transaction
+
+    One multi-row INSERT for the notifications and one for the counters,
+    instead of a round trip per user. Returns the number added.
+    """
+    from models import db, Notification
+    from notification_stream import publish_after_commit
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    now = datetime.utcnow()
+    fields = {'title': title, 'message': message, 'notification_type': notification_type,
+              'action_url': action_url, 'created_at': now}
+    rows = db.session.execute(
+        insert(Notification).returning(Notification.id, Notification.user_id, sort_by_parameter_order=True),
+        [dict(fields, user_id=user_id) for user_id in user_ids]
+    ).all()
+    _add_unread_many(user_ids, now)
+    publish_after_commit(db.session, [Notification(id=row.id, user_id=row.user_id, **fields) for row in rows])
+    return len(rows)
+
+
 def mark_notification_read(user_id, notification_id):
-    """Mark a notification as read"""
-    notifications = get_user_notifications(user_id)
-    for notification in notifications:
-        if notification.id == notification_id:
-            notification.read = True
-            break
-    
-    key = f'notifications_{user_id}'
-    session[key] = [n.to_dict() for n in notifications]
+    """
+    Mark a notification as read
+
+    Returns:
+        bool: False if the user has no such notification
+    """
+    from models import db, Notification
+    result = db.session.execute(
+        update(Notification)
+        .where(Notification.id == notification_id, Notification.user_id == user_id,
+               Notification.read_at.is_(None))
+        .values(read_at=datetime.utcnow())
+    )
+    if result.rowcount:
+        _add_unread(user_id, -1)
+        db.session.commit()
+        return True
+    # Already read, or not this user's
+    return db.session.scalar(
+        select(Notification.id).where(Notification.id == notification_id, Notification.user_id == user_id)
+    ) is not None
+
 
 def mark_all_read(user_id):
-    """Mark all notifications as read"""
-    notifications = get_user_notifications(user_id)
-    for notification in notifications:
-        notification.read = True
-    
-    key = f'notifications_{user_id}'
-    session[key] = [n.to_dict() for n in notifications]
+    """Mark all notifications as read; returns how many were unread"""
+    from models import db, Notification
+    result = db.session.execute(
+        update(Notification)
+        .where(Notification.user_id == user_id, Notification.read_at.is_(None))
+        .values(read_at=datetime.utcnow())
+    )
+    # By the rows changed, not to 0, so a notification added meanwhile stays counted
+    if result.rowcount:
+        _add_unread(user_id, -result.rowcount)
+    db.session.commit()
+    return result.rowcount
+
+
+def purge_notifications(retention_days=None, batch_size=DEFAULT_PURGE_BATCH_SIZE, max_batches=None):
+    """
+    Delete notifications older than the retention period, oldest first
+
+    Each batch is its own short transaction: select up to batch_size ids in
+    created_at order, delete those rows by primary key and take the unread
+    ones off their users' counters.
+
+    Returns:
+        dict: deleted (rows), batches, complete (False if max_batches stopped the run)
+    """
+    from models import db, Notification, NotificationCounter
+    if retention_days is None:
+        retention_days = current_app.config['NOTIFICATION_RETENTION_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+
+    stats = {'deleted': 0, 'batches': 0, 'complete': False}
+    while max_batches is None or stats['batches'] < max_batches:
+        ids = db.session.scalars(
+            select(Notification.id)
+            .where(Notification.created_at < cutoff)
+            .order_by(Notification.created_at, Notification.id)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            stats['complete'] = True
+            break
+        # RETURNING reports the read state at deletion, even if a row was read since the select
+        rows = db.session.execute(
+            delete(Notification)
+            .where(Notification.id.in_(ids))
+            .returning(Notification.user_id, Notification.read_at),
+            execution_options={'synchronize_session': False}
+        ).all()
+        unread = Counter(row.user_id for row in rows if row.read_at is None)
+        if unread:
+            counters = NotificationCounter.__table__
+            db.session.execute(
+                update(counters)
+                .where(counters.c.user_id == bindparam('counter_user_id'))
+                .values(unread_count=case((counters.c.unread_count > bindparam('purged'),
+                                           counters.c.unread_count - bindparam('purged')), else_=0)),
+                [{'counter_user_id': user_id, 'purged': count} for user_id, count in unread.items()]
+            )
+        db.session.commit()
+        stats['deleted'] += len(rows)
+        stats['batches'] += 1
+    return stats
+
 
 def create_claim_notification(user_id, claim_number, status):
     """Create notification for claim status update"""
@@ -107,3 +270,21 @@ def create_policy_notification(user_id, policy_number, message):
         action_url='/policies'
     )
 
+
+def init_notifications(app):
+    """Register the notifications-purge CLI command with Flask app"""
+    app.config.setdefault('NOTIFICATION_RETENTION_DAYS', 90)
+
+    @app.cli.command('notifications-purge')
+    @click.option('--retention-days', type=int, default=None,
+                  help='Delete notifications older than this (default NOTIFICATION_RETENTION_DAYS).')
+    @click.option('--batch-size', default=DEFAULT_PURGE_BATCH_SIZE, show_default=True,
+                  help='Notifications deleted per transaction.')
+    @click.option('--max-batches', type=int, default=None,
+                  help='Stop after this many batches; the next run continues.')
+    def notifications_purge_command(retention_days, batch_size, max_batches):
+        """Delete old notifications in batches."""
+        stats = purge_notifications(retention_days=retention_days, batch_size=batch_size,
+                                    max_batches=max_batches)
+        click.echo(f"Deleted {stats['deleted']} notifications in {stats['batches']} batches.")
+        click.echo('Purge complete.' if stats['complete'] else 'Purge incomplete; run again to continue.')
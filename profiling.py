@@ -0,0 +1,228 @@
+"""
+Profiling Module for SwissAxa Portal
+Opt-in sampling profiler for individual production requests
+
+While a selected request runs, a background thread records the request
+thread's stack every PROFILE_INTERVAL seconds. When the response is done the
+samples are written to PROFILE_DIR as collapsed stacks, one
+'frame;frame;frame count' line per distinct stack. flamegraph.pl,
+speedscope and similar tools read this format directly.
+
+A request is profiled when any of these holds:
+    - a random draw falls under PROFILE_SAMPLE_RATE (0.0 - 1.0)
+    - its endpoint is listed in PROFILE_ENDPOINTS, e.g. ['file_claim']
+    - it carries the header X-Profile-Request: <PROFILE_TOKEN>
+
+With PROFILING_ENABLED off (the default) the middleware is not installed at
+all. Unprofiled requests only pay for the selection check. Admins list and
+download profiles under /admin/profiles.
+"""
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import ClosingIterator
+
+PROFILE_HEADER = 'HTTP_X_PROFILE_REQUEST'
+MAX_STACK_DEPTH = 128
+PROFILE_SUFFIX = '.collapsed'
+PROFILE_NAME = re.compile(r'^(?P<created>\d{8}T\d{6})_(?P<duration>\d+)ms_(?P<endpoint>[\w.-]+)_[0-9a-f]{8}\.collapsed$')
+
+
+def _frame_label(code):
+    # Last two path parts are enough to tell modules apart and keep lines short
+    path = '/'.join(code.co_filename.replace('\\', '/').rsplit('/', 2)[-2:])
+    return f'{code.co_name} ({path}:{code.co_firstlineno})'.replace(';', ':')
+
+
+def collapse_stack(frame):
+    """Root-first 'a;b;c' label of a frame's stack"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """One background thread sampling the stacks of the threads being profiled"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = {}  # thread ident -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, ident):
+        counts = Counter()
+        with self._lock:
+            self._active[ident] = counts
+            # Also covers a forked worker, which inherits no running threads
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+            self._wake.set()
+        return counts
+
+    def stop(self, ident):
+        with self._lock:
+            return self._active.pop(ident, None)
+
+    def sample(self):
+        """Take one sample of every profiled thread"""
+        with self._lock:
+            active = list(self._active.items())
+        if not active:
+            return
+        frames = sys._current_frames()
+        for ident, counts in active:
+            frame = frames.get(ident)
+            if frame is not None:
+                counts[collapse_stack(frame)] += 1
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                if not self._active:
+                    self._wake.clear()
+                    continue
+            self.sample()
+            time.sleep(self.interval)
+
+
+def write_profile(directory, counts, endpoint, duration, max_files=None):
+    """Write collapsed stacks, most frequent first; returns the file name"""
+    os.makedirs(directory, exist_ok=True)
+    endpoint = re.sub(r'[^\w.-]', '_', endpoint or 'unmatched')
+    name = f'{datetime.now():%Y%m%dT%H%M%S}_{int(duration * 1000)}ms_{endpoint}_{uuid.uuid4().hex[:8]}{PROFILE_SUFFIX}'
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        for stack, count in counts.most_common():
+            f.write(f'{stack} {count}\n')
+    if max_files:
+        _prune(directory, max_files)
+    return name
+
+
+def _prune(directory, max_files):
+    names = sorted(n for n in os.listdir(directory) if PROFILE_NAME.match(n))
+    for name in names[:max(len(names) - max_files, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def list_profiles(directory):
+    """Newest first, with the request details encoded in the file names"""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        match = PROFILE_NAME.match(name)
+        if not match:
+            continue
+        profiles.append({
+            'name': name,
+            'endpoint': match['endpoint'],
+            'duration_ms': int(match['duration']),
+            'created_at': datetime.strptime(match['created'], '%Y%m%dT%H%M%S').isoformat(),
+            'size': os.path.getsize(os.path.join(directory, name)),
+        })
+    profiles.sort(key=lambda profile: profile['name'], reverse=True)
+    return profiles
+
+
+class ProfilingMiddleware:
+    """WSGI middleware profiling the requests the PROFILE_* settings select"""
+
+    def __init__(self, wsgi_app, app, sampler=None):
+        self.wsgi_app = wsgi_app
+        self.app = app
+        self.sampler = sampler or StackSampler(app.config['PROFILE_INTERVAL'])
+
+    def _endpoint(self, environ):
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+            return endpoint
+        except HTTPException:
+            return None
+
+    def _selected(self, environ):
+        config = self.app.config
+        token = config['PROFILE_TOKEN']
+        # Constant-time; bytes, since compare_digest refuses non-ASCII str
+        if token and hmac.compare_digest(environ.get(PROFILE_HEADER, '').encode(), token.encode()):
+            return True
+        rate = config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            return True
+        endpoints = config['PROFILE_ENDPOINTS']
+        return bool(endpoints) and self._endpoint(environ) in endpoints
+
+    def __call__(self, environ, start_response):
+        if not self._selected(environ):
+            return self.wsgi_app(environ, start_response)
+
+        ident = threading.get_ident()
+        self.sampler.start(ident)
+        started = time.perf_counter()
+
+        def finish():
+            counts = self.sampler.stop(ident)
+            duration = time.perf_counter() - started
+            config = self.app.config
+            if counts and duration * 1000 >= config['PROFILE_MIN_DURATION_MS']:
+                write_profile(config['PROFILE_DIR'], counts, self._endpoint(environ), duration,
+                              max_files=config['PROFILE_MAX_FILES'])
+
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+        except Exception:
+            finish()
+            raise
+        # Streamed bodies are still part of the request
+        return ClosingIterator(app_iter, [finish])
+
+
+def init_profiling(app):
+    """Initialize request profiling and the admin routes with Flask app"""
+    from flask import abort, jsonify, send_from_directory, url_for
+    from admin_auth import admin_required
+
+    app.config.setdefault('PROFILING_ENABLED', False)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILE_ENDPOINTS', [])
+    app.config.setdefault('PROFILE_TOKEN', None)
+    app.config.setdefault('PROFILE_INTERVAL', 0.005)
+    app.config.setdefault('PROFILE_MIN_DURATION_MS', 0)
+    app.config.setdefault('PROFILE_DIR', 'profiles')
+    app.config.setdefault('PROFILE_MAX_FILES', 500)
+
+    if app.config['PROFILING_ENABLED']:
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app, app)
+
+    @app.route('/admin/profiles')
+    @admin_required
+    def list_request_profiles():
+        profiles = list_profiles(app.config['PROFILE_DIR'])
+        for profile in profiles:
+            profile['url'] = url_for('download_request_profile', name=profile['name'])
+        return jsonify(profiles)
+
+    @app.route('/admin/profiles/<name>')
+    @admin_required
+    def download_request_profile(name):
+        if not PROFILE_NAME.match(name):
+            abort(404)
+        return send_from_directory(os.path.abspath(app.config['PROFILE_DIR']), name,
+                                   mimetype='text/plain', as_attachment=True)
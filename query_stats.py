@@ -0,0 +1,220 @@
+"""
+Query Stats Module for SwissAxa Portal
+Per-request SQL query counts, database time and rows, with a slow-request log
+
+Every statement run while a request is handled is counted and timed. The
+totals are returned in a Server-Timing header, so browser dev tools show the
+database share of each response:
+
+    Server-Timing: db;dur=12.4;desc="7 queries, 31 rows", app;dur=25.0
+
+Requests slower than SLOW_REQUEST_MS, or running more than
+SLOW_REQUEST_QUERIES statements, are logged as one JSON line to the
+'swissaxa.slow_requests' logger. The line lists the slowest statements with
+the shape of their parameters (types, never values).
+
+Rows are those reported by the driver. SQLite does not report row counts
+for SELECT, so ORM objects loaded are counted instead.
+"""
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Mapper
+
+slow_request_log = logging.getLogger('swissaxa.slow_requests')
+
+MAX_STATEMENT_LENGTH = 500
+
+
+class QueryStats:
+    """Statements, time and rows of one request, keeping only the slowest statements"""
+
+    def __init__(self, top_n=5):
+        self.top_n = top_n
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.count_loads = False  # Last SELECT had no driver row count
+        self._slowest = []  # min-heap of (duration, seq, statement, shape)
+        self._seq = itertools.count()
+
+    def record(self, statement, parameters, executemany, duration, rowcount):
+        self.queries += 1
+        self.db_time += duration
+        self.count_loads = rowcount < 0
+        if rowcount > 0:
+            self.rows += rowcount
+        if self.top_n:
+            entry = (duration, next(self._seq), statement, parameters, executemany)
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, entry)
+            elif duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self):
+        """Slowest statements first, with parameter shapes"""
+        return [
+            {
+                'duration_ms': round(duration * 1000, 2),
+                'statement': ' '.join(statement.split())[:MAX_STATEMENT_LENGTH],
+                'params': param_shape(parameters, executemany),
+            }
+            for duration, _, statement, parameters, executemany in sorted(self._slowest, reverse=True)
+        ]
+
+    def server_timing(self, total):
+        return (f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries, {self.rows} rows", '
+                f'app;dur={total * 1000:.1f}')
+
+
+def _type_runs(values):
+    """Type names with runs collapsed, e.g. 'int, str x 3'"""
+    runs = []
+    for name, group in itertools.groupby(type(value).__name__ for value in values):
+        length = sum(1 for _ in group)
+        runs.append(name if length == 1 else f'{name} x {length}')
+    return ', '.join(runs)
+
+
+def param_shape(parameters, executemany=False):
+    """Describe bound parameters by type only, so logs never carry user data"""
+    if executemany:
+        parameters = list(parameters or ())
+        return f'{len(parameters)} x {param_shape(parameters[0]) if parameters else "()"}'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return f'({_type_runs(parameters)})'
+    return type(parameters).__name__
+
+
+def current_stats():
+    """Stats of the request being handled, or None outside a request"""
+    return g.get('_query_stats') if has_app_context() else None
+
+
+class QueryCounter:
+    """Count statements run by the current thread, on any engine"""
+
+    def __init__(self):
+        self.statements = []
+        self._thread = threading.get_ident()
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._thread:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@contextmanager
+def assert_max_queries(limit):
+    """
+    Fail if the block runs more than limit statements
+
+        with assert_max_queries(5):
+            client.get('/dashboard')
+
+    The failure lists the statements, so an N+1 loop is easy to spot.
+    """
+    with QueryCounter() as counter:
+        yield counter
+    if counter.count > limit:
+        listing = '\n'.join(f'  {i + 1}. {" ".join(s.split())[:200]}' for i, s in enumerate(counter.statements))
+        raise AssertionError(f'Expected at most {limit} queries, ran {counter.count}:\n{listing}')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is dropped with the statement even when it fails
+    if context is not None:
+        context._query_stats_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_stats_start', None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    stats = current_stats()
+    if stats is not None:
+        stats.record(statement, parameters, executemany, duration, cursor.rowcount)
+
+
+def _on_load(target, context):
+    stats = current_stats()
+    if stats is not None and stats.count_loads:
+        stats.rows += 1
+
+
+_listening = False
+
+
+def _listen():
+    """Engine and mapper events are global; register them once per process"""
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Mapper, 'load', _on_load)
+        _listening = True
+
+
+def init_query_stats(app):
+    """Initialize per-request query stats with Flask app"""
+    app.config.setdefault('QUERY_STATS_ENABLED', True)
+    app.config.setdefault('SERVER_TIMING_HEADER', True)
+    app.config.setdefault('SLOW_REQUEST_MS', 500)
+    app.config.setdefault('SLOW_REQUEST_QUERIES', 50)
+    app.config.setdefault('SLOW_REQUEST_TOP_STATEMENTS', 5)
+    if not app.config['QUERY_STATS_ENABLED']:
+        return
+    _listen()
+
+    @app.before_request
+    def start_query_stats():
+        g._query_stats = QueryStats(top_n=app.config['SLOW_REQUEST_TOP_STATEMENTS'])
+
+    @app.after_request
+    def finish_query_stats(response):
+        stats = g.pop('_query_stats', None)
+        if stats is None:
+            return response
+        total = time.perf_counter() - stats.started
+        if app.config['SERVER_TIMING_HEADER']:
+            response.headers.add('Server-Timing', stats.server_timing(total))
+
+        slow_ms = app.config['SLOW_REQUEST_MS']
+        max_queries = app.config['SLOW_REQUEST_QUERIES']
+        if (slow_ms is not None and total * 1000 >= slow_ms) or \
+                (max_queries is not None and stats.queries > max_queries):
+            slow_request_log.warning(json.dumps({
+                'event': 'slow_request',
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'duration_ms': round(total * 1000, 2),
+                'db_ms': round(stats.db_time * 1000, 2),
+                'queries': stats.queries,
+                'rows': stats.rows,
+                'slowest': stats.slowest(),
+            }))
+        return response
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Benchmark runner for SwissAxa Portal
+
+Serves the portal in-process against a freshly seeded SQLite database and a
+local fake OpenAI server, then loads the hot routes at a fixed concurrency.
+Results (throughput, p50/p95/p99 latency, SQL queries per request) are
+written to a JSON file.
+
+    python run_benchmarks.py                                   # writes benchmarks/latest.json
+    python run_benchmarks.py --output benchmarks/baseline.json # record a baseline
+    python run_benchmarks.py --compare benchmarks/baseline.json
+
+With --compare the run exits with status 1 if any route regressed. Compare
+runs made on the same machine with the same options.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+DEFAULT_OUTPUT = os.path.join('benchmarks', 'latest.json')
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the portal and record a JSON baseline')
+    parser.add_argument('--concurrency', type=int, default=8, help='Parallel clients, one user each')
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per route')
+    parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests per client and route')
+    parser.add_argument('--routes', help='Comma-separated route names (default: all)')
+    parser.add_argument('--users', type=int, default=200, help='Bulk users to seed')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url', help='Benchmark an existing database instead of seeding one')
+    parser.add_argument('--openai-latency', type=float, default=0.0,
+                        help='Seconds the fake OpenAI server waits before answering')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--compare', metavar='BASELINE', help='Flag regressions against a baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed latency increase / throughput drop as a fraction (default 0.2)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='swissaxa-bench-')
+    fresh_database = not args.database_url
+    os.environ.setdefault('APP_CONFIG', 'production')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+
+    # The OpenAI client is created when ai_services is first imported
+    from benchmarks.fake_openai import FakeOpenAIServer
+    fake_openai = FakeOpenAIServer(latency=args.openai_latency).start()
+    os.environ['OPENAI_API_KEY'] = 'benchmark'
+    os.environ['OPENAI_BASE_URL'] = fake_openai.base_url
+
+    from app import create_app
+    from benchmarks.harness import ROUTES, BenchmarkServer, compare, run_benchmarks
+
+    app = create_app({
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        # Background writers would contend with the measured routes
+        'APPOINTMENT_REMINDER_SCHEDULER': False,
+        'EMAIL_DIGEST_SCHEDULER': False,
+        # No outbox sender threads and no real SMTP connections
+        'EMAIL_OUTBOX_WORKERS': 0,
+        'MAIL_SUPPRESS_SEND': True,
+    })
+
+    if fresh_database:
+        from init_sample_data import generate_bulk_data
+        print(f'Seeding {args.users} users...')
+        generate_bulk_data(users=args.users, seed=args.seed, media_size=4096,
+                           reference_date=date.today(), progress=lambda message: None, app=app)
+
+    routes = ROUTES
+    if args.routes:
+        wanted = [name.strip() for name in args.routes.split(',')]
+        unknown = set(wanted) - {route.name for route in ROUTES}
+        if unknown:
+            sys.exit(f'Unknown routes: {", ".join(sorted(unknown))}')
+        routes = [route for route in ROUTES if route.name in wanted]
+
+    server = BenchmarkServer(app).start()
+    print(f'Running {len(routes)} routes, {args.requests} requests each at concurrency {args.concurrency}\n')
+    started = time.perf_counter()
+    try:
+        results = run_benchmarks(server, routes, args.concurrency, args.requests, args.warmup)
+    finally:
+        server.stop()
+        fake_openai.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'users': args.users if fresh_database else None,
+            'duration_s': round(time.perf_counter() - started, 1),
+        },
+        'routes': results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResults written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline['routes'], results, tolerance=args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) against {args.compare}:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print(f'\nNo regressions against {args.compare}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
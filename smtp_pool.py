@@ -0,0 +1,220 @@
+"""
+SMTP Pool Module for SwissAxa Portal
+Reuses SMTP connections across emails and limits the sending rate
+
+Opening an SMTP connection costs a TCP handshake, STARTTLS and a login.
+SmtpConnectionPool keeps open Flask-Mail connections, each used by one
+sender thread at a time, so a batch from the email outbox goes out over the
+connections already open. A connection is closed after
+EMAIL_SMTP_MAX_MESSAGES messages or EMAIL_SMTP_IDLE_SECONDS without use,
+before the server would drop it. If the server drops it anyway, the pool
+opens a new connection and sends the message again, once.
+
+Providers limit how fast they accept mail. EMAIL_RATE_LIMITS maps an SMTP
+host to messages per second (EMAIL_RATE_LIMIT_PER_SECOND for other hosts);
+a token bucket holds sends to that rate. Limits apply per process, so
+divide a provider's limit by the number of processes that send.
+
+Messages with attachments are written to a file first (email_attachments.py)
+and sent from it with send_stream(), a piece at a time.
+"""
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import EMAIL_SMTP_CONNECTIONS
+
+# The connection, not the message, failed; worth one retry on a new connection
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+SERVICE_CLOSING = 421
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, and bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one if needed; returns the seconds waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+
+class _PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+def _is_connection_error(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == SERVICE_CLOSING
+    return isinstance(error, CONNECTION_ERRORS)
+
+
+def sendmail_stream(host, sender, recipients, stream, buffer_size=64 * 1024):
+    """
+    smtplib.SMTP.sendmail() for a message in a binary file with CRLF line endings
+
+    The message is sent in buffer_size pieces as it is read, instead of as one
+    bytes object.
+    """
+    host.ehlo_or_helo_if_needed()
+    code, response = host.mail(sender)
+    if code != 250:
+        host.rset()
+        raise smtplib.SMTPSenderRefused(code, response, sender)
+    refused = {}
+    for recipient in recipients:
+        code, response = host.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+    if len(refused) == len(recipients):
+        host.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    host.putcmd('data')
+    code, response = host.getreply()
+    if code != 354:
+        host.rset()
+        raise smtplib.SMTPDataError(code, response)
+    buffer = []
+    buffered = 0
+    for line in stream:
+        # Dot-stuffing (RFC 5321 section 4.5.2)
+        if line.startswith(b'.'):
+            line = b'.' + line
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= buffer_size:
+            host.send(b''.join(buffer))
+            buffer, buffered = [], 0
+    host.send(b''.join(buffer) + b'.\r\n')
+    code, response = host.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+
+class SmtpConnectionPool:
+    """Open SMTP connections of one Flask-Mail instance, lent to one thread at a time"""
+
+    def __init__(self, mail, max_messages=100, idle_seconds=30, rate_limiter=None):
+        self.mail = mail
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self.rate_limiter = rate_limiter
+        self.opened = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        connection = self.mail.connect()
+        connection.__enter__()
+        self.opened += 1
+        EMAIL_SMTP_CONNECTIONS.inc()
+        return _PooledConnection(connection)
+
+    @staticmethod
+    def _close(pooled):
+        try:
+            pooled.connection.__exit__(None, None, None)
+        except Exception:
+            pass  # Already dropped by the server
+
+    def _checkout(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                pooled = self._idle.pop()
+                if now - pooled.last_used < self.idle_seconds:
+                    return pooled
+                self._close(pooled)
+        return self._open()
+
+    def _checkin(self, pooled):
+        pooled.last_used = time.monotonic()
+        if pooled.sent >= self.max_messages:
+            self._close(pooled)
+            return
+        with self._lock:
+            self._idle.append(pooled)
+
+    @contextmanager
+    def connection(self):
+        """A connection for this thread; it goes back to the pool unless it failed"""
+        pooled = self._checkout()
+        try:
+            yield pooled
+        except Exception:
+            self._close(pooled)
+            raise
+        self._checkin(pooled)
+
+    def send(self, message):
+        """Send one Flask-Mail message over a pooled connection"""
+        self._send(lambda connection: connection.send(message))
+
+    def send_stream(self, sender, recipients, stream):
+        """Send a message written to a seekable binary file, without reading it into memory"""
+        def send(connection):
+            stream.seek(0)
+            # Flask-Mail has no host when sending is suppressed (MAIL_SUPPRESS_SEND)
+            if connection.host is not None:
+                sendmail_stream(connection.host, sender, recipients, stream)
+        self._send(send)
+
+    def _send(self, send):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        for attempt in (1, 2):
+            try:
+                with self.connection() as pooled:
+                    send(pooled.connection)
+                    pooled.sent += 1
+                return
+            except Exception as e:
+                if attempt == 2 or not _is_connection_error(e):
+                    raise
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._close(pooled)
+
+    @property
+    def idle_connections(self):
+        return len(self._idle)
+
+
+def create_smtp_pool(app, mail):
+    """Build the pool for the app's mail server, with its rate limit"""
+    config = app.config
+    limits = config.get('EMAIL_RATE_LIMITS') or {}
+    rate = limits.get(config.get('MAIL_SERVER'), config.get('EMAIL_RATE_LIMIT_PER_SECOND'))
+    return SmtpConnectionPool(
+        mail,
+        max_messages=config.get('EMAIL_SMTP_MAX_MESSAGES', 100),
+        idle_seconds=config.get('EMAIL_SMTP_IDLE_SECONDS', 30),
+        rate_limiter=TokenBucket(rate) if rate else None
+    )
@@ -0,0 +1,446 @@
+"""
+Storage Module for SwissAxa Portal
+Pluggable file storage with a local filesystem and an S3-compatible backend
+"""
+import hashlib
+import hmac
+import os
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import quote, urlencode, urlsplit
+
+import requests
+from flask import current_app
+
+CHUNK_SIZE = 64 * 1024
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_NAMESPACE = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+
+
+# Entry returned by iter_keys; modified is a POSIX timestamp
+StoredObject = namedtuple('StoredObject', ['key', 'size', 'modified'])
+
+
+class StorageError(Exception):
+    """Raised when a storage backend cannot complete an operation"""
+
+
+class ObjectNotFound(StorageError):
+    """Raised when a key does not exist in the storage backend"""
+
+
+def _read_exactly(stream, size):
+    """Read up to size bytes, looping over short reads until EOF"""
+    chunks, remaining = [], size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+class StorageBackend:
+    """Interface implemented by every storage backend. Keys use '/' separators."""
+
+    def put_stream(self, key, stream, content_type=None):
+        """Store the contents of a file-like object; returns the bytes written"""
+        raise NotImplementedError
+
+    def get_stream(self, key, chunk_size=CHUNK_SIZE):
+        """Return an iterator over the object's bytes"""
+        raise NotImplementedError
+
+    def presign(self, key, expires_in=300, filename=None):
+        """Return a time-limited download URL, or None if unsupported"""
+        return None
+
+    def delete(self, key):
+        """Remove an object; missing keys are ignored"""
+        raise NotImplementedError
+
+    def size(self, key):
+        """Return the object size in bytes"""
+        raise NotImplementedError
+
+    def iter_keys(self, prefix='', start_after=None):
+        """Yield StoredObject entries in lexicographic key order after start_after"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        try:
+            self.size(key)
+            return True
+        except ObjectNotFound:
+            return False
+
+
+class LocalStorage(StorageBackend):
+    """Stores objects as files below a root directory"""
+
+    def __init__(self, root, secret_key=None, url_prefix='/storage'):
+        self.root = os.path.abspath(root)
+        self.secret_key = secret_key
+        self.url_prefix = url_prefix
+
+    def path_for(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise ObjectNotFound(key)
+        return path
+
+    def put_stream(self, key, stream, content_type=None, chunk_size=CHUNK_SIZE):
+        path = self.path_for(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write beside the target and rename, so readers never see partial files
+        temp_path = os.path.join(directory, f'.{uuid.uuid4().hex}.part')
+        size = 0
+        try:
+            with open(temp_path, 'wb') as out:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    size += len(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return size
+
+    def get_stream(self, key, chunk_size=CHUNK_SIZE):
+        path = self.path_for(key)
+        try:
+            f = open(path, 'rb')
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            raise ObjectNotFound(key)
+        return self._iter_file(f, chunk_size)
+
+    @staticmethod
+    def _iter_file(f, chunk_size):
+        with f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def delete(self, key):
+        try:
+            os.remove(self.path_for(key))
+        except (FileNotFoundError, ObjectNotFound):
+            pass
+
+    def size(self, key):
+        path = self.path_for(key)
+        if not os.path.isfile(path):
+            raise ObjectNotFound(key)
+        return os.path.getsize(path)
+
+    def iter_keys(self, prefix='', start_after=None):
+        yield from self._walk(self.root, '', prefix, start_after)
+
+    def _walk(self, directory, rel, prefix, start_after):
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        # Sort by the key each entry produces so the walk matches S3 ordering
+        # ('a.txt' sorts before 'a/b.txt')
+        entries.sort(key=lambda e: e.name + ('/' if e.is_dir(follow_symlinks=False) else ''))
+        for entry in entries:
+            key = rel + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                key += '/'
+                # Skip subtrees that lie entirely before the checkpoint or outside the prefix
+                if start_after and key < start_after and not start_after.startswith(key):
+                    continue
+                if not (key.startswith(prefix) or prefix.startswith(key)):
+                    continue
+                yield from self._walk(entry.path, key, prefix, start_after)
+            elif key.startswith(prefix) and (not start_after or key > start_after):
+                stat = entry.stat(follow_symlinks=False)
+                yield StoredObject(key, stat.st_size, stat.st_mtime)
+
+    def _signature(self, key, expires, filename):
+        message = f'{key}\n{expires}\n{filename or ""}'.encode('utf-8')
+        return hmac.new(self.secret_key.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+    def presign(self, key, expires_in=300, filename=None):
+        """Signed URL served by the portal's /storage route"""
+        if not self.secret_key:
+            return None
+        expires = int(time.time()) + expires_in
+        params = {'expires': expires, 'signature': self._signature(key, expires, filename)}
+        if filename:
+            params['filename'] = filename
+        return f'{self.url_prefix}/{quote(key)}?{urlencode(params)}'
+
+    def verify_presigned(self, key, expires, signature, filename=None):
+        """Check a URL produced by presign()"""
+        if not self.secret_key or not signature:
+            return False
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(key, expires, filename), signature)
+
+
+class S3Storage(StorageBackend):
+    """
+    S3-compatible object storage (AWS S3, MinIO, Ceph RGW) over plain HTTP
+
+    Requests are signed with AWS Signature Version 4. Uploads larger than one
+    part use the multipart API, so at most part_size bytes are held in memory.
+    """
+
+    def __init__(self, endpoint_url, bucket, access_key, secret_key, region='us-east-1',
+                 path_style=True, part_size=8 * 1024 * 1024, session=None):
+        split = urlsplit(endpoint_url)
+        self.scheme = split.scheme or 'https'
+        self.netloc = split.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.path_style = path_style
+        self.part_size = max(part_size, S3_MIN_PART_SIZE)
+        self.session = session or requests.Session()
+
+    # -- request signing -------------------------------------------------
+
+    def _host_and_path(self, key):
+        if self.path_style:
+            host, path = self.netloc, f'/{self.bucket}/{key}'
+        else:
+            host, path = f'{self.bucket}.{self.netloc}', f'/{key}'
+        return host, quote(path, safe='/-_.~')
+
+    @staticmethod
+    def _canonical_query(params):
+        return '&'.join(
+            f"{quote(str(k), safe='-_.~')}={quote(str(v), safe='-_.~')}"
+            for k, v in sorted(params.items())
+        )
+
+    def _signing_key(self, date_stamp):
+        key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in (date_stamp, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        return key
+
+    def _signature(self, method, path, query, headers, payload_hash, amz_date):
+        signed_headers = ';'.join(sorted(headers))
+        canonical_headers = ''.join(f'{name}:{headers[name].strip()}\n' for name in sorted(headers))
+        canonical_request = '\n'.join([
+            method, path, self._canonical_query(query),
+            canonical_headers, signed_headers, payload_hash
+        ])
+        scope = f'{amz_date[:8]}/{self.region}/s3/aws4_request'
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+        signature = hmac.new(self._signing_key(amz_date[:8]), string_to_sign.encode('utf-8'),
+                             hashlib.sha256).hexdigest()
+        return signature, scope, signed_headers
+
+    def _request(self, method, key, query=None, data=None, headers=None, stream=False,
+                 expected=(200,)):
+        query = query or {}
+        host, path = self._host_and_path(key)
+        amz_date = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        signed = {'host': host, 'x-amz-content-sha256': UNSIGNED_PAYLOAD, 'x-amz-date': amz_date}
+        signature, scope, signed_headers = self._signature(method, path, query, signed,
+                                                           UNSIGNED_PAYLOAD, amz_date)
+        request_headers = dict(headers or {})
+        request_headers.update({
+            'x-amz-content-sha256': UNSIGNED_PAYLOAD,
+            'x-amz-date': amz_date,
+            'Authorization': (f'AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, '
+                              f'SignedHeaders={signed_headers}, Signature={signature}')
+        })
+        url = f'{self.scheme}://{host}{path}'
+        if query:
+            url += '?' + self._canonical_query(query)
+
+        try:
+            response = self.session.request(method, url, data=data, headers=request_headers,
+                                            stream=stream)
+        except requests.RequestException as e:
+            raise StorageError(f'S3 {method} {key} failed: {e}')
+        if response.status_code == 404:
+            response.close()
+            raise ObjectNotFound(key)
+        if response.status_code not in expected:
+            message = response.text[:200]
+            response.close()
+            raise StorageError(f'S3 {method} {key} failed: {response.status_code} {message}')
+        return response
+
+    # -- storage interface -------------------------------------------------
+
+    def put_stream(self, key, stream, content_type=None):
+        headers = {'Content-Type': content_type} if content_type else {}
+        chunk = _read_exactly(stream, self.part_size)
+        if len(chunk) < self.part_size:
+            self._request('PUT', key, data=chunk, headers=headers)
+            return len(chunk)
+
+        response = self._request('POST', key, query={'uploads': ''}, headers=headers)
+        upload_id = ET.fromstring(response.content).findtext(f'{S3_NAMESPACE}UploadId')
+        parts, total = [], 0
+        try:
+            while chunk:
+                part_number = len(parts) + 1
+                response = self._request('PUT', key, data=chunk,
+                                         query={'partNumber': part_number, 'uploadId': upload_id})
+                parts.append((part_number, response.headers.get('ETag', '')))
+                total += len(chunk)
+                chunk = _read_exactly(stream, self.part_size)
+
+            body = '<CompleteMultipartUpload>' + ''.join(
+                f'<Part><PartNumber>{n}</PartNumber><ETag>{etag}</ETag></Part>' for n, etag in parts
+            ) + '</CompleteMultipartUpload>'
+            self._request('POST', key, query={'uploadId': upload_id}, data=body.encode('utf-8'),
+                          headers={'Content-Type': 'application/xml'})
+        except BaseException:
+            try:
+                self._request('DELETE', key, query={'uploadId': upload_id}, expected=(200, 204))
+            except StorageError:
+                pass
+            raise
+        return total
+
+    def get_stream(self, key, chunk_size=CHUNK_SIZE):
+        response = self._request('GET', key, stream=True)
+        return self._iter_response(response, chunk_size)
+
+    @staticmethod
+    def _iter_response(response, chunk_size):
+        try:
+            for chunk in response.iter_content(chunk_size):
+                if chunk:
+                    yield chunk
+        finally:
+            response.close()
+
+    def delete(self, key):
+        try:
+            self._request('DELETE', key, expected=(200, 204))
+        except ObjectNotFound:
+            pass
+
+    def size(self, key):
+        response = self._request('HEAD', key)
+        return int(response.headers.get('Content-Length', 0))
+
+    def iter_keys(self, prefix='', start_after=None):
+        token = None
+        while True:
+            query = {'list-type': '2', 'prefix': prefix, 'max-keys': '1000'}
+            if token:
+                query['continuation-token'] = token
+            elif start_after:
+                query['start-after'] = start_after
+            root = ET.fromstring(self._request('GET', '', query=query).content)
+            for item in root.iter(f'{S3_NAMESPACE}Contents'):
+                modified = datetime.strptime(item.findtext(f'{S3_NAMESPACE}LastModified')[:19],
+                                             '%Y-%m-%dT%H:%M:%S')
+                yield StoredObject(item.findtext(f'{S3_NAMESPACE}Key'),
+                                   int(item.findtext(f'{S3_NAMESPACE}Size')),
+                                   modified.replace(tzinfo=timezone.utc).timestamp())
+            token = root.findtext(f'{S3_NAMESPACE}NextContinuationToken')
+            if root.findtext(f'{S3_NAMESPACE}IsTruncated') != 'true' or not token:
+                break
+
+    def presign(self, key, expires_in=300, filename=None, now=None):
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        host, path = self._host_and_path(key)
+        query = {
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential': f'{self.access_key}/{amz_date[:8]}/{self.region}/s3/aws4_request',
+            'X-Amz-Date': amz_date,
+            'X-Amz-Expires': str(expires_in),
+            'X-Amz-SignedHeaders': 'host'
+        }
+        if filename:
+            query['response-content-disposition'] = f'attachment; filename="{filename}"'
+        signature, _, _ = self._signature('GET', path, query, {'host': host},
+                                          UNSIGNED_PAYLOAD, amz_date)
+        query['X-Amz-Signature'] = signature
+        return f'{self.scheme}://{host}{path}?{self._canonical_query(query)}'
+
+
+def create_storage(config):
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    backend = config.get('STORAGE_BACKEND', 'local')
+    if backend == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'], secret_key=config.get('SECRET_KEY'))
+    if backend == 's3':
+        return S3Storage(
+            endpoint_url=config['S3_ENDPOINT_URL'],
+            bucket=config['S3_BUCKET'],
+            access_key=config['S3_ACCESS_KEY'],
+            secret_key=config['S3_SECRET_KEY'],
+            region=config.get('S3_REGION', 'us-east-1'),
+            path_style=config.get('S3_PATH_STYLE', True),
+            part_size=config.get('S3_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024)
+        )
+    raise ValueError(f'Unknown storage backend: {backend}')
+
+
+def init_storage(app):
+    """Initialize the storage backend with Flask app"""
+    backend = os.getenv('STORAGE_BACKEND', 'local')
+    app.config.setdefault('STORAGE_BACKEND', backend)
+    app.config.setdefault('S3_ENDPOINT_URL', os.getenv('S3_ENDPOINT_URL', 'http://localhost:9000'))
+    app.config.setdefault('S3_BUCKET', os.getenv('S3_BUCKET', 'swissaxa-portal'))
+    app.config.setdefault('S3_ACCESS_KEY', os.getenv('S3_ACCESS_KEY', ''))
+    app.config.setdefault('S3_SECRET_KEY', os.getenv('S3_SECRET_KEY', ''))
+    app.config.setdefault('S3_REGION', os.getenv('S3_REGION', 'us-east-1'))
+    app.config.setdefault('S3_PATH_STYLE', os.getenv('S3_PATH_STYLE', 'True').lower() == 'true')
+    # Redirect downloads to presigned URLs where the backend serves them itself
+    app.config.setdefault('STORAGE_PRESIGN_DOWNLOADS', app.config['STORAGE_BACKEND'] == 's3')
+    app.config.setdefault('STORAGE_PRESIGN_EXPIRES', 300)
+
+    storage = create_storage(app.config)
+    app.extensions['storage'] = storage
+    return storage
+
+
+def get_storage():
+    """Return the storage backend of the current app"""
+    return current_app.extensions['storage']
+
+
+def unique_key(prefix, filename):
+    """Key for a new upload; the random part keeps same-named files apart"""
+    return f'{prefix}/{uuid.uuid4().hex[:12]}_{filename}'
+
+
+def storage_key(file_path):
+    """
+    Convert a stored file_path into a storage key
+
+    Rows written before the storage layer hold paths that include the upload
+    folder ('uploads/documents/x.pdf'); newer rows already hold keys.
+    """
+    path = (file_path or '').replace('\\', '/')
+    for folder in (current_app.config['UPLOAD_FOLDER'], 'uploads'):
+        prefix = folder.replace('\\', '/').rstrip('/') + '/'
+        if path.startswith(prefix):
+            return path[len(prefix):]
+    return path
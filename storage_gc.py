@@ -0,0 +1,186 @@
+"""
+Storage GC Module for SwissAxa Portal
+Deletes stored files that no database row references, scanning incrementally
+
+The storage tree is walked in key order in batches. After each batch the last
+key is saved in a checkpoint row, so a run that is interrupted or limited with
+max_batches continues where it stopped instead of rescanning from the start.
+Each batch is reconciled with one indexed IN lookup per file table
+(Document, ClaimMedia, ExternalPolicy). Files younger than the grace period are
+kept, because uploads are written before the row that references them is
+committed.
+"""
+import time
+from datetime import datetime
+from itertools import islice
+
+import click
+from flask import current_app
+from sqlalchemy import select, update
+
+from storage import get_storage
+
+CHECKPOINT_NAME = 'storage_gc'
+DEFAULT_BATCH_SIZE = 500
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _path_variants(key, upload_folder):
+    """Every file_path spelling that refers to key, including pre-storage-layer paths"""
+    folder = upload_folder.replace('\\', '/').rstrip('/')
+    variants = {key, f'uploads/{key}', f'{folder}/{key}'}
+    variants.update(v.replace('/', '\\') for v in list(variants))
+    return variants
+
+
+def find_references(keys):
+    """
+    Look up which keys are referenced by file rows
+
+    Returns:
+        dict: key -> list of (model, row id, recorded file_size)
+    """
+    from models import db, Document, ClaimMedia, ExternalPolicy
+    folder = current_app.config['UPLOAD_FOLDER']
+    paths = {}
+    for key in keys:
+        for path in _path_variants(key, folder):
+            paths[path] = key
+
+    references = {}
+    for model in (Document, ClaimMedia, ExternalPolicy):
+        rows = db.session.execute(
+            select(model.id, model.file_path, model.file_size).where(model.file_path.in_(list(paths)))
+        )
+        for row in rows:
+            references.setdefault(paths[row.file_path], []).append((model, row.id, row.file_size))
+    return references
+
+
+def _get_checkpoint():
+    from models import db, StorageScanCheckpoint
+    checkpoint = db.session.get(StorageScanCheckpoint, CHECKPOINT_NAME)
+    if checkpoint is None:
+        checkpoint = StorageScanCheckpoint(name=CHECKPOINT_NAME)
+        db.session.add(checkpoint)
+    return checkpoint
+
+
+def collect_garbage(batch_size=DEFAULT_BATCH_SIZE, max_batches=None, dry_run=False,
+                    grace_seconds=None, now=None):
+    """
+    Scan the next part of the storage tree and delete unreferenced files
+
+    Referenced rows that have no recorded size get it backfilled from the
+    listing. When a run reaches the end of the tree, the pass is complete:
+    the checkpoint is reset and the per-user counters are recounted.
+
+    Args:
+        batch_size: Keys reconciled per database round trip and checkpoint
+        max_batches: Stop after this many batches (None = until the end)
+        dry_run: Report orphans without deleting or advancing the checkpoint
+        grace_seconds: Minimum age of a file before it may be deleted
+        now: Current POSIX time, for tests
+
+    Returns:
+        dict: scanned, orphans, bytes_reclaimed, backfilled and complete
+    """
+    from models import db
+    from storage_usage import recount_usage
+
+    storage = get_storage()
+    if grace_seconds is None:
+        grace_seconds = current_app.config['STORAGE_GC_GRACE_SECONDS']
+    cutoff = (now or time.time()) - grace_seconds
+
+    checkpoint = _get_checkpoint()
+    if checkpoint.last_key is None:
+        checkpoint.pass_started_at = datetime.utcnow()
+        checkpoint.keys_scanned = checkpoint.orphans_deleted = checkpoint.bytes_reclaimed = 0
+
+    stats = {'scanned': 0, 'orphans': 0, 'bytes_reclaimed': 0, 'backfilled': 0, 'complete': False}
+    batches = 0
+    for batch in _batches(storage.iter_keys(start_after=checkpoint.last_key), batch_size):
+        references = find_references([obj.key for obj in batch])
+        orphans = 0
+        reclaimed = 0
+        for obj in batch:
+            rows = references.get(obj.key)
+            if rows:
+                for model, row_id, file_size in rows:
+                    if file_size is None and not dry_run:
+                        db.session.execute(update(model).where(model.id == row_id).values(file_size=obj.size))
+                        stats['backfilled'] += 1
+            elif obj.modified < cutoff:
+                orphans += 1
+                reclaimed += obj.size
+                if not dry_run:
+                    storage.delete(obj.key)
+
+        stats['scanned'] += len(batch)
+        stats['orphans'] += orphans
+        stats['bytes_reclaimed'] += reclaimed
+        if not dry_run:
+            checkpoint.last_key = batch[-1].key
+            checkpoint.keys_scanned = (checkpoint.keys_scanned or 0) + len(batch)
+            checkpoint.orphans_deleted = (checkpoint.orphans_deleted or 0) + orphans
+            checkpoint.bytes_reclaimed = (checkpoint.bytes_reclaimed or 0) + reclaimed
+            db.session.commit()
+
+        batches += 1
+        if max_batches is not None and batches >= max_batches:
+            break
+    else:
+        stats['complete'] = True
+        if not dry_run:
+            checkpoint.last_key = None
+            checkpoint.last_completed_at = datetime.utcnow()
+            recount_usage()
+            db.session.commit()
+
+    if dry_run:
+        db.session.rollback()
+    return stats
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+def init_storage_gc(app):
+    """Register the storage-gc CLI command with Flask app"""
+
+    @app.cli.command('storage-gc')
+    @click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+                  help='Keys reconciled per checkpoint.')
+    @click.option('--max-batches', type=int, default=None,
+                  help='Stop after this many batches; the next run resumes.')
+    @click.option('--dry-run', is_flag=True, help='Report orphans without deleting them.')
+    @click.option('--grace-hours', type=float, default=None,
+                  help='Keep unreferenced files younger than this.')
+    def storage_gc_command(batch_size, max_batches, dry_run, grace_hours):
+        """Delete uploaded files that no database row references."""
+        stats = collect_garbage(
+            batch_size=batch_size,
+            max_batches=max_batches,
+            dry_run=dry_run,
+            grace_seconds=grace_hours * 3600 if grace_hours is not None else None
+        )
+        action = 'Would delete' if dry_run else 'Deleted'
+        click.echo(f"Scanned {stats['scanned']} files. {action} {stats['orphans']} orphans "
+                   f"({_format_bytes(stats['bytes_reclaimed'])}).")
+        if stats['backfilled']:
+            click.echo(f"Recorded sizes for {stats['backfilled']} files.")
+        click.echo('Pass complete.' if stats['complete'] else 'Pass incomplete; run again to continue.')
@@ -0,0 +1,122 @@
+"""
+Storage Usage Module for SwissAxa Portal
+Per-user byte counters kept up to date on upload, and quota lookups
+
+Counters are adjusted in the same transaction that inserts the rows owning the
+files, so reading a user's usage is a primary key lookup instead of a walk over
+their files. The storage GC recounts them from the file rows after each full
+pass to correct any drift.
+"""
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select, update, delete, insert, union_all, func
+from sqlalchemy.dialects import sqlite, postgresql
+
+from upload_validation import QuotaBudget
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def record_usage(user_id, bytes_delta, files_delta=1):
+    """
+    Adjust a user's counters inside the caller's transaction
+
+    Uses an atomic upsert where the database supports it, so concurrent
+    uploads by the same user never lose an increment.
+    """
+    from models import db, StorageUsage
+    now = datetime.utcnow()
+    upsert = _UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if upsert is not None:
+        stmt = upsert(StorageUsage).values(user_id=user_id, bytes_used=bytes_delta,
+                                           file_count=files_delta, updated_at=now)
+        stmt = stmt.on_conflict_do_update(index_elements=[StorageUsage.user_id], set_={
+            'bytes_used': StorageUsage.bytes_used + stmt.excluded.bytes_used,
+            'file_count': StorageUsage.file_count + stmt.excluded.file_count,
+            'updated_at': stmt.excluded.updated_at,
+        })
+        db.session.execute(stmt)
+        return
+
+    result = db.session.execute(
+        update(StorageUsage)
+        .where(StorageUsage.user_id == user_id)
+        .values(bytes_used=StorageUsage.bytes_used + bytes_delta,
+                file_count=StorageUsage.file_count + files_delta,
+                updated_at=now)
+    )
+    if result.rowcount == 0:
+        db.session.add(StorageUsage(user_id=user_id, bytes_used=bytes_delta,
+                                    file_count=files_delta, updated_at=now))
+
+
+def get_usage(user_id):
+    """
+    Return a user's storage usage
+
+    Returns:
+        dict: bytes_used, file_count, quota_bytes (None if unlimited) and
+        remaining_bytes (None if unlimited)
+    """
+    from models import db, StorageUsage
+    usage = db.session.get(StorageUsage, user_id)
+    bytes_used = usage.bytes_used if usage else 0
+    quota = current_app.config.get('STORAGE_QUOTA_BYTES')
+    return {
+        'bytes_used': bytes_used,
+        'file_count': usage.file_count if usage else 0,
+        'quota_bytes': quota,
+        'remaining_bytes': max(quota - bytes_used, 0) if quota else None,
+    }
+
+
+def quota_budget(user_id):
+    """Budget for one upload request, or None when quotas are disabled"""
+    if not current_app.config.get('STORAGE_QUOTA_BYTES'):
+        return None
+    return QuotaBudget(get_usage(user_id)['remaining_bytes'])
+
+
+def recount_usage():
+    """
+    Rebuild all counters from the file rows in set-based statements
+
+    Counters are overwritten in place with an upsert rather than deleted and
+    reinserted, so a record_usage() running meanwhile never finds its row
+    missing and loses its increment. Rows without a recorded size count as
+    files but add no bytes; the GC backfills their sizes while scanning.
+    """
+    from models import db, StorageUsage, Document, Claim, ClaimMedia, ExternalPolicy
+    files = union_all(
+        select(Document.user_id.label('user_id'), Document.file_size.label('file_size')),
+        select(Claim.user_id, ClaimMedia.file_size).join(Claim, Claim.id == ClaimMedia.claim_id),
+        select(ExternalPolicy.user_id, ExternalPolicy.file_size).where(ExternalPolicy.file_path.isnot(None)),
+    ).subquery()
+    # The WHERE keeps SQLite from reading ON CONFLICT as a join constraint
+    totals = select(
+        files.c.user_id,
+        func.coalesce(func.sum(files.c.file_size), 0),
+        func.count(),
+        func.current_timestamp(),
+    ).where(files.c.user_id.isnot(None)).group_by(files.c.user_id)
+    columns = ['user_id', 'bytes_used', 'file_count', 'updated_at']
+
+    upsert = _UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if upsert is None:
+        db.session.execute(delete(StorageUsage))
+        db.session.execute(insert(StorageUsage).from_select(columns, totals))
+        return
+
+    stmt = upsert(StorageUsage).from_select(columns, totals)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=[StorageUsage.user_id], set_={
+        'bytes_used': stmt.excluded.bytes_used,
+        'file_count': stmt.excluded.file_count,
+        'updated_at': stmt.excluded.updated_at,
+    }))
+    # Users whose files are all gone
+    db.session.execute(
+        update(StorageUsage)
+        .where(StorageUsage.user_id.notin_(select(files.c.user_id).where(files.c.user_id.isnot(None))))
+        .values(bytes_used=0, file_count=0, updated_at=func.current_timestamp())
+    )
@@ -12,36 +12,65 @@ from flask import Flask
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app, db, User, Agent, SwissAxaPolicy, ExternalPolicy, Document, Claim, ClaimMedia, PolicyChangeRequest, Appointment, BankAccount
+# The database is chosen from the environment when config is imported, so
+# the test database has to be set before that
+TEST_DB_DIR = tempfile.mkdtemp()
+os.environ['APP_CONFIG'] = 'testing'
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(TEST_DB_DIR, 'test.db')}")
+
+from app import create_app
+from tests.fake_smtp import FakeSmtpServer
+from models import db, User, Agent, SwissAxaPolicy, ExternalPolicy, Document, Claim, ClaimMedia, PolicyChangeRequest, Appointment, BankAccount
 
 
 @pytest.fixture(scope='function')
 def test_app():
-    """Create a test Flask application with test database"""
-    # Create temporary database
-    db_fd, db_path = tempfile.mkstemp(suffix='.db')
-    
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
-    app.config['SECRET_KEY'] = 'test-secret-key'
-    app.config['WTF_CSRF_ENABLED'] = False
-    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    """Create a new test Flask application with a fresh schema"""
+    upload_folder = tempfile.mkdtemp()
     
     # Create upload directories
-    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'documents'), exist_ok=True)
-    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'policies'), exist_ok=True)
-    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'claims'), exist_ok=True)
+    os.makedirs(os.path.join(upload_folder, 'documents'), exist_ok=True)
+    os.makedirs(os.path.join(upload_folder, 'policies'), exist_ok=True)
+    os.makedirs(os.path.join(upload_folder, 'claims'), exist_ok=True)
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test-secret-key',
+        'WTF_CSRF_ENABLED': False,
+        'UPLOAD_FOLDER': upload_folder,
+    })
     
     with app.app_context():
         db.create_all()
         yield app
         db.session.remove()
         db.drop_all()
+        for engine in db.engines.values():
+            engine.dispose()
     
     # Cleanup
-    os.close(db_fd)
-    os.unlink(db_path)
-    shutil.rmtree(app.config['UPLOAD_FOLDER'])
+    shutil.rmtree(upload_folder)
+
+
+@pytest.fixture(scope='function')
+def smtp_server(test_app):
+    """A local SMTP server the test app really sends to"""
+    server = FakeSmtpServer().start()
+    test_app.config.update({
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': server.port,
+        'MAIL_USE_TLS': False,
+        'MAIL_USE_SSL': False,
+        'MAIL_USERNAME': '',
+        'MAIL_PASSWORD': '',
+        'MAIL_SUPPRESS_SEND': False,
+    })
+    # Flask-Mail reads the settings when it is initialized for the app
+    test_app.extensions.pop('mail', None)
+    yield server
+    pool = test_app.extensions.get('smtp_pool')
+    if pool is not None:
+        pool.close()
+    server.stop()
 
 
 @pytest.fixture(scope='function')
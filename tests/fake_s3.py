@@ -0,0 +1,129 @@
+"""
+Minimal in-memory S3-compatible server, used as a local MinIO stand-in in tests
+"""
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+S3_XMLNS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class FakeS3Server:
+    """Serves path-style bucket/key requests from a dict"""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.requests = []
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.endpoint_url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _parse(self):
+                split = urlsplit(self.path)
+                bucket, _, key = unquote(split.path).lstrip('/').partition('/')
+                query = {k: v[0] for k, v in parse_qs(split.query, keep_blank_values=True).items()}
+                server.requests.append((self.command, key, query))
+                authorized = 'Authorization' in self.headers or 'X-Amz-Signature' in query
+                return bucket, key, query, authorized
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _send(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def do_PUT(self):
+                bucket, key, query, authorized = self._parse()
+                body = self._body()
+                if not authorized:
+                    return self._send(403)
+                if 'uploadId' in query:
+                    server.uploads[query['uploadId']][int(query['partNumber'])] = body
+                    return self._send(200, headers={'ETag': f'"{uuid.uuid4().hex}"'})
+                server.objects[(bucket, key)] = body
+                self._send(200, headers={'ETag': f'"{uuid.uuid4().hex}"'})
+
+            def do_POST(self):
+                bucket, key, query, authorized = self._parse()
+                body = self._body()
+                if not authorized:
+                    return self._send(403)
+                if 'uploads' in query:
+                    upload_id = uuid.uuid4().hex
+                    server.uploads[upload_id] = {}
+                    xml = (f'<InitiateMultipartUploadResult xmlns="{S3_XMLNS}">'
+                           f'<Bucket>{bucket}</Bucket><Key>{key}</Key>'
+                           f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>')
+                    return self._send(200, xml.encode())
+                parts = server.uploads.pop(query['uploadId'])
+                numbers = [int(p.findtext('PartNumber')) for p in ET.fromstring(body).iter('Part')]
+                server.objects[(bucket, key)] = b''.join(parts[n] for n in numbers)
+                self._send(200, f'<CompleteMultipartUploadResult xmlns="{S3_XMLNS}"/>'.encode())
+
+            def do_GET(self):
+                bucket, key, query, authorized = self._parse()
+                if not authorized:
+                    return self._send(403)
+                if not key and query.get('list-type') == '2':
+                    return self._send(200, self._list(bucket, query))
+                if (bucket, key) not in server.objects:
+                    return self._send(404, b'<Error><Code>NoSuchKey</Code></Error>')
+                self._send(200, server.objects[(bucket, key)])
+
+            def _list(self, bucket, query):
+                keys = sorted(k for b, k in server.objects if b == bucket
+                              and k.startswith(query.get('prefix', ''))
+                              and k > query.get('continuation-token', query.get('start-after', '')))
+                limit = int(query.get('max-keys', 1000))
+                page, truncated = keys[:limit], len(keys) > limit
+                contents = ''.join(
+                    f'<Contents><Key>{k}</Key><Size>{len(server.objects[(bucket, k)])}</Size>'
+                    f'<LastModified>2024-01-01T00:00:00.000Z</LastModified></Contents>'
+                    for k in page
+                )
+                token = f'<NextContinuationToken>{page[-1]}</NextContinuationToken>' if truncated else ''
+                return (f'<ListBucketResult xmlns="{S3_XMLNS}"><IsTruncated>{str(truncated).lower()}'
+                        f'</IsTruncated>{token}{contents}</ListBucketResult>').encode()
+
+            def do_HEAD(self):
+                bucket, key, query, authorized = self._parse()
+                if (bucket, key) not in server.objects:
+                    return self._send(404)
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(server.objects[(bucket, key)])))
+                self.end_headers()
+
+            def do_DELETE(self):
+                bucket, key, query, authorized = self._parse()
+                if 'uploadId' in query:
+                    server.uploads.pop(query['uploadId'], None)
+                else:
+                    server.objects.pop((bucket, key), None)
+                self._send(204)
+
+        return Handler
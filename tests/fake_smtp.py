@@ -0,0 +1,88 @@
+"""
+Minimal SMTP server that keeps messages in memory, used as a local mail server in tests
+"""
+import socketserver
+import threading
+
+
+class FakeSmtpServer:
+    """
+    Accepts mail from anyone over plain SMTP
+
+    `connections` counts TCP connections and `messages` holds
+    (sender, recipients, data) tuples. Set `drop_after` to close every
+    connection after that many messages, like a server enforcing a limit.
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.messages = []
+        self.drop_after = None
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f'{line}\r\n'.encode())
+
+            def handle(self):
+                with server._lock:
+                    server.connections += 1
+                sent = 0
+                sender, recipients = None, []
+                self.reply('220 localhost fake SMTP')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode().strip()
+                    verb = command[:4].upper()
+                    if verb == 'EHLO':
+                        self.reply('250-localhost')
+                        self.reply('250 8BITMIME')
+                    elif verb == 'HELO':
+                        self.reply('250 localhost')
+                    elif verb == 'MAIL':
+                        sender, recipients = command.split(':', 1)[1].strip(' <>'), []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        recipients.append(command.split(':', 1)[1].strip(' <>'))
+                        self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        data = []
+                        for data_line in self.rfile:
+                            if data_line in (b'.\r\n', b'.\n'):
+                                break
+                            if data_line.startswith(b'..'):
+                                data_line = data_line[1:]
+                            data.append(data_line)
+                        with server._lock:
+                            server.messages.append((sender, recipients, b''.join(data)))
+                        sent += 1
+                        self.reply('250 OK queued')
+                        if server.drop_after and sent >= server.drop_after:
+                            return
+                    elif verb in ('RSET', 'NOOP'):
+                        self.reply('250 OK')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('502 Command not implemented')
+
+        return Handler
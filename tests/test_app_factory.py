@@ -0,0 +1,83 @@
+"""
+Unit tests for the app factory and lazily imported optional modules
+"""
+import sys
+from app import create_app
+from benchmarks.startup import measure_cold_start
+from metrics import DB_POOL_SIZE, QUEUE_DEPTH
+from models import db, User
+
+
+class TestCreateApp:
+    """Tests for create_app"""
+
+    def test_apps_are_independent(self, test_app):
+        """Test that each app gets its own config and extensions"""
+        other = create_app({'USER_CACHE_BACKEND': 'none', 'METRICS_TOKEN': 'other'})
+        assert other is not test_app
+        assert other.extensions['user_cache'] is None
+        assert test_app.extensions['user_cache'] is not None
+        assert other.extensions['id_generator'] is not test_app.extensions['id_generator']
+        assert test_app.config['METRICS_TOKEN'] is None
+        assert 'login' in other.view_functions and 'get_claims' not in other.view_functions
+        assert 'mobile_api.get_claims' in other.view_functions
+
+    def test_upload_folders_follow_config(self, tmp_path, monkeypatch):
+        """Test that upload directories are made in UPLOAD_FOLDER, not the working directory"""
+        monkeypatch.chdir(tmp_path)
+        create_app({'UPLOAD_FOLDER': str(tmp_path / 'files')})
+        assert sorted(p.name for p in (tmp_path / 'files').iterdir()) == ['claims', 'documents', 'policies']
+        assert not (tmp_path / 'uploads').exists()
+
+    def test_shared_hooks_not_added_twice(self, test_app):
+        """Test that building more apps does not stack metric sources"""
+        pool_sources = len(DB_POOL_SIZE._callbacks)
+        queue_sources = len(QUEUE_DEPTH._callbacks)
+        create_app()
+        create_app()
+        assert len(DB_POOL_SIZE._callbacks) == pool_sources
+        assert len(QUEUE_DEPTH._callbacks) == queue_sources
+
+    def test_cache_invalidated_in_the_app_that_wrote(self, test_app, test_user):
+        """Test that the shared session listeners use the current app's user cache"""
+        from user_cache import load_user_cached
+        cache = test_app.extensions['user_cache']
+        with test_app.app_context():
+            load_user_cached(test_user['id'])
+            user = db.session.get(User, test_user['id'])
+            user.phone = '+49 30 000000'
+            db.session.commit()
+        assert cache.invalidations >= 1
+
+
+class TestLazyModules:
+    """Tests for optional subsystems loading on first use"""
+
+    def test_cold_start_skips_optional_modules(self):
+        """Test that booting the app imports none of the heavy optional modules"""
+        result = measure_cold_start(runs=1)
+        assert result['loaded'] == []
+        assert result['total_ms'] > 0
+
+    def test_language_switch_initializes_babel(self, test_app, authenticated_client):
+        """Test that Flask-Babel is set up by the first request that needs it"""
+        assert 'babel' not in test_app.extensions
+        response = authenticated_client.post('/api/language/de')
+        assert response.status_code == 200
+        assert 'babel' in test_app.extensions
+        assert authenticated_client.post('/api/language/xx').status_code == 400
+
+    def test_email_set_up_on_first_send(self, test_app):
+        """Test that Flask-Mail is initialized for the app on the first email"""
+        import email_service
+        with test_app.app_context():
+            assert email_service.send_email('someone@example.com', 'Subject', 'Body') is True
+        assert 'mail' in test_app.extensions
+        assert 'flask_mail' in sys.modules
+
+    def test_ai_fallback_when_unconfigured(self, authenticated_client):
+        """Test that AI views answer without an OpenAI key"""
+        response = authenticated_client.post('/api/document-tag', json={'filename': 'invoice.pdf'})
+        assert response.status_code == 200
+        assert response.get_json()['document_type']
+        assert 'ai_services' in sys.modules
@@ -0,0 +1,126 @@
+"""
+Unit tests for the appointment reminder scheduler
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect
+
+from appointment_reminders import reminder_windows, send_due_reminders
+from models import db, Appointment, AppointmentReminder, EmailOutbox, Notification, User
+
+NOW = datetime(2026, 11, 2, 8, 0)
+
+
+def book(user_id, starts_in, booked_ago=timedelta(days=7), agent_id=None, status='scheduled'):
+    """Add an appointment starting the given time after NOW"""
+    appointment = Appointment(user_id=user_id, agent_id=agent_id, appointment_type='agent',
+                              date_time=NOW + starts_in, purpose='Review', status=status,
+                              created_at=NOW - booked_ago)
+    db.session.add(appointment)
+    db.session.commit()
+    return appointment.id
+
+
+class TestReminders:
+    """Tests for which reminders are sent"""
+
+    def test_reminders_at_each_offset(self, test_app, test_user, test_agent):
+        """Test that the 24 hour and 1 hour reminders are sent by notification and email"""
+        with test_app.app_context():
+            book(test_user['id'], timedelta(hours=20), agent_id=test_agent['id'])
+            assert send_due_reminders(now=NOW) == {60: 0, 1440: 1}
+            [message] = EmailOutbox.query.all()
+            assert message.subject == 'Appointment Reminder - SwissAxa'
+            assert 'your appointment with Test Agent on:' in message.body
+            [notification] = Notification.query.all()
+            assert notification.title == 'Appointment Reminder'
+
+            assert send_due_reminders(now=NOW + timedelta(hours=19, minutes=30)) == {60: 1, 1440: 0}
+            assert EmailOutbox.query.count() == 2
+
+    def test_only_nearest_reminder_after_downtime(self, test_app, test_user):
+        """Test that an appointment within the hour gets the 1 hour reminder only"""
+        with test_app.app_context():
+            appointment_id = book(test_user['id'], timedelta(minutes=30))
+            assert send_due_reminders(now=NOW) == {60: 1, 1440: 0}
+            offsets = db.session.scalars(db.select(AppointmentReminder.offset_minutes)
+                                         .where(AppointmentReminder.appointment_id == appointment_id)).all()
+            assert offsets == [60]
+
+    def test_late_booking_skips_earlier_reminder(self, test_app, test_user):
+        """Test that an appointment booked for later today gets no 24 hour reminder"""
+        with test_app.app_context():
+            book(test_user['id'], timedelta(hours=3), booked_ago=timedelta(minutes=5))
+            assert send_due_reminders(now=NOW) == {60: 0, 1440: 0}
+            [reminder] = AppointmentReminder.query.all()
+            assert (reminder.offset_minutes, reminder.sent_at) == (1440, None)
+            assert send_due_reminders(now=NOW + timedelta(hours=2, minutes=30)) == {60: 1, 1440: 0}
+
+    def test_cancelled_and_past_ignored(self, test_app, test_user):
+        """Test that only upcoming scheduled appointments are reminded"""
+        with test_app.app_context():
+            book(test_user['id'], timedelta(hours=2), status='cancelled')
+            book(test_user['id'], -timedelta(hours=1))
+            assert send_due_reminders(now=NOW) == {60: 0, 1440: 0}
+            assert EmailOutbox.query.count() == 0
+
+    def test_user_language(self, test_app, test_user):
+        """Test that the reminder email uses the customer's language"""
+        with test_app.app_context():
+            db.session.get(User, test_user['id']).language = 'de'
+            book(test_user['id'], timedelta(hours=20))
+            send_due_reminders(now=NOW)
+            [message] = EmailOutbox.query.all()
+        assert message.subject == 'Terminerinnerung - SwissAxa'
+
+
+class TestIdempotency:
+    """Tests for running the scheduler again or in several instances"""
+
+    def test_rerun_sends_nothing(self, test_app, test_user):
+        """Test that a second scan, e.g. after a restart, does not repeat reminders"""
+        with test_app.app_context():
+            for hours in (2, 5, 20):
+                book(test_user['id'], timedelta(hours=hours))
+            assert send_due_reminders(now=NOW) == {60: 0, 1440: 3}
+            assert send_due_reminders(now=NOW + timedelta(minutes=1)) == {60: 0, 1440: 0}
+            assert EmailOutbox.query.count() == 3
+
+    def test_reminder_recorded_by_another_instance(self, test_app, test_user):
+        """Test that a reminder recorded between the scan and the insert is not sent again"""
+        with test_app.app_context():
+            appointment_id = book(test_user['id'], timedelta(hours=20))
+            db.session.add(AppointmentReminder(appointment_id=appointment_id, offset_minutes=1440, sent_at=NOW))
+            db.session.commit()
+            assert send_due_reminders(now=NOW) == {60: 0, 1440: 0}
+            assert EmailOutbox.query.count() == 0
+
+    def test_batches(self, test_app, test_user):
+        """Test that appointments beyond one batch are all reminded once"""
+        with test_app.app_context():
+            for minutes in range(7):
+                book(test_user['id'], timedelta(hours=10, minutes=minutes))
+            assert send_due_reminders(now=NOW, batch_size=3) == {60: 0, 1440: 7}
+            assert AppointmentReminder.query.count() == 7
+
+    def test_windows_do_not_overlap(self):
+        """Test that each appointment time falls into one offset's window"""
+        windows = reminder_windows([60, 1440, 60], NOW)
+        assert windows == [(60, NOW, NOW + timedelta(hours=1)),
+                           (1440, NOW + timedelta(hours=1), NOW + timedelta(hours=24))]
+
+    def test_status_date_time_index(self, test_app):
+        """Test that the scan has its index"""
+        with test_app.app_context():
+            indexes = {index['name']: index['column_names'] for index in inspect(db.engine).get_indexes('appointment')}
+        assert indexes['ix_appointment_status_date_time'] == ['status', 'date_time']
+
+    def test_cli(self, test_app, test_user):
+        """Test flask appointment-reminders"""
+        with test_app.app_context():
+            now = datetime.utcnow()
+            db.session.add(Appointment(user_id=test_user['id'], date_time=now + timedelta(minutes=30),
+                                       created_at=now - timedelta(days=1)))
+            db.session.commit()
+        result = test_app.test_cli_runner().invoke(args=['appointment-reminders'])
+        assert 'Sent 1 reminders 60 minutes ahead, 0 reminders 1440 minutes ahead.' in result.output
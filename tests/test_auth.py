@@ -2,7 +2,7 @@
 Unit tests for authentication routes
 """
 import pytest
-from app import db, User
+from models import db, User
 
 
 class TestLogin:
@@ -0,0 +1,176 @@
+"""
+Unit tests for agent availability and conflict-free booking
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from availability import AgentSchedule, SlotUnavailable, book_appointment, suggest_slots
+from models import db, Appointment
+
+HOURS = [(weekday, '09:00', '12:00') for weekday in range(5)]
+HALF_HOUR = timedelta(minutes=30)
+
+
+def next_monday(hour, minute=0):
+    """A Monday at least a week ahead, at the given time"""
+    day = (datetime.utcnow() + timedelta(days=7)).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return day + timedelta(days=(7 - day.weekday()) % 7)
+
+
+class TestAgentSchedule:
+    """Tests for the in-memory schedule of one agent"""
+
+    def test_free_slots_skip_booked_and_closed_times(self):
+        """Test that free slots follow working hours and leave out booked appointments"""
+        monday = next_monday(9)
+        schedule = AgentSchedule(HOURS, [monday, monday + HALF_HOUR * 2], HALF_HOUR)
+        slots = schedule.free_slots(monday - timedelta(hours=1), 5, monday + timedelta(days=30))
+        assert slots == [monday + HALF_HOUR, monday + HALF_HOUR * 3, monday + HALF_HOUR * 4,
+                         monday + HALF_HOUR * 5, monday + timedelta(days=1)]
+
+    def test_weekend_skipped(self):
+        """Test that days without working hours have no slots"""
+        saturday = next_monday(12) - timedelta(days=2)
+        schedule = AgentSchedule(HOURS, [], HALF_HOUR)
+        assert schedule.free_slots(saturday, 1, saturday + timedelta(days=30)) == [next_monday(9)]
+
+    def test_overlap_found_by_bisect(self):
+        """Test that an appointment starting inside another one is taken"""
+        monday = next_monday(10)
+        schedule = AgentSchedule(HOURS, [monday], HALF_HOUR)
+        assert not schedule.is_free(monday)
+        assert not schedule.is_free(monday + timedelta(minutes=15))
+        assert not schedule.is_free(monday - timedelta(minutes=15))
+        assert schedule.is_free(monday + HALF_HOUR)
+        assert schedule.is_free(monday - HALF_HOUR)
+
+    def test_working_slot_grid(self):
+        """Test that slots start on the grid and end within working hours"""
+        schedule = AgentSchedule(HOURS, [], HALF_HOUR)
+        assert schedule.is_working_slot(next_monday(11, 30))
+        assert not schedule.is_working_slot(next_monday(10, 15))
+        assert not schedule.is_working_slot(next_monday(12))
+        assert not schedule.is_working_slot(next_monday(8, 30))
+
+
+class TestBooking:
+    """Tests for booking with a transactional conflict check"""
+
+    def test_double_booking_rejected_with_suggestions(self, test_app, test_user, test_agent):
+        """Test that a taken slot is refused and the next free slots are offered"""
+        monday = next_monday(10)
+        with test_app.app_context():
+            book_appointment(test_user['id'], test_agent['id'], 'agent', monday, 'Review')
+            with pytest.raises(SlotUnavailable) as excinfo:
+                book_appointment(test_user['id'], test_agent['id'], 'agent', monday, 'Review')
+            assert excinfo.value.suggestions[0] == monday + HALF_HOUR
+            assert monday not in excinfo.value.suggestions
+            assert Appointment.query.count() == 1
+
+    def test_booking_by_another_process_detected(self, test_app, test_user, test_agent):
+        """Test that the database check catches bookings the cached schedule missed"""
+        monday = next_monday(10)
+        with test_app.app_context():
+            assert monday in suggest_slots(test_agent['id'], after=monday - HALF_HOUR)
+            db.session.add(Appointment(user_id=test_user['id'], agent_id=test_agent['id'],
+                                       appointment_type='agent', date_time=monday, purpose='Review'))
+            db.session.commit()
+            with pytest.raises(SlotUnavailable) as excinfo:
+                book_appointment(test_user['id'], test_agent['id'], 'agent', monday, 'Review')
+            assert monday not in excinfo.value.suggestions
+
+    def test_closed_and_past_times_rejected(self, test_app, test_user, test_agent):
+        """Test that times outside working hours or in the past cannot be booked"""
+        with test_app.app_context():
+            for date_time in (next_monday(20), next_monday(10, 10), datetime.utcnow() - timedelta(days=1)):
+                with pytest.raises(SlotUnavailable):
+                    book_appointment(test_user['id'], test_agent['id'], 'agent', date_time, 'Review')
+            assert Appointment.query.count() == 0
+
+    def test_service_desk_takes_parallel_appointments(self, test_app, test_user):
+        """Test that service desk bookings are not limited to one per slot"""
+        monday = next_monday(10)
+        with test_app.app_context():
+            book_appointment(test_user['id'], None, 'service_desk', monday, 'Question')
+            book_appointment(test_user['id'], None, 'service_desk', monday, 'Question')
+            assert Appointment.query.count() == 2
+
+    def test_service_desk_hours_enforced(self, test_app, test_user):
+        """Test that the service desk refuses past times and times outside SERVICE_DESK_HOURS"""
+        with test_app.app_context():
+            for date_time in (next_monday(19), next_monday(10, 10), next_monday(10) - timedelta(days=2),
+                              datetime.utcnow() - timedelta(days=1)):
+                with pytest.raises(SlotUnavailable) as excinfo:
+                    book_appointment(test_user['id'], None, 'service_desk', date_time, 'Question')
+                assert str(excinfo.value) == 'The service desk does not take appointments at this time.'
+                assert excinfo.value.suggestions
+            assert Appointment.query.count() == 0
+
+    def test_agent_hours_command(self, test_app, test_user, test_agent):
+        """Test that hours set from the CLI replace the default working hours"""
+        result = test_app.test_cli_runner().invoke(
+            args=['agent-hours', str(test_agent['id']), '0', '14:00-16:00'])
+        assert 'works 1 periods a week' in result.output
+        with test_app.app_context():
+            assert suggest_slots(test_agent['id'], after=next_monday(8), limit=2) == [next_monday(14),
+                                                                                     next_monday(14, 30)]
+            with pytest.raises(SlotUnavailable):
+                book_appointment(test_user['id'], test_agent['id'], 'agent', next_monday(10), 'Review')
+
+
+class TestSchedulingViews:
+    """Tests for the scheduling page and suggestions API"""
+
+    def test_taken_slot_flashes_free_times(self, test_app, authenticated_client, test_user, test_agent):
+        """Test that booking a taken slot shows the next free times instead"""
+        monday = next_monday(10)
+        with test_app.app_context():
+            book_appointment(test_user['id'], test_agent['id'], 'agent', monday, 'Review')
+        response = authenticated_client.post('/services/scheduling', data={
+            'agent_id': str(test_agent['id']), 'appointment_type': 'agent',
+            'date_time': monday.strftime('%Y-%m-%dT%H:%M'), 'purpose': 'Review'
+        }, follow_redirects=True)
+        assert b'This time is already booked.' in response.data
+        assert (monday + HALF_HOUR).strftime('%Y-%m-%d %H:%M').encode() in response.data
+        with test_app.app_context():
+            assert Appointment.query.count() == 1
+
+    def test_suggestions_without_ai(self, test_app, authenticated_client, test_agent, monkeypatch):
+        """Test that suggestions come from the schedule without calling the model"""
+        import views
+
+        def fail(*args, **kwargs):
+            raise AssertionError('AI called')
+        monkeypatch.setattr(views.AIService, 'suggest_appointment_times', fail)
+        response = authenticated_client.post('/api/appointment-suggestions',
+                                             json={'appointment_type': 'agent', 'agent_id': test_agent['id']})
+        suggestions = [datetime.strptime(s, '%Y-%m-%d %H:%M') for s in response.get_json()['suggestions']]
+        assert len(suggestions) == 5
+        assert all(s > datetime.utcnow() and s.weekday() < 5 and 9 <= s.hour < 17 for s in suggestions)
+
+    def test_suggestions_bad_agent(self, authenticated_client, test_agent):
+        """Test that a malformed agent id is a 400 and an unknown agent a 404"""
+        response = authenticated_client.post('/api/appointment-suggestions', json={'agent_id': 'abc'})
+        assert response.status_code == 400
+        response = authenticated_client.post('/api/appointment-suggestions', json={'agent_id': test_agent['id'] + 1})
+        assert response.status_code == 404
+
+    def test_ai_suggestions_limited_to_free_slots(self, test_app, authenticated_client, test_user, test_agent,
+                                                  monkeypatch):
+        """Test that model suggestions are only kept when the agent is free then"""
+        import views
+        free, taken = next_monday(11), next_monday(10)
+        with test_app.app_context():
+            book_appointment(test_user['id'], test_agent['id'], 'agent', taken, 'Review')
+        test_app.config['APPOINTMENT_AI_SUGGESTIONS'] = True
+        monkeypatch.setattr(views.AIService, 'suggest_appointment_times', staticmethod(
+            lambda user_id, appointment_type: [taken.strftime('%Y-%m-%d %H:%M'), 'tomorrow',
+                                               next_monday(22).strftime('%Y-%m-%d %H:%M'),
+                                               free.strftime('%Y-%m-%d %H:%M')]))
+        response = authenticated_client.post('/api/appointment-suggestions',
+                                             json={'appointment_type': 'agent', 'agent_id': test_agent['id']})
+        suggestions = response.get_json()['suggestions']
+        assert suggestions[0] == free.strftime('%Y-%m-%d %H:%M')
+        assert taken.strftime('%Y-%m-%d %H:%M') not in suggestions
+        assert len(suggestions) == 5
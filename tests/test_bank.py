@@ -2,7 +2,7 @@
 Unit tests for bank-related routes
 """
 import pytest
-from app import db, BankAccount
+from models import db, BankAccount
 
 
 class TestBankPage:
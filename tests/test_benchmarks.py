@@ -0,0 +1,104 @@
+"""
+Unit tests for the benchmark harness
+"""
+import json
+import urllib.request
+import pytest
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.harness import ROUTES, BenchmarkServer, compare, percentile, run_benchmarks, summarize
+from init_sample_data import generate_bulk_data
+
+
+def _summary(**overrides):
+    summary = summarize([0.010] * 10, [3] * 10, [], wall=0.1)
+    summary.update(overrides)
+    return summary
+
+
+@pytest.fixture
+def bench_server(test_app):
+    """Serve the test app over HTTP with a few bulk users"""
+    generate_bulk_data(users=3, media_size=0, events_per_user=0, progress=lambda message: None)
+    server = BenchmarkServer(test_app).start()
+    yield server
+    server.stop()
+
+
+class TestStatistics:
+    """Tests for summaries and baseline comparison"""
+
+    def test_percentile_nearest_rank(self):
+        """Test percentiles of a known distribution"""
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile(values, 99) == 99
+        assert percentile([7], 99) == 7
+        assert percentile([], 50) == 0.0
+
+    def test_summary(self):
+        """Test the per-route summary fields"""
+        summary = summarize([0.01, 0.02, 0.03, 0.04], [2, 2, 3, 3], ['HTTP 500'], wall=0.5)
+        assert summary['requests'] == 4
+        assert summary['errors'] == 1
+        assert summary['throughput_rps'] == 8.0
+        assert summary['p50_ms'] == 20.0
+        assert summary['p99_ms'] == 40.0
+        assert summary['queries_per_request'] == 2.5
+        assert summary['error_samples'] == ['HTTP 500']
+
+    def test_compare_within_tolerance(self):
+        """Test that noise below the tolerance is not flagged"""
+        baseline = {'dashboard': _summary()}
+        current = {'dashboard': _summary(p95_ms=11.5, throughput_rps=85.0), 'new_route': _summary()}
+        assert compare(baseline, current, tolerance=0.2) == []
+
+    def test_compare_flags_regressions(self):
+        """Test latency, throughput, query count and error regressions"""
+        baseline = {'dashboard': _summary(), 'policies': _summary()}
+        current = {
+            'dashboard': _summary(p95_ms=13.0, throughput_rps=70.0),
+            'policies': _summary(queries_per_request=12.0, errors=2),
+        }
+        regressions = compare(baseline, current, tolerance=0.2)
+        assert 'dashboard: p95_ms 10.0 -> 13.0' in regressions
+        assert 'dashboard: throughput_rps 100.0 -> 70.0' in regressions
+        assert 'policies: queries_per_request 3.0 -> 12.0' in regressions
+        assert 'policies: errors 0 -> 2' in regressions
+
+
+class TestHarness:
+    """Tests for driving the app over HTTP"""
+
+    def test_fake_openai_answers_chat_completions(self):
+        """Test the OpenAI-compatible response shape"""
+        server = FakeOpenAIServer().start()
+        try:
+            request = urllib.request.Request(f'{server.base_url}/chat/completions',
+                                             data=json.dumps({'model': 'gpt-4o-mini', 'messages': []}).encode(),
+                                             headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request) as response:
+                body = json.load(response)
+        finally:
+            server.stop()
+        assert body['choices'][0]['message']['role'] == 'assistant'
+        assert json.loads(body['choices'][0]['message']['content'])['damage_type']
+        assert server.requests == 1
+
+    def test_routes_run_without_errors(self, bench_server):
+        """Test a short run over read, write and mobile routes"""
+        names = {'login', 'dashboard', 'upload_document', 'mobile_claims', 'mobile_claim_detail'}
+        routes = [route for route in ROUTES if route.name in names]
+        results = run_benchmarks(bench_server, routes, concurrency=2, requests=4, progress=lambda line: None)
+
+        assert set(results) == names
+        for name, summary in results.items():
+            assert summary['requests'] == 4, name
+            assert summary['errors'] == 0, (name, summary.get('error_samples'))
+            assert summary['p50_ms'] > 0
+        assert results['dashboard']['queries_per_request'] >= 1
+
+    def test_not_enough_users(self, bench_server):
+        """Test that the harness asks for more seeded users"""
+        with pytest.raises(RuntimeError, match='bulk users'):
+            run_benchmarks(bench_server, ROUTES[:1], concurrency=10, requests=10, progress=lambda line: None)
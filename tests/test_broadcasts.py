@@ -0,0 +1,115 @@
+"""
+Unit tests for policy-wide notification broadcasts
+"""
+import json
+from datetime import date
+from unittest.mock import patch
+from models import db, User, SwissAxaPolicy, Notification, BroadcastCampaign, EmailOutbox
+from broadcasts import create_campaign, run_campaign, run_pending_campaigns
+from notifications import unread_count
+
+
+def make_holders(count, policy_type='Household', status='active', start=0):
+    """Users with one policy each; returns their ids"""
+    user_ids = []
+    for i in range(start, start + count):
+        user = User(email=f'holder{i}@example.com', first_name='Holder', last_name=str(i))
+        user.set_password('holderpassword123')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(SwissAxaPolicy(user_id=user.id, policy_number=f'HOL-{i}', policy_type=policy_type,
+                                      expiration_date=date(2030, 1, 1), status=status))
+        user_ids.append(user.id)
+    db.session.commit()
+    return user_ids
+
+
+class TestCampaign:
+    """Tests for selecting and notifying holders"""
+
+    def test_notifies_only_matching_holders(self, test_app):
+        """Test that policy type and status select the targets, once per user"""
+        with test_app.app_context():
+            holders = make_holders(5)
+            make_holders(2, policy_type='Car', start=10)
+            make_holders(1, status='expired', start=20)
+            # A second policy of the same type must not notify twice
+            db.session.add(SwissAxaPolicy(user_id=holders[0], policy_number='HOL-extra', policy_type='Household',
+                                          expiration_date=date(2030, 1, 1), status='active'))
+            db.session.commit()
+
+            campaign = create_campaign('New terms', 'Household terms change on 1 July', 'Household')
+            assert campaign.targeted == 5
+            result = run_campaign(campaign.id, batch_size=2)
+            assert result == {'batches': 4, 'status': 'completed', 'complete': True}
+
+            campaign = db.session.get(BroadcastCampaign, campaign.id)
+            assert campaign.notified == 5 and campaign.to_dict()['progress'] == 1.0
+            notified = db.session.scalars(db.select(Notification.user_id).order_by(Notification.user_id)).all()
+            assert notified == holders
+            assert unread_count(holders[0]) == 1
+
+    def test_resumes_after_interruption(self, test_app):
+        """Test that a stopped run continues after the last committed batch"""
+        with test_app.app_context():
+            make_holders(5)
+            campaign = create_campaign('New terms', 'Message', 'Household')
+            assert run_campaign(campaign.id, batch_size=2, max_batches=1)['complete'] is False
+            campaign = db.session.get(BroadcastCampaign, campaign.id)
+            assert (campaign.status, campaign.notified) == ('notifying', 2)
+
+            # A crash mid-batch: the batch rolls back, the cursor stays
+            with patch('broadcasts._advance', side_effect=RuntimeError('worker died')):
+                try:
+                    run_campaign(campaign.id, batch_size=2)
+                except RuntimeError:
+                    db.session.rollback()
+            assert db.session.query(Notification).count() == 2
+
+            results = run_pending_campaigns(batch_size=2)
+            assert results[campaign.id]['status'] == 'completed'
+            assert db.session.query(Notification).count() == 5
+            assert db.session.query(Notification.user_id).distinct().count() == 5
+
+    def test_emails_queued_in_chunks(self, test_app):
+        """Test the email phase after the notifications"""
+        with test_app.app_context():
+            make_holders(3)
+            campaign = create_campaign('New terms', 'Message', 'Household', send_email=True)
+            assert run_campaign(campaign.id, email_batch_size=2)['status'] == 'completed'
+            queued = db.session.scalars(db.select(EmailOutbox.recipients).order_by(EmailOutbox.id)).all()
+            assert [json.loads(recipients) for recipients in queued] == [
+                ['holder0@example.com'], ['holder1@example.com'], ['holder2@example.com']]
+            campaign = db.session.get(BroadcastCampaign, campaign.id)
+            assert campaign.emailed == 3
+
+
+class TestAdminRoutes:
+    """Tests for the broadcast admin API"""
+
+    def test_create_progress_and_cancel(self, test_app, authenticated_client):
+        """Test that admins create, follow and cancel campaigns"""
+        payload = {'title': 'New terms', 'message': 'Message', 'policy_type': 'Household'}
+        assert authenticated_client.post('/admin/broadcasts', json=payload).status_code == 403
+
+        test_app.config['ADMIN_EMAILS'] = ['test@example.com']
+        assert authenticated_client.post('/admin/broadcasts', json={'title': 'x'}).status_code == 400
+        response = authenticated_client.post('/admin/broadcasts', json=payload)
+        assert response.status_code == 201
+        campaign_id = response.get_json()['id']
+        assert response.get_json()['status'] == 'pending'
+
+        cancelled = authenticated_client.post(f'/admin/broadcasts/{campaign_id}/cancel').get_json()
+        assert cancelled['status'] == 'cancelled'
+        assert authenticated_client.get(f'/admin/broadcasts/{campaign_id}').get_json()['status'] == 'cancelled'
+        assert authenticated_client.get('/admin/broadcasts/999').status_code == 404
+        with test_app.app_context():
+            assert run_campaign(campaign_id)['batches'] == 0
+
+    def test_cli_command(self, test_app):
+        """Test flask broadcasts-run"""
+        with test_app.app_context():
+            make_holders(3)
+            create_campaign('New terms', 'Message', 'Household')
+        result = test_app.test_cli_runner().invoke(args=['broadcasts-run', '--batch-size', '2'])
+        assert 'completed, notified 3/3' in result.output
@@ -0,0 +1,116 @@
+"""
+Unit tests for parallel claim media saving
+"""
+import hashlib
+import io
+import os
+import pytest
+from werkzeug.datastructures import FileStorage
+from models import Claim, ClaimMedia
+from claim_media import sniff_media_type, classify_media, save_claim_media
+from storage import LocalStorage
+
+JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00' + b'\x00' * 64
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+MP4 = b'\x00\x00\x00\x18ftypisom\x00\x00\x02\x00' + b'\x00' * 64
+MOV = b'\x00\x00\x00\x14ftypqt  \x00\x00\x00\x00' + b'\x00' * 64
+AVI = b'RIFF\x00\x00\x00\x00AVI LIST' + b'\x00' * 64
+HEIC = b'\x00\x00\x00\x18ftypheic\x00\x00\x00\x00' + b'\x00' * 64
+
+
+class TestMediaSniffing:
+    """Tests for magic-byte media detection"""
+
+    @pytest.mark.parametrize('header,expected', [
+        (JPEG, ('photo', 'image/jpeg')),
+        (PNG, ('photo', 'image/png')),
+        (HEIC, ('photo', 'image/heic')),
+        (MP4, ('video', 'video/mp4')),
+        (MOV, ('video', 'video/quicktime')),
+        (AVI, ('video', 'video/x-msvideo')),
+    ])
+    def test_sniff_known_signatures(self, header, expected):
+        """Test that common photo and video signatures are recognized"""
+        assert sniff_media_type(header) == expected
+
+    def test_sniff_ignores_extension(self):
+        """Test that the content decides, not the filename"""
+        assert classify_media(MP4, 'holiday.jpg') == ('video', 'video/mp4')
+        assert classify_media(JPEG, 'clip.mov') == ('photo', 'image/jpeg')
+
+    def test_unknown_content_falls_back_to_extension(self):
+        """Test the extension fallback for unrecognized content"""
+        assert sniff_media_type(b'plain text') is None
+        assert classify_media(b'plain text', 'clip.mp4') == ('video', None)
+        assert classify_media(b'plain text', 'photo.jpg') == ('photo', None)
+
+
+class TestSaveClaimMedia:
+    """Tests for the concurrent media writer"""
+
+    def test_saves_all_files_with_hashes(self, tmp_path):
+        """Test that every upload is written and hashed"""
+        payloads = [os.urandom(200 * 1024) for _ in range(6)]
+        files = [FileStorage(io.BytesIO(p), filename=f'photo_{i}.jpg') for i, p in enumerate(payloads)]
+
+        saved = save_claim_media(files, LocalStorage(str(tmp_path)))
+
+        assert len(saved) == 6
+        for item, payload in zip(saved, payloads):
+            assert item['file_path'].startswith('claims/')
+            with open(tmp_path / item['file_path'], 'rb') as f:
+                assert f.read() == payload
+            assert item['content_hash'] == hashlib.sha256(payload).hexdigest()
+            assert item['file_size'] == len(payload)
+        assert not [n for n in os.listdir(tmp_path / 'claims') if n.endswith('.part')]
+
+    def test_same_filename_does_not_overwrite(self, tmp_path):
+        """Test that two uploads with the same name are kept apart"""
+        files = [FileStorage(io.BytesIO(JPEG + b'a'), filename='damage.jpg'),
+                 FileStorage(io.BytesIO(JPEG + b'b'), filename='damage.jpg')]
+
+        saved = save_claim_media(files, LocalStorage(str(tmp_path)))
+
+        assert saved[0]['file_path'] != saved[1]['file_path']
+        assert len(os.listdir(tmp_path / 'claims')) == 2
+
+    def test_failed_file_removes_written_files(self, tmp_path):
+        """Test that a failing upload leaves no files behind"""
+        class BrokenStream(io.BytesIO):
+            def read(self, size=-1):
+                raise IOError('connection reset')
+
+        files = [FileStorage(io.BytesIO(JPEG), filename='ok.jpg'),
+                 FileStorage(BrokenStream(), filename='broken.jpg')]
+
+        with pytest.raises(IOError):
+            save_claim_media(files, LocalStorage(str(tmp_path)))
+        assert os.listdir(tmp_path / 'claims') == []
+
+
+class TestFileClaimMedia:
+    """Tests for media handling in the file_claim route"""
+
+    def test_multiple_media_inserted_with_sniffed_types(self, test_app, authenticated_client, test_policy):
+        """Test that all media rows are stored with hash and real type"""
+        response = authenticated_client.post('/services/claims/file',
+            data={
+                'policy_id': str(test_policy['id']),
+                'description': 'Storm damage',
+                'damage_type': 'Natural Disaster',
+                'media': [(io.BytesIO(JPEG), 'roof.jpg'),
+                          (io.BytesIO(MP4), 'walkthrough.jpg'),
+                          (io.BytesIO(PNG), 'window.png')]
+            },
+            content_type='multipart/form-data',
+            follow_redirects=True
+        )
+        assert response.status_code == 200
+
+        with test_app.app_context():
+            claim = Claim.query.filter_by(description='Storm damage').first()
+            media = ClaimMedia.query.filter_by(claim_id=claim.id).order_by(ClaimMedia.id).all()
+            assert [m.media_type for m in media] == ['photo', 'video', 'photo']
+            assert media[1].content_hash == hashlib.sha256(MP4).hexdigest()
+            upload_folder = test_app.config['UPLOAD_FOLDER']
+            assert all(os.path.exists(os.path.join(upload_folder, m.file_path)) for m in media)
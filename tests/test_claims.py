@@ -2,7 +2,7 @@
 Unit tests for claims-related routes
 """
 import pytest
-from app import db, Claim, ClaimMedia
+from models import db, Claim, ClaimMedia
 
 
 class TestClaimsPage:
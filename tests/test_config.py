@@ -0,0 +1,111 @@
+"""
+Unit tests for config-driven engine setup and read-replica routing
+"""
+import pytest
+from flask import Flask, jsonify
+from flask_sqlalchemy import SQLAlchemy
+from config import get_config, init_database_config, normalize_database_url, TestingConfig
+from db_engine import RoutingSession, init_db_engine, read_only
+
+routing_db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+class Note(routing_db.Model):
+    id = routing_db.Column(routing_db.Integer, primary_key=True)
+    text = routing_db.Column(routing_db.String(50))
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    """App with a primary and one replica, each seeded with a different note"""
+    app = Flask(__name__)
+    app.config.from_object(TestingConfig)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    app.config['DATABASE_REPLICA_URLS'] = [f"sqlite:///{tmp_path / 'replica.db'}"]
+    init_database_config(app)
+    routing_db.init_app(app)
+    init_db_engine(app, routing_db)
+
+    with app.app_context():
+        routing_db.create_all()
+        routing_db.session.add(Note(text='primary'))
+        routing_db.session.commit()
+        Note.__table__.create(routing_db.engines['replica_0'])
+        with routing_db.engines['replica_0'].begin() as conn:
+            conn.execute(Note.__table__.insert().values(text='replica'))
+
+    @app.route('/notes')
+    @read_only
+    def notes():
+        return jsonify([n.text for n in Note.query.order_by(Note.id)])
+
+    @app.route('/notes/add')
+    @read_only
+    def add_note():
+        routing_db.session.add(Note(text='added'))
+        routing_db.session.commit()
+        return jsonify([n.text for n in Note.query.order_by(Note.id)])
+
+    @app.route('/notes/primary')
+    def primary_notes():
+        return jsonify([n.text for n in Note.query.order_by(Note.id)])
+
+    yield app
+    with app.app_context():
+        routing_db.session.remove()
+        for engine in routing_db.engines.values():
+            engine.dispose()
+
+
+class TestConfig:
+    """Tests for config classes and derived engine settings"""
+
+    def test_config_selection(self, test_app):
+        """Test that APP_CONFIG picks the config class"""
+        assert get_config('testing') is TestingConfig
+        assert test_app.config['TESTING']
+
+    def test_postgres_url_gets_pool_settings(self):
+        """Test QueuePool settings and replica binds for a server database"""
+        app = Flask(__name__)
+        app.config.from_object(get_config('production'))
+        app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url('postgres://u:p@db/portal')
+        app.config['DATABASE_REPLICA_URLS'] = ['postgresql://u:p@replica1/portal']
+        init_database_config(app)
+
+        assert app.config['SQLALCHEMY_DATABASE_URI'] == 'postgresql://u:p@db/portal'
+        options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+        assert options['pool_size'] == 10
+        assert options['max_overflow'] == 20
+        assert options['pool_pre_ping'] is True
+        assert options['pool_recycle'] == 1800
+        assert app.config['SQLALCHEMY_BINDS']['replica_0']['url'] == 'postgresql://u:p@replica1/portal'
+        assert app.config['SQLALCHEMY_BINDS']['replica_0']['pool_size'] == 10
+
+    def test_sqlite_keeps_default_pool(self):
+        """Test that SQLite URLs get no server pool settings"""
+        app = Flask(__name__)
+        app.config.from_object(TestingConfig)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///portal.db'
+        init_database_config(app)
+        assert 'SQLALCHEMY_ENGINE_OPTIONS' not in app.config or \
+            'pool_size' not in app.config['SQLALCHEMY_ENGINE_OPTIONS']
+
+
+class TestReadReplicaRouting:
+    """Tests for @read_only routing"""
+
+    def test_read_only_view_uses_replica(self, replica_app):
+        """Test that reads in a read-only view hit the replica"""
+        client = replica_app.test_client()
+        assert client.get('/notes').get_json() == ['replica']
+        assert client.get('/notes/primary').get_json() == ['primary']
+
+    def test_writes_go_to_primary_and_stick(self, replica_app):
+        """Test that writes reach the primary and the writer then reads from it"""
+        client = replica_app.test_client()
+        assert client.get('/notes/add').get_json() == ['primary', 'added']
+        # Replica has not caught up, so the writer keeps reading from the primary
+        assert client.get('/notes').get_json() == ['primary', 'added']
+        # Other users still read from the replica
+        assert replica_app.test_client().get('/notes').get_json() == ['replica']
@@ -0,0 +1,151 @@
+"""
+Unit tests for the SQLite engine profile and the write serializer
+"""
+import threading
+import time
+import pytest
+from sqlalchemy import text
+from models import db, User, Agent
+from db_engine import WriteSerializer, WriteQueueTimeout
+
+
+class TestSqlitePragmas:
+    """Tests for per-connection pragmas"""
+
+    def test_pragmas_applied_to_connections(self, test_app):
+        """Test that every pooled connection runs in WAL with the tuned settings"""
+        with test_app.app_context():
+            with db.engine.connect() as conn:
+                assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+                assert conn.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+                assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+                assert conn.execute(text('PRAGMA cache_size')).scalar() == -64000
+
+    def test_readers_not_blocked_by_writer(self, test_app):
+        """Test that a read succeeds while another connection holds a write transaction"""
+        with test_app.app_context():
+            with db.engine.connect() as writer, db.engine.connect() as reader:
+                writer.execute(text("INSERT INTO agent (name, email) VALUES ('W', 'w@example.com')"))
+                start = time.monotonic()
+                assert reader.execute(text('SELECT COUNT(*) FROM agent')).scalar() == 0
+                assert time.monotonic() - start < 1
+                writer.rollback()
+
+
+class TestWriteSerializer:
+    """Tests for the FIFO write slot"""
+
+    def test_waiters_are_served_in_arrival_order(self):
+        """Test that queued writers get the slot first come, first served"""
+        serializer = WriteSerializer(timeout=5)
+        serializer.acquire()
+        order = []
+
+        def writer(n):
+            serializer.acquire()
+            order.append(n)
+            serializer.release()
+
+        threads = []
+        for n in range(5):
+            thread = threading.Thread(target=writer, args=(n,))
+            thread.start()
+            threads.append(thread)
+            while serializer.queue_length < n + 1:
+                time.sleep(0.001)
+        serializer.release()
+        for thread in threads:
+            thread.join()
+        assert order == [0, 1, 2, 3, 4]
+
+    def test_wait_is_bounded(self):
+        """Test that a waiter gives up and leaves the queue after the timeout"""
+        serializer = WriteSerializer(timeout=0.05)
+        holder = threading.Thread(target=serializer.acquire)
+        holder.start()
+        holder.join()
+
+        with pytest.raises(WriteQueueTimeout):
+            serializer.acquire()
+        assert serializer.queue_length == 0
+        assert serializer.timeouts == 1
+
+    def test_reentrant_for_the_owning_thread(self):
+        """Test that nested acquisitions by one thread do not deadlock"""
+        serializer = WriteSerializer(timeout=0.05)
+        serializer.acquire()
+        serializer.acquire()
+        serializer.release()
+        serializer.release()
+        serializer.acquire()
+        serializer.release()
+
+
+class TestSessionIntegration:
+    """Tests for the session hooks"""
+
+    def test_slot_held_until_commit(self, test_app):
+        """Test that a session keeps the slot from its first flush until commit"""
+        serializer = test_app.extensions['write_serializer']
+        with test_app.app_context():
+            db.session.add(Agent(name='A', email='a@example.com'))
+            db.session.flush()
+            assert db.session.info.get('write_slot')
+            db.session.commit()
+            assert not db.session.info.get('write_slot')
+
+            Agent.query.all()  # Reads never take the slot
+            assert not db.session.info.get('write_slot')
+        assert serializer._owner is None
+
+    def test_concurrent_writers_do_not_fail(self, test_app):
+        """Test that parallel requests writing at once all succeed"""
+        errors = []
+
+        def write(n):
+            try:
+                with test_app.app_context():
+                    for i in range(10):
+                        db.session.add(Agent(name=f'Agent {n}-{i}', email=f'agent{n}-{i}@example.com'))
+                        db.session.commit()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        with test_app.app_context():
+            assert Agent.query.count() == 80
+
+    def test_queue_timeout_returns_503(self, test_app, client):
+        """Test that a request that cannot get the slot fails fast with 503"""
+        serializer = test_app.extensions['write_serializer']
+        held, done = threading.Event(), threading.Event()
+
+        def hold():
+            serializer.acquire()
+            held.set()
+            done.wait(5)
+            serializer.release()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait(5)
+        serializer.timeout = 0.05
+        try:
+            response = client.post('/register', data={
+                'email': 'busy@example.com', 'password': 'password123',
+                'first_name': 'Busy', 'last_name': 'User'
+            })
+        finally:
+            serializer.timeout = test_app.config['DB_WRITE_QUEUE_TIMEOUT']
+            done.set()
+            holder.join()
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        with test_app.app_context():
+            assert User.query.filter_by(email='busy@example.com').first() is None
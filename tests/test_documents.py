@@ -2,7 +2,7 @@
 Unit tests for document-related routes
 """
 import pytest
-from app import db, Document, User
+from models import db, Document, User
 import tempfile
 import os
 
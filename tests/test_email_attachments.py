@@ -0,0 +1,112 @@
+"""
+Unit tests for streamed email attachments and download links
+"""
+import base64
+import io
+import os
+from email import message_from_bytes
+from email.policy import default
+from urllib.parse import urlsplit
+
+import email_service
+from email_attachments import Attachment, _write_base64, plan_attachments
+from email_outbox import enqueue_email, process_outbox
+from models import db, EmailOutbox
+from storage import get_storage
+
+
+def store(key, data):
+    """Put bytes into the test app's storage"""
+    get_storage().put_stream(key, io.BytesIO(data))
+    return key
+
+
+def received(smtp_server, index=0):
+    """Parse a message the fake SMTP server received"""
+    return message_from_bytes(smtp_server.messages[index][2], policy=default)
+
+
+class TestStreamedAttachments:
+    """Tests for attachments written and sent a chunk at a time"""
+
+    def test_attachment_delivered_intact(self, test_app, smtp_server):
+        """Test that a file larger than one read chunk arrives unchanged"""
+        data = os.urandom(300 * 1024 + 7)
+        with test_app.app_context():
+            key = store('policies/policy.pdf', data)
+            assert email_service.send_email('a@example.com', 'Your policy', 'Attached.\n.Dotted line',
+                                            html_body='<p>Attached.</p>', attachments=[key])
+        message = received(smtp_server)
+        assert message['Subject'] == 'Your policy'
+        assert message.get_body(('plain',)).get_content().replace('\r\n', '\n').startswith('Attached.\n.Dotted line')
+        assert message.get_body(('html',)).get_content().strip() == '<p>Attached.</p>'
+        [attachment] = message.iter_attachments()
+        assert attachment.get_filename() == 'policy.pdf'
+        assert attachment.get_content_type() == 'application/pdf'
+        assert attachment.get_content() == data
+
+    def test_upload_path_resolved_through_storage(self, test_app, smtp_server):
+        """Test that paths stored by older rows are read from UPLOAD_FOLDER, not the app root"""
+        with test_app.app_context():
+            store('documents/statement.txt', b'statement')
+            path = os.path.join(test_app.config['UPLOAD_FOLDER'], 'documents', 'statement.txt')
+            enqueue_email('a@example.com', 'Statement', 'Body', attachments=[path])
+            process_outbox()
+        [attachment] = received(smtp_server).iter_attachments()
+        assert attachment.get_content() == 'statement'
+
+    def test_missing_attachment_skipped(self, test_app, smtp_server):
+        """Test that a deleted file does not stop the email"""
+        with test_app.app_context():
+            assert email_service.send_email('a@example.com', 'Subject', 'Body', attachments=['documents/gone.pdf'])
+        assert list(received(smtp_server).iter_attachments()) == []
+
+    def test_base64_lines_independent_of_chunking(self):
+        """Test that odd-sized storage chunks encode exactly like the whole file"""
+        data = os.urandom(200 * 1024)
+        out = io.BytesIO()
+        _write_base64(out, (data[i:i + 1000] for i in range(0, len(data), 1000)))
+        assert out.getvalue() == base64.encodebytes(data).replace(b'\n', b'\r\n')
+
+
+class TestLargeAttachments:
+    """Tests for the attachment size cap"""
+
+    def test_smallest_attachments_fit_first(self):
+        """Test that the cap keeps as many files attached as possible, in their order"""
+        files = [Attachment('a', 'a', 60), Attachment('b', 'b', 30), Attachment('c', 'c', 50)]
+        attached, linked = plan_attachments(files, 90)
+        assert [a.key for a in attached] == ['b', 'c']
+        assert [a.key for a in linked] == ['a']
+
+    def test_large_file_sent_as_link(self, test_app, client, smtp_server):
+        """Test that a file over EMAIL_ATTACHMENT_MAX_BYTES becomes a working download link"""
+        test_app.config['EMAIL_ATTACHMENT_MAX_BYTES'] = 1024
+        with test_app.app_context():
+            small = store('documents/letter.txt', b'letter')
+            large = store('policies/large.pdf', b'x' * 4096)
+            assert email_service.send_email('a@example.com', 'Documents', 'See below.',
+                                            html_body='<html><body><p>See below.</p></body></html>',
+                                            attachments=[large, small])
+        message = received(smtp_server)
+        assert [a.get_filename() for a in message.iter_attachments()] == ['letter.txt']
+        text = message.get_body(('plain',)).get_content()
+        assert 'large.pdf (4 KB): http://localhost:5000/storage/policies/large.pdf?' in text
+        assert '<a href="http://localhost:5000/storage/policies/large.pdf?' in message.get_body(('html',)).get_content()
+
+        url = urlsplit(text.split('large.pdf (4 KB): ')[1].split()[0])
+        response = client.get(f'{url.path}?{url.query}')
+        assert response.status_code == 200
+        assert response.data == b'x' * 4096
+
+    def test_too_large_without_links_fails_once(self, test_app, smtp_server):
+        """Test that an email that can never fit is marked dead without retries"""
+        test_app.config.update({'EMAIL_ATTACHMENT_MAX_BYTES': 1024, 'EMAIL_ATTACHMENT_LINKS': False})
+        with test_app.app_context():
+            key = store('policies/large.pdf', b'x' * 4096)
+            message_id = enqueue_email('a@example.com', 'Policy', 'Body', attachments=[key]).id
+            process_outbox()
+            message = db.session.get(EmailOutbox, message_id)
+            assert (message.status, message.attempts) == ('dead', 1)
+            assert message.last_error.startswith('AttachmentTooLarge')
+        assert smtp_server.messages == []
@@ -0,0 +1,161 @@
+"""
+Unit tests for claim update digests and their timer scheduler
+"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import email_service
+from email_digests import (DigestScheduler, DigestTimers, add_claim_update, flush_digest, flush_due_digests,
+                           pending_digests)
+from models import db, EmailDigest, EmailOutbox
+
+
+@pytest.fixture
+def digest_window(test_app):
+    """Collect claim updates for five minutes"""
+    test_app.config['EMAIL_DIGEST_WINDOW_SECONDS'] = 300
+    return timedelta(seconds=300)
+
+
+def later(window):
+    """A time when digests opened now are due"""
+    return datetime.utcnow() + window + timedelta(seconds=1)
+
+
+class TestCoalescing:
+    """Tests for collecting updates into one email"""
+
+    def test_burst_sent_as_one_email(self, test_app, digest_window):
+        """Test that several status changes within the window become one summary"""
+        with test_app.app_context():
+            for status in ('submitted', 'under_review', 'approved'):
+                email_service.send_claim_notification('a@example.com', 'CLM-1', status)
+            email_service.send_claim_notification('a@example.com', 'CLM-2', 'submitted')
+            assert EmailOutbox.query.count() == 0
+            assert flush_due_digests() == 0
+
+            assert flush_due_digests(now=later(digest_window)) == 1
+            [message] = EmailOutbox.query.all()
+            assert pending_digests() == 0
+        assert message.subject == 'Updates to 2 claims'
+        assert 'CLM-1: submitted -> under_review -> approved' in message.body
+        assert 'CLM-2: submitted' in message.body
+        assert '&rarr;' in message.html_body
+
+    def test_single_update_sent_as_claim_update(self, test_app, digest_window):
+        """Test that a digest with one update reads like the normal email, in the user's language"""
+        with test_app.app_context():
+            email_service.send_claim_notification('a@example.com', 'CLM-1', 'approved', language='de')
+            flush_due_digests(now=later(digest_window))
+            [message] = EmailOutbox.query.all()
+        assert message.subject == 'Aktualisierung Ihres Schadens: CLM-1'
+
+    def test_window_not_extended(self, test_app, digest_window):
+        """Test that later updates join the waiting digest without delaying it"""
+        with test_app.app_context():
+            first_due = add_claim_update('a@example.com', 'CLM-1', 'submitted')
+            add_claim_update('a@example.com', 'CLM-1', 'approved')
+            [digest] = EmailDigest.query.all()
+            assert digest.due_at == first_due
+
+    def test_recipients_kept_apart(self, test_app, digest_window):
+        """Test that each recipient gets their own digest"""
+        with test_app.app_context():
+            add_claim_update('a@example.com', 'CLM-1', 'submitted')
+            add_claim_update('b@example.com', 'CLM-2', 'submitted')
+            assert flush_due_digests(now=later(digest_window)) == 2
+            recipients = sorted(m.recipients for m in EmailOutbox.query.all())
+        assert recipients == ['["a@example.com"]', '["b@example.com"]']
+
+    def test_sent_once(self, test_app, digest_window):
+        """Test that a digest is claimed by one flush, and later updates open a new one"""
+        with test_app.app_context():
+            add_claim_update('a@example.com', 'CLM-1', 'submitted')
+            now = later(digest_window)
+            assert flush_digest('a@example.com', now)
+            assert not flush_digest('a@example.com', now)
+
+            add_claim_update('a@example.com', 'CLM-1', 'approved')
+            assert flush_due_digests(now=later(digest_window)) == 1
+            subjects = [m.subject for m in EmailOutbox.query.order_by(EmailOutbox.id)]
+        assert subjects == ['Claim Update: CLM-1', 'Claim Update: CLM-1']
+
+    def test_no_window_sends_at_once(self, test_app):
+        """Test EMAIL_DIGEST_WINDOW_SECONDS = 0"""
+        with test_app.app_context():
+            email_service.send_claim_notification('a@example.com', 'CLM-1', 'approved')
+            assert EmailOutbox.query.count() == 1
+            assert pending_digests() == 0
+
+
+class TestScheduling:
+    """Tests for the timer heap and the scheduler thread"""
+
+    def test_timers_pop_in_due_order(self):
+        """Test that the heap returns due recipients earliest first and keeps one timer each"""
+        start = datetime(2026, 1, 1)
+        timers = DigestTimers()
+        for i in reversed(range(1000)):
+            timers.push(start + timedelta(seconds=i), f'user{i}@example.com')
+        assert not timers.push(start + timedelta(seconds=5000), 'user0@example.com')
+        assert timers.push(start - timedelta(seconds=1), 'user999@example.com')
+        assert len(timers) == 1000
+
+        due = timers.pop_due(start + timedelta(seconds=2))
+        assert due == ['user999@example.com', 'user0@example.com', 'user1@example.com', 'user2@example.com']
+        assert timers.next_due() == start + timedelta(seconds=3)
+        assert len(timers) == 996
+
+    def test_scheduler_sends_when_due(self, test_app):
+        """Test that the timer thread sends a digest when its window closes"""
+        test_app.config['EMAIL_DIGEST_WINDOW_SECONDS'] = 1
+        scheduler = DigestScheduler(test_app, poll_interval=30)
+        test_app.extensions['email_digests'] = scheduler
+        scheduler.start()
+        try:
+            with test_app.app_context():
+                add_claim_update('a@example.com', 'CLM-1', 'submitted')
+                add_claim_update('a@example.com', 'CLM-1', 'approved')
+            deadline = time.monotonic() + 5
+            sent = 0
+            while not sent and time.monotonic() < deadline:
+                time.sleep(0.05)
+                with test_app.app_context():
+                    sent = EmailOutbox.query.count()
+                    db.session.remove()
+        finally:
+            scheduler.stop()
+        assert sent == 1
+
+    def test_scheduler_starts_with_first_request(self, test_app, client):
+        """Test that digests opened before a restart are sent without a new claim update"""
+        with test_app.app_context():
+            add_claim_update('a@example.com', 'CLM-1', 'submitted')
+            db.session.query(EmailDigest).update({'due_at': datetime.utcnow() - timedelta(seconds=1)})
+            db.session.commit()
+        scheduler = test_app.extensions['email_digests']
+        scheduler.enabled = True
+        try:
+            client.get('/')
+            deadline = time.monotonic() + 5
+            sent = 0
+            while not sent and time.monotonic() < deadline:
+                time.sleep(0.05)
+                with test_app.app_context():
+                    sent = EmailOutbox.query.count()
+                    db.session.remove()
+        finally:
+            scheduler.stop()
+        assert sent == 1
+
+    def test_cli_flush(self, test_app):
+        """Test flask email-digests-flush"""
+        test_app.config['EMAIL_DIGEST_WINDOW_SECONDS'] = 1
+        with test_app.app_context():
+            add_claim_update('a@example.com', 'CLM-1', 'submitted')
+            db.session.query(EmailDigest).update({'due_at': datetime.utcnow() - timedelta(seconds=1)})
+            db.session.commit()
+        result = test_app.test_cli_runner().invoke(args=['email-digests-flush'])
+        assert 'Queued 1 digests; 0 waiting.' in result.output
@@ -0,0 +1,178 @@
+"""
+Unit tests for the persistent email outbox and its workers
+"""
+import time
+from datetime import datetime, timedelta
+import flask_mail
+from sqlalchemy.exc import OperationalError
+import email_service
+from email_outbox import (OutboxWorker, claim_messages, enqueue_email, outbox_depth, process_outbox,
+                          requeue_dead, retry_delay)
+from metrics import REGISTRY
+from models import db, EmailOutbox
+
+
+def make_due(message_id):
+    """Skip the backoff wait of a message"""
+    message = db.session.get(EmailOutbox, message_id)
+    message.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+
+class TestQueue:
+    """Tests for queueing and sending"""
+
+    def test_request_only_queues(self, test_app, authenticated_client, monkeypatch):
+        """Test that the contact form stores the email instead of talking to the mail server"""
+        def unreachable(connection, message, envelope_from=None):
+            raise AssertionError('the request must not send mail')
+        monkeypatch.setattr(flask_mail.Connection, 'send', unreachable)
+
+        response = authenticated_client.post('/services/contact', data={
+            'recipient_type': 'service_desk', 'recipient_email': 'service@swissaxa.de',
+            'subject': 'Question', 'message': 'Hello'
+        })
+        assert response.status_code == 302
+        with test_app.app_context():
+            [message] = EmailOutbox.query.all()
+            assert message.status == 'pending'
+            assert message.subject == 'Portal Contact: Question'
+            assert outbox_depth() == 1
+
+    def test_queue_failure_reported(self, test_app, authenticated_client, monkeypatch):
+        """Test that a database error while queueing is shown to the customer instead of a 500"""
+        def broken(*args, **kwargs):
+            raise OperationalError('INSERT INTO email_outbox', {}, Exception('database is locked'))
+        monkeypatch.setattr(email_service, 'enqueue_email', broken)
+
+        response = authenticated_client.post('/services/contact', data={
+            'recipient_type': 'service_desk', 'recipient_email': 'service@swissaxa.de',
+            'subject': 'Question', 'message': 'Hello'
+        }, follow_redirects=True)
+        assert response.status_code == 200
+        assert b'Your email could not be sent.' in response.data
+        with test_app.app_context():
+            assert outbox_depth() == 0
+
+    def test_sent_by_worker(self, test_app, monkeypatch):
+        """Test that a processed message is delivered once and marked sent"""
+        delivered = []
+        monkeypatch.setattr(flask_mail.Connection, 'send',
+                            lambda connection, message, envelope_from=None: delivered.append(message))
+        with test_app.app_context():
+            message_id = enqueue_email(['a@example.com', 'b@example.com'], 'Subject', 'Body').id
+            assert process_outbox() == 1
+            assert process_outbox() == 0
+            message = db.session.get(EmailOutbox, message_id)
+            assert (message.status, message.attempts) == ('sent', 1)
+            assert message.sent_at is not None
+        assert [m.recipients for m in delivered] == [['a@example.com', 'b@example.com']]
+        assert 'email_queue_latency_seconds_count' in REGISTRY.exposition()
+
+    def test_not_queued_when_caller_rolls_back(self, test_app):
+        """Test commit=False, where the email belongs to the caller's transaction"""
+        with test_app.app_context():
+            enqueue_email('a@example.com', 'Subject', 'Body', commit=False)
+            db.session.rollback()
+            assert outbox_depth() == 0
+
+
+class TestRetries:
+    """Tests for backoff, dead messages and abandoned claims"""
+
+    def test_backoff_then_dead(self, test_app, monkeypatch):
+        """Test that failures back off and the last allowed attempt marks the message dead"""
+        def refuse(connection, message, envelope_from=None):
+            raise ConnectionRefusedError('SMTP down')
+        monkeypatch.setattr(flask_mail.Connection, 'send', refuse)
+        test_app.config['EMAIL_MAX_ATTEMPTS'] = 3
+        with test_app.app_context():
+            message_id = enqueue_email('a@example.com', 'Subject', 'Body').id
+            process_outbox()
+            message = db.session.get(EmailOutbox, message_id)
+            assert (message.status, message.attempts) == ('pending', 1)
+            assert 'SMTP down' in message.last_error
+            assert message.next_attempt_at > datetime.utcnow() + timedelta(seconds=20)
+            # Not due yet
+            assert process_outbox() == 0
+
+            for _ in range(2):
+                make_due(message_id)
+                process_outbox()
+            message = db.session.get(EmailOutbox, message_id)
+            assert (message.status, message.attempts) == ('dead', 3)
+            assert outbox_depth() == 0
+            assert 'email_outbox_dead 1' in REGISTRY.exposition()
+
+            assert requeue_dead() == 1
+            message = db.session.get(EmailOutbox, message_id)
+            assert (message.status, message.attempts) == ('pending', 0)
+
+    def test_retry_delay_doubles_up_to_the_limit(self):
+        """Test the backoff schedule"""
+        assert 24 <= retry_delay(1, 30, 3600) <= 36
+        assert 96 <= retry_delay(3, 30, 3600) <= 144
+        assert retry_delay(20, 30, 3600) <= 3600 * 1.2
+
+    def test_expired_claim_taken_over(self, test_app):
+        """Test that a message stuck in 'sending' is retried after its lease"""
+        with test_app.app_context():
+            message_id = enqueue_email('a@example.com', 'Subject', 'Body').id
+            assert [m.id for m in claim_messages()] == [message_id]
+            assert claim_messages() == []
+
+            message = db.session.get(EmailOutbox, message_id)
+            message.locked_until = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            [message] = claim_messages()
+            assert message.attempts == 2
+
+
+class TestWorker:
+    """Tests for the sender threads and the CLI worker"""
+
+    def test_threads_send_after_wake(self, test_app, monkeypatch):
+        """Test that queueing wakes the sender threads"""
+        delivered = []
+        monkeypatch.setattr(flask_mail.Connection, 'send',
+                            lambda connection, message, envelope_from=None: delivered.append(message))
+        worker = OutboxWorker(test_app, threads=2, poll_interval=5)
+        test_app.extensions['email_outbox'] = worker
+        try:
+            with test_app.app_context():
+                enqueue_email('a@example.com', 'Subject', 'Body')
+            deadline = time.monotonic() + 5
+            while not delivered and time.monotonic() < deadline:
+                time.sleep(0.02)
+        finally:
+            worker.stop()
+        assert len(delivered) == 1
+
+    def test_threads_start_with_first_request(self, test_app, client, monkeypatch):
+        """Test that email queued without a wake, e.g. by another process, is sent once a request starts the threads"""
+        delivered = []
+        monkeypatch.setattr(flask_mail.Connection, 'send',
+                            lambda connection, message, envelope_from=None: delivered.append(message))
+        worker = test_app.extensions['email_outbox']
+        worker.threads = 1
+        try:
+            with test_app.app_context():
+                enqueue_email('a@example.com', 'Subject', 'Body', commit=False)
+                db.session.commit()
+            assert worker._threads == []
+            client.get('/')
+            assert len(worker._threads) == 1
+            deadline = time.monotonic() + 5
+            while not delivered and time.monotonic() < deadline:
+                time.sleep(0.02)
+        finally:
+            worker.stop()
+        assert len(delivered) == 1
+
+    def test_cli_once(self, test_app, monkeypatch):
+        """Test flask email-outbox-worker --once"""
+        monkeypatch.setattr(flask_mail.Connection, 'send', lambda connection, message, envelope_from=None: None)
+        with test_app.app_context():
+            enqueue_email('a@example.com', 'Subject', 'Body')
+        result = test_app.test_cli_runner().invoke(args=['email-outbox-worker', '--once'])
+        assert 'Processed 1 emails; 0 waiting, 0 dead.' in result.output
@@ -0,0 +1,104 @@
+"""
+Unit tests for localized, precompiled email templates
+"""
+from datetime import datetime, timedelta
+
+import email_service
+from email_templates import get_email_template, render_email, template_names
+from models import db, EmailOutbox, User
+
+
+class TestRendering:
+    """Tests for rendering subject, text and HTML from one template"""
+
+    def test_english_claim_update(self, test_app):
+        """Test that all three parts are rendered with the context"""
+        with test_app.app_context():
+            email = render_email('claim_update', 'en', claim_number='CLM-1', status='approved')
+        assert email.subject == 'Claim Update: CLM-1'
+        assert email.text.startswith('Dear Customer,')
+        assert 'updated to: approved' in email.text
+        assert '<strong>CLM-1</strong>' in email.html
+        assert 'http://localhost:5000/services/claims' in email.html
+
+    def test_german_template(self, test_app):
+        """Test that the language selects the template"""
+        with test_app.app_context():
+            email = render_email('appointment_confirmation', 'de', appointment_date='2026-11-02 10:00',
+                                 agent_name='Anna Agent')
+        assert email.subject == 'Terminbestätigung - SwissAxa'
+        assert 'Ihr Termin mit Anna Agent ist bestätigt für:' in email.text
+
+    def test_unknown_language_falls_back(self, test_app):
+        """Test that a language without templates uses the default language"""
+        with test_app.app_context():
+            email = render_email('claim_update', 'fr', claim_number='CLM-1', status='open')
+        assert email.subject == 'Claim Update: CLM-1'
+
+    def test_only_html_escaped(self, test_app):
+        """Test that customer input is escaped in HTML and kept as is in plain text"""
+        with test_app.app_context():
+            email = render_email('contact_message', 'en', sender_name='Eve <script>', sender_email='e@example.com',
+                                 subject='A & B', message='line 1\nline 2')
+        assert 'Eve <script>' in email.text
+        assert 'Eve &lt;script&gt;' in email.html
+        assert 'A &amp; B' in email.html
+        assert 'line 1<br>line 2' in email.html
+
+    def test_every_template_renders(self, test_app):
+        """Test that every language has every email and each renders all blocks"""
+        context = {'claim_number': 'CLM-1', 'status': 'open', 'appointment_date': '2026-11-02 10:00',
+                   'agent_name': None, 'sender_name': 'Max', 'sender_email': 'max@example.com',
+                   'subject': 'Hi', 'message': 'Hello',
+                   'claims': [{'claim_number': 'CLM-1', 'statuses': ['submitted', 'approved']}]}
+        names = template_names()
+        assert {name for _, name in names} == {'claim_update', 'claim_digest', 'appointment_confirmation',
+                                                'appointment_reminder', 'contact_message'}
+        assert {language for language, _ in names} == {'en', 'de'}
+        with test_app.app_context():
+            for language, name in names:
+                assert all(render_email(name, language, **context))
+
+
+class TestCaching:
+    """Tests for compiling templates once"""
+
+    def test_template_compiled_once(self, test_app):
+        """Test that repeated renders reuse the compiled template"""
+        with test_app.app_context():
+            first = get_email_template('claim_update', 'de')
+            render_email('claim_update', 'de', claim_number='CLM-1', status='open')
+            assert get_email_template('claim_update', 'de') is first
+
+    def test_fallback_resolved_once(self, test_app):
+        """Test that the fallback template is cached under the requested language"""
+        with test_app.app_context():
+            assert get_email_template('claim_update', 'fr') is get_email_template('claim_update', 'en')
+
+
+class TestUserLanguage:
+    """Tests for emails in the customer's language"""
+
+    def test_language_saved_and_used_for_appointment(self, test_app, authenticated_client, test_user):
+        """Test that the language chosen in the portal is saved and used for the confirmation email"""
+        response = authenticated_client.post('/api/language/de')
+        assert response.status_code == 200
+        with test_app.app_context():
+            assert db.session.get(User, test_user['id']).language == 'de'
+
+        monday = (datetime.utcnow() + timedelta(days=7)).replace(hour=10, minute=0)
+        monday += timedelta(days=(7 - monday.weekday()) % 7)
+        authenticated_client.post('/services/scheduling', data={
+            'appointment_type': 'consultation', 'date_time': monday.strftime('%Y-%m-%dT%H:%M'), 'purpose': 'Review'
+        })
+        with test_app.app_context():
+            [message] = EmailOutbox.query.all()
+        assert message.subject == 'Terminbestätigung - SwissAxa'
+
+    def test_helpers_default_to_default_language(self, test_app):
+        """Test that a helper without a language sends in BABEL_DEFAULT_LOCALE"""
+        test_app.config['BABEL_DEFAULT_LOCALE'] = 'de'
+        with test_app.app_context():
+            email_service.send_claim_notification('a@example.com', 'CLM-1', 'open')
+            [message] = EmailOutbox.query.all()
+        assert message.subject == 'Aktualisierung Ihres Schadens: CLM-1'
@@ -0,0 +1,90 @@
+"""
+Unit tests for the streaming document export
+"""
+import io
+import json
+import os
+import zipfile
+from models import db, Document, ClaimMedia
+from export_service import stream_user_export
+
+
+def _write_upload(test_app, folder, filename, content):
+    """Create a file inside the test upload folder and return its path"""
+    path = os.path.join(test_app.config['UPLOAD_FOLDER'], folder, filename)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+class TestDocumentExport:
+    """Tests for the ZIP export endpoint"""
+
+    def test_export_contains_documents_and_media(self, test_app, authenticated_client, test_user, test_claim):
+        """Test that documents and claim media end up in the archive"""
+        with test_app.app_context():
+            doc_path = _write_upload(test_app, 'documents', 'contract.pdf', b'%PDF-1.4 contract')
+            media_path = _write_upload(test_app, 'claims', 'damage.jpg', b'\xff\xd8\xff photo')
+            db.session.add(Document(user_id=test_user['id'], filename='contract.pdf',
+                                    file_path=doc_path, document_type='policy'))
+            db.session.add(ClaimMedia(claim_id=test_claim['id'], filename='damage.jpg',
+                                      file_path=media_path, media_type='photo'))
+            db.session.commit()
+
+        response = authenticated_client.get('/documents/export')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/zip'
+        assert response.is_streamed
+
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        assert archive.testzip() is None
+        assert archive.read('documents/contract.pdf') == b'%PDF-1.4 contract'
+        assert archive.read('claims/CLM-20241212001/damage.jpg') == b'\xff\xd8\xff photo'
+        assert 'manifest.json' not in archive.namelist()
+
+    def test_export_with_manifest(self, test_app, authenticated_client, test_user, test_policy, test_claim, test_document):
+        """Test that the manifest lists claims, policies and missing files"""
+        response = authenticated_client.get('/documents/export?manifest=1')
+        assert response.status_code == 200
+
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        manifest = json.loads(archive.read('manifest.json'))
+        assert manifest['user_id'] == test_user['id']
+        assert manifest['policies'][0]['policy_number'] == 'POL-12345'
+        assert manifest['claims'][0]['claim_number'] == 'CLM-20241212001'
+        # The fixture document has no file on disk
+        assert manifest['documents'][0]['missing'] is True
+        assert manifest['documents'][0]['archive_path'] is None
+
+    def test_export_deduplicates_archive_names(self, test_app, test_user):
+        """Test that two uploads with the same filename are both exported"""
+        with test_app.app_context():
+            for content in (b'first', b'second'):
+                path = _write_upload(test_app, 'documents', f'{content.decode()}.pdf', content)
+                db.session.add(Document(user_id=test_user['id'], filename='scan.pdf',
+                                        file_path=path, document_type='general'))
+            db.session.commit()
+
+            data = b''.join(stream_user_export(test_user['id'], chunk_size=2))
+
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        assert sorted(archive.namelist()) == ['documents/scan.pdf', 'documents/scan_1.pdf']
+        assert {archive.read(n) for n in archive.namelist()} == {b'first', b'second'}
+
+    def test_export_streams_in_chunks(self, test_app, test_user):
+        """Test that the archive is produced incrementally rather than at once"""
+        with test_app.app_context():
+            path = _write_upload(test_app, 'documents', 'large.bin', os.urandom(256 * 1024))
+            db.session.add(Document(user_id=test_user['id'], filename='large.bin',
+                                    file_path=path, document_type='general'))
+            db.session.commit()
+
+            chunks = list(stream_user_export(test_user['id'], chunk_size=16 * 1024))
+
+        assert len(chunks) > 10
+        assert max(len(c) for c in chunks) <= 17 * 1024
+
+    def test_export_requires_auth(self, client):
+        """Test that export requires authentication"""
+        response = client.get('/documents/export')
+        assert response.status_code in [302, 401, 403]
@@ -0,0 +1,95 @@
+"""
+Unit tests for claim and policy number generation
+"""
+import io
+import re
+import threading
+from datetime import datetime
+from sqlalchemy import event
+from models import db, Claim, IdSequence
+from id_generator import IdGenerator, format_policy_number, next_claim_number
+
+
+def _count_statements(engine, statements):
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if 'id_sequence' in statement:
+            statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', record)
+    return record
+
+
+class TestIdGenerator:
+    """Tests for block leasing"""
+
+    def test_numbers_are_formatted_and_increasing(self, test_app):
+        """Test the human-readable, sortable formats"""
+        with test_app.app_context():
+            now = datetime(2024, 3, 15, 10, 0)
+            first, second = next_claim_number(now), next_claim_number(now)
+            assert re.fullmatch(r'CLM-20240315-\d{8}', first)
+            assert first < second
+            assert format_policy_number(1234, now) == 'SAX-2024-00001234'
+
+    def test_one_round_trip_per_block(self, test_app):
+        """Test that numbers come from memory until the block runs out"""
+        generator = IdGenerator(IdSequence.__table__, block_size=100)
+        statements = []
+        with test_app.app_context():
+            listener = _count_statements(db.engine, statements)
+            try:
+                values = [generator.next_value(db.engine, 'claim') for _ in range(250)]
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+
+        assert values == list(range(1, 251))
+        assert generator.leases == 3
+        assert len(statements) <= 3 * 3  # update + select per lease, plus the first insert
+
+    def test_unique_across_processes(self, test_app):
+        """Test that generators in parallel, standing in for processes, never collide"""
+        generators = [IdGenerator(IdSequence.__table__, block_size=50) for _ in range(4)]
+        results = []
+        lock = threading.Lock()
+
+        def generate(generator):
+            with test_app.app_context():
+                values = [generator.next_value(db.engine, 'claim') for _ in range(500)]
+            with lock:
+                results.extend(values)
+
+        threads = [threading.Thread(target=generate, args=(g,)) for g in generators for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == 4000
+        assert len(set(results)) == 4000
+
+    def test_reset_discards_leased_block(self, test_app):
+        """Test that a forked child leases a fresh block"""
+        generator = IdGenerator(IdSequence.__table__, block_size=10)
+        with test_app.app_context():
+            assert generator.next_value(db.engine, 'policy') == 1
+            generator.reset()
+            assert generator.next_value(db.engine, 'policy') == 11
+
+
+class TestClaimNumbers:
+    """Tests for claim numbers assigned by file_claim"""
+
+    def test_claims_in_same_second_do_not_collide(self, test_app, authenticated_client):
+        """Test filing several claims back to back"""
+        for i in range(3):
+            authenticated_client.post('/services/claims/file',
+                data={
+                    'description': f'Claim {i}',
+                    'media': [(io.BytesIO(b'\xff\xd8\xff photo'), 'photo.jpg')]
+                },
+                content_type='multipart/form-data'
+            )
+        with test_app.app_context():
+            numbers = [c.claim_number for c in Claim.query.all()]
+            assert len(numbers) == 3
+            assert len(set(numbers)) == 3
+            assert all(re.fullmatch(r'CLM-\d{8}-\d{8}', n) for n in numbers)
@@ -2,7 +2,7 @@
 Unit tests for user information routes
 """
 import pytest
-from app import db, User
+from models import db, User
 
 
 class TestInformationPage:
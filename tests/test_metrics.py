@@ -0,0 +1,150 @@
+"""
+Unit tests for the metrics registry and /metrics endpoint
+"""
+import threading
+from types import SimpleNamespace
+import pytest
+import ai_services
+from metrics import (AI_REQUESTS, AI_TOKENS, EMAIL_SENT, HTTP_REQUESTS, CallbackMetric, Counter, Histogram,
+                     Registry)
+
+
+def _fake_client(create):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+class TestPrimitives:
+    """Tests for per-thread sharded counters and histograms"""
+
+    def test_counter_sums_thread_shards(self):
+        """Test that increments from many threads add up"""
+        counter = Counter('test_events_total', 'Test events', ['kind'])
+
+        def work():
+            for _ in range(1000):
+                counter.labels('a').inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert counter.labels('a').get() == 8000
+
+    def test_dead_thread_shards_are_retired(self):
+        """Test that finished threads leave only their total behind"""
+        counter = Counter('test_retired_total', 'Test')
+        threads = [threading.Thread(target=counter.inc, args=(2,)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        shards = counter._default._value.shards()
+        assert len(shards) == 1
+        assert counter._default.get() == 40
+
+    def test_histogram_exposition(self):
+        """Test cumulative buckets, sum and count"""
+        histogram = Histogram('test_latency_seconds', 'Test latency', ['route'], buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.labels('home').observe(value)
+        lines = histogram.collect()
+        assert '# TYPE test_latency_seconds histogram' in lines
+        assert 'test_latency_seconds_bucket{route="home",le="0.1"} 2' in lines
+        assert 'test_latency_seconds_bucket{route="home",le="1"} 3' in lines
+        assert 'test_latency_seconds_bucket{route="home",le="+Inf"} 4' in lines
+        assert 'test_latency_seconds_sum{route="home"} 3.65' in lines
+        assert 'test_latency_seconds_count{route="home"} 4' in lines
+
+    def test_wrong_label_count(self):
+        """Test that label mistakes fail loudly"""
+        with pytest.raises(ValueError):
+            Counter('test_labels_total', 'Test', ['a', 'b']).labels('only-one')
+
+    def test_failing_callback_skipped(self):
+        """Test that one broken source does not break the scrape"""
+        registry = Registry()
+        gauge = registry.register(CallbackMetric('test_depth', 'Test depth', ['queue']))
+        gauge.add_callback(lambda: 1 / 0)
+        gauge.add_callback(lambda: [(('mail',), 3)])
+        assert 'test_depth{queue="mail"} 3' in registry.exposition()
+
+
+class TestMetricsEndpoint:
+    """Tests for /metrics"""
+
+    def test_request_metrics(self, client):
+        """Test that requests are counted per endpoint, method and status"""
+        before = HTTP_REQUESTS.labels('login', 'GET', '200').get()
+        client.get('/login')
+        assert HTTP_REQUESTS.labels('login', 'GET', '200').get() == before + 1
+
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        body = response.data.decode()
+        assert 'http_requests_total{endpoint="login",method="GET",status="200"}' in body
+        assert 'http_request_duration_seconds_bucket{endpoint="login",method="GET",le="+Inf"}' in body
+        assert 'db_pool_checked_out{bind="default"}' in body
+        assert 'queue_depth{queue="claim_media"} 0' in body
+
+    def test_token_required_when_configured(self, test_app, client):
+        """Test METRICS_TOKEN"""
+        test_app.config['METRICS_TOKEN'] = 'scrape-secret'
+        try:
+            assert client.get('/metrics').status_code == 401
+            assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+            assert client.get('/metrics', headers={'Authorization': 'Bearer sécret'}).status_code == 401
+            response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+            assert response.status_code == 200
+        finally:
+            test_app.config['METRICS_TOKEN'] = None
+
+    def test_closed_without_token_in_production(self, test_app, client):
+        """Test that /metrics is not public outside debug and testing unless a token is set"""
+        test_app.config['TESTING'] = False
+        assert client.get('/metrics').status_code == 403
+        test_app.config['METRICS_TOKEN'] = 'scrape-secret'
+        response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        assert response.status_code == 200
+
+
+class TestInstrumentation:
+    """Tests for AI and email instrumentation"""
+
+    def test_ai_calls_record_tokens(self, monkeypatch):
+        """Test latency, outcome and token counts per feature"""
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='Hello'))],
+            usage=SimpleNamespace(prompt_tokens=12, completion_tokens=5))
+        monkeypatch.setattr(ai_services, 'openai_client', _fake_client(lambda **kwargs: response))
+        ok = AI_REQUESTS.labels('chat', 'ok').get()
+        prompt = AI_TOKENS.labels('chat', 'prompt').get()
+
+        assert ai_services.AIService.chat_with_ai('Hi') == 'Hello'
+        assert AI_REQUESTS.labels('chat', 'ok').get() == ok + 1
+        assert AI_TOKENS.labels('chat', 'prompt').get() == prompt + 12
+
+    def test_ai_errors_counted(self, monkeypatch):
+        """Test that failed calls are counted and the fallback still answers"""
+        def fail(**kwargs):
+            raise ConnectionError('API down')
+        monkeypatch.setattr(ai_services, 'openai_client', _fake_client(fail))
+        errors = AI_REQUESTS.labels('tag_document', 'error').get()
+
+        assert ai_services.AIService.tag_document('invoice.pdf')
+        assert AI_REQUESTS.labels('tag_document', 'error').get() == errors + 1
+
+    def test_email_outcome_counted(self, test_app, monkeypatch):
+        """Test that a failing mail server is counted"""
+        import email_service
+
+        import flask_mail
+
+        def refuse(connection, message, envelope_from=None):
+            raise ConnectionRefusedError('SMTP down')
+        monkeypatch.setattr(flask_mail.Connection, 'send', refuse)
+        errors = EMAIL_SENT.labels('error').get()
+        with test_app.app_context():
+            assert email_service.send_email('someone@example.com', 'Subject', 'Body') is False
+        assert EMAIL_SENT.labels('error').get() == errors + 1
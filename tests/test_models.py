@@ -3,7 +3,7 @@ Unit tests for database models
 """
 import pytest
 from datetime import date, datetime, timedelta
-from app import db, User, Agent, SwissAxaPolicy, ExternalPolicy, Document, Claim, ClaimMedia, PolicyChangeRequest, Appointment, BankAccount
+from models import db, User, Agent, SwissAxaPolicy, ExternalPolicy, Document, Claim, ClaimMedia, PolicyChangeRequest, Appointment, BankAccount
 
 
 class TestUserModel:
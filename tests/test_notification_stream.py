@@ -0,0 +1,137 @@
+"""
+Unit tests for Server-Sent Events notification push
+"""
+import json
+import time
+import pytest
+from models import db, Notification
+from notification_stream import DatabaseBroker, NotificationHub
+from notifications import add_notification, create_claim_notification
+
+
+def read_events(response, count):
+    """Read SSE chunks until `count` notification events arrived; returns their (id, data)"""
+    events = []
+    for chunk in response.response:
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if text.startswith('id: '):
+            lines = text.splitlines()
+            events.append((int(lines[0][4:]), json.loads(lines[2][6:])))
+            if len(events) == count:
+                break
+    return events
+
+
+@pytest.fixture
+def short_streams(test_app):
+    """Streams that send keepalives and end quickly"""
+    test_app.config['NOTIFICATION_STREAM_KEEPALIVE_SECONDS'] = 0.05
+    test_app.config['NOTIFICATION_STREAM_MAX_SECONDS'] = 2
+    return test_app
+
+
+class TestHub:
+    """Tests for in-process delivery"""
+
+    def test_published_after_commit_only(self, test_app, test_user):
+        """Test that streams get a notification once it commits, and never if it rolls back"""
+        hub = test_app.extensions['notification_stream'].hub
+        subscription = hub.subscribe(test_user['id'])
+        with test_app.app_context():
+            add_notification(test_user['id'], 'Draft', 'Message', commit=False)
+            db.session.flush()
+            assert subscription.get(timeout=0) is None
+            db.session.rollback()
+            assert subscription.get(timeout=0) is None
+
+            notification = create_claim_notification(test_user['id'], 'CLM-1', 'Approved')
+            event = subscription.get(timeout=0)
+            assert event['id'] == notification.id
+            assert event['data']['title'] == 'Claim CLM-1 Updated'
+        hub.unsubscribe(subscription)
+        assert hub.open_streams == 0
+
+    def test_slow_client_overflows(self, test_user):
+        """Test that a full queue marks the subscription instead of blocking publishers"""
+        hub = NotificationHub(max_queued=2)
+        subscription = hub.subscribe(test_user['id'])
+        for i in range(3):
+            hub.publish(test_user['id'], {'id': i, 'data': {}})
+        assert subscription.overflowed
+        hub.publish(test_user['id'] + 1, {'id': 9, 'data': {}})
+
+
+class TestStreamRoute:
+    """Tests for the text/event-stream endpoints"""
+
+    def test_replays_missed_then_pushes(self, test_app, test_user, authenticated_client, short_streams):
+        """Test that Last-Event-ID replays missed notifications before live ones"""
+        with test_app.app_context():
+            seen = add_notification(test_user['id'], 'Seen', 'Message').id
+            add_notification(test_user['id'], 'Missed', 'Message')
+
+        response = authenticated_client.get('/api/notifications/stream', headers={'Last-Event-ID': str(seen)})
+        assert response.mimetype == 'text/event-stream'
+        assert [data['title'] for _, data in read_events(response, 1)] == ['Missed']
+
+        with test_app.app_context():
+            live = add_notification(test_user['id'], 'Live', 'Message').id
+        [(event_id, data)] = read_events(response, 1)
+        assert (event_id, data['title'], data['read']) == (live, 'Live', False)
+        response.close()
+        assert test_app.extensions['notification_stream'].hub.open_streams == 0
+
+    def test_long_replay_resumes_on_reconnect(self, test_app, test_user, authenticated_client, short_streams):
+        """Test that a replay cut at the limit ends the stream, and reconnecting replays the rest"""
+        test_app.config['NOTIFICATION_STREAM_REPLAY_LIMIT'] = 2
+        with test_app.app_context():
+            seen = add_notification(test_user['id'], 'Seen', 'Message').id
+            for i in range(3):
+                add_notification(test_user['id'], f'Missed {i}', 'Message')
+
+        response = authenticated_client.get('/api/notifications/stream', headers={'Last-Event-ID': str(seen)})
+        events = read_events(response, 3)
+        assert [data['title'] for _, data in events] == ['Missed 0', 'Missed 1']
+        response.close()
+
+        response = authenticated_client.get('/api/notifications/stream',
+                                            headers={'Last-Event-ID': str(events[-1][0])})
+        assert [data['title'] for _, data in read_events(response, 1)] == ['Missed 2']
+        response.close()
+
+    def test_mobile_stream_starts_at_now(self, test_app, test_user, authenticated_client, short_streams):
+        """Test that a stream without Last-Event-ID only sends new notifications"""
+        with test_app.app_context():
+            add_notification(test_user['id'], 'Old', 'Message')
+        response = authenticated_client.get('/api/mobile/notifications/stream')
+        with test_app.app_context():
+            add_notification(test_user['id'], 'New', 'Message')
+        assert [data['title'] for _, data in read_events(response, 1)] == ['New']
+        response.close()
+
+    def test_requires_login(self, client):
+        """Test that anonymous clients cannot open a stream"""
+        assert client.get('/api/notifications/stream').status_code == 302
+
+
+class TestDatabaseBroker:
+    """Tests for delivery across processes through the notification table"""
+
+    def test_poller_delivers_rows_from_anywhere(self, test_app, test_user):
+        """Test that rows added without a local publish still reach the stream"""
+        hub = NotificationHub()
+        broker = DatabaseBroker(hub, test_app, interval=0.02)
+        subscription = broker.subscribe(test_user['id'])
+        with test_app.app_context():
+            # As another process would: the row alone, no publish in this process
+            db.session.add(Notification(user_id=test_user['id'], title='From cron', message='Message'))
+            db.session.commit()
+
+        event = subscription.get(timeout=5)
+        assert event['data']['title'] == 'From cron'
+
+        hub.unsubscribe(subscription)
+        deadline = time.monotonic() + 5
+        while broker._thread is not None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert broker._thread is None
@@ -0,0 +1,134 @@
+"""
+Unit tests for the database-backed notification store
+"""
+from datetime import datetime, timedelta
+from models import db, User, Notification
+from notifications import (add_notification, add_notifications, get_user_notifications, unread_count,
+                           mark_notification_read, mark_all_read, purge_notifications)
+
+
+def make_user(email):
+    user = User(email=email, first_name='Other', last_name='User')
+    user.set_password('otherpassword123')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+class TestStore:
+    """Tests for adding, listing and reading notifications"""
+
+    def test_list_newest_first_and_paged(self, test_app, test_user):
+        """Test that lists are newest first and ?before continues the list"""
+        with test_app.app_context():
+            for i in range(5):
+                add_notification(test_user['id'], f'Title {i}', 'Message')
+            first = get_user_notifications(test_user['id'], limit=3)
+            assert [n.title for n in first] == ['Title 4', 'Title 3', 'Title 2']
+            rest = get_user_notifications(test_user['id'], limit=3, before_id=first[-1].id)
+            assert [n.title for n in rest] == ['Title 1', 'Title 0']
+
+    def test_unread_counter(self, test_app, test_user):
+        """Test that the counter follows adds and reads, and reading twice counts once"""
+        with test_app.app_context():
+            assert unread_count(test_user['id']) == 0
+            notifications = [add_notification(test_user['id'], 'Title', 'Message') for _ in range(3)]
+            assert unread_count(test_user['id']) == 3
+
+            assert mark_notification_read(test_user['id'], notifications[0].id) is True
+            assert mark_notification_read(test_user['id'], notifications[0].id) is True
+            assert unread_count(test_user['id']) == 2
+            unread = get_user_notifications(test_user['id'], unread_only=True)
+            assert notifications[0].id not in [n.id for n in unread]
+
+            assert mark_all_read(test_user['id']) == 2
+            assert unread_count(test_user['id']) == 0
+
+    def test_add_for_many_users(self, test_app, test_user):
+        """Test the bulk insert, its counters and its push to open streams"""
+        hub = test_app.extensions['notification_stream'].hub
+        subscription = hub.subscribe(test_user['id'])
+        with test_app.app_context():
+            other_id = make_user('other@example.com')
+            add_notification(test_user['id'], 'Earlier', 'Message')
+            subscription.get(timeout=0)
+            assert add_notifications([test_user['id'], other_id], 'Terms', 'Message') == 2
+            db.session.commit()
+            assert (unread_count(test_user['id']), unread_count(other_id)) == (2, 1)
+            assert get_user_notifications(other_id)[0].title == 'Terms'
+        assert subscription.get(timeout=0)['data']['title'] == 'Terms'
+        hub.unsubscribe(subscription)
+
+    def test_other_users_notifications(self, test_app, test_user):
+        """Test that a user cannot read someone else's notification"""
+        with test_app.app_context():
+            other_id = make_user('other@example.com')
+            notification = add_notification(other_id, 'Private', 'Message')
+            assert mark_notification_read(test_user['id'], notification.id) is False
+            assert unread_count(other_id) == 1
+            assert get_user_notifications(test_user['id']) == []
+
+
+class TestPurge:
+    """Tests for the batched retention purge"""
+
+    def test_purge_old_notifications(self, test_app, test_user):
+        """Test that only old notifications go, and unread ones leave the counter"""
+        with test_app.app_context():
+            old = [add_notification(test_user['id'], 'Old', 'Message') for _ in range(5)]
+            add_notification(test_user['id'], 'New', 'Message')
+            mark_notification_read(test_user['id'], old[0].id)
+            for notification in old:
+                notification.created_at = datetime.utcnow() - timedelta(days=100)
+            db.session.commit()
+            assert unread_count(test_user['id']) == 5
+
+            stats = purge_notifications(retention_days=90, batch_size=2, max_batches=2)
+            assert stats == {'deleted': 4, 'batches': 2, 'complete': False}
+            stats = purge_notifications(retention_days=90, batch_size=2)
+            assert stats['deleted'] == 1 and stats['complete'] is True
+
+            assert [n.title for n in get_user_notifications(test_user['id'])] == ['New']
+            assert unread_count(test_user['id']) == 1
+
+    def test_cli_command(self, test_app, test_user):
+        """Test flask notifications-purge"""
+        with test_app.app_context():
+            notification = add_notification(test_user['id'], 'Old', 'Message')
+            notification.created_at = datetime.utcnow() - timedelta(days=100)
+            db.session.commit()
+        result = test_app.test_cli_runner().invoke(args=['notifications-purge'])
+        assert 'Deleted 1 notifications in 1 batches.' in result.output
+        assert 'Purge complete.' in result.output
+        with test_app.app_context():
+            assert db.session.query(Notification).count() == 0
+
+
+class TestRoutes:
+    """Tests for the notification API"""
+
+    def test_list_count_and_read(self, test_app, test_user, authenticated_client):
+        """Test the list, the unread count and marking read over HTTP"""
+        with test_app.app_context():
+            first = add_notification(test_user['id'], 'First', 'Message').id
+            add_notification(test_user['id'], 'Second', 'Message')
+
+        response = authenticated_client.get('/api/notifications?limit=1')
+        assert [n['title'] for n in response.get_json()] == ['Second']
+        assert authenticated_client.get('/api/notifications/unread-count').get_json() == {'unread': 2}
+
+        assert authenticated_client.post(f'/api/notifications/{first}/read').status_code == 200
+        assert authenticated_client.post('/api/notifications/99999/read').status_code == 404
+        assert authenticated_client.post('/api/notifications/read-all').get_json()['marked'] == 1
+        mobile = authenticated_client.get('/api/mobile/notifications?unread=1')
+        assert mobile.get_json() == []
+        assert mobile.headers['X-Unread-Count'] == '0'
+
+    def test_legacy_cookie_entry_dropped(self, test_user, authenticated_client):
+        """Test that notifications left in the session cookie are removed"""
+        key = f"notifications_{test_user['id']}"
+        with authenticated_client.session_transaction() as http_session:
+            http_session[key] = [{'title': 'Old cookie notification'}]
+        authenticated_client.get('/api/notifications')
+        with authenticated_client.session_transaction() as http_session:
+            assert key not in http_session
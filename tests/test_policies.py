@@ -3,7 +3,7 @@ Unit tests for policy-related routes
 """
 import pytest
 from datetime import date, timedelta
-from app import db, SwissAxaPolicy, ExternalPolicy
+from models import db, SwissAxaPolicy, ExternalPolicy
 
 
 class TestPoliciesPage:
@@ -0,0 +1,151 @@
+"""
+Unit tests for the sampling request profiler
+"""
+import os
+import tempfile
+import threading
+import time
+import shutil
+import pytest
+from profiling import ProfilingMiddleware, StackSampler, list_profiles, write_profile
+
+PROFILE_SETTINGS = ('PROFILE_DIR', 'PROFILE_ENDPOINTS', 'PROFILE_SAMPLE_RATE', 'PROFILE_TOKEN',
+                    'PROFILE_MIN_DURATION_MS', 'PROFILE_MAX_FILES', 'ADMIN_EMAILS')
+
+
+def slow_inner():
+    time.sleep(0.05)
+
+
+def slow_outer():
+    slow_inner()
+
+
+@pytest.fixture
+def profiler(test_app):
+    """
+    Install the middleware on the test app, with slow views so every request gets samples
+
+    Profiles are written when the server closes the response, so tests request
+    with buffered=True, which makes the test client close it.
+    """
+    saved = {key: test_app.config[key] for key in PROFILE_SETTINGS}
+    original_wsgi_app = test_app.wsgi_app
+    original_views = dict(test_app.view_functions)
+    directory = tempfile.mkdtemp()
+    test_app.config['PROFILE_DIR'] = directory
+
+    def slowed(view):
+        def wrapper(*args, **kwargs):
+            slow_outer()
+            return view(*args, **kwargs)
+        return wrapper
+    for endpoint in ('policies', 'policy_management'):
+        test_app.view_functions[endpoint] = slowed(test_app.view_functions[endpoint])
+
+    test_app.wsgi_app = ProfilingMiddleware(original_wsgi_app, test_app, StackSampler(interval=0.002))
+    yield directory
+
+    test_app.wsgi_app = original_wsgi_app
+    test_app.view_functions.update(original_views)
+    test_app.config.update(saved)
+    shutil.rmtree(directory)
+
+
+class TestSampler:
+    """Tests for stack sampling"""
+
+    def test_samples_root_first_stacks(self):
+        """Test that samples show callers before callees"""
+        sampler = StackSampler(interval=0.001)
+        result = {}
+
+        def target():
+            sampler.start(threading.get_ident())
+            slow_outer()
+            result['counts'] = sampler.stop(threading.get_ident())
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+        stacks = [stack for stack in result['counts'] if 'slow_inner' in stack]
+        assert stacks
+        frames = stacks[0].split(';')
+        assert frames.index(next(f for f in frames if f.startswith('slow_outer'))) < \
+            frames.index(next(f for f in frames if f.startswith('slow_inner')))
+        assert 'test_profiling.py' in stacks[0]
+
+    def test_write_and_prune(self, tmp_path):
+        """Test the file format and the retention limit"""
+        from collections import Counter
+        for _ in range(3):
+            write_profile(str(tmp_path), Counter({'a;b': 3, 'a;c': 1}), 'file_claim', 0.25, max_files=2)
+        profiles = list_profiles(str(tmp_path))
+        assert len(profiles) == 2
+        assert profiles[0]['endpoint'] == 'file_claim'
+        assert profiles[0]['duration_ms'] == 250
+        lines = (tmp_path / profiles[0]['name']).read_text().splitlines()
+        assert lines == ['a;b 3', 'a;c 1']
+
+
+class TestSelection:
+    """Tests for choosing which requests to profile"""
+
+    def test_configured_endpoint_profiled(self, test_app, authenticated_client, profiler):
+        """Test PROFILE_ENDPOINTS"""
+        test_app.config['PROFILE_ENDPOINTS'] = ['policy_management']
+        authenticated_client.get('/policies', buffered=True)
+        assert list_profiles(profiler) == []
+
+        authenticated_client.get('/services/policy-management', buffered=True)
+        [profile] = list_profiles(profiler)
+        assert profile['endpoint'] == 'policy_management'
+        assert profile['duration_ms'] >= 50
+        with open(os.path.join(profiler, profile['name'])) as f:
+            assert 'slow_inner' in f.read()
+
+    def test_header_with_token(self, test_app, authenticated_client, profiler):
+        """Test X-Profile-Request, which needs the configured token"""
+        test_app.config['PROFILE_TOKEN'] = 'let-me-profile'
+        authenticated_client.get('/policies', headers={'X-Profile-Request': 'wrong'}, buffered=True)
+        assert list_profiles(profiler) == []
+        authenticated_client.get('/policies', headers={'X-Profile-Request': 'let-me-profile'}, buffered=True)
+        assert [p['endpoint'] for p in list_profiles(profiler)] == ['policies']
+
+    def test_sample_rate_and_min_duration(self, test_app, authenticated_client, profiler):
+        """Test PROFILE_SAMPLE_RATE, and that fast requests can be discarded"""
+        test_app.config['PROFILE_SAMPLE_RATE'] = 1.0
+        test_app.config['PROFILE_MIN_DURATION_MS'] = 10000
+        authenticated_client.get('/policies', buffered=True)
+        assert list_profiles(profiler) == []
+
+        test_app.config['PROFILE_MIN_DURATION_MS'] = 0
+        authenticated_client.get('/policies', buffered=True)
+        assert len(list_profiles(profiler)) == 1
+
+
+class TestAdminRoutes:
+    """Tests for listing and downloading profiles"""
+
+    def test_non_admin_forbidden(self, authenticated_client, profiler):
+        """Test that ordinary customers cannot see profiles"""
+        assert authenticated_client.get('/admin/profiles').status_code == 403
+
+    def test_admin_lists_and_downloads(self, test_app, authenticated_client, profiler):
+        """Test the listing and the download link"""
+        test_app.config['ADMIN_EMAILS'] = ['test@example.com']
+        test_app.config['PROFILE_ENDPOINTS'] = ['policies']
+        authenticated_client.get('/policies', buffered=True)
+
+        response = authenticated_client.get('/admin/profiles')
+        assert response.status_code == 200
+        [profile] = response.get_json()
+        download = authenticated_client.get(profile['url'])
+        assert download.status_code == 200
+        assert 'attachment' in download.headers['Content-Disposition']
+        assert b'slow_outer' in download.data
+
+    def test_download_rejects_other_files(self, test_app, authenticated_client, profiler):
+        """Test that only profile file names are served"""
+        test_app.config['ADMIN_EMAILS'] = ['test@example.com']
+        assert authenticated_client.get('/admin/profiles/..%2Fapp.py').status_code == 404
@@ -0,0 +1,147 @@
+"""
+Unit tests for per-request query stats and query budgets
+"""
+import json
+import logging
+import pytest
+from flask import g
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import OperationalError
+from models import db, User, Claim
+from init_sample_data import generate_bulk_data
+from query_stats import QueryStats, assert_max_queries, param_shape
+
+
+@pytest.fixture
+def busy_client(test_app, client):
+    """Log in as a user with enough rows that an N+1 loop would stand out"""
+    generate_bulk_data(users=1, policies_per_user=4, claims_per_user=6, media_per_claim=3,
+                       documents_per_user=5, appointments_per_user=3, events_per_user=0,
+                       media_size=0, progress=lambda message: None)
+    with test_app.app_context():
+        email = db.session.scalar(select(User.email))
+        client.claim_id = db.session.scalar(select(Claim.id))
+    client.post('/login', data={'email': email, 'password': 'password123'})
+    return client
+
+
+class TestServerTiming:
+    """Tests for the Server-Timing header"""
+
+    def test_header_reports_queries(self, test_app, authenticated_client, test_policy):
+        """Test that the database share of a response is reported"""
+        response = authenticated_client.get('/policies')
+        timing = response.headers['Server-Timing']
+        assert timing.startswith('db;dur=')
+        assert 'queries' in timing
+        assert ', app;dur=' in timing
+
+    def test_header_can_be_disabled(self, test_app, authenticated_client):
+        """Test SERVER_TIMING_HEADER = False"""
+        test_app.config['SERVER_TIMING_HEADER'] = False
+        try:
+            response = authenticated_client.get('/policies')
+        finally:
+            test_app.config['SERVER_TIMING_HEADER'] = True
+        assert 'Server-Timing' not in response.headers
+
+
+class TestFailedStatements:
+    """Tests for statements that raise"""
+
+    def test_failed_statement_leaves_nothing_behind(self, test_app):
+        """Test that a failing statement is not recorded and leaves no state on the pooled connection"""
+        with test_app.test_request_context():
+            g._query_stats = stats = QueryStats()
+            pooled_info = db.session.connection().info  # Lives as long as the pooled connection
+            with pytest.raises(OperationalError):
+                db.session.execute(text('SELECT * FROM no_such_table'))
+            db.session.rollback()
+            assert db.session.scalar(select(func.count()).select_from(User)) == 0
+            assert stats.queries == 1
+            assert not any(key.startswith('query_stats') for key in pooled_info)
+
+
+class TestSlowRequestLog:
+    """Tests for the structured slow-request log"""
+
+    def _slow_records(self, caplog):
+        return [json.loads(r.getMessage()) for r in caplog.records if r.name == 'swissaxa.slow_requests']
+
+    def test_slow_request_logged_with_statements(self, test_app, authenticated_client, test_policy, caplog):
+        """Test the log line for a request over SLOW_REQUEST_MS"""
+        test_app.config['SLOW_REQUEST_MS'] = 0
+        try:
+            with caplog.at_level(logging.WARNING, logger='swissaxa.slow_requests'):
+                authenticated_client.get('/policies')
+        finally:
+            test_app.config['SLOW_REQUEST_MS'] = 500
+
+        [record] = self._slow_records(caplog)
+        assert record['path'] == '/policies'
+        assert record['endpoint'] == 'policies'
+        assert record['status'] == 200
+        assert record['queries'] >= 1
+        assert record['slowest'][0]['statement'].startswith('SELECT')
+        assert record['slowest'][0]['params'].startswith('(')
+
+    def test_parameter_values_not_logged(self, test_app, client, test_user, caplog):
+        """Test that bound values such as the login email stay out of the log"""
+        test_app.config['SLOW_REQUEST_MS'] = 0
+        try:
+            with caplog.at_level(logging.WARNING, logger='swissaxa.slow_requests'):
+                client.post('/login', data={'email': 'test@example.com', 'password': 'testpassword123'})
+        finally:
+            test_app.config['SLOW_REQUEST_MS'] = 500
+
+        [record] = self._slow_records(caplog)
+        assert 'test@example.com' not in json.dumps(record)
+        assert any('str' in statement['params'] for statement in record['slowest'])
+
+    def test_chatty_request_logged(self, test_app, busy_client, caplog):
+        """Test that a fast request over SLOW_REQUEST_QUERIES is logged too"""
+        test_app.config['SLOW_REQUEST_QUERIES'] = 1
+        try:
+            with caplog.at_level(logging.WARNING, logger='swissaxa.slow_requests'):
+                busy_client.get('/api/mobile/claims')
+                busy_client.get('/api/mobile/policies')
+        finally:
+            test_app.config['SLOW_REQUEST_QUERIES'] = 50
+        assert [r['path'] for r in self._slow_records(caplog)] == ['/api/mobile/claims']
+
+
+class TestParamShape:
+    """Tests for parameter shapes"""
+
+    def test_shapes(self):
+        """Test positional, named, repeated and executemany parameters"""
+        assert param_shape(('a@example.com', 1)) == '(str, int)'
+        assert param_shape((1, 2, 3, 'x')) == '(int x 3, str)'
+        assert param_shape({'user_id': 5}) == '{user_id: int}'
+        assert param_shape([(1, 'a'), (2, 'b')], executemany=True) == '2 x (int, str)'
+        assert param_shape(()) == '()'
+
+
+class TestQueryBudgets:
+    """Query budgets for the main views; a failure here usually means an N+1 loop"""
+
+    def test_helper_reports_statements(self, test_app, busy_client):
+        """Test that an exceeded budget fails with the statements listed"""
+        with pytest.raises(AssertionError, match=r'at most 0 queries.*\n  1\. SELECT'):
+            with assert_max_queries(0):
+                busy_client.get('/api/mobile/policies')
+
+    def test_portal_views(self, busy_client):
+        """Test the dashboard and list pages"""
+        for path, limit in [('/dashboard', 5), ('/policies', 3), ('/documents', 2),
+                            ('/services/claims', 3), ('/services/policy-management', 3)]:
+            with assert_max_queries(limit):
+                assert busy_client.get(path).status_code == 200, path
+
+    def test_mobile_api(self, busy_client):
+        """Test the mobile endpoints"""
+        for path, limit in [('/api/mobile/claims', 2), (f'/api/mobile/claims/{busy_client.claim_id}', 2),
+                            ('/api/mobile/policies', 1), ('/api/mobile/documents', 1),
+                            ('/api/mobile/dashboard/stats', 4)]:
+            with assert_max_queries(limit):
+                assert busy_client.get(path).status_code == 200, path
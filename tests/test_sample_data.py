@@ -0,0 +1,103 @@
+"""
+Unit tests for the bulk sample data generator
+"""
+import os
+from datetime import date
+from sqlalchemy import func, select
+from models import db, User, SwissAxaPolicy, Claim, ClaimMedia, Document, Appointment, StorageUsage
+from init_sample_data import generate_bulk_data
+
+REFERENCE_DATE = date(2024, 3, 15)
+
+
+def _generate(**overrides):
+    options = dict(users=5, policies_per_user=2, claims_per_user=2, media_per_claim=2,
+                   documents_per_user=1, appointments_per_user=1, events_per_user=3,
+                   media_size=256, batch_size=2, reference_date=REFERENCE_DATE,
+                   progress=lambda message: None)
+    options.update(overrides)
+    return generate_bulk_data(**options)
+
+
+class TestBulkData:
+    """Tests for generate_bulk_data"""
+
+    def test_row_counts(self, test_app):
+        """Test that every table gets the requested number of rows per user"""
+        counts = _generate()
+        assert counts['user'] == 5
+        assert counts['swissaxa_policy'] == 10
+        assert counts['claim'] == 10
+        assert counts['claim_media'] == 20
+        assert counts['document'] == 5
+        assert counts['appointment'] == 5
+        assert counts['analytics_events'] == 15
+        assert counts['files'] == 25
+        with test_app.app_context():
+            assert db.session.scalar(select(func.count(ClaimMedia.id))) == 20
+            assert db.session.scalar(select(func.count(func.distinct(Claim.claim_number)))) == 10
+            assert db.session.scalar(select(func.count(func.distinct(SwissAxaPolicy.policy_number)))) == 10
+
+    def test_same_seed_same_data(self, test_app):
+        """Test that a seed reproduces the data set"""
+        def snapshot():
+            with test_app.app_context():
+                return (db.session.execute(select(User.email, User.first_name, User.bank_account)).all(),
+                        db.session.execute(select(Claim.claim_number, Claim.damage_type, Claim.status)).all(),
+                        db.session.execute(select(Appointment.date_time, Appointment.status)).all())
+
+        _generate(seed=7)
+        first = snapshot()
+        db.drop_all()
+        db.create_all()
+        test_app.extensions['id_generator'].reset()
+        _generate(seed=7)
+        assert snapshot() == first
+
+        db.drop_all()
+        db.create_all()
+        test_app.extensions['id_generator'].reset()
+        _generate(seed=7, media_size=4096)
+        assert snapshot() == first
+
+        db.drop_all()
+        db.create_all()
+        _generate(seed=8)
+        assert snapshot() != first
+
+    def test_appends_to_existing_data(self, test_app, test_user, test_policy):
+        """Test that generated ids start after existing rows"""
+        _generate(users=2)
+        _generate(users=2)
+        with test_app.app_context():
+            assert db.session.scalar(select(func.count(User.id))) == 5
+            assert db.session.get(User, test_user['id']).email == 'test@example.com'
+
+    def test_bulk_users_can_log_in(self, test_app, client):
+        """Test the shared password of generated users"""
+        _generate(users=1)
+        with test_app.app_context():
+            email = db.session.scalar(select(User.email))
+        response = client.post('/login', data={'email': email, 'password': 'password123'})
+        assert response.status_code == 302
+
+    def test_media_files_written(self, test_app):
+        """Test that files of the configured size back the media rows"""
+        _generate(users=2, media_size=1000)
+        with test_app.app_context():
+            media = db.session.scalars(select(ClaimMedia)).all()
+            documents = db.session.scalars(select(Document)).all()
+            for row in media + documents:
+                path = os.path.join(test_app.config['UPLOAD_FOLDER'], row.file_path)
+                assert os.path.getsize(path) == 1000
+                assert row.file_size == 1000
+            assert open(os.path.join(test_app.config['UPLOAD_FOLDER'], media[0].file_path), 'rb').read(2) in (
+                b'\xff\xd8', b'\x00\x00')
+            usage = db.session.scalars(select(StorageUsage)).all()
+            assert sum(u.bytes_used for u in usage) == 1000 * (len(media) + len(documents))
+
+    def test_media_size_zero_writes_no_files(self, test_app):
+        """Test that rows can be generated without touching storage"""
+        counts = _generate(users=2, media_size=0)
+        assert counts['files'] == 0
+        assert counts['claim_media'] == 8
@@ -3,7 +3,7 @@ Unit tests for services-related routes
 """
 import pytest
 from datetime import datetime, timedelta
-from app import db, PolicyChangeRequest, Appointment, Agent
+from models import db, PolicyChangeRequest, Appointment, Agent
 
 
 class TestServicesPage:
@@ -113,7 +113,9 @@ class TestScheduling:
     def test_book_appointment_with_agent(self, test_app, authenticated_client, test_user, test_agent):
         """Test booking appointment with agent"""
         with test_app.app_context():
-            appointment_time = datetime.now() + timedelta(days=7)
+            # Agents take appointments on the half hour during working hours (Monday 10:00 here)
+            appointment_time = (datetime.utcnow() + timedelta(days=7)).replace(hour=10, minute=0, second=0, microsecond=0)
+            appointment_time += timedelta(days=(7 - appointment_time.weekday()) % 7)
             response = authenticated_client.post('/services/scheduling',
                 data={
                     'agent_id': str(test_agent['id']),
@@ -137,7 +139,9 @@ class TestScheduling:
     def test_book_appointment_with_service_desk(self, test_app, authenticated_client, test_user):
         """Test booking appointment with service desk"""
         with test_app.app_context():
-            appointment_time = datetime.now() + timedelta(days=5)
+            # The service desk takes appointments on the half hour during its hours (Monday 10:00 here)
+            appointment_time = (datetime.utcnow() + timedelta(days=5)).replace(hour=10, minute=0, second=0, microsecond=0)
+            appointment_time += timedelta(days=(7 - appointment_time.weekday()) % 7)
             response = authenticated_client.post('/services/scheduling',
                 data={
                     'appointment_type': 'service_desk',
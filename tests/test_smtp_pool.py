@@ -0,0 +1,76 @@
+"""
+Unit tests for pooled SMTP connections and sending rate limits
+"""
+import pytest
+import email_service
+from email_outbox import enqueue_email, process_outbox
+from models import db, EmailOutbox
+from smtp_pool import TokenBucket
+
+
+class TestConnectionReuse:
+    """Tests for sending many emails per connection"""
+
+    def test_outbox_batch_shares_one_connection(self, test_app, smtp_server):
+        """Test that a batch and the next one go out over the same connection"""
+        with test_app.app_context():
+            for i in range(5):
+                enqueue_email(f'customer{i}@example.com', f'Claim {i} updated', 'Body')
+            assert process_outbox(limit=3) == 3
+            assert process_outbox(limit=3) == 2
+            statuses = db.session.scalars(db.select(EmailOutbox.status)).all()
+        assert statuses == ['sent'] * 5
+        assert len(smtp_server.messages) == 5
+        assert smtp_server.connections == 1
+        assert smtp_server.messages[0][1] == ['customer0@example.com']
+
+    def test_connection_replaced_after_max_messages(self, test_app, smtp_server):
+        """Test EMAIL_SMTP_MAX_MESSAGES"""
+        test_app.config['EMAIL_SMTP_MAX_MESSAGES'] = 2
+        with test_app.app_context():
+            for i in range(5):
+                assert email_service.send_email(f'customer{i}@example.com', 'Subject', 'Body')
+        assert smtp_server.connections == 3
+
+    def test_reconnects_when_server_drops(self, test_app, smtp_server):
+        """Test that a connection closed by the server is replaced without losing the email"""
+        smtp_server.drop_after = 2
+        with test_app.app_context():
+            for i in range(4):
+                assert email_service.send_email(f'customer{i}@example.com', 'Subject', 'Body')
+        assert len(smtp_server.messages) == 4
+        assert smtp_server.connections == 2
+
+    def test_idle_connection_not_reused(self, test_app, smtp_server):
+        """Test that connections unused for EMAIL_SMTP_IDLE_SECONDS are closed"""
+        test_app.config['EMAIL_SMTP_IDLE_SECONDS'] = 0
+        with test_app.app_context():
+            email_service.send_email('a@example.com', 'Subject', 'Body')
+            email_service.send_email('b@example.com', 'Subject', 'Body')
+        assert smtp_server.connections == 2
+
+
+class TestRateLimit:
+    """Tests for per-provider sending rates"""
+
+    def test_token_bucket(self):
+        """Test that the bucket allows a burst, then one token per 1/rate seconds"""
+        now = [0.0]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            now[0] += seconds
+        bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0], sleep=sleep)
+        assert bucket.acquire() == 0
+        assert bucket.acquire() == 0
+        assert bucket.acquire() == pytest.approx(0.1)
+        now[0] += 1
+        assert bucket.acquire() == 0
+
+    def test_limit_chosen_by_mail_server(self, test_app, smtp_server):
+        """Test EMAIL_RATE_LIMITS"""
+        test_app.config['EMAIL_RATE_LIMITS'] = {'127.0.0.1': 50}
+        with test_app.app_context():
+            pool = email_service.get_smtp_pool()
+        assert pool.rate_limiter.rate == 50
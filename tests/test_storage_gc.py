@@ -0,0 +1,180 @@
+"""
+Unit tests for the storage garbage collector and per-user usage counters
+"""
+import io
+import time
+from models import db, User, Document, ExternalPolicy, StorageUsage, StorageScanCheckpoint
+from storage import get_storage
+from storage_gc import collect_garbage
+from storage_usage import get_usage, recount_usage, record_usage
+
+PDF = b'%PDF-1.7\n' + b'0' * 64
+LATER = time.time() + 7 * 24 * 3600
+
+
+def _put(key, data=b'data'):
+    get_storage().put_stream(key, io.BytesIO(data))
+
+
+def _add_document(user_id, file_path, file_size=None):
+    document = Document(user_id=user_id, filename=file_path.rsplit('/', 1)[-1],
+                        file_path=file_path, document_type='general', file_size=file_size)
+    db.session.add(document)
+    db.session.commit()
+    return document.id
+
+
+class TestCollectGarbage:
+    """Tests for orphan detection and the checkpointed scan"""
+
+    def test_deletes_only_unreferenced_files(self, test_app, test_user):
+        """Test that referenced files survive and orphans are removed"""
+        with test_app.app_context():
+            _put('documents/kept.pdf')
+            _put('documents/orphan.pdf', b'orphaned')
+            _add_document(test_user['id'], 'documents/kept.pdf')
+
+            stats = collect_garbage(now=LATER)
+
+            storage = get_storage()
+            assert storage.exists('documents/kept.pdf')
+            assert not storage.exists('documents/orphan.pdf')
+            assert stats['orphans'] == 1
+            assert stats['bytes_reclaimed'] == 8
+            assert stats['complete']
+
+    def test_recent_files_are_kept(self, test_app):
+        """Test that files younger than the grace period are not deleted"""
+        with test_app.app_context():
+            _put('claims/in_flight.jpg')
+            stats = collect_garbage()
+            assert stats['orphans'] == 0
+            assert get_storage().exists('claims/in_flight.jpg')
+
+    def test_legacy_paths_count_as_references(self, test_app, test_user):
+        """Test that rows holding pre-storage-layer paths keep their files"""
+        with test_app.app_context():
+            _put('policies/old.pdf')
+            _put('documents/old.pdf')
+            db.session.add(ExternalPolicy(user_id=test_user['id'], insurance_company='Allianz',
+                                          file_path='uploads/policies/old.pdf'))
+            db.session.commit()
+            _add_document(test_user['id'], f"{test_app.config['UPLOAD_FOLDER']}/documents/old.pdf")
+
+            collect_garbage(now=LATER)
+            assert get_storage().exists('policies/old.pdf')
+            assert get_storage().exists('documents/old.pdf')
+
+    def test_scan_resumes_from_checkpoint(self, test_app):
+        """Test that a limited run continues where the previous one stopped"""
+        with test_app.app_context():
+            for name in ('a', 'b', 'c', 'd', 'e'):
+                _put(f'documents/{name}.pdf')
+
+            first = collect_garbage(batch_size=2, max_batches=1, now=LATER)
+            assert first['scanned'] == 2
+            assert not first['complete']
+            assert db.session.get(StorageScanCheckpoint, 'storage_gc').last_key == 'documents/b.pdf'
+
+            rest = collect_garbage(batch_size=2, now=LATER)
+            assert rest['scanned'] == 3
+            assert rest['complete']
+            checkpoint = db.session.get(StorageScanCheckpoint, 'storage_gc')
+            assert checkpoint.last_key is None
+            assert checkpoint.orphans_deleted == 5
+
+    def test_dry_run_changes_nothing(self, test_app):
+        """Test that a dry run only reports"""
+        with test_app.app_context():
+            _put('documents/orphan.pdf')
+            stats = collect_garbage(dry_run=True, now=LATER)
+            assert stats['orphans'] == 1
+            assert get_storage().exists('documents/orphan.pdf')
+            assert db.session.get(StorageScanCheckpoint, 'storage_gc') is None
+
+    def test_completed_pass_backfills_and_recounts(self, test_app, test_user):
+        """Test that missing sizes are recorded and counters rebuilt"""
+        with test_app.app_context():
+            _put('documents/legacy.pdf', b'x' * 100)
+            doc_id = _add_document(test_user['id'], 'documents/legacy.pdf')
+            record_usage(test_user['id'], 12345, 7)  # Drifted counter
+            db.session.commit()
+
+            stats = collect_garbage(now=LATER)
+
+            assert stats['backfilled'] == 1
+            assert db.session.get(Document, doc_id).file_size == 100
+            usage = db.session.get(StorageUsage, test_user['id'])
+            assert (usage.bytes_used, usage.file_count) == (100, 1)
+
+    def test_recount_overwrites_counters_in_place(self, test_app, test_user):
+        """Test that recounting sets totals without deleting rows, and zeroes users without files"""
+        with test_app.app_context():
+            other = User(email='other@example.com', first_name='Other', last_name='User')
+            other.set_password('otherpassword123')
+            db.session.add(other)
+            db.session.commit()
+            _put('documents/kept.pdf', b'x' * 50)
+            _add_document(test_user['id'], 'documents/kept.pdf', file_size=50)
+            record_usage(test_user['id'], 999, 3)
+            record_usage(other.id, 500, 2)  # Files since deleted
+            db.session.commit()
+
+            recount_usage()
+            db.session.commit()
+            assert (get_usage(test_user['id'])['bytes_used'], get_usage(test_user['id'])['file_count']) == (50, 1)
+            assert (get_usage(other.id)['bytes_used'], get_usage(other.id)['file_count']) == (0, 0)
+            assert db.session.get(StorageUsage, other.id) is not None
+
+    def test_cli_command(self, test_app):
+        """Test the storage-gc command"""
+        result = test_app.test_cli_runner().invoke(args=['storage-gc', '--dry-run'])
+        assert result.exit_code == 0
+        assert 'Pass complete.' in result.output
+
+
+class TestStorageUsage:
+    """Tests for per-user counters and quotas"""
+
+    def test_uploads_increment_counters(self, test_app, authenticated_client, test_user):
+        """Test that each stored file is added to the owner's usage"""
+        for name in ('one.pdf', 'two.pdf'):
+            authenticated_client.post('/documents/upload',
+                data={'file': (io.BytesIO(PDF), name), 'document_type': 'policy'},
+                content_type='multipart/form-data'
+            )
+        response = authenticated_client.get('/api/storage/usage')
+        assert response.get_json()['bytes_used'] == 2 * len(PDF)
+        assert response.get_json()['file_count'] == 2
+
+    def test_same_filename_does_not_overwrite(self, test_app, authenticated_client):
+        """Test that uploading a name twice keeps both files"""
+        for content in (PDF, PDF + b'v2'):
+            authenticated_client.post('/documents/upload',
+                data={'file': (io.BytesIO(content), 'same.pdf'), 'document_type': 'policy'},
+                content_type='multipart/form-data'
+            )
+        with test_app.app_context():
+            paths = [d.file_path for d in Document.query.filter_by(filename='same.pdf')]
+            assert len(set(paths)) == 2
+            assert all(get_storage().exists(p) for p in paths)
+
+    def test_quota_rejects_upload(self, test_app, authenticated_client, test_user):
+        """Test that an upload exceeding the quota is refused and not stored"""
+        with test_app.app_context():
+            record_usage(test_user['id'], 1000, 1)
+            db.session.commit()
+
+        test_app.config['STORAGE_QUOTA_BYTES'] = 1000 + len(PDF) - 1
+        try:
+            response = authenticated_client.post('/documents/upload',
+                data={'file': (io.BytesIO(PDF), 'big.pdf'), 'document_type': 'policy'},
+                content_type='multipart/form-data',
+                follow_redirects=True
+            )
+            assert b'Storage quota exceeded' in response.data
+            with test_app.app_context():
+                assert Document.query.filter_by(filename='big.pdf').first() is None
+                assert get_usage(test_user['id'])['remaining_bytes'] == len(PDF) - 1
+        finally:
+            test_app.config['STORAGE_QUOTA_BYTES'] = None
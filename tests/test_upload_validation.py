@@ -0,0 +1,219 @@
+"""
+Unit tests for the streaming upload validation stage
+"""
+import hashlib
+import io
+import os
+import socket
+import struct
+import threading
+import pytest
+from models import Document, Claim
+from storage import LocalStorage
+from upload_validation import (ValidatingReader, TypeCheck, SizeLimitCheck, ClamdScanCheck,
+                               UploadRejected, sniff_mime_type, build_checks)
+
+PDF = b'%PDF-1.7\n' + b'0' * 64
+EXE = b'MZ\x90\x00' + b'\x00' * 64
+JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00' + b'\x00' * 64
+
+
+class FakeClamd:
+    """Speaks the clamd INSTREAM protocol and flags content containing 'EICAR'"""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.address = f'127.0.0.1:{self.sock.getsockname()[1]}'
+        self.scanned = []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _recv_exactly(self, conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    assert self._recv_exactly(conn, 10) == b'zINSTREAM\0'
+                    content = b''
+                    while True:
+                        length = struct.unpack('!L', self._recv_exactly(conn, 4))[0]
+                        if not length:
+                            break
+                        content += self._recv_exactly(conn, length)
+                except ConnectionError:
+                    continue
+                self.scanned.append(content)
+                if b'EICAR' in content:
+                    conn.sendall(b'stream: Eicar-Test-Signature FOUND\0')
+                else:
+                    conn.sendall(b'stream: OK\0')
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def clamd():
+    """Start a fake clamd on a local socket"""
+    server = FakeClamd()
+    yield server
+    server.close()
+
+
+class CountingStream(io.BytesIO):
+    """Stream recording how many bytes have been read from it"""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def _consume(reader, chunk_size=4096):
+    while reader.read(chunk_size):
+        pass
+
+
+class TestValidatingReader:
+    """Tests for the single-pass validation reader"""
+
+    def test_hash_size_and_type_in_one_pass(self):
+        """Test that reading once yields hash, size and sniffed type"""
+        reader = ValidatingReader(io.BytesIO(PDF), [TypeCheck(['application/pdf'])])
+        _consume(reader, chunk_size=7)
+
+        assert reader.content_hash == hashlib.sha256(PDF).hexdigest()
+        assert reader.size == len(PDF)
+        assert reader.mime_type == 'application/pdf'
+
+    def test_executables_are_rejected(self):
+        """Test that blocked types fail regardless of the allowed list"""
+        reader = ValidatingReader(io.BytesIO(EXE), [TypeCheck(None)])
+        with pytest.raises(UploadRejected) as exc:
+            _consume(reader)
+        assert exc.value.check == 'type'
+
+    def test_type_not_allowed_for_category(self):
+        """Test that a PDF is not accepted as claim media"""
+        reader = ValidatingReader(io.BytesIO(PDF), build_checks('claims', {}))
+        with pytest.raises(UploadRejected):
+            _consume(reader)
+
+    def test_unknown_types_follow_configuration(self):
+        """Test the unknown-type policy"""
+        _consume(ValidatingReader(io.BytesIO(b'plain notes'), [TypeCheck(['application/pdf'])]))
+        with pytest.raises(UploadRejected):
+            _consume(ValidatingReader(io.BytesIO(b'plain notes'),
+                                      [TypeCheck(['application/pdf'], reject_unknown=True)]))
+
+    def test_size_limit_stops_reading_early(self):
+        """Test that an oversized upload is rejected without reading it all"""
+        stream = CountingStream(JPEG + os.urandom(1024 * 1024))
+        reader = ValidatingReader(stream, [SizeLimitCheck({'image/*': 64 * 1024, '*': 1024 * 1024})])
+
+        with pytest.raises(UploadRejected) as exc:
+            _consume(reader, chunk_size=16 * 1024)
+        assert '64 KB' in exc.value.reason
+        assert stream.bytes_read < 128 * 1024
+
+    def test_sniffs_across_short_reads(self):
+        """Test that the type is detected when the header arrives in pieces"""
+        reader = ValidatingReader(io.BytesIO(JPEG), [TypeCheck(['image/*'])])
+        _consume(reader, chunk_size=3)
+        assert reader.mime_type == 'image/jpeg'
+        assert sniff_mime_type(JPEG[:3]) == 'image/jpeg'
+
+
+class TestScannerHook:
+    """Tests for the external scanner check"""
+
+    def test_clean_upload_is_streamed_to_scanner(self, clamd):
+        """Test that the scanner receives every byte exactly once"""
+        payload = PDF + os.urandom(100 * 1024)
+        reader = ValidatingReader(io.BytesIO(payload), [ClamdScanCheck(clamd.address)])
+        _consume(reader)
+        assert clamd.scanned == [payload]
+
+    def test_infected_upload_is_rejected(self, clamd):
+        """Test that a scanner finding rejects the upload"""
+        reader = ValidatingReader(io.BytesIO(PDF + b'EICAR'), [ClamdScanCheck(clamd.address)])
+        with pytest.raises(UploadRejected) as exc:
+            _consume(reader)
+        assert 'Eicar-Test-Signature' in exc.value.reason
+
+    def test_unreachable_scanner_fails_closed(self):
+        """Test that uploads are refused when the scanner is down"""
+        reader = ValidatingReader(io.BytesIO(PDF), [ClamdScanCheck('127.0.0.1:1', timeout=1)])
+        with pytest.raises(UploadRejected):
+            _consume(reader)
+
+    def test_rejected_upload_is_not_stored(self, clamd, tmp_path):
+        """Test that a rejected upload never appears in storage"""
+        storage = LocalStorage(str(tmp_path))
+        reader = ValidatingReader(io.BytesIO(PDF + b'EICAR'), [ClamdScanCheck(clamd.address)])
+        with pytest.raises(UploadRejected):
+            storage.put_stream('documents/infected.pdf', reader)
+        assert os.listdir(tmp_path / 'documents') == []
+
+
+class TestUploadRoutes:
+    """Tests for validation in the upload routes"""
+
+    def test_document_upload_records_hash(self, test_app, authenticated_client):
+        """Test that uploaded documents get their content hash and size"""
+        authenticated_client.post('/documents/upload',
+            data={'file': (io.BytesIO(PDF), 'terms.pdf'), 'document_type': 'policy'},
+            content_type='multipart/form-data'
+        )
+        with test_app.app_context():
+            document = Document.query.filter_by(filename='terms.pdf').first()
+            assert document.content_hash == hashlib.sha256(PDF).hexdigest()
+            assert document.file_size == len(PDF)
+
+    def test_executable_document_is_rejected(self, test_app, authenticated_client):
+        """Test that an executable disguised as a PDF is refused"""
+        response = authenticated_client.post('/documents/upload',
+            data={'file': (io.BytesIO(EXE), 'invoice.pdf'), 'document_type': 'invoice'},
+            content_type='multipart/form-data',
+            follow_redirects=True
+        )
+        assert b'Upload rejected' in response.data
+        with test_app.app_context():
+            assert Document.query.filter_by(filename='invoice.pdf').first() is None
+        assert os.listdir(os.path.join(test_app.config['UPLOAD_FOLDER'], 'documents')) == []
+
+    def test_infected_claim_media_is_rejected(self, test_app, authenticated_client, clamd):
+        """Test that the scanner hook also guards claim media"""
+        test_app.config['UPLOAD_SCANNER_ADDRESS'] = clamd.address
+        try:
+            response = authenticated_client.post('/services/claims/file',
+                data={
+                    'description': 'Infected evidence',
+                    'media': [(io.BytesIO(JPEG), 'ok.jpg'), (io.BytesIO(JPEG + b'EICAR'), 'bad.jpg')]
+                },
+                content_type='multipart/form-data',
+                follow_redirects=True
+            )
+        finally:
+            test_app.config['UPLOAD_SCANNER_ADDRESS'] = None
+        assert b'Malware detected' in response.data
+        with test_app.app_context():
+            assert Claim.query.filter_by(description='Infected evidence').first() is None
+        assert os.listdir(os.path.join(test_app.config['UPLOAD_FOLDER'], 'claims')) == []
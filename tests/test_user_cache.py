@@ -0,0 +1,176 @@
+"""
+Unit tests for the cached Flask-Login user loader
+"""
+import socket
+import threading
+import time
+import pytest
+from sqlalchemy import event
+from models import db, User
+from user_cache import LocalCacheBackend, MemcachedBackend, UserCache
+
+
+class FakeMemcached:
+    """Speaks enough of the memcached text protocol for get, set and delete"""
+
+    def __init__(self):
+        self.data = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.address = f'127.0.0.1:{self.sock.getsockname()[1]}'
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        reader = conn.makefile('rb')
+        with conn:
+            for line in reader:
+                parts = line.split()
+                if parts[0] == b'get':
+                    value = self.data.get(parts[1])
+                    if value is not None:
+                        conn.sendall(b'VALUE %s 0 %d\r\n%s\r\n' % (parts[1], len(value), value))
+                    conn.sendall(b'END\r\n')
+                elif parts[0] == b'set':
+                    value = reader.read(int(parts[4]) + 2)[:-2]
+                    self.data[parts[1]] = value
+                    conn.sendall(b'STORED\r\n')
+                elif parts[0] == b'delete':
+                    found = self.data.pop(parts[1], None) is not None
+                    conn.sendall(b'DELETED\r\n' if found else b'NOT_FOUND\r\n')
+                elif parts[0] == b'flush_all':
+                    self.data.clear()
+                    conn.sendall(b'OK\r\n')
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def memcached():
+    """Start a fake memcached on a local socket"""
+    server = FakeMemcached()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def user_queries(test_app):
+    """Record SELECT statements against the user table"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'FROM user' in statement:
+            statements.append(statement)
+
+    with test_app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+class TestCachedUserLoader:
+    """Tests for the loader used on every authenticated request"""
+
+    def test_repeat_loads_skip_user_query(self, test_app, test_user, user_queries):
+        """Test that only the first load after login queries the user row"""
+        from app import load_user
+        cache = test_app.extensions['user_cache']
+        hits, misses = cache.hits, cache.misses
+        with test_app.app_context():
+            assert load_user(str(test_user['id'])).email == 'test@example.com'
+        assert len(user_queries) == 1
+
+        for _ in range(3):
+            # A fresh app context per request, as in production
+            with test_app.app_context():
+                user = load_user(str(test_user['id']))
+                assert user.first_name == 'Test'
+                assert user in db.session
+        assert len(user_queries) == 1
+        assert (cache.hits - hits, cache.misses - misses) == (3, 1)
+        assert 0 < cache.stats()['hit_ratio'] <= 1
+
+    def test_update_information_invalidates(self, test_app, authenticated_client, test_user):
+        """Test that the next request sees the updated profile"""
+        authenticated_client.get('/information')
+        authenticated_client.post('/information/update', data={
+            'first_name': 'Renamed', 'last_name': 'User', 'phone': '', 'address': 'Test Street 123, Berlin',
+            'correspondence_address': 'Test Street 123, Berlin'
+        })
+        response = authenticated_client.get('/information')
+        assert b'Renamed' in response.data
+
+    def test_password_change_invalidates(self, test_app, test_user):
+        """Test that changing the password drops the cached entry"""
+        cache = test_app.extensions['user_cache']
+        with test_app.app_context():
+            from user_cache import load_user_cached
+            load_user_cached(test_user['id'])
+            assert cache.backend.get(f"portal:user:v1:{test_user['id']}") is not None
+
+            user = db.session.get(User, test_user['id'])
+            user.set_password('a-new-password')
+            db.session.commit()
+            assert cache.backend.get(f"portal:user:v1:{test_user['id']}") is None
+
+    def test_password_hash_not_cached(self, test_app, test_user):
+        """Test that cached entries leave out the password hash"""
+        with test_app.app_context():
+            from user_cache import load_user_cached
+            load_user_cached(test_user['id'])
+            row = test_app.extensions['user_cache'].backend.get(f"portal:user:v1:{test_user['id']}")
+            assert 'password_hash' not in row
+            assert row['email'] == 'test@example.com'
+
+            db.session.remove()
+            user = load_user_cached(test_user['id'])
+            assert user.check_password('testpassword123')  # Loaded lazily on access
+
+
+class TestCacheBackends:
+    """Tests for the cache backends"""
+
+    def test_local_entries_expire(self):
+        """Test that local entries disappear after their TTL"""
+        backend = LocalCacheBackend()
+        backend.set('k', {'id': 1}, ttl=0.01)
+        assert backend.get('k') == {'id': 1}
+        time.sleep(0.02)
+        assert backend.get('k') is None
+
+    def test_local_evicts_least_recently_used(self):
+        """Test the entry limit"""
+        backend = LocalCacheBackend(max_entries=2)
+        backend.set('a', 1, 60)
+        backend.set('b', 2, 60)
+        backend.get('a')
+        backend.set('c', 3, 60)
+        assert backend.get('b') is None
+        assert backend.get('a') == 1
+
+    def test_memcached_roundtrip(self, memcached):
+        """Test get, set and delete against a memcached server"""
+        cache = UserCache(MemcachedBackend(memcached.address), ttl=30)
+        assert cache.get(1) is None
+        cache.set(1, {'id': 1, 'email': 'a@example.com'})
+        assert cache.get(1) == {'id': 1, 'email': 'a@example.com'}
+        cache.invalidate(1)
+        assert cache.get(1) is None
+        assert cache.stats() == {'hits': 1, 'misses': 2, 'invalidations': 1, 'hit_ratio': 0.3333}
+
+    def test_memcached_down_counts_as_miss(self):
+        """Test that an unreachable cache falls back instead of failing"""
+        backend = MemcachedBackend('127.0.0.1:1', timeout=0.2)
+        assert backend.get('k') is None
+        backend.set('k', {'id': 1}, 30)
+        assert backend.errors == 2
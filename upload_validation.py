@@ -0,0 +1,389 @@
+"""
+Upload Validation Module for SwissAxa Portal
+Validates uploads in a single streaming pass while they are written to storage
+
+Every byte is inspected exactly once on its way to the storage backend: the
+reader wrapper hashes it, sniffs the real type from the first bytes, enforces
+per-type size limits and optionally forwards it to an external scanner. The
+backend only publishes an object after the stream has been read to the end,
+so a rejected upload never leaves quarantine (the temporary part file or the
+unfinished multipart upload) and is discarded by the backend itself.
+"""
+import hashlib
+import socket
+import struct
+import threading
+
+HEADER_SIZE = 32
+MB = 1024 * 1024
+
+# Types rejected for every upload category
+BLOCKED_TYPES = {
+    'application/x-msdownload',
+    'application/x-executable',
+    'application/x-mach-binary',
+    'text/x-shellscript',
+}
+
+DEFAULT_ALLOWED_TYPES = {
+    'documents': ['application/pdf', 'image/*', 'application/zip', 'application/x-ole-storage',
+                  'application/rtf'],
+    'policies': ['application/pdf', 'image/*', 'application/zip', 'application/x-ole-storage',
+                 'application/rtf'],
+    'claims': ['image/*', 'video/*'],
+}
+
+DEFAULT_SIZE_LIMITS = {
+    'application/pdf': 16 * MB,
+    'image/*': 10 * MB,
+    'video/*': 16 * MB,
+    '*': 16 * MB,
+}
+
+# ISO base media brands (bytes 8-12 after 'ftyp') that are still images
+_IMAGE_BRANDS = (b'heic', b'heix', b'hevc', b'heim', b'heis', b'mif1', b'msf1', b'avif')
+
+
+class UploadRejected(Exception):
+    """Raised while streaming when an upload fails a validation check"""
+
+    def __init__(self, reason, check=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.check = check
+
+
+def sniff_media_type(header: bytes):
+    """
+    Detect photo and video formats from the first bytes of a file
+
+    Returns:
+        tuple: (media_type, mime_type) with media_type 'photo' or 'video',
+        or None if the signature is unknown
+    """
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'photo', 'image/jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'photo', 'image/png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'photo', 'image/gif'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'photo', 'image/webp'
+    if header.startswith(b'RIFF') and header[8:12] == b'AVI ':
+        return 'video', 'video/x-msvideo'
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'photo', 'image/tiff'
+    if header.startswith(b'BM') and len(header) >= 14:
+        return 'photo', 'image/bmp'
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video', 'video/webm'
+    if header[4:8] == b'ftyp':
+        brand = header[8:12]
+        if brand in _IMAGE_BRANDS:
+            return 'photo', 'image/heic'
+        if brand == b'qt  ':
+            return 'video', 'video/quicktime'
+        return 'video', 'video/mp4'
+    if header[4:8] in (b'moov', b'mdat', b'wide', b'free'):
+        return 'video', 'video/quicktime'
+    return None
+
+
+def sniff_mime_type(header: bytes):
+    """Detect the MIME type of any upload from its magic bytes, or None"""
+    media = sniff_media_type(header)
+    if media:
+        return media[1]
+    if header.startswith(b'%PDF-'):
+        return 'application/pdf'
+    if header.startswith(b'PK\x03\x04'):
+        return 'application/zip'  # Also docx, xlsx, odt
+    if header.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        return 'application/x-ole-storage'  # Legacy doc, xls
+    if header.startswith(b'{\\rtf'):
+        return 'application/rtf'
+    if header.startswith(b'MZ'):
+        return 'application/x-msdownload'
+    if header.startswith(b'\x7fELF'):
+        return 'application/x-executable'
+    if header[:4] in (b'\xfe\xed\xfa\xce', b'\xfe\xed\xfa\xcf', b'\xcf\xfa\xed\xfe', b'\xce\xfa\xed\xfe'):
+        return 'application/x-mach-binary'
+    if header.startswith(b'#!'):
+        return 'text/x-shellscript'
+    return None
+
+
+def _format_size(size):
+    if size >= MB:
+        return f'{size / MB:g} MB'
+    return f'{size / 1024:g} KB'
+
+
+def _match_type(mime_type, patterns):
+    """Match a MIME type against exact entries, 'major/*' wildcards or '*'"""
+    for pattern in patterns:
+        if pattern == '*' or pattern == mime_type:
+            return pattern
+        if pattern.endswith('/*') and mime_type and mime_type.startswith(pattern[:-1]):
+            return pattern
+    return None
+
+
+class UploadCheck:
+    """Base class for checks run by ValidatingReader; raise UploadRejected to fail"""
+    name = 'check'
+
+    def start(self, upload):
+        """Called before the first byte is read"""
+
+    def update(self, upload, chunk):
+        """Called for every chunk, after the type has been sniffed"""
+
+    def finish(self, upload):
+        """Called once the whole upload has been read"""
+
+    def abort(self, upload):
+        """Called when reading stops early; release resources"""
+
+
+class TypeCheck(UploadCheck):
+    """Reject blocked types and types not allowed for the upload category"""
+    name = 'type'
+
+    def __init__(self, allowed_types, reject_unknown=False):
+        self.allowed_types = allowed_types
+        self.reject_unknown = reject_unknown
+        self._checked = False
+
+    def update(self, upload, chunk):
+        if self._checked or not upload.type_known:
+            return
+        self._checked = True
+        mime_type = upload.mime_type
+        if mime_type in BLOCKED_TYPES:
+            raise UploadRejected('Executable files are not allowed', self.name)
+        if mime_type is None:
+            if self.reject_unknown:
+                raise UploadRejected('Unrecognized file type', self.name)
+            return
+        if self.allowed_types is not None and not _match_type(mime_type, self.allowed_types):
+            raise UploadRejected(f'File type {mime_type} is not allowed here', self.name)
+
+    def finish(self, upload):
+        self.update(upload, b'')
+
+
+class SizeLimitCheck(UploadCheck):
+    """Enforce per-type size limits as bytes arrive, before the rest is read"""
+    name = 'size'
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._limit = None
+
+    def update(self, upload, chunk):
+        if self._limit is None and upload.type_known:
+            pattern = _match_type(upload.mime_type, [p for p in self.limits if p != '*']) \
+                if upload.mime_type else None
+            self._limit = self.limits.get(pattern or '*')
+        if self._limit is not None and upload.size > self._limit:
+            kind = upload.mime_type or 'this file type'
+            raise UploadRejected(f'File exceeds the {_format_size(self._limit)} limit for {kind}', self.name)
+
+
+class ClamdScanCheck(UploadCheck):
+    """
+    Stream bytes to a ClamAV-compatible daemon using the INSTREAM command
+
+    The scanner sees each chunk as it is written, so its verdict is ready as
+    soon as the upload ends. Fails closed if the scanner cannot be reached.
+    """
+    name = 'malware_scan'
+
+    def __init__(self, address, timeout=10):
+        self.address = address
+        self.timeout = timeout
+        self._sock = None
+
+    def _connect(self):
+        if self.address.startswith('unix:') or self.address.startswith('/'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.address.split(':', 1)[1] if self.address.startswith('unix:') else self.address)
+            return sock
+        host, _, port = self.address.rpartition(':')
+        return socket.create_connection((host, int(port)), timeout=self.timeout)
+
+    def start(self, upload):
+        try:
+            self._sock = self._connect()
+            self._sock.sendall(b'zINSTREAM\0')
+        except OSError:
+            self.abort(upload)
+            raise UploadRejected('Virus scanner unavailable, please try again later', self.name)
+
+    def update(self, upload, chunk):
+        if not chunk:
+            return
+        try:
+            self._sock.sendall(struct.pack('!L', len(chunk)) + chunk)
+        except OSError:
+            self.abort(upload)
+            raise UploadRejected('Virus scanner rejected the upload', self.name)
+
+    def finish(self, upload):
+        try:
+            self._sock.sendall(struct.pack('!L', 0))
+            reply = b''
+            while not reply.endswith(b'\0'):
+                data = self._sock.recv(4096)
+                if not data:
+                    break
+                reply += data
+        except OSError:
+            raise UploadRejected('Virus scanner unavailable, please try again later', self.name)
+        finally:
+            self.abort(upload)
+
+        verdict = reply.rstrip(b'\0').decode('utf-8', 'replace')
+        if verdict.endswith('FOUND'):
+            signature = verdict.split(':', 1)[-1].replace('FOUND', '').strip()
+            raise UploadRejected(f'Malware detected ({signature})', self.name)
+        if not verdict.endswith('OK'):
+            raise UploadRejected('Virus scanner could not verify the file', self.name)
+
+    def abort(self, upload):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+
+class QuotaBudget:
+    """Bytes a user may still store, shared by all files of one request"""
+
+    def __init__(self, remaining):
+        self.remaining = remaining
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        """Take size bytes from the budget; returns False once it is overdrawn"""
+        with self._lock:
+            self.remaining -= size
+            return self.remaining >= 0
+
+
+class QuotaCheck(UploadCheck):
+    """Stop an upload as soon as it would exceed the user's storage quota"""
+    name = 'quota'
+
+    def __init__(self, budget):
+        self.budget = budget
+
+    def update(self, upload, chunk):
+        if chunk and not self.budget.consume(len(chunk)):
+            raise UploadRejected('Storage quota exceeded', self.name)
+
+
+class ValidatingReader:
+    """
+    File-like wrapper that runs upload checks on the bytes as they are read
+
+    Pass it to StorageBackend.put_stream in place of the raw upload stream.
+    After the backend returns, content_hash, size and mime_type describe the
+    stored object.
+    """
+
+    def __init__(self, stream, checks=(), filename=None):
+        self._stream = stream
+        self.checks = list(checks)
+        self.filename = filename
+        self.header = b''
+        self.size = 0
+        self.mime_type = None
+        self.type_known = False
+        self._digest = hashlib.sha256()
+        self._pending = []
+        self._done = False
+        self._started = False
+
+    def _sniff(self):
+        self.mime_type = sniff_mime_type(self.header)
+        self.type_known = True
+
+    def _dispatch(self, data):
+        for check in self.checks:
+            check.update(self, data)
+
+    def read(self, size=-1):
+        if self._done:
+            return b''
+        try:
+            if not self._started:
+                self._started = True
+                for check in self.checks:
+                    check.start(self)
+            chunk = self._stream.read(size)
+            if chunk:
+                self._digest.update(chunk)
+                self.size += len(chunk)
+                if self.type_known:
+                    self._dispatch(chunk)
+                else:
+                    # Hold back the first bytes until there are enough to sniff
+                    self._pending.append(chunk)
+                    self.header = b''.join(self._pending)[:HEADER_SIZE]
+                    if len(self.header) >= HEADER_SIZE:
+                        self._sniff()
+                        self._dispatch(b''.join(self._pending))
+                        self._pending = []
+            else:
+                self._done = True
+                if not self.type_known:
+                    self._sniff()
+                    self._dispatch(b''.join(self._pending))
+                    self._pending = []
+                for check in self.checks:
+                    check.finish(self)
+            return chunk
+        except BaseException:
+            self._done = True
+            for check in self.checks:
+                check.abort(self)
+            raise
+
+    @property
+    def content_hash(self):
+        return self._digest.hexdigest()
+
+
+def build_checks(category, config, quota=None):
+    """Create fresh checks for one upload from the app configuration"""
+    allowed = config.get('UPLOAD_ALLOWED_TYPES', DEFAULT_ALLOWED_TYPES).get(category)
+    checks = [
+        TypeCheck(allowed, reject_unknown=config.get('UPLOAD_REJECT_UNKNOWN_TYPES', False)),
+        SizeLimitCheck(config.get('UPLOAD_SIZE_LIMITS', DEFAULT_SIZE_LIMITS)),
+    ]
+    if config.get('UPLOAD_SCANNER_ADDRESS'):
+        checks.append(ClamdScanCheck(config['UPLOAD_SCANNER_ADDRESS'],
+                                     timeout=config.get('UPLOAD_SCANNER_TIMEOUT', 10)))
+    if quota is not None:
+        checks.append(QuotaCheck(quota))
+    return checks
+
+
+def store_validated(storage, key, file, category, config, quota=None):
+    """
+    Validate an uploaded file while writing it to storage
+
+    Raises:
+        UploadRejected: if a check fails; nothing is stored in that case
+
+    Returns:
+        ValidatingReader: holds content_hash, size and mime_type of the upload
+    """
+    reader = ValidatingReader(file.stream, build_checks(category, config, quota), filename=file.filename)
+    storage.put_stream(key, reader, content_type=file.mimetype)
+    return reader
@@ -0,0 +1,289 @@
+"""
+User Cache Module for SwissAxa Portal
+Caches the user loaded by Flask-Login so authenticated requests skip the user query
+
+Entries hold the user's column values, not ORM objects. A cached user is
+rebuilt and attached to the current session without a query. Relationships
+and the password hash are not cached; they load lazily as before. Entries
+expire after a short TTL. They are also dropped when a user row is updated
+or deleted, both at flush and after commit, so a concurrent request cannot
+re-cache the old row.
+
+Backends:
+    local      per-process dict (default)
+    memcached  shared across processes and hosts; set USER_CACHE_ADDRESS
+"""
+import json
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+from sqlalchemy import DateTime, Date, event
+from sqlalchemy.orm import make_transient_to_detached, object_session
+
+KEY_PREFIX = 'portal:user:v1:'
+# Never cached, so it cannot leak from a shared cache
+EXCLUDED_COLUMNS = {'password_hash'}
+
+
+class LocalCacheBackend:
+    """Thread-safe in-process cache with per-entry expiry and LRU eviction"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class MemcachedBackend:
+    """
+    Minimal memcached client (text protocol) with one connection per thread
+
+    Any network error counts as a miss and drops the connection. The portal
+    then falls back to the database instead of failing the request.
+    """
+
+    def __init__(self, address, timeout=0.5):
+        host, _, port = address.rpartition(':')
+        self.address = (host or 'localhost', int(port or 11211))
+        self.timeout = timeout
+        self._local = threading.local()
+        self.errors = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    def _call(self, command, handler):
+        try:
+            sock, reader = self._connection()
+            sock.sendall(command)
+            return handler(reader)
+        except (OSError, ValueError):
+            self.errors += 1
+            self._drop()
+            return None
+
+    def get(self, key):
+        def read_value(reader):
+            header = reader.readline()
+            if header == b'END\r\n':
+                return None
+            if not header.startswith(b'VALUE '):
+                raise ValueError(header)
+            length = int(header.split()[3])
+            data = reader.read(length + 2)[:-2]
+            if reader.readline() != b'END\r\n':
+                raise ValueError('Missing END')
+            return json.loads(data)
+        return self._call(f'get {key}\r\n'.encode(), read_value)
+
+    def set(self, key, value, ttl):
+        data = json.dumps(value, separators=(',', ':')).encode()
+        command = f'set {key} 0 {max(int(ttl), 1)} {len(data)}\r\n'.encode() + data + b'\r\n'
+        self._call(command, lambda reader: reader.readline())
+
+    def delete(self, key):
+        self._call(f'delete {key}\r\n'.encode(), lambda reader: reader.readline())
+
+    def clear(self):
+        self._call(b'flush_all\r\n', lambda reader: reader.readline())
+
+
+class UserCache:
+    """Cache-aside wrapper around a backend, counting hits and misses"""
+
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        value = self.backend.get(f'{KEY_PREFIX}{user_id}')
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, user_id, row):
+        self.backend.set(f'{KEY_PREFIX}{user_id}', row, self.ttl)
+
+    def invalidate(self, user_id):
+        self.invalidations += 1
+        self.backend.delete(f'{KEY_PREFIX}{user_id}')
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _to_row(user):
+    row = {}
+    for column in user.__table__.columns:
+        if column.key in EXCLUDED_COLUMNS:
+            continue
+        value = getattr(user, column.key)
+        row[column.key] = value.isoformat() if isinstance(value, (date, datetime)) else value
+    return row
+
+
+def _from_row(model, row):
+    values = {}
+    for column in model.__table__.columns:
+        if column.key not in row:
+            continue
+        value = row[column.key]
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, Date):
+            value = date.fromisoformat(value)
+        values[column.key] = value
+    return values
+
+
+def load_user_cached(user_id):
+    """
+    Return the user for Flask-Login, from the cache when possible
+
+    Cached users are attached to the current session with merge(load=False),
+    which issues no query. Attributes left out of the cache load lazily on
+    first access, the same way expired attributes do.
+    """
+    from flask import current_app
+    from models import db, User
+    cache = current_app.extensions.get('user_cache')
+    if cache is None:
+        return db.session.get(User, user_id)
+
+    row = cache.get(user_id)
+    if row is not None:
+        user = User(**_from_row(User, row))
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None:
+        cache.set(user_id, _to_row(user))
+    return user
+
+
+def invalidate_user(user_id):
+    """Drop a user from the cache, e.g. after changing them outside the ORM"""
+    from flask import current_app
+    cache = current_app.extensions.get('user_cache')
+    if cache is not None:
+        cache.invalidate(user_id)
+
+
+def create_user_cache(config):
+    """Build the cache selected by USER_CACHE_BACKEND, or None when disabled"""
+    backend = config.get('USER_CACHE_BACKEND', 'local')
+    if not backend or backend == 'none':
+        return None
+    if backend == 'local':
+        store = LocalCacheBackend(max_entries=config.get('USER_CACHE_MAX_ENTRIES', 10000))
+    elif backend == 'memcached':
+        store = MemcachedBackend(config['USER_CACHE_ADDRESS'])
+    else:
+        raise ValueError(f'Unknown user cache backend: {backend}')
+    return UserCache(store, ttl=config.get('USER_CACHE_TTL', 30))
+
+
+def _current_cache():
+    from flask import current_app, has_app_context
+    return current_app.extensions.get('user_cache') if has_app_context() else None
+
+
+def _user_changed(mapper, connection, target):
+    cache = _current_cache()
+    if cache is None:
+        return
+    cache.invalidate(target.id)
+    sess = object_session(target)
+    if sess is not None:
+        sess.info.setdefault('changed_user_ids', set()).add(target.id)
+
+
+def _after_commit(sess):
+    # Invalidate again once the change is visible, in case another request
+    # cached the old row between the flush and the commit
+    user_ids = sess.info.pop('changed_user_ids', ())
+    cache = _current_cache()
+    if cache is not None:
+        for user_id in user_ids:
+            cache.invalidate(user_id)
+
+
+def _after_rollback(sess):
+    sess.info.pop('changed_user_ids', None)
+
+
+def init_user_cache(app, session, user_model):
+    """Initialize the user cache with Flask app and invalidate it on user writes"""
+    cache = create_user_cache(app.config)
+    app.extensions['user_cache'] = cache
+    if cache is None:
+        return None
+
+    # The listeners are shared by every app and use the current app's cache.
+    # Covers register, update_information and password changes; bulk UPDATE
+    # statements bypass these events and must call invalidate_user()
+    for target, identifier, fn in ((user_model, 'after_update', _user_changed),
+                                   (user_model, 'after_delete', _user_changed),
+                                   (session, 'after_commit', _after_commit),
+                                   (session, 'after_rollback', _after_rollback)):
+        if not event.contains(target, identifier, fn):
+            event.listen(target, identifier, fn)
+
+    return cache
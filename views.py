@@ -0,0 +1,838 @@
+"""
+Views Module for SwissAxa Portal
+Page and API routes of the portal
+
+Routes are collected when this module is imported and added to an app by
+register_views(), so every app create_app() builds gets its own url map.
+Endpoint names are the view function names, as templates expect.
+"""
+from flask import current_app, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context, abort
+from sqlalchemy import insert
+from flask_login import login_user, login_required, logout_user, current_user
+from werkzeug.utils import secure_filename
+from datetime import datetime
+import os
+import mimetypes
+from availability import book_appointment, get_availability_index, suggest_slots, SlotUnavailable
+from storage import get_storage, storage_key, unique_key, ObjectNotFound
+from upload_validation import build_checks, store_validated, UploadRejected
+from db_engine import read_only
+from id_generator import next_claim_number
+from models import db, User, Agent, SwissAxaPolicy, ExternalPolicy, Document, Claim, ClaimMedia, PolicyChangeRequest, Appointment, BankAccount
+
+_routes = []
+
+
+def route(rule, **options):
+    """Like app.route, but for the app register_views() is later called with"""
+    def decorator(view):
+        _routes.append((rule, view, options))
+        return view
+    return decorator
+
+
+def register_views(app):
+    """Add the portal routes to a Flask app"""
+    for rule, view, options in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+
+
+class UnavailableAIService:
+    """Stand-in used when ai_services cannot be imported"""
+    @staticmethod
+    def is_available():
+        return False
+    @staticmethod
+    def compare_policies(data):
+        return {'similar_products': [], 'recommendations': []}
+    @staticmethod
+    def tag_document(filename):
+        return 'general'
+    @staticmethod
+    def analyze_claim_damage(**kwargs):
+        return {}
+    @staticmethod
+    def recommend_policies(profile):
+        return []
+    @staticmethod
+    def suggest_appointment_times(user_id, appointment_type):
+        return []
+    @staticmethod
+    def detect_transaction_anomaly(transactions):
+        return {'is_anomaly': False}
+    @staticmethod
+    def validate_user_data(data):
+        return {'is_valid': True, 'inconsistencies': []}
+    @staticmethod
+    def chat_with_ai(message, history=None):
+        return "AI services are currently unavailable. Please contact customer service."
+
+
+class _LazyAIService:
+    """Imports ai_services (and with it openai) on the first AI call, not at startup"""
+    _service = None
+
+    def __getattr__(self, name):
+        service = _LazyAIService._service
+        if service is None:
+            try:
+                from ai_services import AIService as service
+            except Exception:
+                service = UnavailableAIService
+            _LazyAIService._service = service
+        return getattr(service, name)
+
+
+AIService = _LazyAIService()
+
+# Routes
+@route('/')
+def index():
+    if current_user.is_authenticated:
+        return redirect(url_for('dashboard'))
+    return redirect(url_for('login'))
+
+@route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        email = request.form.get('email')
+        password = request.form.get('password')
+        user = User.query.filter_by(email=email).first()
+        
+        if user and user.check_password(password):
+            login_user(user)
+            return redirect(url_for('dashboard'))
+        else:
+            flash('Invalid email or password', 'error')
+    
+    return render_template('login.html')
+
+@route('/register', methods=['GET', 'POST'])
+def register():
+    if request.method == 'POST':
+        email = request.form.get('email')
+        password = request.form.get('password')
+        first_name = request.form.get('first_name')
+        last_name = request.form.get('last_name')
+        
+        if User.query.filter_by(email=email).first():
+            flash('Email already registered', 'error')
+            return render_template('register.html')
+        
+        user = User(email=email, first_name=first_name, last_name=last_name)
+        user.set_password(password)
+        db.session.add(user)
+        db.session.commit()
+        
+        flash('Registration successful! Please login.', 'success')
+        return redirect(url_for('login'))
+    
+    return render_template('register.html')
+
+@route('/logout')
+@login_required
+def logout():
+    logout_user()
+    return redirect(url_for('login'))
+
+@route('/dashboard')
+@login_required
+def dashboard():
+    return render_template('dashboard.html', user=current_user)
+
+# Policies routes
+@route('/policies')
+@login_required
+@read_only
+def policies():
+    swissaxa_policies = SwissAxaPolicy.query.filter_by(user_id=current_user.id).all()
+    external_policies = ExternalPolicy.query.filter_by(user_id=current_user.id).all()
+    
+    # Calculate days until expiry for each policy
+    today = datetime.now().date()
+    for policy in swissaxa_policies:
+        if policy.expiration_date:
+            days_until_expiry = (policy.expiration_date - today).days
+            policy.days_until_expiry = days_until_expiry
+        else:
+            policy.days_until_expiry = 999
+    
+    return render_template('policies.html', 
+                         swissaxa_policies=swissaxa_policies,
+                         external_policies=external_policies,
+                         today=today)
+
+@route('/policies/external/upload', methods=['POST'])
+@login_required
+def upload_external_policy():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    
+    if file:
+        from storage_usage import quota_budget, record_usage
+        filename = secure_filename(file.filename)
+        filepath = unique_key('policies', filename)
+        try:
+            upload = store_validated(get_storage(), filepath, file, 'policies', current_app.config,
+                                     quota=quota_budget(current_user.id))
+        except UploadRejected as e:
+            return jsonify({'error': e.reason}), 400
+        
+        external_policy = ExternalPolicy(
+            user_id=current_user.id,
+            insurance_company=request.form.get('insurance_company', 'Unknown'),
+            policy_number=request.form.get('policy_number', ''),
+            policy_type=request.form.get('policy_type', ''),
+            expiration_date=datetime.strptime(request.form.get('expiration_date'), '%Y-%m-%d').date() if request.form.get('expiration_date') else None,
+            file_path=filepath,
+            file_size=upload.size
+        )
+        db.session.add(external_policy)
+        record_usage(current_user.id, upload.size)
+        db.session.commit()
+        
+        flash('External policy uploaded successfully', 'success')
+        return jsonify({'success': True})
+
+# Documents routes
+@route('/documents')
+@login_required
+@read_only
+def documents():
+    user_documents = Document.query.filter_by(user_id=current_user.id).all()
+    return render_template('documents.html', documents=user_documents)
+
+@route('/documents/upload', methods=['POST'])
+@login_required
+def upload_document():
+    if 'file' not in request.files:
+        flash('No file provided', 'error')
+        return redirect(url_for('documents'))
+    
+    file = request.files['file']
+    if file.filename == '':
+        flash('No file selected', 'error')
+        return redirect(url_for('documents'))
+    
+    if file:
+        from storage_usage import quota_budget, record_usage
+        filename = secure_filename(file.filename)
+        filepath = unique_key('documents', filename)
+        try:
+            upload = store_validated(get_storage(), filepath, file, 'documents', current_app.config,
+                                     quota=quota_budget(current_user.id))
+        except UploadRejected as e:
+            flash(f'Upload rejected: {e.reason}', 'error')
+            return redirect(url_for('documents'))
+        
+        # AI-powered document tagging
+        document_type = request.form.get('document_type')
+        if not document_type or document_type == 'auto':
+            # Use AI to auto-tag the document
+            ai_tag = AIService.tag_document(filename)
+            document_type = ai_tag
+            flash(f'Document automatically tagged as: {ai_tag.replace("_", " ").title()}', 'info')
+        
+        document = Document(
+            user_id=current_user.id,
+            filename=filename,
+            file_path=filepath,
+            document_type=document_type or 'general',
+            content_hash=upload.content_hash,
+            file_size=upload.size
+        )
+        db.session.add(document)
+        record_usage(current_user.id, upload.size)
+        db.session.commit()
+        
+        flash('Document uploaded successfully', 'success')
+        return redirect(url_for('documents'))
+
+@route('/documents/download/<int:doc_id>')
+@login_required
+def download_document(doc_id):
+    document = Document.query.get_or_404(doc_id)
+    if document.user_id != current_user.id:
+        flash('Unauthorized access', 'error')
+        return redirect(url_for('documents'))
+    
+    key = storage_key(document.file_path)
+    if current_app.config['STORAGE_PRESIGN_DOWNLOADS']:
+        url = get_storage().presign(key, expires_in=current_app.config['STORAGE_PRESIGN_EXPIRES'],
+                                    filename=document.filename)
+        if url:
+            return redirect(url)
+    return stored_file_response(key, document.filename)
+
+@route('/storage/<path:key>')
+def storage_download(key):
+    """Serve a presigned URL issued by the local storage backend"""
+    storage = get_storage()
+    filename = request.args.get('filename')
+    if not hasattr(storage, 'verify_presigned') or not storage.verify_presigned(
+            key, request.args.get('expires'), request.args.get('signature'), filename):
+        abort(403)
+    return stored_file_response(key, filename or os.path.basename(key))
+
+def stored_file_response(key, download_name):
+    """Stream an object from storage as a file download"""
+    storage = get_storage()
+    try:
+        size = storage.size(key)
+        chunks = storage.get_stream(key)
+    except ObjectNotFound:
+        abort(404)
+    
+    return Response(chunks, mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream',
+                    headers={
+                        'Content-Disposition': f'attachment; filename="{download_name}"',
+                        'Content-Length': str(size)
+                    })
+
+@route('/documents/export')
+@login_required
+def export_documents():
+    """Stream all of the user's documents and claim media as one ZIP archive"""
+    from export_service import stream_user_export
+    include_manifest = request.args.get('manifest', '').lower() in ('1', 'true', 'yes')
+    
+    filename = f'swissaxa_export_{datetime.now().strftime("%Y%m%d")}.zip'
+    return Response(
+        stream_with_context(stream_user_export(current_user.id, include_manifest)),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            # Let reverse proxies pass chunks through instead of buffering the archive
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@route('/api/storage/usage', methods=['GET'])
+@login_required
+def get_storage_usage():
+    """Report the current user's stored bytes and quota"""
+    from storage_usage import get_usage
+    return jsonify(get_usage(current_user.id))
+
+# Bank routes
+@route('/bank')
+@login_required
+def bank():
+    bank_accounts = BankAccount.query.filter_by(user_id=current_user.id).all()
+    return render_template('bank.html', bank_accounts=bank_accounts)
+
+@route('/bank/connect', methods=['POST'])
+@login_required
+def connect_bank():
+    bank_name = request.form.get('bank_name')
+    account_number = request.form.get('account_number')
+    
+    bank_account = BankAccount.query.filter_by(
+        user_id=current_user.id,
+        bank_name=bank_name
+    ).first()
+    
+    if not bank_account:
+        bank_account = BankAccount(
+            user_id=current_user.id,
+            bank_name=bank_name,
+            account_number=account_number,
+            is_connected=True
+        )
+        db.session.add(bank_account)
+    else:
+        bank_account.is_connected = True
+        bank_account.account_number = account_number
+    
+    db.session.commit()
+    flash(f'Connected to {bank_name} successfully', 'success')
+    return redirect(url_for('bank'))
+
+@route('/bank/transaction', methods=['POST'])
+@login_required
+def bank_transaction():
+    # Simulated transaction - in production, this would integrate with bank APIs
+    transaction_type = request.form.get('transaction_type')
+    amount = request.form.get('amount')
+    bank_name = request.form.get('bank_name')
+    
+    flash(f'Transaction {transaction_type} of {amount} EUR processed via {bank_name}', 'success')
+    return redirect(url_for('bank'))
+
+# Services routes
+@route('/services')
+@login_required
+def services():
+    return render_template('services.html')
+
+@route('/services/claims')
+@login_required
+@read_only
+def claims():
+    user_claims = Claim.query.filter_by(user_id=current_user.id).all()
+    policies = SwissAxaPolicy.query.filter_by(user_id=current_user.id).all()
+    return render_template('claims.html', claims=user_claims, policies=policies)
+
+@route('/services/claims/file', methods=['POST'])
+@login_required
+def file_claim():
+    description = request.form.get('description', '')
+    damage_type = request.form.get('damage_type', '')
+    
+    # AI-powered claims analysis if media is uploaded
+    ai_analysis = None
+    if 'media' in request.files:
+        files = request.files.getlist('media')
+        if files and files[0].filename:
+            # Perform AI analysis on the claim
+            ai_analysis = AIService.analyze_claim_damage(
+                claim_description=description
+            )
+            
+            # Use AI suggestions only if user hasn't provided values
+            # User-provided values take precedence
+            if ai_analysis.get('damage_type') and not damage_type:
+                damage_type = ai_analysis.get('damage_type', damage_type)
+            if ai_analysis.get('suggested_description') and not description:
+                description = ai_analysis.get('suggested_description', description)
+            
+            # Set priority based on AI analysis
+            priority = ai_analysis.get('priority', 'normal')
+    
+    # Validate that at least one piece of evidence exists
+    has_evidence = False
+    if 'media' in request.files:
+        files = request.files.getlist('media')
+        has_evidence = any(f.filename for f in files)
+    
+    if not has_evidence:
+        flash('Please upload at least one photo or video as evidence', 'error')
+        return redirect(url_for('claims'))
+    
+    # Write media before opening the claim transaction so the database write
+    # lock is only held for the two inserts below, not for disk I/O
+    from claim_media import save_claim_media, discard_saved_media
+    from storage_usage import quota_budget, record_usage
+    storage = get_storage()
+    quota = quota_budget(current_user.id)
+    try:
+        saved_media = save_claim_media(
+            request.files.getlist('media'),
+            storage,
+            max_workers=current_app.config['MEDIA_UPLOAD_WORKERS'],
+            checks_factory=lambda: build_checks('claims', current_app.config, quota)
+        )
+    except UploadRejected as e:
+        flash(f'Upload rejected: {e.reason}', 'error')
+        return redirect(url_for('claims'))
+    
+    try:
+        claim = Claim(
+            user_id=current_user.id,
+            policy_id=request.form.get('policy_id') if request.form.get('policy_id') else None,
+            claim_number=next_claim_number(),
+            description=description,
+            damage_type=damage_type,
+            latitude=float(request.form.get('latitude')) if request.form.get('latitude') else None,
+            longitude=float(request.form.get('longitude')) if request.form.get('longitude') else None,
+            address=request.form.get('address')
+        )
+        db.session.add(claim)
+        db.session.flush()
+        
+        # Single executemany insert for all media rows
+        db.session.execute(insert(ClaimMedia), [{
+            'claim_id': claim.id,
+            'filename': media['filename'],
+            'file_path': media['file_path'],
+            'media_type': media['media_type'],
+            'content_hash': media['content_hash'],
+            'file_size': media['file_size']
+        } for media in saved_media])
+        record_usage(current_user.id, sum(m['file_size'] for m in saved_media), len(saved_media))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        discard_saved_media(storage, saved_media)
+        raise
+    
+    if ai_analysis:
+        flash(f'Claim filed successfully. AI Analysis: {damage_type} detected (Priority: {ai_analysis.get("priority", "normal")})', 'success')
+    else:
+        flash('Claim filed successfully', 'success')
+    return redirect(url_for('claims'))
+
+@route('/services/policy-management')
+@login_required
+def policy_management():
+    policies = SwissAxaPolicy.query.filter_by(user_id=current_user.id).all()
+    change_requests = PolicyChangeRequest.query.filter_by(user_id=current_user.id).all()
+    
+    # Get AI recommendations if available
+    ai_recommendations = []
+    if AIService.is_available():
+        user_profile = {
+            'policies': [p.policy_type for p in policies],
+            'claims_count': len(current_user.claims),
+            'location': current_user.address or 'Unknown'
+        }
+        ai_recommendations = AIService.recommend_policies(user_profile)
+    
+    return render_template('policy_management.html', 
+                         policies=policies, 
+                         change_requests=change_requests,
+                         ai_recommendations=ai_recommendations)
+
+@route('/services/policy-management/request', methods=['POST'])
+@login_required
+def submit_policy_change():
+    change_request = PolicyChangeRequest(
+        user_id=current_user.id,
+        policy_id=request.form.get('policy_id') if request.form.get('policy_id') else None,
+        request_type=request.form.get('request_type'),
+        description=request.form.get('description')
+    )
+    db.session.add(change_request)
+    db.session.commit()
+    flash('Policy change request submitted successfully', 'success')
+    return redirect(url_for('policy_management'))
+
+@route('/services/contact', methods=['GET', 'POST'])
+@login_required
+def contact():
+    agents = Agent.query.all()
+    if request.method == 'POST':
+        recipient_type = request.form.get('recipient_type')
+        recipient_email = request.form.get('recipient_email')
+        subject = request.form.get('subject')
+        message = request.form.get('message')
+        
+        # Queued in the outbox; a background worker talks to the mail server
+        try:
+            from email_service import send_contact_email
+            if send_contact_email(
+                recipient_email=recipient_email,
+                sender_name=f"{current_user.first_name} {current_user.last_name}",
+                sender_email=current_user.email,
+                subject=subject,
+                message=message
+            ):
+                flash(f'Your email to {recipient_email} will be sent shortly', 'success')
+            else:
+                flash('Your email could not be sent. Please try again later or contact support directly.', 'warning')
+        except ImportError:
+            # Fallback if email service not available
+            flash(f'Email would be sent to {recipient_email} (email service not configured)', 'info')
+        
+        return redirect(url_for('contact'))
+    
+    return render_template('contact.html', agents=agents)
+
+@route('/services/scheduling', methods=['GET', 'POST'])
+@login_required
+def scheduling():
+    if request.method == 'POST':
+        # Booked before any other read, so the agent lock starts the transaction
+        try:
+            appointment = book_appointment(
+                user_id=current_user.id,
+                agent_id=request.form.get('agent_id', type=int),
+                appointment_type=request.form.get('appointment_type'),
+                date_time=datetime.strptime(request.form.get('date_time'), '%Y-%m-%dT%H:%M'),
+                purpose=request.form.get('purpose')
+            )
+        except SlotUnavailable as e:
+            message = str(e)
+            if e.suggestions:
+                message += ' Free times: ' + ', '.join(slot.strftime('%Y-%m-%d %H:%M') for slot in e.suggestions)
+            flash(message, 'error')
+            return redirect(url_for('scheduling'))
+        
+        # Send notifications
+        try:
+            from notifications import create_appointment_notification
+            agent_name = appointment.agent.name if appointment.agent else None
+            create_appointment_notification(
+                current_user.id, 
+                appointment.date_time.strftime('%Y-%m-%d %H:%M'),
+                agent_name
+            )
+        except ImportError:
+            pass
+        
+        # Send email confirmation
+        try:
+            from email_service import send_appointment_confirmation
+            from i18n_support import user_language
+            agent_name = appointment.agent.name if appointment.agent else None
+            send_appointment_confirmation(
+                current_user.email,
+                appointment.date_time.strftime('%Y-%m-%d %H:%M'),
+                agent_name,
+                language=user_language(current_user)
+            )
+        except ImportError:
+            pass
+        
+        flash('Appointment booked successfully', 'success')
+        return redirect(url_for('scheduling'))
+    
+    agents = Agent.query.all()
+    appointments = Appointment.query.filter_by(user_id=current_user.id).all()
+    return render_template('scheduling.html', agents=agents, appointments=appointments)
+
+# Information routes
+@route('/information')
+@login_required
+def information():
+    return render_template('information.html', user=current_user)
+
+@route('/information/update', methods=['POST'])
+@login_required
+def update_information():
+    # Collect user data for AI validation
+    user_data = {
+        'first_name': request.form.get('first_name'),
+        'last_name': request.form.get('last_name'),
+        'phone': request.form.get('phone'),
+        'address': request.form.get('address'),
+        'correspondence_address': request.form.get('correspondence_address'),
+        'email': current_user.email
+    }
+    
+    # AI-powered data validation
+    validation_result = AIService.validate_user_data(user_data)
+    
+    # Check if sensitive fields changed (address, bank account)
+    sensitive_changed = (
+        current_user.address != request.form.get('address') or
+        current_user.correspondence_address != request.form.get('correspondence_address') or
+        current_user.bank_account != request.form.get('bank_account')
+    )
+    
+    # Require re-authentication for sensitive changes or if AI detects inconsistencies
+    if sensitive_changed or validation_result.get('requires_reauth'):
+        # In production, this would require password confirmation
+        if validation_result.get('inconsistencies'):
+            flash(f'Please verify your information: {", ".join(validation_result["inconsistencies"])}', 'warning')
+    
+    current_user.first_name = request.form.get('first_name')
+    current_user.last_name = request.form.get('last_name')
+    current_user.phone = request.form.get('phone')
+    current_user.address = request.form.get('address')
+    current_user.correspondence_address = request.form.get('correspondence_address')
+    current_user.bank_account = request.form.get('bank_account')
+    
+    db.session.commit()
+    
+    if validation_result.get('inconsistencies'):
+        flash('Information updated. Please review any warnings above.', 'warning')
+    else:
+        flash('Information updated successfully', 'success')
+    return redirect(url_for('information'))
+
+# AI-powered external policy comparison
+@route('/api/policy-comparison', methods=['POST'])
+@login_required
+def compare_policies():
+    """AI-powered policy comparison using OpenAI"""
+    external_policy_data = request.json.get('external_policy', {})
+    
+    # Use AI service for comparison
+    comparison_result = AIService.compare_policies(external_policy_data)
+    
+    return jsonify(comparison_result)
+
+# AI-powered document tagging
+@route('/api/document-tag', methods=['POST'])
+@login_required
+def tag_document():
+    """AI-powered document type tagging"""
+    filename = request.json.get('filename', '')
+    if not filename:
+        return jsonify({'error': 'Filename required'}), 400
+    
+    tag = AIService.tag_document(filename)
+    return jsonify({'document_type': tag})
+
+# AI-powered claims analysis
+@route('/api/claims/analyze', methods=['POST'])
+@login_required
+def analyze_claim():
+    """AI-powered claim damage analysis"""
+    data = request.json
+    claim_description = data.get('description', '')
+    image_description = data.get('image_description', '')
+    
+    analysis = AIService.analyze_claim_damage(
+        image_description=image_description,
+        claim_description=claim_description
+    )
+    
+    return jsonify(analysis)
+
+# AI-powered policy recommendations
+@route('/api/policy-recommendations', methods=['GET'])
+@login_required
+def get_policy_recommendations():
+    """Get AI-powered policy recommendations for user"""
+    user_profile = {
+        'policies': [p.policy_type for p in current_user.swissaxa_policies],
+        'claims_count': len(current_user.claims),
+        'location': current_user.address or 'Unknown',
+        'age': 'Unknown'  # Could be added to user model
+    }
+    
+    recommendations = AIService.recommend_policies(user_profile)
+    return jsonify({'recommendations': recommendations})
+
+# AI-powered appointment suggestions
+@route('/api/appointment-suggestions', methods=['POST'])
+@login_required
+def get_appointment_suggestions():
+    """Get free appointment times, optionally ranked by AI"""
+    appointment_type = request.json.get('appointment_type', 'service_desk')
+    agent_id = request.json.get('agent_id') or None
+    if agent_id is not None:
+        try:
+            agent_id = int(agent_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid agent id'}), 400
+        if db.session.get(Agent, agent_id) is None:
+            return jsonify({'error': 'Agent not found'}), 404
+    slots = suggest_slots(agent_id, limit=5)
+    
+    if current_app.config['APPOINTMENT_AI_SUGGESTIONS']:
+        # The model only picks among times the agent is actually free
+        schedule = get_availability_index().get(agent_id)
+        preferred = []
+        for suggestion in AIService.suggest_appointment_times(
+            user_id=current_user.id,
+            appointment_type=appointment_type
+        ):
+            try:
+                slot = datetime.strptime(str(suggestion), '%Y-%m-%d %H:%M')
+            except ValueError:
+                continue
+            if slot > datetime.utcnow() and schedule.is_working_slot(slot) and schedule.is_free(slot) \
+                    and slot not in preferred:
+                preferred.append(slot)
+        slots = (preferred + [slot for slot in slots if slot not in preferred])[:5]
+    
+    return jsonify({'suggestions': [slot.strftime('%Y-%m-%d %H:%M') for slot in slots]})
+
+# AI chatbot endpoint
+@route('/api/chat', methods=['POST'])
+@login_required
+def chat_with_ai():
+    """AI chatbot endpoint"""
+    message = request.json.get('message', '')
+    if not message:
+        return jsonify({'error': 'Message required'}), 400
+    
+    # Get conversation history from session
+    conversation_history = session.get('chat_history', [])
+    
+    # Get AI response
+    response = AIService.chat_with_ai(message, conversation_history)
+    
+    # Update conversation history
+    conversation_history.append({'role': 'user', 'content': message})
+    conversation_history.append({'role': 'assistant', 'content': response})
+    session['chat_history'] = conversation_history[-10:]  # Keep last 10 messages
+    
+    return jsonify({'response': response})
+
+# Clear chat history
+@route('/api/chat/clear', methods=['POST'])
+@login_required
+def clear_chat_history():
+    """Clear chat conversation history"""
+    session.pop('chat_history', None)
+    return jsonify({'success': True})
+
+# Analytics dashboard route
+@route('/admin/analytics')
+@login_required
+@read_only
+def analytics_dashboard():
+    """Advanced analytics dashboard"""
+    try:
+        from analytics import init_analytics, get_analytics_summary, get_ai_usage_stats
+        init_analytics(db)
+        summary = get_analytics_summary(days=30)
+        ai_stats = get_ai_usage_stats(days=30)
+        return render_template('analytics.html', summary=summary, ai_stats=ai_stats)
+    except ImportError:
+        flash('Analytics module not available', 'warning')
+        return redirect(url_for('dashboard'))
+
+# Language switching route
+@route('/api/language/<language_code>', methods=['POST'])
+@login_required
+def set_language(language_code):
+    """Set user language preference"""
+    try:
+        from i18n_support import set_language as set_user_language
+        if set_user_language(language_code):
+            return jsonify({'success': True, 'language': language_code})
+        return jsonify({'error': 'Invalid language code'}), 400
+    except ImportError:
+        return jsonify({'error': 'i18n not available'}), 500
+
+# Notifications API
+@route('/api/notifications', methods=['GET'])
+@login_required
+def get_notifications():
+    """Get user notifications, newest first; ?before=<id> for the next page"""
+    # Notifications used to be kept in the session cookie
+    session.pop(f'notifications_{current_user.id}', None)
+    try:
+        from notifications import get_user_notifications, page_params
+        notifications = get_user_notifications(current_user.id, **page_params(request.args))
+        return jsonify([n.to_dict() for n in notifications])
+    except ImportError:
+        return jsonify([])
+
+@route('/api/notifications/stream', methods=['GET'])
+@login_required
+def notification_stream():
+    """Push new notifications as Server-Sent Events"""
+    from notification_stream import last_event_id, stream_response
+    return stream_response(current_user.id, last_event_id(request))
+
+@route('/api/notifications/unread-count', methods=['GET'])
+@login_required
+def get_unread_notification_count():
+    """Number of unread notifications, for the badge"""
+    try:
+        from notifications import unread_count
+        return jsonify({'unread': unread_count(current_user.id)})
+    except ImportError:
+        return jsonify({'unread': 0})
+
+@route('/api/notifications/<int:notification_id>/read', methods=['POST'])
+@login_required
+def mark_notification_read(notification_id):
+    """Mark notification as read"""
+    try:
+        from notifications import mark_notification_read
+        if not mark_notification_read(current_user.id, notification_id):
+            return jsonify({'error': 'Notification not found'}), 404
+        return jsonify({'success': True})
+    except ImportError:
+        return jsonify({'error': 'Notifications not available'}), 500
+
+@route('/api/notifications/read-all', methods=['POST'])
+@login_required
+def mark_all_notifications_read():
+    """Mark all notifications as read"""
+    try:
+        from notifications import mark_all_read
+        return jsonify({'success': True, 'marked': mark_all_read(current_user.id)})
+    except ImportError:
+        return jsonify({'error': 'Notifications not available'}), 500